@@ -0,0 +1,147 @@
+"""
+Hot/cold archival of posts.
+
+Every listing scans and sorts the Post table, but most of it is dead
+weight: posts marked resolved, and posts nobody has touched in a year.
+ArchiveService moves them to the ArchivedPost table in batches of
+ARCHIVE_BATCH_SIZE, one transaction per batch:
+
+- resolved posts once they are ARCHIVE_RESOLVED_AFTER_DAYS old;
+- any post once it is ARCHIVE_STALE_AFTER_DAYS old.
+
+An archived post keeps its id. /blog/post/<pk>/ falls back to the archive
+when the post is not in the hot table, and listings search the archive only
+when asked to (?archived=1, "Search archived posts" in the filters). The
+post's payments are kept (see cascade_unless_archiving); its pending match
+notifications are dropped, as the match is stale. With region sharding each
+shard archives into its own ArchivedPost table, so the shard directory entry
+stays valid.
+
+`python manage.py archive_posts --loop` runs it on a schedule (the
+``archiver`` process in the Procfile).
+"""
+
+import contextvars
+import logging
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, models, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+ARCHIVED_PARAM = 'archived'
+
+# Set while ArchiveService deletes archived posts from the hot table
+_archiving = contextvars.ContextVar('archiving', default=False)
+
+
+@contextmanager
+def archiving():
+    token = _archiving.set(True)
+    try:
+        yield
+    finally:
+        _archiving.reset(token)
+
+
+def is_archiving():
+    """Whether the posts being deleted are being archived, not deleted."""
+    return _archiving.get()
+
+
+def cascade_unless_archiving(collector, field, sub_objs, using):
+    """
+    on_delete for rows that must outlive archiving (PaymentAccess): deleted
+    with the post, kept when the post moves to the archive.
+    """
+    if not is_archiving():
+        models.CASCADE(collector, field, sub_objs, using)
+
+
+def wants_archived(params):
+    """Whether a listing's query string asks for archived posts."""
+    return params.get(ARCHIVED_PARAM) in ('1', 'on', 'true')
+
+
+class ArchiveService:
+    """
+    Service class for moving old posts out of the hot table.
+    """
+
+    @staticmethod
+    def _setting(name, default):
+        return getattr(settings, name, default)
+
+    @classmethod
+    def due(cls, now=None):
+        """
+        Filter for posts that belong in the archive.
+
+        Returns:
+            Q: resolved posts past ARCHIVE_RESOLVED_AFTER_DAYS, and every
+            post past ARCHIVE_STALE_AFTER_DAYS
+        """
+        from .models import Post
+        now = now or timezone.now()
+        resolved_before = now - timedelta(days=cls._setting('ARCHIVE_RESOLVED_AFTER_DAYS', 14))
+        stale_before = now - timedelta(days=cls._setting('ARCHIVE_STALE_AFTER_DAYS', 365))
+        return Q(status=Post.RESOLVED, date_posted__lt=resolved_before) | Q(date_posted__lt=stale_before)
+
+    @classmethod
+    def archive_batch(cls, using=None, now=None, batch_size=None):
+        """
+        Move one batch of due posts, oldest first, to the archive.
+
+        Args:
+            using: Database (shard) to archive on; None for default
+            now: Reference time for the age limits
+            batch_size: Posts per transaction (default ARCHIVE_BATCH_SIZE)
+
+        Returns:
+            int: Number of posts archived (0 when nothing is due)
+        """
+        from .models import ArchivedPost, Post
+        db = using or DEFAULT_DB_ALIAS
+        now = now or timezone.now()
+        batch_size = batch_size or cls._setting('ARCHIVE_BATCH_SIZE', 500)
+        fields = [field.attname for field in Post._meta.concrete_fields]
+
+        with transaction.atomic(using=db), archiving():
+            # Locked so two archivers never take the same rows (no-op on SQLite)
+            posts = list(
+                Post.objects.using(db).filter(cls.due(now)).order_by('date_posted')
+                .select_for_update(skip_locked=True)[:batch_size]
+            )
+            if not posts:
+                return 0
+            ArchivedPost.objects.using(db).bulk_create([
+                ArchivedPost(archived_at=now, **{name: getattr(post, name) for name in fields})
+                for post in posts
+            ])
+            # Cascades to the posts' match notifications, not their payments
+            Post.objects.using(db).filter(pk__in=[post.pk for post in posts]).delete()
+        return len(posts)
+
+    @classmethod
+    def archive_due(cls, now=None, batch_size=None):
+        """
+        Archive every due post, batch by batch, on each database.
+
+        Returns:
+            dict: database alias -> number of posts archived
+        """
+        from .sharding import PostShardService
+        now = now or timezone.now()
+        archived = {}
+        for alias in PostShardService.shards():
+            total = 0
+            while count := cls.archive_batch(alias, now, batch_size):
+                total += count
+            archived[alias or DEFAULT_DB_ALIAS] = total
+        if any(archived.values()):
+            logger.info(f"📦 Archived {sum(archived.values())} posts: {archived}")
+        return archived
@@ -0,0 +1,21 @@
+from django import forms
+from django.conf import settings
+from myproject.uploads import BoundedImageField
+from .models import Post, SavedSearch
+
+
+class PostForm(forms.ModelForm):
+    image = BoundedImageField(max_size=settings.POST_IMAGE_MAX_SIZE, required=False)
+
+    class Meta:
+        model = Post
+        fields = ['title', 'content', 'item_type', 'category', 'location', 'status', 'date_item_lost_found', 'image']
+
+
+class SavedSearchForm(forms.ModelForm):
+    """The Home page filters, checked against the SavedSearch fields before an alert is saved"""
+
+    class Meta:
+        model = SavedSearch
+        fields = ['q', 'item_type', 'category', 'location', 'status']
+        labels = {'q': 'Search'}
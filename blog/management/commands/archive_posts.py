@@ -0,0 +1,40 @@
+import signal
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from blog.archive import ArchiveService
+
+
+class Command(BaseCommand):
+    help = 'Move resolved and stale posts from the hot Post table to the archive'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep running and archive posts as they come due')
+        parser.add_argument('--interval', type=float, default=settings.ARCHIVE_INTERVAL,
+                            help='Seconds between runs (with --loop)')
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='Posts per transaction (default ARCHIVE_BATCH_SIZE)')
+
+    def handle(self, *args, **options):
+        if not options['loop']:
+            archived = ArchiveService.archive_due(batch_size=options['batch_size'])
+            details = ', '.join(f'{alias}: {count}' for alias, count in archived.items())
+            self.stdout.write(self.style.SUCCESS(f"Archived {sum(archived.values())} posts ({details})"))
+            return
+
+        stop_event = threading.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(sig, lambda *args: stop_event.set())
+        self.stdout.write(f"Archiving posts every {options['interval']:g}s (Ctrl+C to stop)...")
+        while not stop_event.is_set():
+            try:
+                ArchiveService.archive_due(batch_size=options['batch_size'])
+            except Exception as e:
+                self.stderr.write(f'Error archiving posts: {e}')
+            finally:
+                close_old_connections()
+            stop_event.wait(options['interval'])
@@ -0,0 +1,169 @@
+"""
+Delete uploaded files that no post or profile refers to any more.
+
+    python manage.py gc_media --dry-run -v 2
+    python manage.py gc_media --grace-hours 24 --workers 8
+
+Editing or deleting a post leaves its old image behind, and so does a new
+avatar. The scan streams over MEDIA_ROOT with os.scandir and checks the
+files it finds against Post.image, ArchivedPost.image (on every shard) and
+Profile.image a batch at a time with `image__in` queries, so memory stays
+flat however many files and rows there are. Files modified within the grace
+period are kept: an upload is written before its row is committed. Field
+defaults (default.jpg) are never deleted.
+"""
+
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from blog.models import ArchivedPost, Post
+from blog.sharding import PostShardService
+from users.models import Profile
+
+
+def scan(root):
+    """
+    Every regular file under ``root``, streamed depth-first.
+
+    Yields:
+        tuple: (storage name with '/' separators, os.DirEntry)
+    """
+    stack = ['']
+    while stack:
+        prefix = stack.pop()
+        try:
+            with os.scandir(os.path.join(root, prefix)) as entries:
+                for entry in entries:
+                    name = f'{prefix}/{entry.name}' if prefix else entry.name
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(name)
+                    elif entry.is_file(follow_symlinks=False):
+                        yield name, entry
+        except FileNotFoundError:
+            continue
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+class Command(BaseCommand):
+    help = 'Delete files in MEDIA_ROOT that no Post, ArchivedPost or Profile image refers to'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be deleted')
+        parser.add_argument('--grace-hours', type=float, default=24,
+                            help='Keep files modified more recently than this')
+        parser.add_argument('--batch-size', type=int, default=500, help='Files checked per query')
+        parser.add_argument('--workers', type=int, default=4, help='Threads deleting files')
+
+    def handle(self, *args, **options):
+        root = os.fspath(settings.MEDIA_ROOT)
+        if not os.path.isdir(root):
+            raise CommandError(f'MEDIA_ROOT {root} does not exist')
+        dry_run = options['dry_run']
+        cutoff = time.time() - options['grace_hours'] * 3600
+        started = time.perf_counter()
+
+        references = self.references()
+        protected = {
+            field.default for model, field, _ in references if isinstance(field.default, str)
+        }
+        scanned = scanned_bytes = recent = 0
+        orphans = orphan_bytes = reclaimed = failed = 0
+        emptied = set()
+
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            for batch in batched(scan(root), options['batch_size']):
+                scanned += len(batch)
+                names = [name for name, _ in batch]
+                referenced = self.referenced(references, names)
+                candidates = []
+                for name, entry in batch:
+                    stat = entry.stat(follow_symlinks=False)
+                    scanned_bytes += stat.st_size
+                    if name in referenced or name in protected:
+                        continue
+                    if stat.st_mtime > cutoff:
+                        recent += 1
+                        continue
+                    candidates.append((name, entry.path, stat.st_size))
+                orphans += len(candidates)
+                orphan_bytes += sum(size for _, _, size in candidates)
+                if options['verbosity'] >= 2:
+                    for name, _, size in candidates:
+                        self.stdout.write(f'   {name} ({size} bytes)')
+                if dry_run:
+                    continue
+                # Parallel unlinks: on network or slow disks each one is a round trip
+                errors = executor.map(self.delete, [path for _, path, _ in candidates])
+                for (name, path, size), error in zip(candidates, errors):
+                    if error:
+                        failed += 1
+                        self.stderr.write(f'⚠️ Could not delete {name}: {error}')
+                    else:
+                        reclaimed += size
+                        emptied.add(os.path.dirname(path))
+
+        if not dry_run:
+            self.prune(root, emptied)
+        self.stdout.write(f'🔎 Scanned {scanned} files ({scanned_bytes / 1e6:.1f} MB); '
+                          f'{recent} unreferenced files are within the grace period')
+        if dry_run:
+            message = f'Would delete {orphans} orphaned files ({orphan_bytes / 1e6:.1f} MB)'
+        else:
+            message = f'Deleted {orphans - failed} orphaned files, reclaimed {reclaimed / 1e6:.1f} MB ({reclaimed} bytes)'
+        self.stdout.write(self.style.SUCCESS(f'✅ {message} in {time.perf_counter() - started:.1f}s'))
+
+    @staticmethod
+    def references():
+        """(model, file field, database aliases) for every field that refers to media."""
+        shards = [alias or DEFAULT_DB_ALIAS for alias in PostShardService.shards()]
+        return [
+            (Post, Post._meta.get_field('image'), shards),
+            (ArchivedPost, ArchivedPost._meta.get_field('image'), shards),
+            (Profile, Profile._meta.get_field('image'), [DEFAULT_DB_ALIAS]),
+        ]
+
+    @staticmethod
+    def referenced(references, names):
+        """The subset of ``names`` some row refers to (one query per field and database)."""
+        found = set()
+        for model, field, aliases in references:
+            for alias in aliases:
+                found.update(
+                    model.objects.using(alias).filter(**{f'{field.name}__in': names})
+                    .values_list(field.name, flat=True)
+                )
+        return found
+
+    @staticmethod
+    def delete(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            return e
+        return None
+
+    @staticmethod
+    def prune(root, directories):
+        """Remove directories the deletions left empty (dated upload folders), up to MEDIA_ROOT."""
+        root = os.path.abspath(root)
+        for directory in sorted(directories, key=len, reverse=True):
+            directory = os.path.abspath(directory)
+            while directory != root and directory.startswith(root + os.sep):
+                try:
+                    os.rmdir(directory)
+                except OSError:
+                    break
+                directory = os.path.dirname(directory)
@@ -0,0 +1,127 @@
+"""
+Put every post on the shard its location belongs to (see blog/sharding.py).
+
+    python manage.py rebalance_shards --dry-run
+    python manage.py rebalance_shards
+
+First registers posts that are missing from the shard directory (posts
+created before sharding was enabled) so new ids never collide with them,
+then walks every database in batches and moves each misplaced post with its
+payments and notifications. Run it after adding a shard to POST_SHARD_URLS
+and now and then to catch posts whose location was edited. If a run is
+interrupted, the next one finishes the moves it left half done.
+"""
+
+import time
+from collections import Counter
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from blog.models import Post, PostShard
+from blog.sharding import PostShardService
+
+
+class Command(BaseCommand):
+    help = 'Register unsharded posts in the shard directory and move posts to the shard for their location'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would move')
+        parser.add_argument('--batch-size', type=int, default=500, help='Posts read per query')
+
+    def handle(self, *args, **options):
+        if not PostShardService.enabled():
+            raise CommandError('Sharding is off: set POST_SHARD_URLS')
+        dry_run, batch_size = options['dry_run'], options['batch_size']
+        started = time.perf_counter()
+
+        registered, repaired, conflicts = self.register(dry_run, batch_size)
+        self.stdout.write(f'📒 {registered} posts registered in the shard directory')
+        if repaired:
+            self.stdout.write(f'🔧 {repaired} directory entries of interrupted moves pointed back at default')
+        if conflicts:
+            self.stderr.write(f'⚠️ {len(conflicts)} posts on default have ids the directory gives to '
+                              f'another shard (e.g. {conflicts[:5]}); they are left in place')
+
+        moves = Counter()
+        for shard in PostShardService.shards():
+            source = shard or DEFAULT_DB_ALIAS
+            last_pk = 0
+            while True:
+                batch = Post.objects.using(source).filter(pk__gt=last_pk)
+                if source == DEFAULT_DB_ALIAS:
+                    # Conflicting ids are only the default database's copies
+                    batch = batch.exclude(pk__in=conflicts)
+                batch = list(batch.order_by('pk')[:batch_size])
+                if not batch:
+                    break
+                last_pk = batch[-1].pk
+                for post in batch:
+                    target = PostShardService.shard_for_location(post.location)
+                    if target == shard:
+                        continue
+                    moves[source, target or DEFAULT_DB_ALIAS] += 1
+                    if not dry_run:
+                        PostShardService.move(post, target)
+
+        for (source, target), count in sorted(moves.items()):
+            self.stdout.write(f'   {source} -> {target}: {count}')
+        verb = 'Would move' if dry_run else 'Moved'
+        self.stdout.write(self.style.SUCCESS(
+            f'✅ {verb} {sum(moves.values())} posts in {time.perf_counter() - started:.1f}s'
+        ))
+        for shard in PostShardService.shards():
+            alias = shard or DEFAULT_DB_ALIAS
+            self.stdout.write(f'   {alias}: {Post.objects.using(alias).count()} posts')
+
+    @staticmethod
+    def register(dry_run, batch_size):
+        """
+        Add directory entries for posts on default that have none.
+
+        A post on default whose entry names another shard is either a real
+        id conflict (that shard holds a different post with the id) or a
+        move that was interrupted (see PostShardService.move): before the
+        copy, its entry is pointed back at default; after it, the walk
+        finishes the move.
+
+        Returns:
+            tuple: (number of posts registered, number of entries pointed
+            back at default, ids of default posts that conflict with a post
+            on another shard)
+        """
+        registered, repaired, conflicts, last_pk = 0, 0, [], 0
+        while True:
+            rows = {pk: (author_id, date_posted) for pk, author_id, date_posted in
+                    Post.objects.using(DEFAULT_DB_ALIAS).filter(pk__gt=last_pk).order_by('pk')
+                    .values_list('pk', 'author_id', 'date_posted')[:batch_size]}
+            if not rows:
+                break
+            ids = list(rows)
+            last_pk = ids[-1]
+            known = dict(PostShard.objects.filter(pk__in=ids).values_list('pk', 'shard'))
+            elsewhere = {}
+            for pk, shard in known.items():
+                if shard != DEFAULT_DB_ALIAS:
+                    elsewhere.setdefault(shard, []).append(pk)
+            for shard, pks in elsewhere.items():
+                copies = {pk: (author_id, date_posted) for pk, author_id, date_posted in
+                          Post.objects.using(shard).filter(pk__in=pks)
+                          .values_list('pk', 'author_id', 'date_posted')}
+                conflicts += [pk for pk in pks if pk in copies and copies[pk] != rows[pk]]
+                orphaned = [pk for pk in pks if pk not in copies]
+                repaired += len(orphaned)
+                if orphaned and not dry_run:
+                    PostShard.objects.filter(pk__in=orphaned).update(shard=DEFAULT_DB_ALIAS)
+            missing = [PostShard(pk=pk, shard=DEFAULT_DB_ALIAS) for pk in ids if pk not in known]
+            registered += len(missing)
+            if missing and not dry_run:
+                PostShard.objects.bulk_create(missing, batch_size=batch_size)
+        if registered and not dry_run:
+            # Explicit ids don't advance a Postgres sequence; allocate after them
+            connection = connections[DEFAULT_DB_ALIAS]
+            with connection.cursor() as cursor:
+                for sql in connection.ops.sequence_reset_sql(no_style(), [PostShard]):
+                    cursor.execute(sql)
+        return registered, repaired, conflicts
@@ -0,0 +1,211 @@
+"""
+Seed the database with a large, deterministic synthetic dataset.
+
+    python manage.py seed_data --posts 100000
+    python manage.py seed_data --posts 1000000 --users 50000 --clear
+
+Users, profiles and posts are created with bulk_create in batches, so memory
+stays flat even for a million posts. The same --seed always produces the same
+rows, which makes benchmark runs comparable (see scripts/benchmark.py).
+Running it again without --clear adds another set of posts.
+
+Seeded users are named ``seed_<n>`` and share the password SEED_PASSWORD so
+benchmarks can log in as them. Post and profile images point at a handful of
+placeholder JPEGs written once to MEDIA_ROOT/seed/.
+"""
+
+import os
+import random
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from blog.models import Post
+from blog.sharding import PostShardService
+from users.models import Profile
+
+SEED_PREFIX = 'seed_'
+SEED_PASSWORD = 'seed-Passw0rd!'
+PLACEHOLDER_DIR = 'seed'
+PLACEHOLDER_COLOURS = [
+    (52, 73, 94), (231, 76, 60), (46, 204, 113), (52, 152, 219),
+    (241, 196, 15), (155, 89, 182), (230, 126, 34), (149, 165, 166),
+]
+
+# Rough shape of real traffic: Nairobi dominates, then the big towns
+LOCATIONS = [
+    ('Nairobi CBD', 18), ('Westlands', 8), ('Kasarani', 5), ('Embakasi', 5), ('Kilimani', 4),
+    ('Rongai', 3), ('Kitengela', 3), ('Thika', 4), ('Kiambu', 4), ('Machakos', 3),
+    ('Mombasa', 9), ('Kisumu', 7), ('Nakuru', 6), ('Eldoret', 5), ('Nyeri', 3),
+    ('Meru', 3), ('Kakamega', 2), ('Kisii', 2), ('Malindi', 2), ('Garissa', 1),
+    ('Naivasha', 2), ('Kitale', 1),
+]
+CATEGORIES = [
+    ('phone', 22), ('documents', 18), ('money', 12), ('keys', 10), ('electronics', 10),
+    ('clothing', 7), ('jewelry', 5), ('pet', 5), ('vehicle', 3), ('other', 8),
+]
+ITEMS = {
+    'phone': ['Samsung Galaxy', 'iPhone', 'Tecno Spark', 'Infinix Hot', 'Nokia', 'Oppo'],
+    'documents': ['national ID', 'passport', 'KCSE certificate', 'driving licence', 'logbook', 'ATM card'],
+    'money': ['wallet', 'purse', 'envelope with cash', 'M-PESA line'],
+    'keys': ['car keys', 'house keys', 'office keys', 'motorbike key'],
+    'electronics': ['laptop', 'earphones', 'power bank', 'tablet', 'camera', 'smart watch'],
+    'clothing': ['jacket', 'school sweater', 'handbag', 'backpack', 'shoes'],
+    'jewelry': ['gold ring', 'necklace', 'bracelet', 'wedding ring', 'earrings'],
+    'pet': ['dog', 'cat', 'puppy', 'parrot'],
+    'vehicle': ['motorbike', 'bicycle', 'number plate', 'car'],
+    'other': ['umbrella', 'bible', 'spectacles', 'water bottle', 'book'],
+}
+COLOURS = ['black', 'white', 'blue', 'red', 'brown', 'grey', 'silver', 'green']
+PLACES = ['matatu', 'bus stage', 'supermarket', 'church', 'hospital', 'market', 'school', 'boda boda']
+
+
+def _weighted(pairs):
+    values, weights = zip(*pairs)
+    return list(values), list(weights)
+
+
+class Command(BaseCommand):
+    help = 'Create a deterministic synthetic dataset of users, profiles and posts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=1000)
+        parser.add_argument('--users', type=int, default=None,
+                            help='Users to create (default: one per 10 posts, at least 10)')
+        parser.add_argument('--seed', type=int, default=42, help='Random seed')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--image-ratio', type=float, default=0.4,
+                            help='Share of posts with a (placeholder) image')
+        parser.add_argument('--end-date', default='2025-12-31',
+                            help='Newest date_posted (fixed so reruns are identical)')
+        parser.add_argument('--clear', action='store_true', help='Delete previously seeded users and posts first')
+
+    def handle(self, *args, **options):
+        n_posts = options['posts']
+        n_users = options['users'] or max(10, n_posts // 10)
+        batch_size = options['batch_size']
+        end = datetime.strptime(options['end_date'], '%Y-%m-%d').replace(tzinfo=dt_timezone.utc)
+
+        if options['clear']:
+            started = time.perf_counter()
+            deleted, _ = User.objects.filter(username__startswith=SEED_PREFIX).delete()
+            self.stdout.write(f'🗑️ Deleted {deleted} seeded rows in {time.perf_counter() - started:.1f}s')
+
+        post_images, profile_images = self.write_placeholders()
+
+        started = time.perf_counter()
+        user_ids = self.create_users(random.Random(options['seed']), n_users, batch_size, profile_images)
+        self.stdout.write(f'✅ {len(user_ids)} users and profiles in {time.perf_counter() - started:.1f}s')
+
+        started = time.perf_counter()
+        self.create_posts(random.Random(options['seed'] + 1), n_posts, user_ids, batch_size, end,
+                          post_images, options['image_ratio'])
+        self.stdout.write(self.style.SUCCESS(f'✅ {n_posts} posts in {time.perf_counter() - started:.1f}s'))
+
+    def write_placeholders(self):
+        """Write small placeholder JPEGs once and return their storage names."""
+        from PIL import Image
+        from myproject.uploads import image_placeholder
+
+        directory = os.path.join(settings.MEDIA_ROOT, PLACEHOLDER_DIR)
+        os.makedirs(directory, exist_ok=True)
+        post_images, profile_images = [], []
+        self.image_placeholders = {}
+        for i, colour in enumerate(PLACEHOLDER_COLOURS):
+            for names, size, prefix in ((post_images, (800, 600), 'post'), (profile_images, (300, 300), 'profile')):
+                name = f'{PLACEHOLDER_DIR}/{prefix}_{i}.jpg'
+                path = os.path.join(settings.MEDIA_ROOT, name)
+                if not os.path.exists(path):
+                    Image.new('RGB', size, colour).save(path, 'JPEG', quality=70)
+                names.append(name)
+                # bulk_create skips the save() that computes it
+                self.image_placeholders[name] = image_placeholder(path)
+        return post_images, profile_images
+
+    def create_users(self, rng, n_users, batch_size, profile_images):
+        # Hashing is deliberately slow, so every seeded user shares one hash
+        password = make_password(SEED_PASSWORD)
+        existing = set(User.objects.filter(username__startswith=SEED_PREFIX).values_list('username', flat=True))
+        for start in range(0, n_users, batch_size):
+            users = [
+                User(username=f'{SEED_PREFIX}{i:07d}', email=f'{SEED_PREFIX}{i:07d}@example.com',
+                     password=password, first_name=f'Seed{i}')
+                for i in range(start, min(start + batch_size, n_users))
+                if f'{SEED_PREFIX}{i:07d}' not in existing
+            ]
+            with transaction.atomic():
+                User.objects.bulk_create(users, batch_size=batch_size)
+
+        user_ids = list(
+            User.objects.filter(username__startswith=SEED_PREFIX).order_by('username').values_list('id', flat=True)
+        )[:n_users]
+
+        # bulk_create skips the post_save signal that creates profiles
+        with_profile = set(
+            Profile.objects.filter(user__username__startswith=SEED_PREFIX).values_list('user_id', flat=True)
+        )
+        missing = [uid for uid in user_ids if uid not in with_profile]
+        for start in range(0, len(missing), batch_size):
+            profiles = [
+                Profile(
+                    user_id=uid,
+                    phone_number=f'2547{rng.randrange(10 ** 8):08d}',
+                    location=rng.choice(LOCATIONS)[0],
+                    image=rng.choice(profile_images),
+                    image_width=300, image_height=300,
+                )
+                for uid in missing[start:start + batch_size]
+            ]
+            for profile in profiles:
+                profile.image_lqip, profile.image_color = self.image_placeholders[profile.image.name]
+            with transaction.atomic():
+                Profile.objects.bulk_create(profiles, batch_size=batch_size)
+        return user_ids
+
+    def create_posts(self, rng, n_posts, user_ids, batch_size, end, post_images, image_ratio):
+        locations, location_weights = _weighted(LOCATIONS)
+        categories, category_weights = _weighted(CATEGORIES)
+        for start in range(0, n_posts, batch_size):
+            posts = []
+            for _ in range(min(batch_size, n_posts - start)):
+                category = rng.choices(categories, category_weights)[0]
+                item = f'{rng.choice(COLOURS)} {rng.choice(ITEMS[category])}'
+                item_type = Post.LOST if rng.random() < 0.6 else Post.FOUND
+                # Most posts are recent; a long tail goes back two years
+                age = timedelta(days=min(730.0, rng.expovariate(1 / 90)), seconds=rng.randrange(86400))
+                date_posted = end - age
+                place = rng.choice(PLACES)
+                location = rng.choices(locations, location_weights)[0]
+                # Older posts are more likely to have been resolved
+                status = Post.RESOLVED if rng.random() < min(0.6, age.days / 365) else Post.ACTIVE
+                image = rng.choice(post_images) if rng.random() < image_ratio else ''
+                lqip, color = self.image_placeholders.get(image, ('', ''))
+                posts.append(Post(
+                    title=f'{item_type.capitalize()} {item}',
+                    content=(f'{item_type.capitalize()} a {item} at the {place} '
+                             f'in {location}. Please contact me if you have any information.'),
+                    item_type=item_type,
+                    category=category,
+                    location=location,
+                    status=status,
+                    image=image,
+                    image_lqip=lqip,
+                    image_color=color,
+                    date_posted=date_posted,
+                    date_item_lost_found=(date_posted - timedelta(days=rng.randrange(8))).date(),
+                    # A few heavy posters and a long tail of one-off users
+                    author_id=user_ids[int(len(user_ids) * rng.random() ** 2)],
+                ))
+            with transaction.atomic():
+                if PostShardService.enabled():
+                    PostShardService.bulk_create(posts, batch_size=batch_size)
+                else:
+                    Post.objects.bulk_create(posts, batch_size=batch_size)
+            if n_posts > batch_size:
+                self.stdout.write(f'   {start + len(posts)}/{n_posts} posts', ending='\r')
+        if n_posts > batch_size:
+            self.stdout.write('')
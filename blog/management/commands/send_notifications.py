@@ -0,0 +1,38 @@
+import signal
+import threading
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from blog.services import NotificationService
+
+
+class Command(BaseCommand):
+    help = 'Send digest emails for new posts that match users\' alerts and posts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep running and send digests as they come due')
+        parser.add_argument('--interval', type=float, default=30,
+                            help='Seconds between checks (with --loop)')
+
+    def handle(self, *args, **options):
+        if not options['loop']:
+            result = NotificationService.send_all_due()
+            self.stdout.write(self.style.SUCCESS(
+                f"Sent {result['digests']} digests covering {result['notifications']} notifications"
+            ))
+            return
+
+        stop_event = threading.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(sig, lambda *args: stop_event.set())
+        self.stdout.write('Sending match digests (Ctrl+C to stop)...')
+        while not stop_event.is_set():
+            try:
+                NotificationService.send_all_due()
+            except Exception as e:
+                self.stderr.write(f'Error sending digests: {e}')
+            finally:
+                close_old_connections()
+            stop_event.wait(options['interval'])
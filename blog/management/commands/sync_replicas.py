@@ -0,0 +1,57 @@
+import signal
+import sqlite3
+import threading
+from contextlib import closing
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+SQLITE_ENGINE = 'django.db.backends.sqlite3'
+
+
+class Command(BaseCommand):
+    help = ('Copy the SQLite primary database to the SQLite replicas in DATABASE_REPLICAS, '
+            'a local stand-in for replication')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep copying; the interval is the replication lag')
+        parser.add_argument('--interval', type=float, default=5,
+                            help='Seconds between copies (with --loop)')
+
+    def handle(self, *args, **options):
+        primary = settings.DATABASES['default']
+        if primary['ENGINE'] != SQLITE_ENGINE:
+            raise CommandError('The primary is not SQLite: use the database\'s own replication '
+                               '(e.g. a Postgres streaming replica) for DATABASE_REPLICA_URLS')
+        replicas = [
+            alias for alias in settings.DATABASE_REPLICAS
+            if settings.DATABASES[alias]['ENGINE'] == SQLITE_ENGINE
+        ]
+        if not replicas:
+            raise CommandError('No SQLite replicas configured: set DATABASE_REPLICA_URLS')
+
+        if not options['loop']:
+            self.sync(primary['NAME'], replicas)
+            self.stdout.write(self.style.SUCCESS(f"Copied the primary to {', '.join(replicas)}"))
+            return
+
+        stop_event = threading.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(sig, lambda *args: stop_event.set())
+        self.stdout.write(f"Copying the primary to {', '.join(replicas)} every "
+                          f"{options['interval']:g}s (Ctrl+C to stop)...")
+        while not stop_event.is_set():
+            try:
+                self.sync(primary['NAME'], replicas)
+            except sqlite3.Error as e:
+                self.stderr.write(f'Error copying the primary: {e}')
+            stop_event.wait(options['interval'])
+
+    @staticmethod
+    def sync(source, replicas):
+        """Consistent snapshot of ``source`` into each replica file (sqlite backup API)."""
+        with closing(sqlite3.connect(source)) as src:
+            for alias in replicas:
+                with closing(sqlite3.connect(settings.DATABASES[alias]['NAME'], timeout=30)) as dst:
+                    src.backup(dst)
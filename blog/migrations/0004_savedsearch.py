@@ -0,0 +1,49 @@
+# Generated by Django 5.2.8 on 2026-10-19 10:54
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0003_post_image'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SavedSearch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(blank=True, max_length=100)),
+                ('q', models.CharField(blank=True, max_length=200)),
+                ('item_type', models.CharField(blank=True, choices=[('lost', 'Lost Item'), ('found', 'Found Item')], max_length=10)),
+                ('category', models.CharField(blank=True, choices=[('electronics', 'Electronics'), ('documents', 'Documents'), ('jewelry', 'Jewelry'), ('vehicle', 'Vehicle'), ('pet', 'Pet'), ('clothing', 'Clothing'), ('money', 'Money/Wallet'), ('keys', 'Keys'), ('phone', 'Phone'), ('other', 'Other')], max_length=50)),
+                ('location', models.CharField(blank=True, max_length=200)),
+                ('status', models.CharField(blank=True, choices=[('active', 'Active'), ('resolved', 'Resolved')], max_length=20)),
+                ('anchor', models.CharField(db_index=True, editable=False, max_length=120)),
+                ('is_active', models.BooleanField(default=True)),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='saved_searches', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created'],
+            },
+        ),
+        migrations.CreateModel(
+            name='SavedSearchMatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+                ('notified_at', models.DateTimeField(blank=True, db_index=True, null=True)),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_matches', to='blog.post')),
+                ('search', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='matches', to='blog.savedsearch')),
+            ],
+            options={
+                'unique_together': {('search', 'post')},
+            },
+        ),
+    ]
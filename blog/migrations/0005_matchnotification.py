@@ -0,0 +1,83 @@
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def populate_recipients(apps, schema_editor):
+    MatchNotification = apps.get_model('blog', 'MatchNotification')
+    # The database being migrated (default or a shard), not the routers' choice
+    db = schema_editor.connection.alias
+    seen = set()
+    for notification in MatchNotification.objects.using(db).select_related('search').order_by('created', 'pk'):
+        key = (notification.search.user_id, notification.post_id)
+        if key in seen:
+            notification.delete()
+            continue
+        seen.add(key)
+        notification.recipient_id = notification.search.user_id
+        notification.save(update_fields=['recipient'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0004_savedsearch'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RenameModel('SavedSearchMatch', 'MatchNotification'),
+        migrations.AlterUniqueTogether(
+            name='matchnotification',
+            unique_together=set(),
+        ),
+        migrations.RenameField(
+            model_name='matchnotification',
+            old_name='notified_at',
+            new_name='sent_at',
+        ),
+        migrations.AlterField(
+            model_name='matchnotification',
+            name='sent_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='matchnotification',
+            name='recipient',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='match_notifications', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(populate_recipients, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='matchnotification',
+            name='recipient',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='match_notifications', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='matchnotification',
+            name='reason',
+            field=models.CharField(choices=[('saved_search', 'Matches a saved search'), ('possible_match', 'Could be your item')], default='saved_search', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='matchnotification',
+            name='matched_post',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='blog.post'),
+        ),
+        migrations.AlterField(
+            model_name='matchnotification',
+            name='search',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='notifications', to='blog.savedsearch'),
+        ),
+        migrations.AlterField(
+            model_name='matchnotification',
+            name='post',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='match_notifications', to='blog.post'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='matchnotification',
+            unique_together={('recipient', 'post')},
+        ),
+        migrations.AddIndex(
+            model_name='matchnotification',
+            index=models.Index(fields=['sent_at', 'recipient', 'created'], name='blog_matchn_sent_at_08f5cc_idx'),
+        ),
+    ]
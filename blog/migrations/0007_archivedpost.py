@@ -0,0 +1,46 @@
+# Generated by Django 5.2.8 on 2026-10-19 11:44
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0006_postshard'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedPost',
+            fields=[
+                ('title', models.CharField(max_length=200)),
+                ('content', models.TextField()),
+                ('item_type', models.CharField(choices=[('lost', 'Lost Item'), ('found', 'Found Item')], default='lost', max_length=10)),
+                ('category', models.CharField(choices=[('electronics', 'Electronics'), ('documents', 'Documents'), ('jewelry', 'Jewelry'), ('vehicle', 'Vehicle'), ('pet', 'Pet'), ('clothing', 'Clothing'), ('money', 'Money/Wallet'), ('keys', 'Keys'), ('phone', 'Phone'), ('other', 'Other')], default='other', max_length=50)),
+                ('location', models.CharField(default='Kenya', max_length=200)),
+                ('status', models.CharField(choices=[('active', 'Active'), ('resolved', 'Resolved')], default='active', max_length=20)),
+                ('image', models.ImageField(blank=True, null=True, upload_to='post_pics/%Y/%m/%d/')),
+                ('date_posted', models.DateTimeField(default=django.utils.timezone.now)),
+                ('date_item_lost_found', models.DateField(blank=True, null=True)),
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('archived_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'ordering': ['-date_posted'],
+                'abstract': False,
+            },
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['date_posted'], name='blog_post_date_po_3dd414_idx'),
+        ),
+        migrations.AddField(
+            model_name='archivedpost',
+            name='author',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+    ]
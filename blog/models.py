@@ -1,10 +1,15 @@
+import logging
+
 from django.db import models
 from django.utils import timezone
 from django.contrib.auth.models import User
 from django.urls import reverse
 
+logger = logging.getLogger(__name__)
+
 
-class Post(models.Model):
+class PostFields(models.Model):
+    """The fields of a post, shared by the hot Post table and ArchivedPost."""
     # Item type choices
     LOST = 'lost'
     FOUND = 'found'
@@ -43,16 +48,201 @@ class Post(models.Model):
     location = models.CharField(max_length=200, default='Kenya')
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=ACTIVE)
     image = models.ImageField(upload_to='post_pics/%Y/%m/%d/', null=True, blank=True)
+    # Placeholder shown while the image loads, computed once per upload
+    # (see myproject/uploads.py)
+    image_lqip = models.TextField(blank=True, editable=False)
+    image_color = models.CharField(max_length=7, blank=True, editable=False)
     
     date_posted = models.DateTimeField(default=timezone.now)
     date_item_lost_found = models.DateField(null=True, blank=True)
-    author = models.ForeignKey(User, on_delete=models.CASCADE)
+    # No database constraint: with region sharding the post can be on a
+    # shard and its author on default (see blog/sharding.py)
+    author = models.ForeignKey(User, on_delete=models.CASCADE, db_constraint=False)
 
     class Meta:
+        abstract = True
         ordering = ['-date_posted']
 
     def __str__(self):
         return f"[{self.get_item_type_display()}] {self.title}"
     
     def get_absolute_url(self):
-        return reverse('post-detail', kwargs={'pk': self.pk})
\ No newline at end of file
+        return reverse('post-detail', kwargs={'pk': self.pk})
+
+
+class Post(PostFields):
+    class Meta(PostFields.Meta):
+        # Listings sort on it, and the archiver picks the oldest posts
+        indexes = [models.Index(fields=['date_posted'])]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember which image was stored so save() can tell if it changed
+        if 'image' in field_names:
+            instance._placeholder_image_name = values[field_names.index('image')]
+        return instance
+
+    def image_changed(self):
+        """True if the image was set or replaced since the post was loaded"""
+        if self._state.adding:
+            return bool(self.image)
+        # Not loaded (deferred): unknown, leave the placeholder alone
+        if not hasattr(self, '_placeholder_image_name'):
+            return False
+        return (self.image.name or '') != (self._placeholder_image_name or '')
+
+    def save(self, *args, **kwargs):
+        from .sharding import PostShardService
+        image_changed = self.image_changed()
+        # With region sharding a new post gets its id and database from the
+        # shard directory
+        allocated = self._state.adding and self.pk is None and PostShardService.enabled()
+        if allocated:
+            kwargs['using'] = PostShardService.allocate(self, kwargs.get('using'))
+        try:
+            super().save(*args, **kwargs)
+        except Exception:
+            # No directory entry for a post that was never saved
+            if allocated:
+                PostShardService.release([self])
+            raise
+
+        if image_changed:
+            self._update_placeholder()
+
+    def _update_placeholder(self):
+        """Compute the stored image's placeholder and save it on the row."""
+        from myproject.uploads import image_placeholder
+        self._placeholder_image_name = self.image.name
+        lqip, color = '', ''
+        if self.image:
+            try:
+                # From storage: the uploaded file may be closed by now
+                with self.image.storage.open(self.image.name) as file:
+                    lqip, color = image_placeholder(file)
+            except Exception as e:
+                logger.warning(f"⚠️ No placeholder for post {self.pk} ({self.image.name}): {e}")
+        self.image_lqip, self.image_color = lqip, color
+        # Update only the placeholder; a full save would run the signals again
+        Post.objects.using(self._state.db).filter(pk=self.pk).update(image_lqip=lqip, image_color=color)
+
+
+class ArchivedPost(PostFields):
+    """
+    A resolved or stale post moved out of the hot Post table by
+    ArchiveService (blog/archive.py). It keeps the post's id, so its URL,
+    payments and shard directory entry stay valid.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    archived_at = models.DateTimeField(default=timezone.now)
+
+    class Meta(PostFields.Meta):
+        pass
+
+
+class PostShard(models.Model):
+    """
+    The shard directory: which database a post is on when posts are sharded
+    by region (see blog/sharding.py). Always on the default database; the id
+    is the post's id, so allocating it here keeps ids unique across shards.
+    """
+    shard = models.CharField(max_length=100, db_index=True)
+
+    def __str__(self):
+        return f"Post {self.pk} on {self.shard}"
+
+
+class SavedSearch(models.Model):
+    """
+    A PostFilterService query saved by a user as a standing alert.
+
+    Each search is indexed under a single "anchor" predicate key (see
+    SavedSearchService.anchor_key) so new posts are matched through an index
+    lookup instead of scanning every saved search.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='saved_searches')
+    name = models.CharField(max_length=100, blank=True)
+    q = models.CharField(max_length=200, blank=True)
+    item_type = models.CharField(max_length=10, choices=Post.ITEM_TYPE_CHOICES, blank=True)
+    category = models.CharField(max_length=50, choices=Post.CATEGORY_CHOICES, blank=True)
+    location = models.CharField(max_length=200, blank=True)
+    status = models.CharField(max_length=20, choices=Post.STATUS_CHOICES, blank=True)
+    anchor = models.CharField(max_length=120, db_index=True, editable=False)
+    is_active = models.BooleanField(default=True)
+    created = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['-created']
+
+    def __str__(self):
+        return self.name or self.describe()
+
+    @property
+    def params(self):
+        """The search as the dict PostFilterService expects"""
+        return {
+            'q': self.q,
+            'item_type': self.item_type,
+            'category': self.category,
+            'location': self.location,
+            'status': self.status,
+        }
+
+    def describe(self):
+        parts = [f'"{self.q}"'] if self.q else []
+        if self.item_type:
+            parts.append(self.get_item_type_display())
+        if self.category:
+            parts.append(self.get_category_display())
+        if self.location:
+            parts.append(f'in {self.location}')
+        if self.status:
+            parts.append(self.get_status_display())
+        return ', '.join(parts) or 'All posts'
+
+    def get_search_url(self):
+        from urllib.parse import urlencode
+        query = urlencode({k: v for k, v in self.params.items() if v})
+        return f"{reverse('blog-home')}?{query}"
+
+    def save(self, *args, **kwargs):
+        from .services import SavedSearchService
+        self.anchor = SavedSearchService.anchor_key(self.params)
+        super().save(*args, **kwargs)
+
+
+class MatchNotification(models.Model):
+    """
+    A new post that could interest a user, waiting to be sent in a digest.
+
+    There is at most one notification per (recipient, post), however many of
+    the recipient's alerts or posts it matched, so nobody is told twice.
+    """
+    SAVED_SEARCH = 'saved_search'
+    POSSIBLE_MATCH = 'possible_match'
+    REASON_CHOICES = [
+        (SAVED_SEARCH, 'Matches a saved search'),
+        (POSSIBLE_MATCH, 'Could be your item'),
+    ]
+
+    # Stored with the post; with region sharding the recipient, saved search
+    # and matched post can be in other databases, so those keys have no
+    # database constraint (see blog/sharding.py)
+    recipient = models.ForeignKey(User, on_delete=models.CASCADE, related_name='match_notifications', db_constraint=False)
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='match_notifications')
+    reason = models.CharField(max_length=20, choices=REASON_CHOICES, default=SAVED_SEARCH)
+    # What the post matched: one of the recipient's saved searches or posts
+    search = models.ForeignKey(SavedSearch, on_delete=models.SET_NULL, null=True, blank=True, related_name='notifications',
+                               db_constraint=False)
+    matched_post = models.ForeignKey(Post, on_delete=models.CASCADE, null=True, blank=True, related_name='+',
+                                     db_constraint=False)
+    created = models.DateTimeField(default=timezone.now)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ('recipient', 'post')
+        indexes = [models.Index(fields=['sent_at', 'recipient', 'created'])]
+
+    def __str__(self):
+        return f"{self.recipient} <- {self.post} ({self.reason})"
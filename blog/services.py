@@ -1,5 +1,21 @@
-from django.db.models import Q
-from .models import Post
+import logging
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from itertools import groupby
+from operator import attrgetter, itemgetter
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import close_old_connections, transaction
+from django.db.models import Min, Q
+from django.template.loader import render_to_string
+from django.utils import timezone
+from .models import MatchNotification, Post, SavedSearch
+from .sharding import PostShardService
+
+logger = logging.getLogger(__name__)
 
 class PostFilterService:
     """
@@ -44,3 +60,333 @@ class PostFilterService:
             queryset = queryset.filter(status=status)
             
         return queryset
+
+    @staticmethod
+    def matches(post, params):
+        """
+        Check a single post against filter parameters in Python.
+
+        Mirrors filter_posts (case-insensitive substring matches for the
+        search query and location, exact matches for the rest) so a post can
+        be tested without a query.
+        """
+        search_query = (params.get('q') or '').lower()
+        location = (params.get('location') or '').lower()
+
+        if search_query and search_query not in post.title.lower() and search_query not in post.content.lower():
+            return False
+        for field in ('item_type', 'category', 'status'):
+            value = params.get(field)
+            if value and getattr(post, field) != value:
+                return False
+        if location and location not in (post.location or '').lower():
+            return False
+        return True
+
+
+class SavedSearchService:
+    """
+    Service class to match new posts against saved searches.
+
+    Every saved search is indexed under one anchor key, the most selective of
+    its predicates: a keyword trigram, then a location trigram, then the
+    category, item type and status. A post produces the set of keys it could
+    satisfy, so only searches whose anchor is in that set are candidates, and
+    each candidate is then checked in full with PostFilterService.matches.
+
+    Keywords and locations match as substrings, the same as the Home page
+    search, so an alert for "phone" also matches "iPhone". The index keys
+    are trigrams (three-character slices) of the words: when a search's
+    keyword occurs anywhere in a post, every trigram of its words is also a
+    trigram of the post's words, so no match is missed. Words shorter than
+    a trigram are not indexed and such searches fall back to the next
+    predicate.
+    """
+
+    TOKEN_RE = re.compile(r'[a-z0-9]+')
+    GRAM = 3
+    # Common words that would make poor (very unselective) anchors
+    STOPWORDS = {'the', 'and', 'for', 'with', 'lost', 'found', 'near', 'from', 'was', 'has', 'have', 'this', 'that'}
+
+    @classmethod
+    def tokenize(cls, text):
+        """Lowercase word tokens with a light plural normalisation"""
+        tokens = set()
+        for token in cls.TOKEN_RE.findall((text or '').lower()):
+            if len(token) < 2:
+                continue
+            if len(token) > 3 and token.endswith('s') and not token.endswith('ss'):
+                token = token[:-1]
+            tokens.add(token)
+        return tokens
+
+    @classmethod
+    def grams(cls, text):
+        """All trigrams of the lowercase words in the text"""
+        return {
+            word[i:i + cls.GRAM]
+            for word in cls.TOKEN_RE.findall((text or '').lower())
+            for i in range(len(word) - cls.GRAM + 1)
+        }
+
+    @classmethod
+    def anchor_gram(cls, text):
+        """The trigram to index a keyword or location under, or None if it has none"""
+        words = [word for word in cls.TOKEN_RE.findall((text or '').lower()) if len(word) >= cls.GRAM]
+        # Longer words are usually rarer; a stopword only if there is nothing else
+        words.sort(key=lambda word: (word not in cls.STOPWORDS, len(word)), reverse=True)
+        return words[0][:cls.GRAM] if words else None
+
+    @classmethod
+    def anchor_key(cls, params):
+        """Pick the index key a saved search is stored under"""
+        gram = cls.anchor_gram(params.get('q'))
+        if gram:
+            return f'kw:{gram}'
+        gram = cls.anchor_gram(params.get('location'))
+        if gram:
+            return f'loc:{gram}'
+        for field in ('category', 'item_type', 'status'):
+            if params.get(field):
+                return f'{field}:{params[field]}'
+        return 'all'
+
+    @classmethod
+    def post_keys(cls, post):
+        """All index keys a post could satisfy"""
+        keys = {'all', f'category:{post.category}', f'item_type:{post.item_type}', f'status:{post.status}'}
+        keys.update(f'loc:{gram}' for gram in cls.grams(post.location))
+        keys.update(f'kw:{gram}' for gram in cls.grams(f'{post.title} {post.content}'))
+        return keys
+
+    @classmethod
+    def find_matching_searches(cls, post):
+        """Return the active saved searches that match the post (excluding the author's own)"""
+        candidates = SavedSearch.objects.filter(
+            anchor__in=cls.post_keys(post), is_active=True
+        ).exclude(user_id=post.author_id).only(
+            'id', 'user_id', 'q', 'item_type', 'category', 'location', 'status'
+        )
+        return [search for search in candidates.iterator(chunk_size=2000)
+                if PostFilterService.matches(post, search.params)]
+
+
+class NotificationService:
+    """
+    Service class for the new-match notification pipeline.
+
+    1. collect() runs after a post is committed. It finds the users who may
+       care (saved-search hits and owners of counterpart lost/found posts)
+       with a couple of set-based queries and records one MatchNotification
+       per recipient. Repeats are dropped by the (recipient, post) unique key.
+       Counterparts come from the post's shard and notifications are stored
+       with the post when posts are sharded by region (blog/sharding.py).
+    2. send_due_digests() runs in the background (`manage.py
+       send_notifications --loop`). Once a recipient's oldest pending
+       notification is NOTIFICATION_DIGEST_WINDOW seconds old, it groups
+       everything pending for them into one digest email. Digests go out in
+       batches over one mail connection.
+    """
+
+    @staticmethod
+    def _setting(name, default):
+        return getattr(settings, name, default)
+
+    @classmethod
+    def find_counterpart_posts(cls, post):
+        """
+        Active posts of the opposite type that could be the same item:
+        same category, a shared location word and recent enough.
+        """
+        opposite = Post.FOUND if post.item_type == Post.LOST else Post.LOST
+        max_age = timedelta(days=cls._setting('NOTIFICATION_MATCH_MAX_AGE_DAYS', 90))
+        queryset = Post.objects.using(PostShardService.shard_of(post)).filter(
+            item_type=opposite,
+            category=post.category,
+            status=Post.ACTIVE,
+            date_posted__gte=post.date_posted - max_age,
+        ).exclude(author_id=post.author_id)
+
+        # 'Kenya' is the default location and says nothing about where
+        locations = SavedSearchService.tokenize(post.location) - {'kenya'}
+        if locations:
+            location_filter = Q()
+            for token in locations:
+                location_filter |= Q(location__icontains=token)
+            queryset = queryset.filter(location_filter)
+
+        limit = cls._setting('NOTIFICATION_MAX_MATCHES', 500)
+        return queryset.order_by('-date_posted').only('id', 'author_id')[:limit]
+
+    @classmethod
+    def collect(cls, post):
+        """
+        Record notifications for everyone the new post could interest.
+
+        Returns:
+            int: Number of candidate notifications (before deduplication).
+        """
+        now = timezone.now()
+        notifications = {}
+        for search in SavedSearchService.find_matching_searches(post):
+            notifications.setdefault(search.user_id, MatchNotification(
+                recipient_id=search.user_id, post=post, reason=MatchNotification.SAVED_SEARCH,
+                search_id=search.pk, created=now,
+            ))
+        for match in cls.find_counterpart_posts(post):
+            notifications.setdefault(match.author_id, MatchNotification(
+                recipient_id=match.author_id, post=post, reason=MatchNotification.POSSIBLE_MATCH,
+                matched_post_id=match.pk, created=now,
+            ))
+
+        MatchNotification.objects.using(PostShardService.shard_of(post)).bulk_create(
+            notifications.values(), batch_size=1000, ignore_conflicts=True
+        )
+        return len(notifications)
+
+    @classmethod
+    def collect_on_commit(cls, post):
+        """
+        Collect notifications once the surrounding transaction has committed.
+
+        With NOTIFICATION_COLLECT_ASYNC the work runs on a per-process
+        background thread so the author's request does not wait for it.
+        """
+        if cls._setting('NOTIFICATION_COLLECT_ASYNC', True):
+            transaction.on_commit(lambda: _collect_executor().submit(cls._collect_in_background, post.pk))
+        else:
+            transaction.on_commit(lambda: cls.collect(post))
+
+    @classmethod
+    def _collect_in_background(cls, post_id):
+        try:
+            post = PostShardService.queryset_for(post_id).filter(pk=post_id).first()
+            if post is not None:
+                cls.collect(post)
+        except Exception as e:
+            logger.error(f"❌ Collecting notifications for post {post_id} failed: {e}", exc_info=True)
+        finally:
+            close_old_connections()
+
+    @classmethod
+    def due_recipient_ids(cls, now=None, limit=None):
+        """Recipients whose oldest pending notification has waited out the digest window"""
+        now = now or timezone.now()
+        window = timedelta(seconds=cls._setting('NOTIFICATION_DIGEST_WINDOW', 600))
+        queryset = (
+            MatchNotification.objects.filter(sent_at__isnull=True)
+            .values('recipient_id')
+            .annotate(oldest=Min('created'))
+            .filter(oldest__lte=now - window)
+            .order_by('oldest')
+            .values_list('recipient_id', 'oldest')
+        )
+        rows = PostShardService.route(queryset, key=itemgetter(1), reverse=False)
+        rows = rows[:limit] if limit else rows
+        # A recipient can have pending notifications on several shards
+        return list(dict.fromkeys(recipient_id for recipient_id, _ in rows))
+
+    @classmethod
+    def build_digest(cls, recipient, notifications, overflow=0):
+        """
+        Build the digest EmailMessage for one recipient.
+
+        Args:
+            recipient: The User the digest is for.
+            notifications: The notifications listed in the digest.
+            overflow: How many more are pending but not listed; the digest
+                counts them and points to the site for the rest.
+        """
+        count = len(notifications) + overflow
+        body = render_to_string('blog/emails/match_digest.txt', {
+            'user': recipient,
+            'notifications': notifications,
+            'count': count,
+            'overflow': overflow,
+            'site_url': settings.SITE_URL,
+        })
+        subject = f"{count} new item{'s' if count != 1 else ''} on LostLink Kenya could be yours"
+        return EmailMessage(subject, body, settings.DEFAULT_FROM_EMAIL, [recipient.email])
+
+    @classmethod
+    def send_due_digests(cls, now=None):
+        """
+        Send one batch of due digests.
+
+        Returns:
+            dict: 'digests' sent, 'notifications' delivered and their 'lags'
+                (seconds from post creation to sending).
+        """
+        batch_size = cls._setting('NOTIFICATION_BATCH_SIZE', 200)
+        max_items = cls._setting('NOTIFICATION_MAX_DIGEST_ITEMS', 20)
+        recipient_ids = cls.due_recipient_ids(now, limit=batch_size)
+        result = {'digests': 0, 'notifications': 0, 'lags': []}
+        if not recipient_ids:
+            return result
+
+        pending = PostShardService.route(
+            MatchNotification.objects.filter(recipient_id__in=recipient_ids, sent_at__isnull=True)
+            .select_related('recipient', 'post', 'search', 'matched_post').order_by('recipient_id', 'created'),
+            key=attrgetter('recipient_id', 'created'), reverse=False,
+        )
+
+        messages, delivered = [], []
+        for recipient, notifications in groupby(pending, key=lambda n: n.recipient):
+            notifications = list(notifications)
+            if recipient.email:
+                messages.append(cls.build_digest(recipient, notifications[:max_items],
+                                                 overflow=max(0, len(notifications) - max_items)))
+            # Anything beyond max_items is counted in the digest ("and N more"), not sent separately
+            delivered.extend(notifications)
+
+        if messages:
+            connection = get_connection()
+            connection.send_messages(messages)
+
+        sent_at = timezone.now()
+        for shard, shard_delivered in groupby(sorted(delivered, key=lambda n: n._state.db),
+                                              key=lambda n: PostShardService.shard_of(n)):
+            MatchNotification.objects.using(shard).filter(
+                pk__in=[n.pk for n in shard_delivered]
+            ).update(sent_at=sent_at)
+
+        result['digests'] = len(messages)
+        result['notifications'] = len(delivered)
+        result['lags'] = [(sent_at - n.post.date_posted).total_seconds() for n in delivered]
+        logger.info(f"📬 Sent {len(messages)} match digests covering {len(delivered)} notifications")
+        return result
+
+    @classmethod
+    def send_all_due(cls, now=None):
+        """Send due digests batch by batch until none are left. Returns the combined result."""
+        total = {'digests': 0, 'notifications': 0, 'lags': []}
+        while True:
+            result = cls.send_due_digests(now)
+            if not result['notifications']:
+                return total
+            for key in total:
+                total[key] += result[key]
+
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def _collect_executor():
+    """Per-process single-thread executor (recreated after gunicorn forks)"""
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='match-notifications')
+            _executor_pid = os.getpid()
+        return _executor
+
+
+def shutdown_background_collector(wait=True):
+    """Finish (or drop) queued notification collection before the process exits."""
+    global _executor
+    with _executor_lock:
+        if _executor is not None and _executor_pid == os.getpid():
+            _executor.shutdown(wait=wait)
+        _executor = None
@@ -0,0 +1,536 @@
+"""
+Region sharding of posts (optional: on when POST_SHARD_URLS is set).
+
+Lost items are searched near where they were lost, so posts can be spread
+over several databases by where they are. POST_SHARD_URLS maps a region
+(nairobi, central, coast, eastern, north_eastern, nyanza, rift_valley,
+western) or a single county to a database, added as alias ``shard_<key>``.
+A post's shard comes from the last county, town or Nairobi neighbourhood
+named in its location; posts that name none, or whose region has no shard,
+stay on ``default``. Users, profiles, sessions, saved searches and the cache
+always live on ``default``.
+
+A post's dependent rows (its PaymentAccess rows and MatchNotifications) live
+on the post's shard, so deleting a post cascades within one database. The
+foreign keys that cross databases (to users and saved searches) have no
+database constraint; the signals in blog/signals.py clean up the shards when
+a user or saved search is deleted.
+
+Post ids stay unique across shards: they are allocated from the PostShard
+directory on ``default``, which also records each post's shard so a page
+like /blog/post/<pk>/ reads from exactly one database.
+
+Reading:
+- by id: PostShardService.queryset_for(pk) (one directory lookup), or
+  get_post_or_404(pk), which falls back to the archived post;
+- listings: PostShardService.route(queryset, location) targets the one
+  shard that holds the filter's location, or fans out to every shard and
+  merges the ordered results (ShardedResults, a k-way merge on
+  date_posted, sliceable for the paginator). A post whose location names
+  places in two regions is only found by a filter on the last one;
+- dependent rows of a known post: PostShardService.shard_of(post).
+
+``None`` stands for the default database throughout: querysets on it are
+left to the other routers (read replicas, the SQLite read connection).
+
+Posts are placed when created (PostShardService.bulk_create() for batches,
+as seed_data does). Posts created before sharding was enabled and posts
+whose location was edited are moved by `python manage.py rebalance_shards`.
+
+Locally, several SQLite files stand in for the shards:
+
+    POST_SHARD_URLS=nairobi=sqlite:////tmp/shard-nairobi.db,coast=sqlite:////tmp/shard-coast.db \\
+        python manage.py migrate --database shard_nairobi   # and shard_coast
+"""
+
+import heapq
+import re
+from itertools import islice
+from operator import attrgetter
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.shortcuts import aget_object_or_404, get_object_or_404
+
+# Kenya's 47 counties by region (the former provinces)
+REGION_COUNTIES = {
+    'nairobi': ['nairobi'],
+    'central': ['nyandarua', 'nyeri', 'kirinyaga', "murang'a", 'kiambu'],
+    'coast': ['mombasa', 'kwale', 'kilifi', 'tana river', 'lamu', 'taita taveta'],
+    'eastern': ['marsabit', 'isiolo', 'meru', 'tharaka nithi', 'embu', 'kitui', 'machakos', 'makueni'],
+    'north_eastern': ['garissa', 'wajir', 'mandera'],
+    'nyanza': ['siaya', 'kisumu', 'homa bay', 'migori', 'kisii', 'nyamira'],
+    'rift_valley': [
+        'turkana', 'west pokot', 'samburu', 'trans nzoia', 'uasin gishu', 'elgeyo marakwet', 'nandi',
+        'baringo', 'laikipia', 'nakuru', 'narok', 'kajiado', 'kericho', 'bomet',
+    ],
+    'western': ['kakamega', 'vihiga', 'bungoma', 'busia'],
+}
+
+# Towns and Nairobi neighbourhoods people write instead of the county
+PLACE_COUNTIES = {
+    'cbd': 'nairobi', 'westlands': 'nairobi', 'kilimani': 'nairobi', 'kasarani': 'nairobi',
+    'embakasi': 'nairobi', 'eastleigh': 'nairobi', 'langata': 'nairobi', 'karen': 'nairobi',
+    'kibera': 'nairobi', 'ruaka': 'kiambu', 'thika': 'kiambu', 'ruiru': 'kiambu', 'juja': 'kiambu',
+    'limuru': 'kiambu', 'rongai': 'kajiado', 'kitengela': 'kajiado', 'ngong': 'kajiado',
+    'athi river': 'machakos', 'mlolongo': 'machakos', 'syokimau': 'machakos',
+    'malindi': 'kilifi', 'watamu': 'kilifi', 'diani': 'kwale', 'ukunda': 'kwale', 'voi': 'taita taveta',
+    'naivasha': 'nakuru', 'gilgil': 'nakuru', 'eldoret': 'uasin gishu', 'kitale': 'trans nzoia',
+    'kapsabet': 'nandi', 'nanyuki': 'laikipia',
+}
+
+SHARDED_MODELS = {'blog.post', 'blog.archivedpost', 'blog.matchnotification', 'users.paymentaccess'}
+# Created empty on every shard so the migrations have the tables they refer
+# to: the foreign keys of the first migrations and the model renamed to
+# MatchNotification
+SHARD_SCHEMA_APPS = {'auth', 'contenttypes'}
+SHARD_SCHEMA_MODELS = {'blog.savedsearch', 'blog.savedsearchmatch'}
+
+
+def _words(text):
+    return re.sub(r'[^a-z0-9]+', ' ', text.lower().replace("'", '')).strip()
+
+
+def shard_key(name):
+    """Normalise a region or county name: "Homa Bay" -> "homa_bay", "Murang'a" -> "muranga"."""
+    return _words(name).replace(' ', '_')
+
+
+COUNTY_REGIONS = {shard_key(county): region for region, counties in REGION_COUNTIES.items() for county in counties}
+# Place names as words -> county key
+_PLACES = {
+    **{_words(county): shard_key(county) for counties in REGION_COUNTIES.values() for county in counties},
+    **{_words(place): shard_key(county) for place, county in PLACE_COUNTIES.items()},
+}
+# Longest names first, so "homa bay" wins over a shorter name at the same position
+_PLACE_PATTERN = re.compile(
+    r'\b(' + '|'.join(re.escape(p) for p in sorted(_PLACES, key=len, reverse=True)) + r')\b'
+)
+
+
+def county_for_location(location):
+    """
+    The county a free-text location is in, from the last place it names
+    (addresses go from the street to the county: "Thika Road, Nairobi").
+
+    Returns:
+        str: county key (see shard_key), or None if no known place is named
+    """
+    matches = _PLACE_PATTERN.findall(_words(location or ''))
+    return _PLACES[matches[-1]] if matches else None
+
+
+def shard_aliases():
+    """Database aliases of the configured shards (without default)."""
+    return list(dict.fromkeys(getattr(settings, 'POST_SHARDS', {}).values()))
+
+
+class PostShardService:
+    """
+    Service class for placing and finding posts across shards.
+    """
+
+    @staticmethod
+    def enabled():
+        return bool(getattr(settings, 'POST_SHARDS', None))
+
+    @staticmethod
+    def shards():
+        """Every shard, default (None) first."""
+        return [None, *shard_aliases()]
+
+    @staticmethod
+    def shard_for_location(location):
+        """
+        The shard for posts at ``location``: a shard for its county, else for
+        its region, else default.
+
+        Returns:
+            str: database alias, or None for default
+        """
+        shards = getattr(settings, 'POST_SHARDS', {})
+        county = county_for_location(location)
+        if not shards or county is None:
+            return None
+        return shards.get(county) or shards.get(COUNTY_REGIONS[county])
+
+    @classmethod
+    def shard_for_filter(cls, location):
+        """
+        The one shard that can hold posts matching a location filter.
+
+        Returns:
+            tuple: (True, alias or None) when one shard is enough, or
+            (False, None) when every shard has to be searched
+        """
+        if not cls.enabled() or county_for_location(location) is None:
+            return False, None
+        return True, cls.shard_for_location(location)
+
+    @staticmethod
+    def shard_of(post):
+        """The shard a loaded post (and so its dependent rows) is on."""
+        db = post._state.db
+        return db if db in shard_aliases() else None
+
+    @classmethod
+    def shard_for_post_id(cls, pk):
+        """Look a post's shard up in the directory (None: default, or sharding is off)."""
+        if not cls.enabled():
+            return None
+        from .models import PostShard
+        shard = PostShard.objects.filter(pk=pk).values_list('shard', flat=True).first()
+        return shard if shard in shard_aliases() else None
+
+    @classmethod
+    async def ashard_for_post_id(cls, pk):
+        """Async version of shard_for_post_id()."""
+        if not cls.enabled():
+            return None
+        from .models import PostShard
+        shard = await PostShard.objects.filter(pk=pk).values_list('shard', flat=True).afirst()
+        return shard if shard in shard_aliases() else None
+
+    @classmethod
+    def queryset_for(cls, pk, queryset=None):
+        """
+        ``queryset`` (default: all posts) on the shard that holds post ``pk``.
+
+        Args:
+            pk: Post id, as given in the URL
+            queryset: Post queryset to route
+
+        Returns:
+            QuerySet
+        """
+        from .models import Post
+        queryset = Post.objects.all() if queryset is None else queryset
+        if not cls.enabled():
+            return queryset
+        alias = cls.shard_for_post_id(pk)
+        return cls.with_author(queryset.using(alias), alias)
+
+    @classmethod
+    async def aqueryset_for(cls, pk, queryset=None):
+        """Async version of queryset_for()."""
+        from .models import Post
+        queryset = Post.objects.all() if queryset is None else queryset
+        if not cls.enabled():
+            return queryset
+        alias = await cls.ashard_for_post_id(pk)
+        return cls.with_author(queryset.using(alias), alias)
+
+    @classmethod
+    def get_post_or_404(cls, pk):
+        """
+        Post ``pk`` from its shard, or its ArchivedPost once it has been
+        archived (blog/archive.py): archived posts keep their URLs and payments.
+
+        Raises:
+            Http404: If neither table has the post
+        """
+        from .models import ArchivedPost
+        post = cls.queryset_for(pk).filter(pk=pk).first()
+        if post is None:
+            post = get_object_or_404(cls.queryset_for(pk, ArchivedPost.objects.all()), pk=pk)
+        return post
+
+    @classmethod
+    async def aget_post_or_404(cls, pk):
+        """Async version of get_post_or_404()."""
+        from .models import ArchivedPost
+        post = await (await cls.aqueryset_for(pk)).filter(pk=pk).afirst()
+        if post is None:
+            post = await aget_object_or_404(await cls.aqueryset_for(pk, ArchivedPost.objects.all()), pk=pk)
+        return post
+
+    @staticmethod
+    def with_author(queryset, alias):
+        """
+        Shards have no auth tables to join, so on a shard turn select_related()
+        of the author into prefetch_related() (a query more per relation, on default).
+        """
+        if alias is None or not isinstance(queryset.query.select_related, dict):
+            return queryset
+        related = []
+
+        def walk(tree, prefix):
+            for name, children in tree.items():
+                related.append(prefix + name)
+                walk(children, f'{prefix}{name}__')
+        walk(queryset.query.select_related, '')
+        return queryset.select_related(None).prefetch_related(*related)
+
+    @classmethod
+    def route(cls, queryset, location=None, key=attrgetter('date_posted'), reverse=True, unique=False):
+        """
+        Run a Post queryset on the one shard for ``location``, or on every shard.
+
+        Args:
+            queryset: Ordered queryset; with several shards the results are
+                merged by ``key``, which must follow the queryset's ordering
+            location: The location filter, if any
+            key: Sort key of the merged rows
+            reverse: Whether the ordering is descending
+            unique: Drop duplicates across shards (for distinct values)
+
+        Returns:
+            The queryset itself when sharding is off, the queryset on one
+            shard, or ShardedResults over every shard.
+        """
+        if not cls.enabled():
+            return queryset
+        single, alias = cls.shard_for_filter(location)
+        if single:
+            return cls.with_author(queryset.using(alias), alias)
+        return ShardedResults(
+            [cls.with_author(queryset.using(alias), alias) for alias in cls.shards()],
+            key=key, reverse=reverse, unique=unique,
+        )
+
+    @classmethod
+    def aggregate(cls, queryset, **aggregates):
+        """Sum count-like aggregates of ``queryset`` over every shard."""
+        if not cls.enabled():
+            return queryset.aggregate(**aggregates)
+        totals = dict.fromkeys(aggregates, 0)
+        for alias in cls.shards():
+            for name, value in queryset.using(alias).aggregate(**aggregates).items():
+                totals[name] += value or 0
+        return totals
+
+    @classmethod
+    async def aaggregate(cls, queryset, **aggregates):
+        """Async version of aggregate()."""
+        if not cls.enabled():
+            return await queryset.aaggregate(**aggregates)
+        totals = dict.fromkeys(aggregates, 0)
+        for alias in cls.shards():
+            for name, value in (await queryset.using(alias).aaggregate(**aggregates)).items():
+                totals[name] += value or 0
+        return totals
+
+    @classmethod
+    def allocate(cls, post, using=None):
+        """
+        Give a new post a globally unique id and pick its shard.
+
+        The id is the new directory entry's, so the entry is written before
+        the post; if saving the post then fails, release() removes it.
+
+        Args:
+            post: Unsaved post without an id
+            using: Database the caller asked for; a shard alias is kept,
+                anything else is replaced by the shard for the post's location
+
+        Returns:
+            str: database alias to save to, or None for the default routing
+        """
+        from .models import PostShard
+        alias = using if using in shard_aliases() else cls.shard_for_location(post.location)
+        post.pk = PostShard.objects.create(shard=alias or DEFAULT_DB_ALIAS).pk
+        return alias or using
+
+    @staticmethod
+    def release(posts):
+        """
+        Remove the directory entries allocated to posts that were not saved,
+        and clear their ids so a retry allocates new ones.
+        """
+        from .models import PostShard
+        PostShard.objects.filter(pk__in=[post.pk for post in posts]).delete()
+        for post in posts:
+            post.pk = None
+
+    @classmethod
+    def bulk_create(cls, posts, batch_size=None):
+        """
+        bulk_create() new posts on their shards, with ids from the directory.
+
+        Args:
+            posts: Unsaved posts without ids
+            batch_size: Rows per INSERT
+        """
+        from .models import Post, PostShard
+        aliases = [cls.shard_for_location(post.location) for post in posts]
+        entries = PostShard.objects.bulk_create(
+            [PostShard(shard=alias or DEFAULT_DB_ALIAS) for alias in aliases], batch_size=batch_size
+        )
+        by_shard = {}
+        for post, entry, alias in zip(posts, entries, aliases):
+            post.pk = entry.pk
+            by_shard.setdefault(alias, []).append(post)
+        saved = set()
+        try:
+            for alias, shard_posts in by_shard.items():
+                # One transaction per shard: a failed shard inserts none of its posts
+                Post.objects.using(alias or DEFAULT_DB_ALIAS).bulk_create(shard_posts, batch_size=batch_size)
+                saved.add(alias)
+        except Exception:
+            cls.release([post for alias, shard_posts in by_shard.items() if alias not in saved
+                         for post in shard_posts])
+            raise
+
+    @classmethod
+    def move(cls, post, alias):
+        """
+        Move a post and its dependent rows to another shard, keeping its id.
+
+        The steps run in an order that a crash at any point leaves
+        recoverable by running the move (rebalance_shards) again:
+
+        1. The directory entry is pointed at the target first, so lookups
+           and new payments go there from now on.
+        2. The post and its rows are copied to the target. Rows already
+           there from an interrupted earlier move are skipped.
+        3. The source copy is deleted. Its post_delete signal leaves the
+           directory alone, since the entry no longer names the source.
+
+        Until step 3 the post is on both databases; rebalance_shards finds
+        the source copy on its next run and finishes the move.
+
+        Args:
+            post: Post loaded from its current shard
+            alias: Target shard (None for default)
+        """
+        from users.models import PaymentAccess
+        from .models import MatchNotification, Post, PostShard
+        source_db = cls.shard_of(post) or DEFAULT_DB_ALIAS
+        target_db = alias or DEFAULT_DB_ALIAS
+        payments = list(PaymentAccess.objects.using(source_db).filter(post_id=post.pk))
+        notifications = list(MatchNotification.objects.using(source_db).filter(post_id=post.pk))
+        # Other posts' notifications that point at this one stay where they are
+        pointing = list(MatchNotification.objects.using(source_db).filter(matched_post_id=post.pk)
+                        .exclude(post_id=post.pk))
+
+        PostShard.objects.update_or_create(pk=post.pk, defaults={'shard': target_db})
+        with transaction.atomic(using=target_db):
+            Post.objects.using(target_db).bulk_create([post], ignore_conflicts=True)
+            PaymentAccess.objects.using(target_db).bulk_create(payments, ignore_conflicts=True)
+            MatchNotification.objects.using(target_db).bulk_create(notifications, ignore_conflicts=True)
+        with transaction.atomic(using=source_db):
+            # Cascades to the copied rows and to ``pointing``, put back below
+            Post.objects.using(source_db).filter(pk=post.pk).delete()
+            MatchNotification.objects.using(source_db).bulk_create(pointing)
+        post._state.db = target_db
+
+
+class ShardedResults:
+    """
+    The rows of one query run on several shards, merged in order.
+
+    Each shard's queryset must already be ordered by ``key``. Iterating
+    merges the shards lazily (a k-way merge); slicing asks each shard for at
+    most ``stop`` rows, so the first page of a listing reads page-size rows
+    per shard. Enough of the QuerySet API for ListView, Paginator and the
+    templates: iteration (sync and async), slicing, len(), count(), exists().
+    """
+
+    ordered = True
+
+    def __init__(self, querysets, key=None, reverse=False, unique=False):
+        self.querysets = querysets
+        self.model = getattr(querysets[0], 'model', None) if querysets else None
+        self.key = key
+        self.reverse = reverse
+        self.unique = unique
+        self._result_cache = None
+
+    def _merge(self, iterables):
+        merged = heapq.merge(*iterables, key=self.key, reverse=self.reverse)
+        if not self.unique:
+            return merged
+        return (row for row, previous in _with_previous(merged) if row != previous)
+
+    def __iter__(self):
+        if self._result_cache is None:
+            self._result_cache = list(self._merge(self.querysets))
+        return iter(self._result_cache)
+
+    async def __aiter__(self):
+        if self._result_cache is None:
+            self._result_cache = list(self._merge([[row async for row in qs] for qs in self.querysets]))
+        for row in self._result_cache:
+            yield row
+
+    def __len__(self):
+        return len(list(iter(self)))
+
+    def __bool__(self):
+        return self.exists()
+
+    def __getitem__(self, index):
+        if self._result_cache is not None:
+            return self._result_cache[index]
+        if isinstance(index, slice):
+            if index.step or (index.start or 0) < 0 or (index.stop is not None and index.stop < 0):
+                return list(self)[index]
+            if index.stop is None:
+                return list(islice(self._merge(self.querysets), index.start, None))
+            return list(islice(self._merge([qs[:index.stop] for qs in self.querysets]), index.start, index.stop))
+        if index < 0:
+            return list(self)[index]
+        rows = self[index:index + 1]
+        if not rows:
+            raise IndexError('ShardedResults index out of range')
+        return rows[0]
+
+    def count(self):
+        if self._result_cache is not None:
+            return len(self._result_cache)
+        return sum(qs.count() for qs in self.querysets)
+
+    def exists(self):
+        if self._result_cache is not None:
+            return bool(self._result_cache)
+        return any(qs.exists() for qs in self.querysets)
+
+
+def _with_previous(iterable):
+    previous = object()
+    for row in iterable:
+        yield row, previous
+        previous = row
+
+
+class ShardRouter:
+    """
+    Keep related lookups on the right database when posts are sharded.
+
+    Posts and their dependent rows follow the database of the instance they
+    are reached from (post.payments on the post's shard); users, profiles and
+    every other model are always on default, even when reached from a post on
+    a shard (post.author). Queries without an instance are left to the
+    routers after this one: PostShardService picks the shard explicitly.
+    """
+
+    def db_for_read(self, model, **hints):
+        return self._db_for(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self._db_for(model, hints)
+
+    @staticmethod
+    def _db_for(model, hints):
+        instance = hints.get('instance')
+        db = getattr(getattr(instance, '_state', None), 'db', None)
+        if db not in shard_aliases():
+            return None
+        if model._meta.label_lower in SHARDED_MODELS:
+            return db
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {obj1._state.db, obj2._state.db}
+        if databases & set(shard_aliases()):
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # A shard holds only the post tables (see SHARDED_MODELS)
+        if db not in shard_aliases():
+            return None
+        if app_label in SHARD_SCHEMA_APPS:
+            return True
+        label = f'{app_label}.{model_name}'
+        return model_name is not None and (label in SHARDED_MODELS or label in SHARD_SCHEMA_MODELS)
@@ -0,0 +1,43 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from users.models import PaymentAccess
+from .archive import is_archiving
+from .models import ArchivedPost, MatchNotification, Post, PostShard, SavedSearch
+from .services import NotificationService
+from .sharding import PostShardService, shard_aliases
+
+
+@receiver(post_save, sender=Post, dispatch_uid='blog.collect_match_notifications')
+def collect_match_notifications(sender, instance, created, raw=False, **kwargs):
+    """Queue notifications for users a new post could interest, once it is committed"""
+    if created and not raw:
+        NotificationService.collect_on_commit(instance)
+
+
+@receiver(post_delete, sender=Post, dispatch_uid='blog.forget_post_shard')
+@receiver(post_delete, sender=ArchivedPost, dispatch_uid='blog.forget_archived_post_shard')
+def forget_post_shard(sender, instance, using, **kwargs):
+    """Drop a deleted post from the shard directory (an archived one keeps its entry)"""
+    if PostShardService.enabled() and not is_archiving():
+        # Only while the entry names this database: a post being moved
+        # (PostShardService.move) already points at its new shard
+        PostShard.objects.filter(pk=instance.pk, shard=using).delete()
+
+
+@receiver(pre_delete, sender=User, dispatch_uid='blog.delete_sharded_user_rows')
+def delete_sharded_user_rows(sender, instance, **kwargs):
+    """Cascade a user's deletion to their posts, payments and notifications on the shards"""
+    # The foreign keys into default have no constraint, so nothing else would
+    for alias in shard_aliases():
+        Post.objects.using(alias).filter(author_id=instance.pk).delete()
+        ArchivedPost.objects.using(alias).filter(author_id=instance.pk).delete()
+        PaymentAccess.objects.using(alias).filter(user_id=instance.pk).delete()
+        MatchNotification.objects.using(alias).filter(recipient_id=instance.pk).delete()
+
+
+@receiver(post_delete, sender=SavedSearch, dispatch_uid='blog.detach_sharded_notifications')
+def detach_sharded_notifications(sender, instance, **kwargs):
+    """SET_NULL the deleted alert on notifications stored on the shards"""
+    for alias in shard_aliases():
+        MatchNotification.objects.using(alias).filter(search_id=instance.pk).update(search=None)
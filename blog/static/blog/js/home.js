@@ -0,0 +1,110 @@
+// Filter Dropdown Toggle
+document.addEventListener('DOMContentLoaded', function() {
+  const filterToggle = document.getElementById('filterToggle');
+  const filterDropdown = document.getElementById('filterDropdown');
+
+  if (filterToggle && filterDropdown) {
+    // Toggle dropdown on button click
+    filterToggle.addEventListener('click', function(e) {
+      e.preventDefault();
+      const isVisible = filterDropdown.style.display !== 'none';
+      filterDropdown.style.display = isVisible ? 'none' : 'block';
+      filterToggle.classList.toggle('active');
+    });
+
+    // Auto-submit form when a filter changes
+    const filterInputs = filterDropdown.querySelectorAll('select, input[type="text"], input[type="checkbox"]');
+    const filterForm = filterDropdown.closest('form');
+    filterInputs.forEach(input => {
+      input.addEventListener('change', function() {
+        if (filterForm) {
+          filterForm.submit();
+        }
+      });
+    });
+
+    // Close dropdown when clicking outside
+    document.addEventListener('click', function(e) {
+      if (!filterToggle.contains(e.target) && !filterDropdown.contains(e.target)) {
+        filterDropdown.style.display = 'none';
+        filterToggle.classList.remove('active');
+      }
+    });
+
+    // Show dropdown if any filters are already applied
+    const hasActiveFilters = 
+      document.getElementById('item_type').value !== '' ||
+      document.getElementById('category').value !== '' ||
+      document.getElementById('location').value !== '' ||
+      document.getElementById('status').value !== '' ||
+      document.getElementById('archived').checked;
+
+    if (hasActiveFilters) {
+      filterDropdown.style.display = 'block';
+      filterToggle.classList.add('active');
+    }
+  }
+});
+
+// Carousel functionality
+let currentSlide = 0;
+const slides = document.querySelectorAll('.carousel-slide');
+const indicators = document.querySelectorAll('.indicator');
+const totalSlides = slides.length;
+
+function showSlide(n) {
+  if (totalSlides === 0) return;
+
+  currentSlide = (n + totalSlides) % totalSlides;
+  const track = document.querySelector('.carousel-track');
+  if (track) {
+    track.style.transform = 'translateX(' + (-currentSlide * 100) + '%)';
+  }
+
+  indicators.forEach((indicator, index) => {
+    indicator.classList.toggle('active', index === currentSlide);
+  });
+}
+
+function nextSlide() {
+  showSlide(currentSlide + 1);
+}
+
+function prevSlide() {
+  showSlide(currentSlide - 1);
+}
+
+// Attach button listeners if they exist
+const nextBtn = document.querySelector('.carousel-btn-next');
+const prevBtn = document.querySelector('.carousel-btn-prev');
+if (nextBtn) nextBtn.addEventListener('click', nextSlide);
+if (prevBtn) prevBtn.addEventListener('click', prevSlide);
+
+// Attach indicator listeners
+indicators.forEach((indicator, index) => {
+  indicator.addEventListener('click', () => showSlide(index));
+});
+
+// Auto-rotate carousel every 5 seconds
+setInterval(nextSlide, 5000);
+
+// Make whole item card clickable (except when clicking links/buttons inside)
+document.addEventListener('DOMContentLoaded', function() {
+  document.querySelectorAll('.item-card[data-href]').forEach(card => {
+    card.addEventListener('click', function(e) {
+      // ignore clicks on links, buttons, inputs
+      if (e.target.closest('a') || e.target.closest('button') || e.target.closest('input')) return;
+      const href = this.dataset.href;
+      if (href) {
+        window.location = href;
+      }
+    });
+    // keyboard accessibility
+    card.addEventListener('keypress', function(e) {
+      if (e.key === 'Enter' || e.key === ' ') {
+        const href = this.dataset.href;
+        if (href) window.location = href;
+      }
+    });
+  });
+});
@@ -1,3 +1,886 @@
-from django.test import TestCase
+import gzip
+import json
+import multiprocessing
+import os
+import re
+import shutil
+import struct
+import sys
+import tempfile
+import time
+import traceback
+import zlib
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.staticfiles import finders
+from django.core.exceptions import ValidationError
+from django.core.files import File
+from django.core import mail
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.paginator import Paginator
+from django.db import DatabaseError, connections
+from django.db.models.query import QuerySet
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.template.loader import get_template
+from django.test import AsyncRequestFactory, RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image as PILImage
+
+from blog.management.commands.seed_data import SEED_PREFIX
+from blog.archive import ArchiveService
+from blog.models import ArchivedPost, MatchNotification, Post, PostShard, SavedSearch
+from blog.services import NotificationService, PostFilterService, SavedSearchService
+from blog.sharding import PostShardService, ShardedResults, county_for_location
+from blog.views import AsyncHomeView, AsyncPostDetailView, HomeView
+from myproject import metrics
+from myproject.budgets import BudgetTestMixin
+from myproject.compression import CompressionMiddleware, brotli, compression, minify_html, negotiate
+from myproject.db_routers import PIN_COOKIE, READ_DB, WRITE_DB, ReadWriteRouter, ReplicaPinningMiddleware, ReplicaRouter
+from myproject.uploads import ingest_image
+from users.models import PaymentAccess
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, SECURE_SSL_REDIRECT=False)
+class ViewBudgetTests(BudgetTestMixin, TestCase):
+    """Query, time and allocation budgets for the blog pages (see myproject/budgets.py)."""
+
+    @classmethod
+    def setUpTestData(cls):
+        with override_settings(MEDIA_ROOT=MEDIA_ROOT):
+            call_command('seed_data', posts=300, users=30, stdout=StringIO())
+        cls.heavy_user = User.objects.get(username=f'{SEED_PREFIX}0000000')
+        cls.post = Post.objects.filter(author=cls.heavy_user).first()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def test_landing(self):
+        self.assertWithinBudget('landing', lambda: self.client.get(reverse('landing')))
+
+    def test_home(self):
+        self.assertWithinBudget('blog-home', lambda: self.client.get(reverse('blog-home')))
+
+    def test_home_logged_in(self):
+        self.client.force_login(self.heavy_user)
+        self.assertWithinBudget('blog-home', lambda: self.client.get(reverse('blog-home')), 'logged-in')
+
+    def test_home_filtered(self):
+        params = {'q': 'samsung', 'item_type': 'lost', 'category': 'phone', 'status': 'active'}
+        self.assertWithinBudget('blog-home', lambda: self.client.get(reverse('blog-home'), params), 'filtered')
+
+    def test_post_detail(self):
+        url = reverse('post-detail', args=[self.post.pk])
+        self.assertWithinBudget('post-detail', lambda: self.client.get(url))
+
+    def test_user_posts(self):
+        url = reverse('user-posts', args=[self.heavy_user.username])
+        self.assertWithinBudget('user-posts', lambda: self.client.get(url))
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class AsyncViewTests(TestCase):
+    """
+    The async pages used under ASGI. They render on the event loop, where a
+    lazy query in the template raises SynchronousOnlyOperation.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('owner', 'owner@example.com', 'pw')
+        cls.post = Post.objects.create(
+            title='Lost black wallet', content='At the bus stage', author=cls.user, location='Nairobi'
+        )
+        Post.objects.create(title='Found wallet', content='Near the market', author=cls.user, item_type=Post.FOUND)
+
+    def request(self, path, user, params=None):
+        request = AsyncRequestFactory().get(path, params)
+
+        async def auser():
+            return user
+        request.auser = auser
+        return request
+
+    async def test_home(self):
+        user = await User.objects.aget(pk=self.user.pk)
+        response = await AsyncHomeView.as_view()(self.request('/blog/', user, {'q': 'wallet'}))
+        self.assertContains(response, 'Lost black wallet')
+        self.assertContains(response, 'Found wallet')
+
+    @mock.patch.object(HomeView, 'paginate_by', 1)
+    async def test_home_is_paginated_like_the_sync_view(self):
+        user = await User.objects.aget(pk=self.user.pk)
+        response = await AsyncHomeView.as_view()(self.request('/blog/', user, {'q': 'wallet', 'page': 2}))
+        self.assertContains(response, 'Lost black wallet')
+        self.assertNotContains(response, 'Found wallet')
+        self.assertContains(response, '?q=wallet&amp;page=1')
+        sync_response = await self.async_client.get(reverse('blog-home'), {'q': 'wallet', 'page': 2})
+        self.assertEqual(sync_response.context['page_obj'].number, 2)
+        self.assertEqual([post.pk for post in sync_response.context['posts']], [self.post.pk])
+
+    async def test_post_detail(self):
+        user = await User.objects.aget(pk=self.user.pk)
+        response = await AsyncPostDetailView.as_view()(self.request('/blog/post/', user), pk=self.post.pk)
+        self.assertContains(response, 'Lost black wallet')
+        self.assertEqual(response.status_code, 200)
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class ServerTimingTests(TestCase):
+    """The Server-Timing header is only sent to staff, or to everyone with DEBUG."""
+
+    def test_staff_only(self):
+        self.assertNotIn('Server-Timing', self.client.get(reverse('blog-home')))
+        self.client.force_login(User.objects.create_user('member', 'member@example.com', 'pw'))
+        self.assertNotIn('Server-Timing', self.client.get(reverse('blog-home')))
+        self.client.force_login(User.objects.create_user('staff', 'staff@example.com', 'pw', is_staff=True))
+        self.assertIn('queries', self.client.get(reverse('blog-home'))['Server-Timing'])
+
+    def test_everyone_with_debug(self):
+        with override_settings(DEBUG=True):
+            self.assertIn('Server-Timing', self.client.get(reverse('blog-home')))
+
+
+@override_settings(SECURE_SSL_REDIRECT=False, METRICS_AUTH_TOKEN='')
+class MetricsAccessTests(TestCase):
+    """/metrics is closed unless the scraper has the token, the user is staff or DEBUG is on."""
+
+    def assertAllowed(self, response, allowed):
+        self.assertEqual(response.status_code != 401, allowed)
+
+    def test_closed_by_default(self):
+        self.assertAllowed(self.client.get(reverse('metrics')), False)
+        self.client.force_login(User.objects.create_user('member', 'member@example.com', 'pw'))
+        self.assertAllowed(self.client.get(reverse('metrics')), False)
+        self.client.force_login(User.objects.create_user('staff', 'staff@example.com', 'pw', is_staff=True))
+        self.assertAllowed(self.client.get(reverse('metrics')), True)
+        with override_settings(DEBUG=True):
+            self.client.logout()
+            self.assertAllowed(self.client.get(reverse('metrics')), True)
+
+    @override_settings(METRICS_AUTH_TOKEN='s3cret', DEBUG=True)
+    def test_token(self):
+        self.assertAllowed(self.client.get(reverse('metrics')), False)
+        self.assertAllowed(self.client.get(reverse('metrics'), headers={'Authorization': 'Bearer wrong'}), False)
+        self.assertAllowed(self.client.get(reverse('metrics'), headers={'Authorization': 'Bearer s3cret'}), True)
+
+
+@override_settings(SECURE_SSL_REDIRECT=False, TRAFFIC_CAPTURE_RATE=1.0, PERF_SLOW_REQUEST_MS=0)
+class RequestLogRouteTests(TestCase):
+    """The traffic capture and the slow log record URL patterns, never usernames or ids."""
+
+    def test_logs_record_the_route(self):
+        user = User.objects.create_user('jane.doe', 'jane@example.com', 'pw')
+        capture_log, slow_log = mock.Mock(), mock.Mock()
+        with mock.patch('myproject.capture.get_jsonl_logger', return_value=capture_log), \
+                mock.patch('myproject.middleware.get_slow_request_logger', return_value=slow_log):
+            self.client.get(reverse('user-posts', args=[user.username]), {'page': 1})
+        for log in (capture_log, slow_log):
+            line = log.info.call_args.args[0]
+            self.assertNotIn('jane', line)
+            record = json.loads(line)
+            self.assertEqual(record['route'], '/blog/user/<str:username>/')
+            self.assertEqual(record['route_kwargs'], ['username'])
+
+
+@override_settings(SECURE_SSL_REDIRECT=False, ARCHIVE_RESOLVED_AFTER_DAYS=14, ARCHIVE_STALE_AFTER_DAYS=365)
+class ArchiveTests(TestCase):
+    """Moving resolved and stale posts to the archive (blog/archive.py)."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('owner', 'owner@example.com', 'pw')
+        now = timezone.now()
+
+        def post(title, days, status=Post.ACTIVE):
+            return Post.objects.create(title=title, content='At the stage', author=cls.user, status=status,
+                                       date_posted=now - timedelta(days=days))
+        cls.resolved = post('Resolved wallet', 30, Post.RESOLVED)
+        cls.stale = post('Stale umbrella', 400)
+        post('Just resolved phone', 2, Post.RESOLVED)
+        post('Active keys', 30)
+        PaymentAccess.objects.create(user=cls.user, post=cls.resolved, paid=True)
+
+    def test_archive_due(self):
+        self.assertEqual(ArchiveService.archive_due(batch_size=1), {'default': 2})
+        self.assertEqual(set(ArchivedPost.objects.values_list('pk', flat=True)), {self.resolved.pk, self.stale.pk})
+        self.assertEqual(Post.objects.count(), 2)
+        # Payments survive archiving; a second run finds nothing
+        self.assertTrue(PaymentAccess.objects.filter(post_id=self.resolved.pk).exists())
+        self.assertEqual(ArchiveService.archive_due(), {'default': 0})
+
+    def test_archived_posts_keep_urls_and_are_searched_on_request(self):
+        ArchiveService.archive_due()
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('post-detail', args=[self.resolved.pk]))
+        self.assertContains(response, 'Resolved wallet')
+        self.assertContains(response, 'Archived')
+
+        response = self.client.get(reverse('blog-home'))
+        self.assertNotContains(response, 'Stale umbrella')
+        self.assertContains(response, 'Active keys')
+        response = self.client.get(reverse('blog-home'), {'archived': '1'})
+        self.assertContains(response, 'Stale umbrella')
+        self.assertNotContains(response, 'Active keys')
+
+
+class SavedSearchTests(TestCase):
+    """Saved-search alerts match the posts the Home page search would show."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author', 'author@example.com', 'pw')
+        cls.reader = User.objects.create_user('reader', 'reader@example.com', 'pw')
+        cls.post = Post.objects.create(title='Lost iPhone 12', content='Blue case, cracked screen at the Sarit Centre',
+                                       location='Westlands, Nairobi', category='electronics', author=cls.author)
+
+    def search(self, **params):
+        return SavedSearch.objects.create(user=self.reader, **params)
+
+    def test_tokenize_and_grams(self):
+        self.assertEqual(SavedSearchService.tokenize('Lost: two Keys, a glass & IDs!'),
+                         {'lost', 'two', 'key', 'glass', 'ids'})
+        self.assertEqual(SavedSearchService.grams('iPhone 12'), {'iph', 'pho', 'hon', 'one'})
+        self.assertEqual(SavedSearchService.anchor_key({'q': 'lost black wallet'}), 'kw:wal')
+        self.assertEqual(SavedSearchService.anchor_key({'q': 'tv', 'location': 'CBD'}), 'loc:cbd')
+        self.assertEqual(SavedSearchService.anchor_key({'q': 'tv', 'category': 'electronics'}), 'category:electronics')
+        self.assertEqual(SavedSearchService.anchor_key({}), 'all')
+
+    def test_matches_agree_with_home_search(self):
+        cases = [
+            {'q': 'phone'}, {'q': 'iPhone 12'}, {'q': 'PHONE 1'}, {'q': 'sarit'}, {'q': 'screen at'},
+            {'q': 'phones'}, {'q': 'tv'}, {'q': 'ip', 'location': 'lands'}, {'location': 'nairobi'},
+            {'location': 'Kisumu'}, {'q': 'case', 'category': 'documents'}, {'category': 'electronics'}, {},
+        ]
+        searches = [self.search(**params) for params in cases]
+        matched = {search.pk for search in SavedSearchService.find_matching_searches(self.post)}
+        for search in searches:
+            with self.subTest(params=search.params):
+                expected = PostFilterService.filter_posts(Post.objects.filter(pk=self.post.pk), search.params).exists()
+                self.assertEqual(search.pk in matched, expected)
+        self.assertIn(searches[0].pk, matched)
+
+    def test_skips_own_and_inactive_searches(self):
+        SavedSearch.objects.create(user=self.author, q='phone')
+        self.search(q='phone', is_active=False)
+        active = self.search(q='phone')
+        self.assertEqual([s.pk for s in SavedSearchService.find_matching_searches(self.post)], [active.pk])
+
+    def test_create_validates_filters(self):
+        self.client.force_login(self.reader)
+        url = reverse('saved-search-create')
+        response = self.client.post(url, {'q': 'x' * 201, 'category': 'spaceships'}, follow=True)
+        self.assertFalse(SavedSearch.objects.exists())
+        errors = [str(m) for m in response.context['messages']]
+        self.assertEqual(len(errors), 1)
+        self.assertIn('at most 200 characters', errors[0])
+        self.assertIn('spaceships is not one of the available choices', errors[0])
+
+        self.client.post(url, {'q': ' phone ', 'category': 'electronics'})
+        self.assertEqual(SavedSearch.objects.get().params, {
+            'q': 'phone', 'item_type': '', 'category': 'electronics', 'location': '', 'status': '',
+        })
+
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend',
+                   NOTIFICATION_DIGEST_WINDOW=0, NOTIFICATION_MAX_DIGEST_ITEMS=3)
+class MatchDigestTests(TestCase):
+    """Pending match notifications are sent as one digest per recipient."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author', 'author@example.com', 'pw')
+        cls.reader = User.objects.create_user('reader', 'reader@example.com', 'pw')
+
+    def notify(self, count):
+        for i in range(count):
+            post = Post.objects.create(title=f'Found wallet {i}', content='At the stage', author=self.author)
+            MatchNotification.objects.create(recipient=self.reader, post=post,
+                                             created=timezone.now() - timedelta(minutes=count - i))
+
+    def test_digest_lists_every_notification(self):
+        self.notify(3)
+        result = NotificationService.send_all_due()
+        self.assertEqual((result['digests'], result['notifications']), (1, 3))
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertTrue(mail.outbox[0].subject.startswith('3 new items'))
+        self.assertEqual(mail.outbox[0].body.count('Found wallet'), 3)
+        self.assertNotIn('more', mail.outbox[0].body)
+        self.assertFalse(MatchNotification.objects.filter(sent_at__isnull=True).exists())
+
+    def test_digest_counts_overflow(self):
+        self.notify(5)
+        result = NotificationService.send_all_due()
+        self.assertEqual((result['digests'], result['notifications']), (1, 5))
+        message = mail.outbox[0]
+        self.assertTrue(message.subject.startswith('5 new items'))
+        # The oldest are listed, the rest are counted
+        self.assertIn('Found wallet 0', message.body)
+        self.assertNotIn('Found wallet 3', message.body)
+        self.assertIn('...and 2 more', message.body)
+        self.assertFalse(MatchNotification.objects.filter(sent_at__isnull=True).exists())
+
+
+class MediaGCTests(TestCase):
+    """gc_media deletes only old files nothing refers to."""
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        user = User.objects.create_user('owner', 'owner@example.com', 'pw')
+        Post.objects.create(title='Lost phone', content='At the stage', author=user, image='post_pics/2025/kept.jpg')
+        archived = Post.objects.create(title='Old keys', content='Gate B', author=user, image='post_pics/archived.jpg')
+        ArchivedPost.objects.create(
+            **{f.attname: getattr(archived, f.attname) for f in Post._meta.concrete_fields}
+        )
+        archived.delete()
+        for name, age_hours in [('post_pics/2025/kept.jpg', 48), ('post_pics/archived.jpg', 48),
+                                ('default.jpg', 48), ('post_pics/2024/01/edited.jpg', 48),
+                                ('profile_pics/replaced.png', 48), ('post_pics/uploading.jpg', 0)]:
+            path = os.path.join(self.media_root, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(b'x' * 100)
+            mtime = time.time() - age_hours * 3600
+            os.utime(path, (mtime, mtime))
+
+    def files(self):
+        return sorted(
+            os.path.relpath(os.path.join(directory, name), self.media_root).replace(os.sep, '/')
+            for directory, _, names in os.walk(self.media_root) for name in names
+        )
+
+    def test_gc_media(self):
+        with override_settings(MEDIA_ROOT=self.media_root):
+            out = StringIO()
+            call_command('gc_media', dry_run=True, grace_hours=24, stdout=out)
+            self.assertIn('Would delete 2 orphaned files', out.getvalue())
+            self.assertEqual(len(self.files()), 6)
+
+            out = StringIO()
+            call_command('gc_media', grace_hours=24, batch_size=2, stdout=out)
+        self.assertIn('reclaimed 0.0 MB (200 bytes)', out.getvalue())
+        self.assertEqual(self.files(), [
+            'default.jpg', 'post_pics/2025/kept.jpg', 'post_pics/archived.jpg', 'post_pics/uploading.jpg',
+        ])
+        # Emptied dated directories are removed too
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, 'post_pics', '2024')))
+
+
+def peak_rss_kb(func):
+    """
+    Memory high-water of ``func()`` in KB, run in a forked child so the
+    pixel buffers Pillow allocates outside tracemalloc are counted too.
+    """
+    import resource  # Unix only, like fork
+    context = multiprocessing.get_context('fork')
+    receiver, sender = context.Pipe(duplex=False)
+
+    def child():
+        try:
+            baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            func()
+            sender.send((resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline, None))
+        except BaseException:
+            sender.send((None, traceback.format_exc()))
+    process = context.Process(target=child)
+    process.start()
+    # Only the child holds the sending end now, so recv() raises EOFError
+    # instead of waiting forever if the child dies without sending
+    sender.close()
+    try:
+        peak, error = receiver.recv()
+    except EOFError:
+        peak, error = None, 'no result'
+    finally:
+        receiver.close()
+        process.join()
+    if error is not None:
+        raise AssertionError(f'Measured function failed in the child (exit code {process.exitcode}):\n{error}')
+    # ru_maxrss is in KB on Linux, bytes on macOS
+    return peak / 1024 if sys.platform == 'darwin' else peak
+
+
+def write_jpeg(path, size):
+    # In a child process: the parent's heap must not keep the pixels around
+    context = multiprocessing.get_context('fork')
+    process = context.Process(target=lambda: PILImage.new('RGB', size, (40, 90, 160)).save(path, 'JPEG'))
+    process.start()
+    process.join()
+
+
+@skipUnless(hasattr(os, 'fork'), 'measures memory in a forked process')
+@override_settings(SECURE_SSL_REDIRECT=False, POST_IMAGE_MAX_SIZE=(1600, 1600))
+class UploadIngestionTests(TestCase):
+    """Upload limits and bounded-memory image ingestion (myproject/uploads.py)."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.media_root = tempfile.mkdtemp()
+        cls.photo = os.path.join(cls.media_root, 'phone-photo.jpg')
+        write_jpeg(cls.photo, (6000, 4000))
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+
+    def test_memory_high_water_per_upload(self):
+        def full_decode():
+            with PILImage.open(self.photo) as image:
+                image.load()
+
+        def ingest():
+            with open(self.photo, 'rb') as f:
+                stored = ingest_image(File(f, name='phone-photo.jpg'), (1600, 1600))
+                with PILImage.open(stored) as image:
+                    assert max(image.size) == 1600, image.size
+
+        full_kb, ingest_kb = peak_rss_kb(full_decode), peak_rss_kb(ingest)
+        # Draft mode decodes at half scale: a quarter of the pixels
+        self.assertLess(ingest_kb, full_kb / 2, f'24 MP upload, memory high-water: full decode '
+                        f'{full_kb / 1024:.1f} MB, ingest_image {ingest_kb / 1024:.1f} MB')
+
+    def test_pixel_bomb_rejected_from_header(self):
+        def chunk(kind, data):
+            return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+        # A PNG claiming 30000x30000 pixels (2.7 GB decoded) with no image data
+        bomb = b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', 30000, 30000, 8, 2, 0, 0, 0))
+        bomb += chunk(b'IEND', b'')
+        with self.assertRaises(ValidationError) as raised:
+            ingest_image(SimpleUploadedFile('bomb.png', bomb), (1600, 1600))
+        self.assertEqual(raised.exception.code, 'image_too_large')
+
+    def test_post_photo_limits(self):
+        user = User.objects.create_user('owner', 'owner@example.com', 'pw')
+        self.client.force_login(user)
+        data = {'title': 'Lost phone', 'content': 'At the stage', 'item_type': 'lost', 'category': 'phone',
+                'location': 'Nairobi', 'status': 'active'}
+        with override_settings(MEDIA_ROOT=self.media_root), open(self.photo, 'rb') as photo:
+            with override_settings(UPLOAD_MAX_BYTES=20 * 1024):
+                response = self.client.post(reverse('post-create'), {**data, 'image': photo})
+            self.assertContains(response, 'The file is too large')
+            self.assertFalse(Post.objects.exists())
+
+            photo.seek(0)
+            response = self.client.post(reverse('post-create'), {**data, 'image': photo})
+            self.assertRedirects(response, reverse('blog-home'), fetch_redirect_response=False)
+            with Post.objects.get().image.open() as stored, PILImage.open(stored) as image:
+                self.assertEqual(image.size, (1600, 1067))
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class ImagePlaceholderTests(TestCase):
+    """Placeholders computed on upload, inlined in cards and backfilled for existing media."""
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        self.user = User.objects.create_user('owner', 'owner@example.com', 'pw')
+
+    def upload(self, name, colour):
+        buffer = BytesIO()
+        # A red item on a white background takes most of the frame
+        image = PILImage.new('RGB', (800, 600), 'white')
+        image.paste(colour, (100, 50, 700, 550))
+        image.save(buffer, 'JPEG')
+        return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/jpeg')
+
+    def test_placeholder_on_upload_and_in_cards(self):
+        with override_settings(MEDIA_ROOT=self.media_root):
+            post = Post.objects.create(title='Red phone', content='At the stage', author=self.user,
+                                       image=self.upload('phone.jpg', (200, 30, 30)))
+            post.refresh_from_db()
+            self.assertTrue(post.image_lqip.startswith('data:image/webp;base64,'))
+            self.assertLess(len(post.image_lqip), 300)
+            red, green, blue = (int(post.image_color[i:i + 2], 16) for i in (1, 3, 5))
+            self.assertGreater(red, 150)
+            self.assertLess(max(green, blue), 80)
+
+            # Saves that don't touch the image don't recompute it
+            Post.objects.filter(pk=post.pk).update(image_color='#000000')
+            post = Post.objects.get(pk=post.pk)
+            post.title = 'Red phone (Samsung)'
+            post.save()
+            self.assertEqual(Post.objects.get(pk=post.pk).image_color, '#000000')
+
+            response = self.client.get(reverse('blog-home'))
+        self.assertContains(response, f'url({post.image_lqip})')
+
+    def test_backfill_placeholders(self):
+        with override_settings(MEDIA_ROOT=self.media_root):
+            stored = Post(title='Keys', content='Gate B', author=self.user, image=self.upload('keys.jpg', (30, 30, 200)))
+            stored.image.save('keys.jpg', stored.image.file, save=False)
+            # bulk_create skips save(), like rows stored before placeholders
+            Post.objects.bulk_create([
+                Post(title=f'Keys {i}', content='Gate B', author=self.user, image=stored.image.name)
+                for i in range(3)
+            ] + [Post(title='Gone', content='Gate C', author=self.user, image='post_pics/missing.jpg')])
+
+            out, err = StringIO(), StringIO()
+            call_command('backfill_placeholders', workers=2, batch_size=2, stdout=out, stderr=err)
+        # The owner's default.jpg avatar isn't in this MEDIA_ROOT either
+        self.assertIn('Post on default: 3 updated, 1 failed', out.getvalue())
+        self.assertEqual(Post.objects.exclude(image_lqip='').values('image_color').distinct().count(), 1)
+        self.assertFalse(Post.objects.get(title='Gone').image_lqip)
+
+
+@override_settings(DATABASE_REPLICAS=['replica1'], DATABASE_REPLICA_APPS=['blog'])
+class ReplicaRoutingTests(SimpleTestCase):
+    """Which database a request reads from (the routing decision only; no replica is queried)."""
+
+    def serve(self, request, view):
+        routed = {}
+
+        def get_response(request):
+            view(routed)
+            return HttpResponse()
+        response = ReplicaPinningMiddleware(get_response)(request)
+        return routed, response
+
+    def test_reads_use_replica_except_payment_access(self):
+        def view(routed):
+            routed['post'] = ReplicaRouter().db_for_read(Post)
+            routed['access'] = ReplicaRouter().db_for_read(PaymentAccess)
+        routed, response = self.serve(RequestFactory().get('/blog/'), view)
+        self.assertEqual(routed, {'post': 'replica1', 'access': None})
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+        # Outside a request (commands, background threads) everything stays on the primary
+        self.assertIsNone(ReplicaRouter().db_for_read(Post))
+
+    def test_write_pins_user_to_primary(self):
+        def view(routed):
+            routed['before'] = ReplicaRouter().db_for_read(Post)
+            routed['write'] = ReplicaRouter().db_for_write(Post)
+            routed['after'] = ReplicaRouter().db_for_read(Post)
+        routed, response = self.serve(RequestFactory().get('/blog/'), view)
+        self.assertEqual(routed, {'before': 'replica1', 'write': 'default', 'after': None})
+        self.assertEqual(response.cookies[PIN_COOKIE]['max-age'], 15)
+
+        # The next request from the same browser reads from the primary
+        request = RequestFactory().get('/blog/')
+        request.COOKIES[PIN_COOKIE] = '1'
+        routed, _ = self.serve(request, lambda routed: routed.update(post=ReplicaRouter().db_for_read(Post)))
+        self.assertEqual(routed, {'post': None})
+
+
+class ReadWriteRoutingTests(SimpleTestCase):
+    """
+    The SQLite read/write split (ReadWriteRouter). In tests 'read' mirrors
+    the one in-memory database and every TestCase runs in an atomic block,
+    so the decisions are checked directly; the atomic block is simulated on
+    the connection.
+    """
+
+    def test_reads_use_read_connection_outside_transactions(self):
+        router = ReadWriteRouter()
+        self.assertEqual(router.db_for_read(Post), READ_DB)
+        self.assertEqual(router.db_for_read(PaymentAccess), READ_DB)
+        self.assertEqual(router.db_for_write(Post), WRITE_DB)
+
+    def test_reads_stay_on_writer_inside_atomic_block(self):
+        router = ReadWriteRouter()
+        with mock.patch.object(connections[WRITE_DB], 'in_atomic_block', True):
+            self.assertEqual(router.db_for_read(Post), WRITE_DB)
+            self.assertEqual(router.db_for_write(Post), WRITE_DB)
+        self.assertEqual(router.db_for_read(Post), READ_DB)
+
+    def test_migrations_only_on_writer(self):
+        router = ReadWriteRouter()
+        self.assertIsNone(router.allow_migrate(WRITE_DB, 'blog'))
+        self.assertFalse(router.allow_migrate(READ_DB, 'blog'))
+        self.assertTrue(router.allow_relation(Post(), PaymentAccess()))
+
+
+@override_settings(POST_SHARDS={'nairobi': 'shard_nairobi', 'mombasa': 'shard_mombasa'})
+class PostShardingTests(SimpleTestCase):
+    """Placing posts by location and merging fanned-out results (blog/sharding.py)."""
+
+    def test_county_for_location(self):
+        self.assertEqual(county_for_location('Nairobi CBD'), 'nairobi')
+        self.assertEqual(county_for_location("Murang'a town"), 'muranga')
+        self.assertEqual(county_for_location('Homa Bay pier'), 'homa_bay')
+        # The last place named wins: addresses end with the county
+        self.assertEqual(county_for_location('Thika Road, Nairobi'), 'nairobi')
+        self.assertEqual(county_for_location('Ruaka'), 'kiambu')
+        self.assertIsNone(county_for_location('somewhere near the stage'))
+
+    def test_shard_for_location(self):
+        self.assertEqual(PostShardService.shard_for_location('Westlands'), 'shard_nairobi')
+        # A county shard, a region without a shard
+        self.assertEqual(PostShardService.shard_for_location('Nyali, Mombasa'), 'shard_mombasa')
+        self.assertIsNone(PostShardService.shard_for_location('Malindi'))
+        self.assertEqual(PostShardService.shard_for_filter('Kilimani'), (True, 'shard_nairobi'))
+        self.assertEqual(PostShardService.shard_for_filter('Kisumu'), (True, None))
+        self.assertEqual(PostShardService.shard_for_filter(''), (False, None))
+        self.assertEqual(PostShardService.shards(), [None, 'shard_nairobi', 'shard_mombasa'])
+
+    def test_sharded_results_merge_in_order(self):
+        results = ShardedResults([[9, 5, 1], [8, 7, 2], []], key=lambda n: n, reverse=True)
+        self.assertEqual(results[:4], [9, 8, 7, 5])
+        self.assertEqual(results[2:4], [7, 5])
+        self.assertEqual(results[5], 1)
+        self.assertEqual(list(results), [9, 8, 7, 5, 2, 1])
+        self.assertEqual(len(results), 6)
+        unique = ShardedResults([['Kisumu', 'Nairobi'], ['Kisumu', 'Mombasa']], unique=True)
+        self.assertEqual(list(unique), ['Kisumu', 'Mombasa', 'Nairobi'])
+
+
+# The shard databases of myproject/test_settings.py
+TEST_SHARDS = {'nairobi': 'shard_nairobi', 'coast': 'shard_coast'}
+
+
+@override_settings(SECURE_SSL_REDIRECT=False, POST_SHARDS=TEST_SHARDS,
+                   DATABASE_ROUTERS=['blog.sharding.ShardRouter', *settings.DATABASE_ROUTERS])
+class ShardedPostTests(TestCase):
+    """Posts on real shard databases: placement, lookups, listings, moves (blog/sharding.py)."""
+
+    databases = {'default', *TEST_SHARDS.values()}
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author', 'author@example.com', 'pw')
+        cls.buyer = User.objects.create_user('buyer', 'buyer@example.com', 'pw')
+
+    def post(self, title, location, minutes_ago=0):
+        return Post.objects.create(title=title, content='At the stage', location=location, author=self.author,
+                                   date_posted=timezone.now() - timedelta(minutes=minutes_ago))
+
+    def on(self, alias):
+        return list(Post.objects.using(alias).order_by('pk').values_list('pk', flat=True))
+
+    def test_save_places_post_and_directory_finds_it(self):
+        placed = [(self.post('Lost wallet', 'Westlands'), 'shard_nairobi'),
+                  (self.post('Lost phone', 'Diani beach'), 'shard_coast'),
+                  (self.post('Lost keys', 'Kisumu'), 'default')]
+        for post, alias in placed:
+            with self.subTest(location=post.location):
+                self.assertEqual(post._state.db, alias)
+                self.assertEqual(self.on(alias), [post.pk])
+                self.assertEqual(PostShard.objects.get(pk=post.pk).shard, alias)
+                found = PostShardService.get_post_or_404(post.pk)
+                self.assertEqual((found.title, found._state.db), (post.title, alias))
+        self.assertEqual(len({post.pk for post, _ in placed}), 3)
+        self.assertContains(self.client.get(reverse('post-detail', args=[placed[1][0].pk])), 'Lost phone')
+        with self.assertRaises(Http404):
+            PostShardService.get_post_or_404(max(post.pk for post, _ in placed) + 1)
+
+    def test_failed_save_releases_directory_entry(self):
+        post = Post(title='Lost bag', content='At the stage', location='Westlands', author=self.author)
+        with mock.patch.object(Post, 'save_base', side_effect=DatabaseError('disk I/O error')):
+            with self.assertRaises(DatabaseError):
+                post.save()
+        self.assertIsNone(post.pk)
+        self.assertFalse(PostShard.objects.exists())
+        post.save()
+        self.assertEqual(self.on('shard_nairobi'), [post.pk])
+        self.assertEqual(list(PostShard.objects.values_list('pk', flat=True)), [post.pk])
+
+    def test_listings_merge_shards_in_order(self):
+        titles = ['Wallet A', 'Phone B', 'Keys C', 'Bag D', 'ID E']
+        for minutes_ago, (title, location) in enumerate(zip(titles, ['Westlands', 'Diani', 'Kisumu', 'CBD', 'Mombasa'])):
+            self.post(title, location, minutes_ago)
+
+        pages = Paginator(PostShardService.route(Post.objects.order_by('-date_posted')), 2)
+        self.assertEqual(pages.count, 5)
+        self.assertEqual([[post.title for post in pages.page(number)] for number in pages.page_range],
+                         [['Wallet A', 'Phone B'], ['Keys C', 'Bag D'], ['ID E']])
+        # A location filter reads one shard
+        nairobi = PostShardService.route(Post.objects.order_by('-date_posted'), 'Kilimani')
+        self.assertEqual([post.title for post in nairobi], ['Wallet A', 'Bag D'])
+
+        response = self.client.get(reverse('blog-home'))
+        self.assertEqual([post.title for post in response.context['posts']], titles)
+
+    def test_move_resumes_after_interruption(self):
+        # Posted in Kisumu (default), then the location was edited
+        copied, not_copied = self.post('Lost wallet', 'Kisumu'), self.post('Lost keys', 'Kisumu')
+        PaymentAccess.objects.create(user=self.buyer, post=copied, paid=True)
+        Post.objects.update(location='Westlands')
+        copied.refresh_from_db()
+        not_copied.refresh_from_db()
+
+        # Interrupted before deleting the source copy, and before copying
+        with mock.patch.object(QuerySet, 'delete', side_effect=DatabaseError('connection lost')):
+            self.assertRaises(DatabaseError, PostShardService.move, copied, 'shard_nairobi')
+        with mock.patch.object(QuerySet, 'bulk_create', side_effect=DatabaseError('connection lost')):
+            self.assertRaises(DatabaseError, PostShardService.move, not_copied, 'shard_nairobi')
+        self.assertEqual(self.on('default'), [copied.pk, not_copied.pk])
+        self.assertEqual(self.on('shard_nairobi'), [copied.pk])
+
+        out = StringIO()
+        call_command('rebalance_shards', stdout=out)
+        self.assertIn('1 directory entries of interrupted moves pointed back at default', out.getvalue())
+        self.assertEqual(self.on('default'), [])
+        self.assertEqual(self.on('shard_nairobi'), [copied.pk, not_copied.pk])
+        self.assertEqual(dict(PostShard.objects.values_list('pk', 'shard')),
+                         {copied.pk: 'shard_nairobi', not_copied.pk: 'shard_nairobi'})
+        self.assertEqual(list(PaymentAccess.objects.using('shard_nairobi').values_list('post_id', flat=True)),
+                         [copied.pk])
+        self.assertFalse(PaymentAccess.objects.using('default').exists())
+
+    def test_rebalance_registers_and_places_unsharded_posts(self):
+        with self.settings(POST_SHARDS={}):
+            legacy = [self.post('Lost wallet', 'Westlands'), self.post('Lost phone', 'Diani'),
+                      self.post('Lost keys', 'Kisumu')]
+        self.assertFalse(PostShard.objects.exists())
+
+        out = StringIO()
+        call_command('rebalance_shards', stdout=out)
+        self.assertIn('3 posts registered', out.getvalue())
+        self.assertEqual(self.on('shard_nairobi'), [legacy[0].pk])
+        self.assertEqual(self.on('shard_coast'), [legacy[1].pk])
+        self.assertEqual(self.on('default'), [legacy[2].pk])
+        self.assertEqual(dict(PostShard.objects.values_list('pk', 'shard')), {
+            legacy[0].pk: 'shard_nairobi', legacy[1].pk: 'shard_coast', legacy[2].pk: 'default',
+        })
+        # New ids are allocated after the registered ones
+        self.assertGreater(self.post('Lost bag', 'CBD').pk, max(post.pk for post in legacy))
+
+
+class ConnectionPoolMetricsTests(SimpleTestCase):
+    """psycopg_pool stats (myproject/db_pool.py) as Prometheus metrics."""
+
+    def sample(self, name, **labels):
+        return metrics.prometheus_client.REGISTRY.get_sample_value(name, {'alias': 'pool-test', **labels}) or 0
+
+    def test_observe_db_pool(self):
+        if not metrics.enabled():
+            self.skipTest('prometheus_client is not installed')
+        waited = self.sample('lostlink_db_pool_requests_total', outcome='waited')
+        metrics.observe_db_pool('pool-test', {
+            'pool_size': 4, 'pool_available': 1, 'requests_waiting': 2,
+            'requests_num': 10, 'requests_queued': 3, 'requests_errors': 1, 'requests_wait_ms': 1500,
+            'connections_num': 4,
+        })
+        self.assertEqual(self.sample('lostlink_db_pool_connections', state='in_use'), 3)
+        self.assertEqual(self.sample('lostlink_db_pool_requests_waiting'), 2)
+        self.assertEqual(self.sample('lostlink_db_pool_requests_total', outcome='waited') - waited, 2)
+        self.assertGreaterEqual(self.sample('lostlink_db_pool_wait_seconds_total'), 1.5)
+
+
+class StaticAssetTests(SimpleTestCase):
+    """Templates link self-hosted, cacheable assets (see scripts/subset_fonts.py)."""
+
+    def templates(self):
+        for app in ('blog', 'users'):
+            directory = os.path.join(settings.BASE_DIR, app, 'templates')
+            for root, _, names in os.walk(directory):
+                for name in names:
+                    if name.endswith('.html'):
+                        with open(os.path.join(root, name), encoding='utf-8') as f:
+                            yield os.path.relpath(os.path.join(root, name), directory), f.read()
+
+    def test_no_inline_styles_or_third_party_assets(self):
+        for name, source in self.templates():
+            with self.subTest(template=name):
+                self.assertNotIn('<style', source)
+                self.assertIsNone(re.search(r'<(link|script)[^>]+(href|src)="(https?:)?//', source))
+
+    def test_icons_are_in_the_font_subset(self):
+        with open(finders.find('blog/vendor/fonts/fonts.css'), encoding='utf-8') as f:
+            defined = set(re.findall(r'\.(fa-[\w-]+)', f.read()))
+        used = {
+            name for _, source in self.templates()
+            for value in re.findall(r'class="([^"]*)"', source)
+            for name in value.split() if name.startswith('fa-') and name not in ('fa-solid', 'fa-brands')
+        }
+        self.assertEqual(used - defined, set(), 'run scripts/subset_fonts.py')
+
+
+class ResponseCompressionTests(SimpleTestCase):
+    """Templates are minified when compiled and responses compressed (myproject/compression.py)."""
+
+    PAGE = '<html><body>' + '<p class="card">Lost phone near the stage</p>\n' * 50 + '</body></html>'
+
+    def respond(self, response, accept_encoding='', view=None):
+        middleware = CompressionMiddleware(lambda request: response)
+        request = RequestFactory().get('/', HTTP_ACCEPT_ENCODING=accept_encoding)
+        middleware.process_view(request, view or (lambda request: response), (), {})
+        return middleware(request)
+
+    def test_minify_html(self):
+        source = (
+            '<div>\n    <!-- Hero -->\n    <a>one</a> <a>two</a>\n\n  </div>\n'
+            '<pre>\n  keep\n</pre>\n  <script>\n  var a = 1;\n</script>\n'
+            '<!-- {% if x %} -->\n  <!--[if IE]>old<![endif]-->\n'
+        )
+        self.assertEqual(minify_html(source), (
+            '<div>\n<a>one</a> <a>two</a>\n</div>\n'
+            '<pre>\n  keep\n</pre>\n<script>\n  var a = 1;\n</script>\n'
+            '<!-- {% if x %} -->\n<!--[if IE]>old<![endif]-->\n'
+        ))
+
+    def test_templates_are_minified_when_compiled(self):
+        source = get_template('blog/about.html').template.source
+        self.assertNotIn('<!--', source)
+        self.assertNotIn('\n ', source)
+        # Plain-text e-mail with an .html name (HTML_MINIFY_EXCLUDE)
+        email = get_template('registration/password_reset_email.html').template
+        with open(email.origin.name, encoding='utf-8') as f:
+            self.assertEqual(email.source, f.read())
+
+    def test_negotiate(self):
+        self.assertEqual(negotiate('gzip, deflate, br', ['br', 'gzip']), 'br')
+        self.assertEqual(negotiate('br;q=0.5, gzip', ['br', 'gzip']), 'gzip')
+        self.assertEqual(negotiate('*;q=0.1', ['br', 'gzip']), 'br')
+        self.assertIsNone(negotiate('gzip;q=0, identity', ['br', 'gzip']))
+        self.assertIsNone(negotiate('', ['br', 'gzip']))
+
+    def test_compresses_text_responses(self):
+        response = self.respond(HttpResponse(self.PAGE), 'gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertEqual(int(response['Content-Length']), len(response.content))
+        self.assertEqual(gzip.decompress(response.content).decode(), self.PAGE)
+
+    @skipUnless(brotli, 'brotli is not installed')
+    def test_prefers_brotli(self):
+        response = self.respond(HttpResponse(self.PAGE), 'gzip, deflate, br')
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertEqual(brotli.decompress(response.content).decode(), self.PAGE)
+
+    def test_leaves_other_responses_alone(self):
+        cases = [
+            ('no accept-encoding', HttpResponse(self.PAGE), ''),
+            ('small', HttpResponse('<p>ok</p>'), 'gzip'),
+            ('binary', HttpResponse(b'\x89PNG' * 500, content_type='image/png'), 'gzip'),
+            ('partial', HttpResponse(self.PAGE, status=206), 'gzip'),
+        ]
+        for name, response, accept_encoding in cases:
+            with self.subTest(name):
+                body = response.content
+                response = self.respond(response, accept_encoding)
+                self.assertFalse(response.has_header('Content-Encoding'))
+                self.assertEqual(response.content, body)
+        opted_out = compression(False)(lambda request: None)
+        response = self.respond(HttpResponse(self.PAGE), 'gzip', view=opted_out)
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_streaming_responses_are_compressed_per_chunk(self):
+        chunks = [self.PAGE[:1000], self.PAGE[1000:]]
+        response = self.respond(StreamingHttpResponse(iter(chunks)), 'gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertFalse(response.has_header('Content-Length'))
+        parts = list(response.streaming_content)
+        # Each chunk is flushed as it is produced, plus the gzip trailer
+        self.assertEqual(len(parts), 3)
+        self.assertEqual(gzip.decompress(b''.join(parts)).decode(), self.PAGE)
+
+    async def test_async_streaming_responses(self):
+        async def chunks():
+            yield self.PAGE.encode()
+
+        response = self.respond(StreamingHttpResponse(chunks()), 'gzip')
+        body = b''.join([part async for part in response.streaming_content])
+        self.assertEqual(gzip.decompress(body).decode(), self.PAGE)
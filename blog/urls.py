@@ -1,18 +1,28 @@
+from django.conf import settings
 from django.urls import path, include
 from .views import (
     HomeView, AboutView, LandingView, 
     PostListView, PostDetailView, PostCreateView, 
-    PostDeleteView, UserPostListView, PostUpdateView
+    AsyncHomeView, AsyncPostDetailView,
+    PostDeleteView, UserPostListView, PostUpdateView,
+    SavedSearchListView, SavedSearchCreateView, SavedSearchDeleteView
 )
 
+# Async versions under ASGI (see ASYNC_VIEWS in settings)
+home_view = AsyncHomeView if settings.ASYNC_VIEWS else HomeView
+post_detail_view = AsyncPostDetailView if settings.ASYNC_VIEWS else PostDetailView
+
 urlpatterns = [
-    path('', HomeView.as_view(), name='blog-home'),
+    path('', home_view.as_view(), name='blog-home'),
     path('user/<str:username>/', UserPostListView.as_view(), name='user-posts'),
     path('post/new/', PostCreateView.as_view(), name='post-create'),
-    path('post/<int:pk>/', PostDetailView.as_view(), name='post-detail'),
+    path('post/<int:pk>/', post_detail_view.as_view(), name='post-detail'),
     path('post/<int:pk>/update/', PostUpdateView.as_view(), name='post-update'),
     path('post/<int:pk>/delete/', PostDeleteView.as_view(), name='post-delete'),
     path('about/', AboutView.as_view(), name='blog-about'),
     path('landing/', LandingView.as_view(), name='landing'),
+    path('alerts/', SavedSearchListView.as_view(), name='saved-searches'),
+    path('alerts/new/', SavedSearchCreateView.as_view(), name='saved-search-create'),
+    path('alerts/<int:pk>/delete/', SavedSearchDeleteView.as_view(), name='saved-search-delete'),
 ]
 
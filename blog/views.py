@@ -1,50 +1,108 @@
-from django.shortcuts import render, get_object_or_404
+from asgiref.sync import sync_to_async
+from django.core.paginator import Paginator
+from django.shortcuts import render, get_object_or_404, aget_object_or_404, redirect
+from django.http import Http404
 from django.contrib.auth.models import User
+from django.views import View
 from django.views.generic import ListView, DetailView, CreateView, DeleteView, TemplateView
 from django.views.generic.edit import UpdateView
 from django.contrib.auth.decorators import login_required
 from django.utils.decorators import method_decorator
 from django.urls import reverse_lazy
-from django.db.models import Q
-from .models import Post
+from django.db.models import Count, Q
+from .models import ArchivedPost, Post, SavedSearch
 from users.models import Profile
+from users.services import PaymentAccessService, aget_request_user
+from myproject.uploads import UploadLimitsMixin
 from django.core.exceptions import ObjectDoesNotExist
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.contrib import messages
+from .archive import ARCHIVED_PARAM, wants_archived
+from .forms import PostForm, SavedSearchForm
 from .services import PostFilterService
+from .sharding import PostShardService
+
+FILTER_FIELDS = ('q', 'item_type', 'category', 'location', 'status')
+
+# Per-author post counts for the detail page, in one aggregate query
+# instead of three COUNTs
+AUTHOR_COUNTS = {
+    'total': Count('pk'),
+    'lost': Count('pk', filter=Q(item_type=Post.LOST)),
+    'found': Count('pk', filter=Q(item_type=Post.FOUND)),
+}
+
+
+def home_filter_context(params):
+    """Filter values and dropdown options shared by HomeView and AsyncHomeView."""
+    return {
+        # Pass filter parameters back to the template
+        'search_query': params.get('q', ''),
+        'selected_item_type': params.get('item_type', ''),
+        'selected_category': params.get('category', ''),
+        'selected_location': params.get('location', ''),
+        'selected_status': params.get('status', ''),
+        'has_filters': any(params.get(field) for field in FILTER_FIELDS),
+        'archived_param': ARCHIVED_PARAM,
+        'selected_archived': wants_archived(params),
+        # Dropdown options
+        'categories': Post.CATEGORY_CHOICES,
+        'item_types': Post.ITEM_TYPE_CHOICES,
+        'statuses': Post.STATUS_CHOICES,
+    }
+
+
+def listed_posts(params):
+    """Posts for a listing: the hot table, or the archive when asked for."""
+    model = ArchivedPost if wants_archived(params) else Post
+    return model.objects.order_by('-date_posted')
+
+
+def post_locations():
+    # Clear the default -date_posted ordering, which would make DISTINCT
+    # return one row per post instead of one per location
+    return PostShardService.route(
+        Post.objects.order_by('location').values_list('location', flat=True).distinct(),
+        key=None, reverse=False, unique=True,
+    )
+
+
+def related_posts(post):
+    # From the post's own shard: nearby items when posts are sharded by region
+    return (Post.objects.using(PostShardService.shard_of(post))
+            .filter(category=post.category).exclude(pk=post.pk).order_by('-date_posted')[:3])
+
+
+def author_count_context(author_counts):
+    return {
+        'author_posts_count': author_counts['total'],
+        'author_lost_count': author_counts['lost'],
+        'author_found_count': author_counts['found'],
+    }
 
 class HomeView(ListView):
     model = Post
     template_name = 'blog/Home.html'
     context_object_name = 'posts'
     ordering = ['-date_posted']
+    paginate_by = 24
     
     def get_queryset(self):
-        queryset = super().get_queryset()
+        queryset = listed_posts(self.request.GET)
         # Use the service to filter posts
         queryset = PostFilterService.filter_posts(queryset, self.request.GET)
-        
-        # Ensure profiles exist (defensive programming)
-        author_ids = queryset.values_list('author', flat=True).distinct()
-        for uid in author_ids:
-            Profile.objects.get_or_create(user_id=uid)
-            
-        return queryset
+        # Post cards do not show author details, and profiles are created
+        # with the user (users/signals.py), so no per-author work is needed here
+        return PostShardService.route(queryset, self.request.GET.get('location'))
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        # Pass filter parameters back to the template
-        context['search_query'] = self.request.GET.get('q', '')
-        context['selected_item_type'] = self.request.GET.get('item_type', '')
-        context['selected_category'] = self.request.GET.get('category', '')
-        context['selected_location'] = self.request.GET.get('location', '')
-        context['selected_status'] = self.request.GET.get('status', '')
+        context.update(home_filter_context(self.request.GET))
+        context['locations'] = post_locations()
         
-        # Dropdown options
-        context['categories'] = Post.CATEGORY_CHOICES
-        context['locations'] = Post.objects.values_list('location', flat=True).distinct()
-        context['item_types'] = Post.ITEM_TYPE_CHOICES
-        context['statuses'] = Post.STATUS_CHOICES
+        # Posts the user has paid for, so cards can show an "unlocked" badge
+        # without a query per card
+        context['paid_post_ids'] = PaymentAccessService.get_paid_post_ids(self.request.user)
         
         return context
 
@@ -53,7 +111,9 @@ class AboutView(TemplateView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['images'] = Post.objects.filter(image__isnull=False).exclude(image='').order_by('-date_posted')[:12]
+        context['images'] = PostShardService.route(
+            Post.objects.filter(image__isnull=False).exclude(image='').order_by('-date_posted')
+        )[:12]
         return context
 
 class LandingView(TemplateView):
@@ -61,7 +121,7 @@ class LandingView(TemplateView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['recent_posts'] = Post.objects.all().order_by('-date_posted')[:6]
+        context['recent_posts'] = PostShardService.route(Post.objects.all().order_by('-date_posted'))[:6]
         return context
 
 # Keep existing CBVs but ensure they are clean
@@ -76,9 +136,8 @@ class PostListView(ListView):
     ordering = ['-date_posted']
     
     def get_queryset(self):
-        queryset = super().get_queryset()
-        queryset = PostFilterService.filter_posts(queryset, self.request.GET)
-        return queryset
+        queryset = PostFilterService.filter_posts(listed_posts(self.request.GET), self.request.GET)
+        return PostShardService.route(queryset, self.request.GET.get('location'))
 
 class UserPostListView(ListView):
     model = Post
@@ -89,33 +148,99 @@ class UserPostListView(ListView):
 
     def get_queryset(self):
         user = get_object_or_404(User, username=self.kwargs.get('username'))
-        return Post.objects.filter(author=user).order_by('-date_posted')
+        return PostShardService.route(Post.objects.filter(author=user).order_by('-date_posted'))
 
 class PostDetailView(DetailView):
     model = Post
     template_name = 'blog/post_detail.html'
     context_object_name = 'post'
 
+    def get_queryset(self):
+        # The template shows the author's details and profile
+        return PostShardService.queryset_for(
+            self.kwargs['pk'], Post.objects.select_related('author', 'author__profile')
+        )
+
+    def get_object(self, queryset=None):
+        try:
+            return super().get_object(queryset)
+        except Http404:
+            # Archived posts keep their URL (see blog/archive.py)
+            return get_object_or_404(PostShardService.queryset_for(
+                self.kwargs['pk'], ArchivedPost.objects.select_related('author', 'author__profile')
+            ), pk=self.kwargs['pk'])
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        post = self.get_object()
-        Profile.objects.get_or_create(user=post.author)
-        
-        related_posts = Post.objects.filter(
-            category=post.category
-        ).exclude(pk=post.pk).order_by('-date_posted')[:3]
-        context['related_posts'] = related_posts
+        post = self.object
+        try:
+            post.author.profile
+        except ObjectDoesNotExist:
+            Profile.objects.get_or_create(user=post.author)
         
-        author_posts = Post.objects.filter(author=post.author)
-        context['author_posts_count'] = author_posts.count()
-        context['author_lost_count'] = author_posts.filter(item_type='lost').count()
-        context['author_found_count'] = author_posts.filter(item_type='found').count()
+        context['related_posts'] = related_posts(post)
+        context.update(author_count_context(
+            PostShardService.aggregate(Post.objects.filter(author=post.author), **AUTHOR_COUNTS)
+        ))
         
         return context
 
-class PostCreateView(LoginRequiredMixin, CreateView):
+# Async versions of the hot views, routed instead of the sync ones when
+# ASYNC_VIEWS is on (the ASGI deployment, see myproject/asgi.py). Everything
+# the template reads is loaded before rendering: a lazy query during the
+# render would run on the event loop, which Django does not allow.
+
+class AsyncHomeView(View):
+    template_name = HomeView.template_name
+
+    async def get(self, request, *args, **kwargs):
+        user = await aget_request_user(request)
+        queryset = PostShardService.route(
+            PostFilterService.filter_posts(listed_posts(request.GET), request.GET),
+            request.GET.get('location'),
+        )
+
+        # Paginator is sync; counting and loading the page run in a thread
+        paginator = Paginator(queryset, HomeView.paginate_by)
+        page = await sync_to_async(paginator.get_page)(request.GET.get('page'))
+
+        context = home_filter_context(request.GET)
+        context['posts'] = await sync_to_async(list)(page.object_list)
+        context.update(paginator=paginator, page_obj=page, is_paginated=page.has_other_pages())
+        context['locations'] = [location async for location in post_locations()]
+        context['paid_post_ids'] = await PaymentAccessService.aget_paid_post_ids(user)
+        return render(request, self.template_name, context)
+
+class AsyncPostDetailView(View):
+    template_name = PostDetailView.template_name
+
+    async def get(self, request, pk, *args, **kwargs):
+        await aget_request_user(request)
+        queryset = await PostShardService.aqueryset_for(pk, Post.objects.select_related('author', 'author__profile'))
+        post = await queryset.filter(pk=pk).afirst()
+        if post is None:
+            queryset = await PostShardService.aqueryset_for(
+                pk, ArchivedPost.objects.select_related('author', 'author__profile')
+            )
+            post = await aget_object_or_404(queryset, pk=pk)
+        try:
+            post.author.profile
+        except ObjectDoesNotExist:
+            post.author.profile, _ = await Profile.objects.aget_or_create(user=post.author)
+
+        context = {
+            'post': post,
+            'object': post,
+            'related_posts': [related async for related in related_posts(post)],
+        }
+        context.update(author_count_context(
+            await PostShardService.aaggregate(Post.objects.filter(author=post.author), **AUTHOR_COUNTS)
+        ))
+        return render(request, self.template_name, context)
+
+class PostCreateView(LoginRequiredMixin, UploadLimitsMixin, CreateView):
     model = Post
-    fields = ['title', 'content', 'item_type', 'category', 'location', 'status', 'date_item_lost_found', 'image']
+    form_class = PostForm
     template_name = 'blog/post_form.html'
     
     def form_valid(self, form):
@@ -125,11 +250,14 @@ class PostCreateView(LoginRequiredMixin, CreateView):
     def get_success_url(self):
         return reverse_lazy('blog-home')
 
-class PostUpdateView(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
+class PostUpdateView(LoginRequiredMixin, UserPassesTestMixin, UploadLimitsMixin, UpdateView):
     model = Post
-    fields = ['title', 'content', 'item_type', 'category', 'location', 'status', 'date_item_lost_found', 'image']
+    form_class = PostForm
     template_name = 'blog/post_form.html'
 
+    def get_queryset(self):
+        return PostShardService.queryset_for(self.kwargs['pk'])
+
     def form_valid(self, form):
         form.instance.author = self.request.user
         return super().form_valid(form)
@@ -146,6 +274,9 @@ class PostDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
     template_name = 'blog/post_confirm_delete.html'
     success_url = reverse_lazy('blog-home')
 
+    def get_queryset(self):
+        return PostShardService.queryset_for(self.kwargs['pk'])
+
     def test_func(self):
         post = self.get_object()
         return self.request.user == post.author
@@ -153,3 +284,40 @@ class PostDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
     def delete(self, request, *args, **kwargs):
         messages.success(request, 'Post deleted successfully.')
         return super().delete(request, *args, **kwargs)
+
+class SavedSearchListView(LoginRequiredMixin, ListView):
+    model = SavedSearch
+    template_name = 'blog/saved_searches.html'
+    context_object_name = 'searches'
+
+    def get_queryset(self):
+        return SavedSearch.objects.filter(user=self.request.user)
+
+class SavedSearchCreateView(LoginRequiredMixin, View):
+    """Save the current HomeView filters as a standing alert"""
+
+    def post(self, request, *args, **kwargs):
+        form = SavedSearchForm({field: request.POST.get(field, '') for field in FILTER_FIELDS})
+        if not form.is_valid():
+            errors = '; '.join(f'{form[field].label}: {" ".join(errors)}' for field, errors in form.errors.items())
+            messages.error(request, f'This alert could not be saved. {errors}')
+            return redirect('blog-home')
+        if not any(form.cleaned_data.values()):
+            messages.error(request, 'Add a search term or filter before saving an alert.')
+            return redirect('blog-home')
+
+        search, created = SavedSearch.objects.get_or_create(user=request.user, **form.cleaned_data)
+        if created:
+            messages.success(request, "Alert saved! We'll email you when a matching item is posted.")
+        else:
+            messages.info(request, 'You already have an alert for this search.')
+        return redirect('saved-searches')
+
+
+class SavedSearchDeleteView(LoginRequiredMixin, DeleteView):
+    model = SavedSearch
+    template_name = 'blog/saved_search_confirm_delete.html'
+    success_url = reverse_lazy('saved-searches')
+
+    def get_queryset(self):
+        return SavedSearch.objects.filter(user=self.request.user)
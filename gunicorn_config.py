@@ -1,21 +1,97 @@
 """
 Gunicorn configuration file for Django
 Place in project root alongside manage.py
+
+This is the single source of server settings: the Procfile and render.yaml
+both run `gunicorn -c gunicorn_config.py`, and everything below can be tuned
+through environment variables.
+
+Profiles (GUNICORN_PROFILE):
+    sync     one request per worker process; simplest, most memory per request
+    gthread  (default) a few processes with a thread pool each; requests
+             waiting on the database or Daraja don't block a whole process
+    asyncio  uvicorn workers serving the ASGI app (myproject/asgi.py), with
+             async home, post detail, payment status and M-PESA callback
+             views; compare with scripts/asgi_benchmark.py
+
+Tuning (environment):
+    WEB_CONCURRENCY               worker processes (default from the profile)
+    GUNICORN_THREADS              threads per gthread worker
+    GUNICORN_TIMEOUT              seconds before a stuck worker is killed
+    GUNICORN_PRELOAD              load the app once in the master and fork it (default True)
+    GUNICORN_MAX_REQUESTS         recycle a worker after this many requests (0 = never)
+    GUNICORN_MAX_REQUESTS_JITTER  random extra requests so workers don't recycle together
+    GUNICORN_MAX_RSS_MB           recycle a worker once its resident memory passes this (0 = off)
+
+Each worker has its own Postgres connection pool (DATABASE_POOL_MAX_SIZE in
+settings): keep WEB_CONCURRENCY x DATABASE_POOL_MAX_SIZE below the
+database's connection limit.
 """
 
 import multiprocessing
 import os
+import shutil
+import tempfile
+
+# Prometheus multiprocess mode: each worker writes its metrics to files in
+# this directory and /metrics merges them. It must be set before the app
+# imports prometheus_client, and is wiped on start so stale workers from a
+# previous run don't linger in the totals.
+prometheus_dir = os.environ.setdefault(
+    'PROMETHEUS_MULTIPROC_DIR', os.path.join(tempfile.gettempdir(), 'lostlink-prometheus')
+)
+shutil.rmtree(prometheus_dir, ignore_errors=True)
+os.makedirs(prometheus_dir, exist_ok=True)
+
+cpu_count = multiprocessing.cpu_count()
+
+PROFILES = {
+    'sync': {
+        'worker_class': 'sync',
+        'workers': cpu_count * 2 + 1,
+        'threads': 1,
+    },
+    'gthread': {
+        'worker_class': 'gthread',
+        'workers': cpu_count + 1,
+        'threads': 4,
+    },
+    'asyncio': {
+        'worker_class': 'uvicorn.workers.UvicornWorker',
+        'workers': cpu_count + 1,
+        'threads': 1,
+        'wsgi_app': 'myproject.asgi:application',
+    },
+}
+
+profile_name = os.environ.get('GUNICORN_PROFILE', 'gthread')
+if profile_name not in PROFILES:
+    raise RuntimeError(f"Unknown GUNICORN_PROFILE '{profile_name}' (choose from {', '.join(PROFILES)})")
+profile = PROFILES[profile_name]
+
+# Application
+wsgi_app = profile.get('wsgi_app', 'myproject.wsgi:application')
+preload_app = os.environ.get('GUNICORN_PRELOAD', 'True') == 'True'
 
 # Server socket
 bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
 backlog = 2048
 
 # Worker processes
-workers = multiprocessing.cpu_count() * 2 + 1
-worker_class = 'sync'
+workers = int(os.environ.get('WEB_CONCURRENCY', profile['workers']))
+worker_class = profile['worker_class']
+threads = int(os.environ.get('GUNICORN_THREADS', profile['threads']))
 worker_connections = 1000
-timeout = 120
-keepalive = 2
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+graceful_timeout = 30
+keepalive = 5
+
+# Worker recycling: guards against slow leaks and fragmentation. The jitter
+# spreads restarts so all workers are not recycled at the same moment.
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 100))
+max_rss_mb = int(os.environ.get('GUNICORN_MAX_RSS_MB', 0))
+RSS_CHECK_EVERY = 20  # requests
 
 # Server mechanics
 daemon = False
@@ -29,23 +105,62 @@ tmp_upload_dir = None
 accesslog = '-'
 errorlog = '-'
 loglevel = 'info'
-access_log_format = '%(h)s %(l)s %(u)s %(t)s "%(r)s" %(s)s %(b)s "%(f)s" "%(a)s"'
+access_log_format = '%(h)s %(l)s %(u)s %(t)s "%(r)s" %(s)s %(b)s "%(f)s" "%(a)s" %(M)sms'
 
 # Process naming
 proc_name = 'lostlink-kenya'
 
+
+def current_rss_mb():
+    """Resident memory of this process in MB (Linux /proc, else peak RSS)."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
 # Server hooks
+def on_starting(server):
+    """
+    Called just before the master process is initialized.
+    """
+    server.log.info(
+        f"Profile '{profile_name}': {workers} x {worker_class}"
+        f"{f' ({threads} threads)' if worker_class == 'gthread' else ''}, preload={preload_app}, "
+        f"max_requests={max_requests}+{max_requests_jitter}, max_rss_mb={max_rss_mb or 'off'}"
+    )
+
 def post_fork(server, worker):
     """
     Called just after a worker has been forked.
     """
-    pass
+    worker.rss_checked_requests = 0
+    # Nothing should be open after pre_fork; if something is, never use (or
+    # close) the master's sockets from here
+    if preload_app:
+        from myproject.db_pool import reset_after_fork
+        reset_after_fork()
+
+def post_worker_init(worker):
+    """
+    Called just after a worker has initialized the application.
+    """
+    if not preload_app:
+        from myproject.warmup import warm_up
+        warm_up()
 
 def pre_fork(server, worker):
     """
     Called just prior to forking the worker subprocess.
     """
-    pass
+    # A connection (or connection pool) opened in the master would be shared
+    # by every worker's copy of the socket, so make sure nothing is open at
+    # fork time
+    if preload_app:
+        from myproject.warmup import close_connections
+        close_connections()
 
 def pre_exec(server):
     """
@@ -57,19 +172,49 @@ def when_ready(server):
     """
     Called just after the server is started.
     """
-    pass
+    # With preload the app is already imported in the master: warm it once
+    # here and every worker inherits compiled templates and URL patterns
+    if preload_app:
+        from myproject.warmup import warm_up
+        warm_up()
+
+def post_request(worker, req, environ, resp):
+    """
+    Called after a worker processes the request (sync and gthread workers).
+    """
+    if not max_rss_mb:
+        return
+    worker.rss_checked_requests = getattr(worker, 'rss_checked_requests', 0) + 1
+    if worker.rss_checked_requests % RSS_CHECK_EVERY:
+        return
+    rss = current_rss_mb()
+    if rss > max_rss_mb and worker.alive:
+        worker.log.info(f"Worker {worker.pid} uses {rss:.0f} MB (limit {max_rss_mb} MB), recycling")
+        # Finish in-flight requests, then exit; the master starts a fresh worker
+        worker.alive = False
 
 def child_exit(server, worker):
     """
     Called just after a worker has been exited.
     """
-    pass
+    from myproject import metrics
+    metrics.mark_process_dead(worker.pid)
 
 def worker_exit(server, worker):
     """
     Called when a worker is terminated.
     """
-    pass
+    # Flush work still queued on this worker's background threads, then
+    # release its connections
+    try:
+        from blog.services import shutdown_background_collector
+        from users.mail import stop_background_sender
+        shutdown_background_collector(wait=True)
+        stop_background_sender(timeout=graceful_timeout / 2)
+        from myproject.warmup import close_connections
+        close_connections()
+    except Exception as e:
+        worker.log.warning(f"Worker {worker.pid} did not shut down cleanly: {e}")
 
 def nworkers_changed(server, new_value, old_value):
     """
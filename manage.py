@@ -6,7 +6,8 @@ import sys
 
 def main():
     """Run administrative tasks."""
-    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'myproject.settings')
+    # The test suite runs on its own settings (see myproject/test_settings.py)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'myproject.test_settings' if sys.argv[1:2] == ['test'] else 'myproject.settings')
     try:
         from django.core.management import execute_from_command_line
     except ImportError as exc:
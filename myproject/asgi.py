@@ -3,6 +3,13 @@ ASGI config for myproject project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+This is the production ASGI mode (GUNICORN_PROFILE=asyncio in
+gunicorn_config.py, uvicorn workers). It turns ASYNC_VIEWS on, so the home
+page, post detail, payment status and M-PESA callback run as coroutines with
+the async ORM and an async Daraja client: a slow query or Daraja call only
+suspends the request waiting on it, and one worker keeps serving the rest.
+Other views are sync and run in a thread per request.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
@@ -12,5 +19,6 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'myproject.settings')
+os.environ.setdefault('ASYNC_VIEWS', 'True')
 
 application = get_asgi_application()
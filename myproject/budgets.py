@@ -0,0 +1,170 @@
+"""
+Per-view performance budgets, enforced by the test suite.
+
+Each URL name declares the most SQL queries a request may run, how long it
+may take and how much Python memory it may allocate. BudgetTestMixin renders
+a view against a seeded dataset (see `manage.py seed_data`) and fails when a
+budget is exceeded.
+
+A variant of a view (e.g. 'pay_post:stk-push') can have its own entry;
+otherwise it shares the view's budget.
+
+On failure the message lists every query of the request grouped by statement
+(so a query-per-row loop shows up as one line with a large count) and a diff
+against the queries recorded in QUERY_BASELINES_PATH. A request within
+budget also fails when its queries no longer match the recorded ones, so the
+baselines stay current. Refresh them after an intentional change with:
+
+    UPDATE_QUERY_BASELINES=1 python manage.py test blog users
+
+Time budgets are generous and use the fastest of several runs to keep them
+stable on slow machines; scale them with PERF_BUDGET_TIME_FACTOR if needed.
+"""
+
+import difflib
+import json
+import os
+import re
+import time
+import tracemalloc
+from collections import Counter, namedtuple
+from contextlib import ExitStack
+
+from django.db import connections
+from django.test.utils import CaptureQueriesContext
+
+Budget = namedtuple('Budget', ['queries', 'ms', 'alloc_kb'])
+
+# Query budgets sit just above today's counts; raise them only on purpose
+BUDGETS = {
+    'landing': Budget(queries=2, ms=100, alloc_kb=512),
+    'blog-home': Budget(queries=7, ms=400, alloc_kb=8192),
+    'post-detail': Budget(queries=4, ms=100, alloc_kb=1024),
+    'user-posts': Budget(queries=4, ms=100, alloc_kb=1024),
+    'pay_post': Budget(queries=5, ms=100, alloc_kb=1024),
+    'pay_post:stk-push': Budget(queries=11, ms=100, alloc_kb=1024),
+    'mpesa_callback': Budget(queries=10, ms=100, alloc_kb=512),
+}
+
+QUERY_BASELINES_PATH = os.path.join(os.path.dirname(__file__), 'query_baselines.json')
+
+_LITERAL_RE = re.compile(r"'(?:[^']|'')*'|\"s\d+_x\d+\"|\b\d+\b")
+
+Measurement = namedtuple('Measurement', ['response', 'queries', 'ms', 'alloc_kb'])
+
+
+def normalize_sql(sql):
+    """Replace literals with ? so the same statement with other values compares equal."""
+    return _LITERAL_RE.sub('?', sql)
+
+
+def load_baselines():
+    try:
+        with open(QUERY_BASELINES_PATH) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_baseline(key, queries):
+    baselines = load_baselines()
+    baselines[key] = queries
+    with open(QUERY_BASELINES_PATH, 'w') as f:
+        json.dump(baselines, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+def measure(send, aliases=None, runs=3):
+    """
+    Call ``send()`` (which performs one request) and measure it.
+
+    The first call is a warm-up whose queries are captured; then the fastest
+    of ``runs`` timed calls is kept, and one more call runs under tracemalloc
+    for the allocation peak.
+
+    Args:
+        send: Callable performing the request
+        aliases: Databases whose queries are captured (default: all)
+        runs: Timed calls, of which the fastest is kept
+
+    Returns:
+        Measurement: response, normalized SQL list, best time (ms) and peak allocation (KB).
+    """
+    with ExitStack() as stack:
+        captures = [stack.enter_context(CaptureQueriesContext(connections[alias]))
+                    for alias in (aliases or connections)]
+        response = send()
+    queries = [normalize_sql(q['sql']) for capture in captures for q in capture.captured_queries]
+
+    best = None
+    for _ in range(runs):
+        started = time.perf_counter()
+        send()
+        elapsed = (time.perf_counter() - started) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+
+    tracemalloc.start()
+    try:
+        baseline = tracemalloc.get_traced_memory()[0]
+        send()
+        alloc_kb = (tracemalloc.get_traced_memory()[1] - baseline) / 1024
+    finally:
+        tracemalloc.stop()
+    return Measurement(response, queries, best, alloc_kb)
+
+
+def format_queries(queries):
+    lines = []
+    for sql, count in Counter(queries).most_common():
+        flag = '   <-- repeated' if count > 1 else ''
+        lines.append(f'  x{count:<4} {sql[:400]}{flag}')
+    return '\n'.join(lines)
+
+
+def query_diff(expected, actual):
+    diff = difflib.unified_diff(sorted(expected), sorted(actual), 'baseline', 'this run', lineterm='', n=1)
+    return '\n'.join(line[:400] for line in diff)
+
+
+class BudgetTestMixin:
+    """TestCase mixin providing assertWithinBudget(url_name, send)."""
+
+    def assertWithinBudget(self, url_name, send, variant=''):
+        """
+        Run ``send()`` and fail if the request exceeds BUDGETS[url_name].
+
+        ``variant`` distinguishes several requests to the same view (e.g.
+        with and without filters) in the stored query baselines.
+        """
+        key = f'{url_name}{":" + variant if variant else ""}'
+        budget = BUDGETS.get(key, BUDGETS[url_name])
+        # The databases the test may query ('__all__' or a set of aliases)
+        aliases = None if self.databases == '__all__' else sorted(self.databases)
+        result = measure(send, aliases)
+        self.assertLess(result.response.status_code, 500, f'{url_name} failed: {result.response.status_code}')
+
+        time_factor = float(os.environ.get('PERF_BUDGET_TIME_FACTOR', 1))
+        problems = []
+        if len(result.queries) > budget.queries:
+            problems.append(f'{len(result.queries)} queries (budget {budget.queries})')
+        if result.ms > budget.ms * time_factor:
+            problems.append(f'{result.ms:.1f} ms (budget {budget.ms * time_factor:.0f} ms)')
+        if result.alloc_kb > budget.alloc_kb:
+            problems.append(f'{result.alloc_kb:.0f} KB allocated (budget {budget.alloc_kb} KB)')
+
+        if not problems and os.environ.get('UPDATE_QUERY_BASELINES'):
+            save_baseline(key, result.queries)
+            return result
+        expected = load_baselines().get(key)
+        if not problems:
+            if expected is not None and sorted(expected) == sorted(result.queries):
+                return result
+            problems.append('queries differ from the recorded baseline (rerun with UPDATE_QUERY_BASELINES=1 '
+                            'if the change is intended)' if expected is not None else
+                            'no recorded query baseline (run with UPDATE_QUERY_BASELINES=1)')
+
+        message = [f'{key}: ' + ', '.join(problems), '', 'Queries:', format_queries(result.queries)]
+        if expected is not None:
+            message += ['', f'Query diff against the recorded baseline ({len(expected)} queries):',
+                        query_diff(expected, result.queries)]
+        self.fail('\n'.join(message))
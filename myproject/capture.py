@@ -0,0 +1,142 @@
+"""
+Sampled traffic capture for load testing.
+
+TrafficCaptureMiddleware writes the shape of a sample of real requests to a
+JSONL file (TRAFFIC_CAPTURE_PATH): method, URL pattern, resolved view,
+query parameters, whether the user was logged in, and the status and time
+the server took. scripts/replay_traffic.py replays the file against a local
+gunicorn, filling the patterns in with ids and usernames of the local data.
+
+Nothing identifying is kept:
+- no user ids, cookies, IPs or headers;
+- the URL pattern (``/user/<str:username>``) and the names of its arguments
+  instead of the path, so no usernames or post ids;
+- POST bodies are reduced to their field names;
+- credentials and tokens in the query string are dropped;
+- e-mail addresses and phone numbers in the remaining values (e.g. a search
+  for "0712 345678") are replaced with placeholders.
+"""
+
+import json
+import logging
+import random
+import re
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from .middleware import get_jsonl_logger, request_route
+
+logger = logging.getLogger(__name__)
+
+# Parameters whose values are never recorded
+SECRET_PARAMS = {'csrfmiddlewaretoken', 'password', 'password1', 'password2', 'token', 'code', 'key', 'secret'}
+# Internal switches that should not be replayed
+IGNORED_PARAMS = {'_profile'}
+IGNORED_PREFIXES = ('/static/', '/media/', '/metrics', '/_profiles/', '/admin/')
+
+EMAIL_RE = re.compile(r'[\w.+-]+@[\w-]+\.[\w.-]+')
+PHONE_RE = re.compile(r'\+?\d[\d\s-]{6,}\d')
+
+
+def scrub(value):
+    """Replace e-mail addresses and phone numbers in a free-text value."""
+    value = EMAIL_RE.sub('user@example.com', value)
+    return PHONE_RE.sub('0700000000', value)
+
+
+def scrub_query(querydict):
+    query = {}
+    for key, values in querydict.lists():
+        if key in IGNORED_PARAMS:
+            continue
+        if key.lower() in SECRET_PARAMS:
+            query[key] = ['[scrubbed]']
+        else:
+            query[key] = [scrub(v)[:200] for v in values]
+    return query
+
+
+def auth_state(user):
+    if user is None or not user.is_authenticated:
+        return 'anonymous'
+    return 'staff' if user.is_staff else 'user'
+
+
+class TrafficCaptureMiddleware:
+    """
+    Record a sample of requests for replay.
+
+    Must come after AuthenticationMiddleware so the auth state is known.
+
+    Settings:
+        TRAFFIC_CAPTURE_RATE: fraction of requests to record (0 disables).
+        TRAFFIC_CAPTURE_PATH: the JSONL file (rotated externally, see
+            myproject/middleware.py).
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        self.rate = getattr(settings, 'TRAFFIC_CAPTURE_RATE', 0.0)
+
+    def sampled(self, request):
+        return self.rate and random.random() < self.rate and not request.path.startswith(IGNORED_PREFIXES)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not self.sampled(request):
+            return self.get_response(request)
+
+        started = time.perf_counter()
+        response = self.get_response(request)
+        duration = time.perf_counter() - started
+        self.record(request, response, duration, getattr(request, 'user', None))
+        return response
+
+    async def __acall__(self, request):
+        if not self.sampled(request):
+            return await self.get_response(request)
+
+        started = time.perf_counter()
+        response = await self.get_response(request)
+        duration = time.perf_counter() - started
+        user = await request.auser() if hasattr(request, 'auser') else None
+        self.record(request, response, duration, user)
+        return response
+
+    @classmethod
+    def record(cls, request, response, duration, user):
+        try:
+            cls.write(request, response, duration, user)
+        except Exception as e:
+            logger.error(f"❌ Could not record captured request: {e}")
+
+    @staticmethod
+    def write(request, response, duration, user):
+        match = getattr(request, 'resolver_match', None)
+        route, route_kwargs = request_route(request)
+        entry = {
+            'ts': round(time.time(), 3),
+            'method': request.method,
+            'route': route,
+            'route_kwargs': route_kwargs,
+            'view': match.view_name if match else None,
+            'query': scrub_query(request.GET),
+            'auth': auth_state(user),
+            'status': response.status_code,
+            'duration_ms': round(duration * 1000, 1),
+        }
+        if request.method not in ('GET', 'HEAD'):
+            entry['content_type'] = request.content_type
+            entry['form_keys'] = sorted(
+                k for k in request.POST.keys() if k.lower() not in SECRET_PARAMS
+            ) if request.content_type in ('application/x-www-form-urlencoded', 'multipart/form-data') else []
+        get_jsonl_logger('myproject.traffic_capture', settings.TRAFFIC_CAPTURE_PATH).info(json.dumps(entry))
@@ -0,0 +1,293 @@
+"""
+Smaller HTML responses: template minification and response compression.
+
+WhiteNoise serves static files precompressed, but the pages themselves left
+Django as plain text: Home is ~380 KB of HTML, much of it the indentation
+of the card markup repeated for every post. Two layers fix that:
+
+1. MinifyingLoader, a cached template loader, removes HTML comments and
+   collapses the whitespace around line breaks in every ``.html`` template
+   before it is compiled, so the cost is paid once per template and
+   process, not per request. The contents of <pre>, <textarea>, <script>
+   and <style> are kept as they are, as are comments containing template
+   tags and conditional comments. Whitespace within a line is untouched
+   and a line break stays a line break, so inline elements render the same
+   (unlike ``{% spaceless %}``, which runs on every render). Only the
+   template's own markup is minified, never the values rendered into it.
+   Plain-text templates with an .html name (Django's password reset
+   e-mail) are listed in HTML_MINIFY_EXCLUDE.
+
+2. CompressionMiddleware compresses text responses with brotli or gzip,
+   whichever the client prefers of those it accepts (brotli needs the
+   brotli package, installed by whitenoise[brotli]). Streaming responses
+   are compressed chunk by chunk and flushed after each one, so they still
+   reach the client as they are produced. Responses that are small, not
+   text, or already encoded are left alone.
+
+The defaults (brotli quality 5, gzip level 6) are tuned for pages that are
+compressed on every request, not once like static files;
+scripts/compression_benchmark.py measures the CPU time and bytes of each
+level on the real pages. A view can change them or opt out:
+
+    @compression(False)
+    def export(request): ...
+
+    @method_decorator(compression(brotli_quality=2), name='dispatch')
+    class BigListView(ListView): ...
+
+Compressed pages that echo user input next to a secret are open to BREACH.
+Django masks the CSRF token differently in every response; a view that
+renders other secrets should use @compression(False).
+"""
+
+import gzip
+import re
+import zlib
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.template.loaders import cached
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Kept as they are: comments are decided on separately, the elements'
+# contents are whitespace-sensitive
+PROTECTED = re.compile(r'<!--.*?-->|<(pre|textarea|script|style)\b.*?</\1\s*>', re.S | re.I)
+LINE_BREAK = re.compile(r'[ \t\r\f\v]*\n\s*')
+COMPRESSIBLE_TYPES = {'application/json', 'application/javascript', 'application/xml', 'image/svg+xml'}
+
+
+def minify_html(source):
+    """
+    Remove HTML comments and collapse whitespace around line breaks.
+
+    Args:
+        source: HTML or template source
+
+    Returns:
+        str: the source with every run of whitespace containing a line break
+        reduced to one line break, outside <pre>, <textarea>, <script> and
+        <style>, and with plain comments removed
+    """
+    parts, text, position = [], [], 0
+    for match in PROTECTED.finditer(source):
+        text.append(source[position:match.start()])
+        position = match.end()
+        block = match.group()
+        if not match.group(1) and '{%' not in block and not block.startswith('<!--['):
+            # A plain comment: dropped, and the text around it joined
+            continue
+        parts.append(LINE_BREAK.sub('\n', ''.join(text)))
+        parts.append(block)
+        text = []
+    text.append(source[position:])
+    parts.append(LINE_BREAK.sub('\n', ''.join(text)))
+    return ''.join(parts)
+
+
+class MinifyingLoader(cached.Loader):
+    """Cached template loader that minifies .html templates as they are loaded."""
+
+    def get_contents(self, origin):
+        contents = super().get_contents(origin)
+        name = origin.template_name or ''
+        if name.endswith('.html') and not name.startswith(tuple(getattr(settings, 'HTML_MINIFY_EXCLUDE', ()))):
+            return minify_html(contents)
+        return contents
+
+
+def compression(enabled=True, brotli_quality=None, gzip_level=None):
+    """
+    Decorator setting how CompressionMiddleware treats a view's responses.
+
+    Args:
+        enabled: False sends the responses uncompressed.
+        brotli_quality: Brotli quality (0-11) instead of COMPRESSION_BROTLI_QUALITY.
+        gzip_level: Gzip level (1-9) instead of COMPRESSION_GZIP_LEVEL.
+    """
+    options = {'enabled': enabled}
+    if brotli_quality is not None:
+        options['brotli_quality'] = brotli_quality
+    if gzip_level is not None:
+        options['gzip_level'] = gzip_level
+
+    def decorator(view_func):
+        if iscoroutinefunction(view_func):
+            @wraps(view_func)
+            async def wrapped(request, *args, **kwargs):
+                return await view_func(request, *args, **kwargs)
+        else:
+            @wraps(view_func)
+            def wrapped(request, *args, **kwargs):
+                return view_func(request, *args, **kwargs)
+        # Read by the middleware's process_view, like csrf_exempt
+        wrapped.compression = options
+        return wrapped
+    return decorator
+
+
+def negotiate(accept_encoding, available):
+    """
+    Pick the content coding for a response.
+
+    Args:
+        accept_encoding: The request's Accept-Encoding header
+        available: Codings the server can produce, most preferred first
+
+    Returns:
+        str or None: the coding with the highest q-value (ties go to the
+        server's preference), or None when none is acceptable
+    """
+    accepted = {}
+    for part in accept_encoding.lower().split(','):
+        coding, *params = [token.strip() for token in part.split(';')]
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if coding:
+            accepted[coding] = quality
+    best, best_quality = None, 0.0
+    for coding in available:
+        quality = accepted.get(coding, accepted.get('*', 0.0))
+        if quality > best_quality:
+            best, best_quality = coding, quality
+    return best
+
+
+def is_compressible(content_type):
+    mime = content_type.split(';')[0].strip().lower()
+    return mime.startswith('text/') or mime in COMPRESSIBLE_TYPES or mime.endswith(('+json', '+xml'))
+
+
+class StreamCompressor:
+    """Incremental brotli or gzip compressor that flushes after every chunk."""
+
+    def __init__(self, encoding, level):
+        self.encoding = encoding
+        if encoding == 'br':
+            self.compressor = brotli.Compressor(quality=level)
+        else:
+            # wbits 31: gzip header and trailer
+            self.compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        if self.encoding == 'br':
+            return self.compressor.process(data) + self.compressor.flush()
+        return self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        if self.encoding == 'br':
+            return self.compressor.finish()
+        return self.compressor.flush()
+
+
+def compress(data, encoding, level):
+    if encoding == 'br':
+        return brotli.compress(data, quality=level)
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+class CompressionMiddleware:
+    """
+    Compress text responses with brotli or gzip (see the module docstring).
+
+    Settings:
+        COMPRESSION_ENABLED: turn the middleware on or off.
+        COMPRESSION_MIN_BYTES: smaller responses are sent as they are.
+        COMPRESSION_BROTLI_QUALITY: brotli quality for responses (0-11).
+        COMPRESSION_GZIP_LEVEL: gzip level for responses (1-9).
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        self.enabled = getattr(settings, 'COMPRESSION_ENABLED', True)
+        self.min_bytes = getattr(settings, 'COMPRESSION_MIN_BYTES', 512)
+        self.levels = {
+            'br': getattr(settings, 'COMPRESSION_BROTLI_QUALITY', 5),
+            'gzip': getattr(settings, 'COMPRESSION_GZIP_LEVEL', 6),
+        }
+        self.encodings = ['br', 'gzip'] if brotli is not None else ['gzip']
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        response = self.get_response(request)
+        return self.process_response(request, response) if self.enabled else response
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        return self.process_response(request, response) if self.enabled else response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.compression = getattr(view_func, 'compression', None)
+
+    def process_response(self, request, response):
+        options = getattr(request, 'compression', None) or {}
+        if not options.get('enabled', True):
+            return response
+        if response.has_header('Content-Encoding') or response.status_code in (204, 206, 304):
+            return response
+        if not is_compressible(response.get('Content-Type', '')):
+            return response
+        if not response.streaming and len(response.content) < self.min_bytes:
+            return response
+
+        # The response differs by Accept-Encoding from here on, even when
+        # this client gets it uncompressed
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = negotiate(request.META.get('HTTP_ACCEPT_ENCODING', ''), self.encodings)
+        if encoding is None:
+            return response
+        level = options.get('brotli_quality' if encoding == 'br' else 'gzip_level', self.levels[encoding])
+
+        if response.streaming:
+            if response.is_async:
+                response.streaming_content = self.compress_async_stream(response.streaming_content, encoding, level)
+            else:
+                response.streaming_content = self.compress_stream(response.streaming_content, encoding, level)
+            del response.headers['Content-Length']
+        else:
+            compressed = compress(response.content, encoding, level)
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response.headers['Content-Length'] = str(len(compressed))
+
+        # The bytes changed, so a strong ETag no longer matches them
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = encoding
+        return response
+
+    @staticmethod
+    def compress_stream(chunks, encoding, level):
+        compressor = StreamCompressor(encoding, level)
+        for chunk in chunks:
+            if data := compressor.compress(chunk):
+                yield data
+        yield compressor.finish()
+
+    @staticmethod
+    async def compress_async_stream(chunks, encoding, level):
+        compressor = StreamCompressor(encoding, level)
+        async for chunk in chunks:
+            if data := compressor.compress(chunk):
+                yield data
+        yield compressor.finish()
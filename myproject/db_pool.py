@@ -0,0 +1,96 @@
+"""
+Postgres connection pool management (see DATABASE_POOL in settings).
+
+Django keeps one psycopg_pool.ConnectionPool per alias per process, created
+on first use. Two things need help from outside Django:
+
+Forking. A pool opened in the gunicorn master (warm-up with preload) holds
+sockets and background threads; a forked worker would inherit the sockets
+without the threads. close_pools() runs before every fork, and
+reset_after_fork() drops anything a worker still inherited without closing
+it: closing would send Terminate over a socket the master still owns.
+
+Metrics. export_metrics() publishes each pool's size, in-use and idle
+connections, waiting requests and the counters psycopg_pool keeps (requests,
+requests that had to wait because every connection was busy, wait time,
+timeouts, connections opened and lost). PerformanceMiddleware calls it at
+most once a second per worker.
+"""
+
+import logging
+import time
+
+from django.db import connections
+
+from myproject import metrics
+
+logger = logging.getLogger(__name__)
+
+EXPORT_INTERVAL = 1.0  # seconds
+
+# Pools inherited across a fork. Kept referenced so they are never
+# finalized, which would close the master's sockets.
+_inherited = []
+_last_export = 0.0
+
+
+def pools():
+    """
+    The connection pools this process has created.
+
+    Returns:
+        dict: alias -> psycopg_pool.ConnectionPool
+    """
+    found = {}
+    for alias in connections:
+        # Pools are shared by every thread's wrapper for the alias
+        pool = getattr(connections[alias], '_connection_pools', {}).get(alias)
+        if pool is not None:
+            found[alias] = pool
+    return found
+
+
+def close_pools():
+    """Close every pool and its connections (before a fork, or at exit)."""
+    for alias in pools():
+        try:
+            connections[alias].close_pool()
+        except Exception as e:
+            logger.warning(f"⚠️ Could not close the '{alias}' connection pool: {e}")
+
+
+def reset_after_fork():
+    """Forget pools and connections inherited from the parent process."""
+    for connection in connections.all(initialized_only=True):
+        registry = getattr(connection, '_connection_pools', None)
+        if registry:
+            logger.warning(f"⚠️ Worker inherited {len(registry)} connection pool(s); starting fresh ones")
+            _inherited.extend(registry.values())
+            registry.clear()
+        if connection.connection is not None:
+            _inherited.append(connection.connection)
+            connection.connection = None
+
+
+def pool_stats():
+    """
+    Current size and usage of each pool, plus counters since the last call.
+
+    Returns:
+        dict: alias -> psycopg_pool stats (pool_size, pool_available,
+        requests_waiting, requests_num, requests_queued, requests_wait_ms,
+        requests_errors, connections_num, connections_lost, ...)
+    """
+    # pop_stats() resets the counters, so each call returns increments
+    return {alias: pool.pop_stats() for alias, pool in pools().items()}
+
+
+def export_metrics(force=False):
+    """Publish pool stats to Prometheus (throttled to once per EXPORT_INTERVAL)."""
+    global _last_export
+    now = time.monotonic()
+    if not metrics.enabled() or (not force and now - _last_export < EXPORT_INTERVAL):
+        return
+    _last_export = now
+    for alias, stats in pool_stats().items():
+        metrics.observe_db_pool(alias, stats)
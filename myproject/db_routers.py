@@ -0,0 +1,175 @@
+"""
+Database routers.
+
+ReplicaRouter sends the read-only queries of web requests for the models in
+DATABASE_REPLICA_APPS (the blog's posts, alerts and notifications) to a
+replica from DATABASE_REPLICAS, and everything else to the primary:
+
+- writes, and any read inside a transaction;
+- PaymentAccess, whose checks must see a payment the moment it is recorded;
+- sessions, users, the cache table and other apps;
+- management commands and other code outside a request.
+
+Replicas lag. A request that writes a replicated model (creating a post,
+saving an alert) or PaymentAccess is pinned to the primary for the rest of
+the request, and ReplicaPinningMiddleware sets a short-lived cookie so the
+same browser keeps reading from the primary for REPLICA_PIN_SECONDS: the user
+sees their own post on the next page.
+
+ReadWriteRouter is enabled by the SQLite production mode in settings: the
+'read' alias is a second connection to the same file, opened query-only, so
+page views read through it while 'default' is the single writer. With WAL a
+reader sees every committed write and never waits for the writer.
+
+Locally, two SQLite files stand in for a primary and a replica:
+
+    DATABASE_URL=sqlite:////tmp/primary.db \\
+    DATABASE_REPLICA_URLS=sqlite:////tmp/replica.db python manage.py runserver
+    # copy the primary to the replica every 5 seconds (replication lag)
+    DATABASE_URL=... DATABASE_REPLICA_URLS=... python manage.py sync_replicas --loop --interval 5
+"""
+
+import contextvars
+import random
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+
+WRITE_DB = 'default'
+READ_DB = 'read'
+
+# Never read from a replica, whatever DATABASE_REPLICA_APPS says
+PRIMARY_ONLY_MODELS = {'users.paymentaccess'}
+
+PIN_COOKIE = 'pin_primary'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# Pinning state of the current request (None outside requests)
+_request_pin = contextvars.ContextVar('replica_pin', default=None)
+
+
+class PinState:
+    __slots__ = ('pinned', 'wrote')
+
+    def __init__(self, pinned):
+        self.pinned = pinned
+        self.wrote = False
+
+
+def pin_to_primary():
+    """Read from the primary for the rest of this request and the user's next few seconds."""
+    state = _request_pin.get()
+    if state is not None:
+        state.pinned = state.wrote = True
+
+
+def replicated(model):
+    """Whether reads of ``model`` may be served by a replica."""
+    return (model._meta.app_label in getattr(settings, 'DATABASE_REPLICA_APPS', ())
+            and model._meta.label_lower not in PRIMARY_ONLY_MODELS)
+
+
+class ReplicaRouter:
+    """Request reads of replicated models on a random replica, everything else on the primary."""
+
+    def db_for_read(self, model, **hints):
+        replicas = getattr(settings, 'DATABASE_REPLICAS', ())
+        state = _request_pin.get()
+        if not replicas or state is None or state.pinned or not replicated(model):
+            return None
+        if connections[WRITE_DB].in_atomic_block:
+            return None
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        # Session and cache writes don't change what replicas serve
+        if replicated(model) or model._meta.label_lower in PRIMARY_ONLY_MODELS:
+            pin_to_primary()
+        return WRITE_DB
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {WRITE_DB, READ_DB, *getattr(settings, 'DATABASE_REPLICAS', ())}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema from the primary
+        if db in getattr(settings, 'DATABASE_REPLICAS', ()):
+            return False
+        return None
+
+
+class ReplicaPinningMiddleware:
+    """
+    Track primary pinning per request (see ReplicaRouter).
+
+    A request is pinned from the start if it carries the pin cookie or is
+    not a GET/HEAD/OPTIONS (form posts write, then redirect and read). If it
+    wrote, the response sets the cookie for REPLICA_PIN_SECONDS.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        self.pin_seconds = getattr(settings, 'REPLICA_PIN_SECONDS', 15)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        state = self.start(request)
+        token = _request_pin.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_pin.reset(token)
+        return self.finish(request, response, state)
+
+    async def __acall__(self, request):
+        state = self.start(request)
+        token = _request_pin.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_pin.reset(token)
+        return self.finish(request, response, state)
+
+    @staticmethod
+    def start(request):
+        return PinState(pinned=PIN_COOKIE in request.COOKIES or request.method not in SAFE_METHODS)
+
+    def finish(self, request, response, state):
+        if state.wrote:
+            response.set_cookie(
+                PIN_COOKIE, '1', max_age=self.pin_seconds,
+                httponly=True, samesite='Lax', secure=request.is_secure(),
+            )
+        return response
+
+
+class ReadWriteRouter:
+    """Reads on the 'read' connection, writes on 'default'."""
+
+    def db_for_read(self, model, **hints):
+        # Inside a transaction the writer must read its own uncommitted rows
+        if connections[WRITE_DB].in_atomic_block:
+            return WRITE_DB
+        return READ_DB
+
+    def db_for_write(self, model, **hints):
+        return WRITE_DB
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases are the same database
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # 'read' is the same file as default; other databases (shards) are
+        # left to the other routers
+        return False if db == READ_DB else None
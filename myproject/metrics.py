@@ -0,0 +1,139 @@
+"""
+Prometheus metrics aggregated across gunicorn workers.
+
+Each worker writes its samples to memory-mapped files in
+PROMETHEUS_MULTIPROC_DIR (set up by gunicorn_config.py), and the /metrics
+view merges every worker's files with prometheus_client's
+MultiProcessCollector, so the numbers cover the whole server rather than
+whichever worker answered the scrape.
+
+If prometheus_client is not installed the helpers below do nothing and
+/metrics returns 503.
+"""
+
+import logging
+import os
+
+try:
+    from prometheus_client import (
+        CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess,
+    )
+except ImportError:
+    prometheus_client = None
+else:
+    import prometheus_client
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+if prometheus_client is not None:
+    REQUEST_LATENCY = Histogram(
+        'lostlink_http_request_duration_seconds', 'Time spent handling a request in Django',
+        ['view', 'method', 'status'], buckets=LATENCY_BUCKETS,
+    )
+    REQUEST_QUERIES = Histogram(
+        'lostlink_http_request_db_queries', 'SQL queries per request',
+        ['view'], buckets=QUERY_COUNT_BUCKETS,
+    )
+    DB_QUERIES = Counter('lostlink_db_queries_total', 'SQL queries executed', ['view'])
+    DB_TIME = Counter('lostlink_db_query_seconds_total', 'Time spent in SQL queries', ['view'])
+    TEMPLATE_TIME = Counter('lostlink_template_render_seconds_total', 'Time spent rendering templates', ['view'])
+    CACHE_REQUESTS = Counter('lostlink_cache_requests_total', 'Cache lookups', ['cache', 'result'])
+    DARAJA_LATENCY = Histogram(
+        'lostlink_daraja_request_duration_seconds', 'Latency of calls to the M-PESA Daraja API',
+        ['endpoint', 'outcome'], buckets=LATENCY_BUCKETS,
+    )
+    PAYMENTS = Counter('lostlink_payments_total', 'Payment outcomes', ['stage', 'outcome'])
+    # Summed over live workers: the connections the server holds per alias
+    DB_POOL_CONNECTIONS = Gauge(
+        'lostlink_db_pool_connections', 'Pooled database connections',
+        ['alias', 'state'], multiprocess_mode='livesum',
+    )
+    DB_POOL_WAITING = Gauge(
+        'lostlink_db_pool_requests_waiting', 'Requests waiting for a pooled connection',
+        ['alias'], multiprocess_mode='livesum',
+    )
+    DB_POOL_REQUESTS = Counter(
+        'lostlink_db_pool_requests_total', 'Connections requested from the pool (outcome: '
+        'immediate, waited = every connection was busy, timeout)', ['alias', 'outcome'],
+    )
+    DB_POOL_WAIT = Counter('lostlink_db_pool_wait_seconds_total', 'Time spent waiting for a pooled connection', ['alias'])
+    DB_POOL_CONNECTS = Counter(
+        'lostlink_db_pool_connects_total', 'Connections opened by the pool (outcome: ok, error, lost)',
+        ['alias', 'outcome'],
+    )
+
+
+def enabled():
+    return prometheus_client is not None
+
+
+def observe_request(request, response, stats, duration):
+    """Record a finished request (called by PerformanceMiddleware)."""
+    if prometheus_client is None:
+        return
+    match = getattr(request, 'resolver_match', None)
+    # Only use resolved view names as labels to keep cardinality bounded
+    view = match.view_name if match and match.view_name else '<unmatched>'
+    REQUEST_LATENCY.labels(view, request.method, f'{response.status_code // 100}xx').observe(duration)
+    REQUEST_QUERIES.labels(view).observe(stats.sql_count)
+    DB_QUERIES.labels(view).inc(stats.sql_count)
+    DB_TIME.labels(view).inc(stats.sql_time)
+    TEMPLATE_TIME.labels(view).inc(stats.template_time)
+
+
+def record_cache(cache, hit):
+    if prometheus_client is not None:
+        CACHE_REQUESTS.labels(cache, 'hit' if hit else 'miss').inc()
+
+
+def observe_daraja(endpoint, outcome, duration):
+    if prometheus_client is not None:
+        DARAJA_LATENCY.labels(endpoint, outcome).observe(duration)
+
+
+def record_payment(stage, outcome):
+    if prometheus_client is not None:
+        PAYMENTS.labels(stage, outcome).inc()
+
+
+def observe_db_pool(alias, stats):
+    """Record a connection pool's psycopg_pool stats (see myproject/db_pool.py)."""
+    if prometheus_client is None:
+        return
+    size, available = stats.get('pool_size', 0), stats.get('pool_available', 0)
+    DB_POOL_CONNECTIONS.labels(alias, 'in_use').set(size - available)
+    DB_POOL_CONNECTIONS.labels(alias, 'idle').set(available)
+    DB_POOL_WAITING.labels(alias).set(stats.get('requests_waiting', 0))
+    queued, errors = stats.get('requests_queued', 0), stats.get('requests_errors', 0)
+    DB_POOL_REQUESTS.labels(alias, 'immediate').inc(max(stats.get('requests_num', 0) - queued, 0))
+    DB_POOL_REQUESTS.labels(alias, 'waited').inc(max(queued - errors, 0))
+    DB_POOL_REQUESTS.labels(alias, 'timeout').inc(errors)
+    DB_POOL_WAIT.labels(alias).inc(stats.get('requests_wait_ms', 0) / 1000)
+    DB_POOL_CONNECTS.labels(alias, 'ok').inc(stats.get('connections_num', 0) - stats.get('connections_errors', 0))
+    DB_POOL_CONNECTS.labels(alias, 'error').inc(stats.get('connections_errors', 0))
+    DB_POOL_CONNECTS.labels(alias, 'lost').inc(stats.get('connections_lost', 0))
+
+
+def render_latest():
+    """
+    Render all metrics in the Prometheus text exposition format.
+
+    Returns:
+        tuple: (body bytes, content type)
+    """
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        # Single process (runserver): the default registry is complete
+        registry = prometheus_client.REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead(pid):
+    """Drop a dead worker's live gauges (called from gunicorn's child_exit)."""
+    if prometheus_client is not None and os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        multiprocess.mark_process_dead(pid)
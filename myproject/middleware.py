@@ -0,0 +1,331 @@
+"""
+Request-level performance instrumentation.
+
+PerformanceMiddleware records, for every request, the number of SQL queries
+and the time spent in them, the time spent rendering templates and the total
+time in Django. It adds a ``Server-Timing`` header (visible in the browser's
+network panel) for staff users, or everyone with DEBUG, and appends requests
+slower than PERF_SLOW_REQUEST_MS, with their SQL, to a JSONL log.
+
+Every gunicorn worker appends to the same log file, so the log is not
+rotated from inside the app (RotatingFileHandler would rename the file under
+the other workers). Rotate it with logrotate; the WatchedFileHandler reopens
+the file once it has been moved:
+
+    /srv/lostlink/logs/*.jsonl {
+        daily
+        rotate 7
+        compress
+        delaycompress
+        missingok
+    }
+
+A path of ``-`` writes the lines to stdout instead, for hosts that collect
+the process output.
+
+It is cheap enough to leave on in production: queries are counted through
+an execute wrapper installed on every database connection (no DEBUG cursor,
+no stack capture), and only the SQL text (not the parameters) is kept, and
+only up to PERF_MAX_LOGGED_QUERIES per request. The wrapper stays installed
+and does nothing outside a request, so queries the async ORM runs in
+``sync_to_async`` threads under ASGI are counted against the request too.
+
+The same numbers feed the Prometheus metrics in myproject/metrics.py, along
+with the database connection pool stats (myproject/db_pool.py).
+"""
+
+import contextvars
+import json
+import logging
+import os
+import sys
+import time
+from logging.handlers import WatchedFileHandler
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.core.signals import request_started
+from django.db.backends.signals import connection_created
+from django.template.backends.django import Template as DjangoTemplate
+from whitenoise.middleware import WhiteNoiseMiddleware as BaseWhiteNoiseMiddleware
+
+from . import db_pool, metrics
+
+logger = logging.getLogger(__name__)
+
+# Stats for the request being handled on this thread / task
+_current = contextvars.ContextVar('perf_request_stats', default=None)
+
+
+class RequestStats:
+    __slots__ = ('started', 'sql_count', 'sql_time', 'template_time', 'queries', 'max_queries')
+
+    def __init__(self, max_queries):
+        self.started = time.perf_counter()
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.template_time = 0.0
+        self.queries = []
+        self.max_queries = max_queries
+
+
+def current_stats():
+    """Return the RequestStats of the current request (or None outside one)."""
+    return _current.get()
+
+
+def _sql_wrapper(execute, sql, params, many, context):
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        duration = time.perf_counter() - started
+        stats.sql_count += 1
+        stats.sql_time += duration
+        if len(stats.queries) < stats.max_queries:
+            stats.queries.append((context['connection'].alias, sql, duration))
+
+
+def instrument_connection(connection):
+    """Install the SQL counter on a database connection (once)."""
+    if _sql_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_sql_wrapper)
+
+
+def _on_connection_created(sender, connection, **kwargs):
+    instrument_connection(connection)
+
+
+def _on_request_started(sender, **kwargs):
+    # Connections opened before the middleware was loaded. Under ASGI this
+    # sync receiver runs on the thread the request's ORM calls will use.
+    for connection in connections.all(initialized_only=True):
+        instrument_connection(connection)
+
+
+_original_template_render = DjangoTemplate.render
+
+
+def _timed_template_render(self, context=None, request=None):
+    # Only top-level renders go through the backend Template, so includes
+    # and extends are not counted twice
+    stats = _current.get()
+    if stats is None:
+        return _original_template_render(self, context, request)
+    started = time.perf_counter()
+    try:
+        return _original_template_render(self, context, request)
+    finally:
+        stats.template_time += time.perf_counter() - started
+
+
+def request_route(request):
+    """
+    The URL pattern a request resolved to and the names of its arguments.
+
+    Logs keep the pattern (``/user/<str:username>``) rather than the path,
+    which would record usernames and ids.
+
+    Returns:
+        tuple: (route, sorted kwarg names), or (None, []) if the request did
+            not resolve
+    """
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return None, []
+    return '/' + match.route, sorted(match.kwargs)
+
+
+_jsonl_loggers = {}
+
+
+def get_jsonl_logger(name, path):
+    """
+    Logger writing one JSON object per line to a file (or stdout for ``-``).
+
+    The file is shared by every worker process and rotated externally (see
+    the module docstring).
+    """
+    jsonl_log = _jsonl_loggers.get(name)
+    if jsonl_log is None:
+        path = str(path)
+        if path == '-':
+            handler = logging.StreamHandler(sys.stdout)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            handler = WatchedFileHandler(path)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        jsonl_log = logging.getLogger(name)
+        jsonl_log.setLevel(logging.INFO)
+        jsonl_log.propagate = False
+        if not jsonl_log.handlers:
+            jsonl_log.addHandler(handler)
+        _jsonl_loggers[name] = jsonl_log
+    return jsonl_log
+
+
+def get_slow_request_logger():
+    """Logger writing one JSON object per line to the slow-request log."""
+    return get_jsonl_logger('myproject.slow_requests', settings.PERF_SLOW_LOG_PATH)
+
+
+class PerformanceMiddleware:
+    """
+    Collect SQL count/time, template render time and total time per request.
+
+    Settings:
+        PERF_INSTRUMENTATION: turn the middleware on or off.
+        PERF_SERVER_TIMING: add the Server-Timing header for staff users
+            (and for everyone when DEBUG is on).
+        PERF_SLOW_REQUEST_MS: requests slower than this are logged.
+        PERF_SLOW_LOG_PATH: where the JSONL slow-request log is written
+            (``-`` for stdout).
+        PERF_MAX_LOGGED_QUERIES: SQL statements kept per request.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        self.enabled = getattr(settings, 'PERF_INSTRUMENTATION', True)
+        self.server_timing = getattr(settings, 'PERF_SERVER_TIMING', True)
+        self.slow_ms = getattr(settings, 'PERF_SLOW_REQUEST_MS', 500)
+        self.max_queries = getattr(settings, 'PERF_MAX_LOGGED_QUERIES', 200)
+        if self.enabled:
+            if DjangoTemplate.render is not _timed_template_render:
+                DjangoTemplate.render = _timed_template_render
+            # Connections are per thread: instrument every one, whichever
+            # thread opens it
+            connection_created.connect(_on_connection_created, dispatch_uid='perf_sql_wrapper')
+            request_started.connect(_on_request_started, dispatch_uid='perf_sql_wrapper')
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not self.enabled:
+            return self.get_response(request)
+
+        stats = RequestStats(self.max_queries)
+        token = _current.set(stats)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, stats)
+
+    async def __acall__(self, request):
+        if not self.enabled:
+            return await self.get_response(request)
+
+        stats = RequestStats(self.max_queries)
+        token = _current.set(stats)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        total = time.perf_counter() - stats.started
+        if total * 1000 >= self.slow_ms:
+            # Resolving request.user may need the session, which is a query
+            request.perf_user = await request.auser() if hasattr(request, 'auser') else None
+        return self.finish(request, response, stats, total)
+
+    def finish(self, request, response, stats, total=None):
+        if total is None:
+            total = time.perf_counter() - stats.started
+        request.perf_stats = stats
+        metrics.observe_request(request, response, stats, total)
+        db_pool.export_metrics()
+        if self.server_timing and self.show_server_timing(request):
+            response['Server-Timing'] = self.format_server_timing(stats, total)
+        if total * 1000 >= self.slow_ms:
+            self.log_slow_request(request, response, stats, total)
+        return response
+
+    @staticmethod
+    def show_server_timing(request):
+        """
+        Timings reveal how the site performs, so only staff see them outside
+        DEBUG. The user is only checked if the view has already loaded it
+        (every HTML page does), so the header never costs a session query.
+        """
+        if settings.DEBUG:
+            return True
+        user = (getattr(request, 'perf_user', None) or getattr(request, '_cached_user', None)
+                or getattr(request, '_acached_user', None))
+        return bool(user is not None and user.is_staff)
+
+    @staticmethod
+    def format_server_timing(stats, total):
+        return (
+            f'db;dur={stats.sql_time * 1000:.1f};desc="{stats.sql_count} queries", '
+            f'tpl;dur={stats.template_time * 1000:.1f}, '
+            f'total;dur={total * 1000:.1f}'
+        )
+
+    def log_slow_request(self, request, response, stats, total):
+        match = getattr(request, 'resolver_match', None)
+        route, route_kwargs = request_route(request)
+        user = getattr(request, 'perf_user', None) or getattr(request, 'user', None)
+        record = {
+            'ts': time.time(),
+            'method': request.method,
+            'route': route,
+            'route_kwargs': route_kwargs,
+            'view': match.view_name if match else None,
+            'status': response.status_code,
+            'total_ms': round(total * 1000, 1),
+            'sql_count': stats.sql_count,
+            'sql_ms': round(stats.sql_time * 1000, 1),
+            'template_ms': round(stats.template_time * 1000, 1),
+            'user_id': user.pk if user is not None and user.is_authenticated else None,
+            'queries': [
+                {'db': alias, 'sql': sql, 'ms': round(duration * 1000, 2)}
+                for alias, sql, duration in stats.queries
+            ],
+        }
+        try:
+            get_slow_request_logger().info(json.dumps(record))
+        except Exception as e:
+            logger.error(f"❌ Could not write slow request log: {e}")
+
+
+class WhiteNoiseMiddleware(BaseWhiteNoiseMiddleware):
+    """
+    WhiteNoise that can also sit in an async middleware chain.
+
+    whitenoise only declares sync support, so under ASGI Django would run
+    every middleware and view below it through async_to_sync, tying up a
+    thread per request. Finding a static file is a dict lookup; only
+    serving one (opening the file) is handed to a thread.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, settings=settings):
+        super().__init__(get_response, settings)
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            static_file = await sync_to_async(self.find_file, thread_sensitive=False)(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            return await sync_to_async(self.serve, thread_sensitive=False)(static_file, request)
+        return await self.get_response(request)
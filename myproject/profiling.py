@@ -0,0 +1,520 @@
+"""
+On-demand request profiling.
+
+A staff user can profile any page by adding ``?_profile`` to the URL (or
+sending an ``X-Profile`` header):
+
+    /blog/?q=phone&_profile            cProfile, report shown instead of the page
+    /blog/?q=phone&_profile=sample     sampling call tree instead of cProfile
+    curl -H 'X-Profile: sample' ...    page served as usual, report id returned
+                                       in the X-Profile-Report header
+
+Every report includes the ORM breakdown (queries grouped by SQL text, so N+1
+loops stand out) and the time spent rendering each template, and is stored
+in PROFILER_DIR as JSON (plus a .prof file for cProfile runs, which opens in
+snakeviz / pstats). Stored reports are listed at /_profiles/ and can be
+compared with /_profiles/<id>/?against=<other id>.
+
+With PROFILER_SAMPLE_RATE = N, one in N requests from any user is profiled
+with the sampling profiler and stored silently. The sampler is a background
+thread reading the request thread's stack every PROFILER_SAMPLE_INTERVAL
+seconds, so the profiled request itself runs at (almost) full speed.
+
+Under ASGI (myproject/asgi.py) every request is profiled with the sampler:
+the event loop thread serves many requests at once, so its stacks can
+include other requests' coroutines, and cProfile would record all of them.
+
+The ORM numbers come from PerformanceMiddleware (myproject/middleware.py),
+which must stay enabled and come before this middleware.
+"""
+
+import contextvars
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import random
+import secrets
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import HttpResponse
+from django.template.base import Template
+
+from .middleware import current_stats, request_route
+
+logger = logging.getLogger(__name__)
+
+PROFILE_PARAM = '_profile'
+PROFILE_HEADER = 'X-Profile'
+REPORT_HEADER = 'X-Profile-Report'
+
+CPROFILE = 'cprofile'
+SAMPLING = 'sample'
+
+TOP_FUNCTIONS = 40
+TOP_QUERIES = 25
+
+# Python 3.12+ allows a single cProfile per interpreter, so concurrent
+# profiled requests fall back to the sampler instead of failing
+_cprofile_lock = threading.Lock()
+
+# Per-template render times for the request being profiled (a context
+# variable, so concurrent requests on one event loop are kept apart)
+_template_timings = contextvars.ContextVar('profiler_template_timings', default=None)
+
+
+class TemplateTimings:
+    """Render times per template name, plus the time spent in top-level renders."""
+
+    def __init__(self):
+        self.by_name = defaultdict(list)
+        self.depth = 0
+        self.top_level = 0.0
+
+
+def _install_template_timer():
+    """Wrap Template._render so nested templates (includes/extends) are timed too."""
+    current = Template._render
+    if getattr(current, 'profiler_wrapped', False):
+        return
+
+    def _render(self, context):
+        timings = _template_timings.get()
+        if timings is None:
+            return current(self, context)
+        timings.depth += 1
+        started = time.perf_counter()
+        try:
+            return current(self, context)
+        finally:
+            duration = time.perf_counter() - started
+            timings.depth -= 1
+            timings.by_name[self.origin.template_name or '<string>'].append(duration)
+            if timings.depth == 0:
+                timings.top_level += duration
+
+    _render.profiler_wrapped = True
+    Template._render = _render
+
+
+class SamplingProfiler:
+    """
+    Statistical profiler for one thread.
+
+    A daemon thread snapshots the target thread's stack every ``interval``
+    seconds and counts identical stacks. Cost on the profiled thread is only
+    the GIL hand-off, unlike cProfile which hooks every call.
+    """
+
+    def __init__(self, thread_id=None, interval=0.005):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='request-sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                break
+            stack = []
+            while frame is not None:
+                stack.append(frame_label(frame.f_code))
+                frame = frame.f_back
+            self.stacks[tuple(reversed(stack))] += 1
+            self.samples += 1
+
+    def functions(self):
+        """Per-function inclusive/self time estimated from the sample counts."""
+        inclusive, own = Counter(), Counter()
+        for stack, count in self.stacks.items():
+            for label in set(stack):
+                inclusive[label] += count
+            own[stack[-1]] += count
+        ms = self.interval * 1000
+        return [
+            {'name': label, 'calls': None, 'self_ms': own[label] * ms, 'cum_ms': count * ms}
+            for label, count in inclusive.most_common(TOP_FUNCTIONS)
+        ]
+
+    def call_tree(self, min_fraction=0.01, max_depth=40):
+        """Render the merged stacks as an indented tree with sample percentages."""
+        if not self.samples:
+            return '(no samples: the request finished within one sampling interval)'
+        root = {}
+        for stack, count in self.stacks.items():
+            node = root
+            for label in stack:
+                entry = node.setdefault(label, [0, {}])
+                entry[0] += count
+                node = entry[1]
+
+        lines = []
+
+        def walk(children, depth):
+            for label, (count, grandchildren) in sorted(children.items(), key=lambda i: -i[1][0]):
+                if count < self.samples * min_fraction or depth > max_depth:
+                    continue
+                lines.append(f'{count / self.samples * 100:5.1f}%  {"  " * depth}{label}')
+                walk(grandchildren, depth + 1)
+
+        walk(root, 0)
+        return '\n'.join(lines)
+
+
+def frame_label(code):
+    return f'{code.co_name} ({_short_path(code.co_filename)}:{code.co_firstlineno})'
+
+
+def _short_path(filename):
+    for marker in ('site-packages' + os.sep, str(settings.BASE_DIR) + os.sep):
+        if marker in filename:
+            return filename.split(marker, 1)[1]
+    return filename
+
+
+def _cprofile_functions(profiler):
+    stats = pstats.Stats(profiler)
+    rows = []
+    for (filename, lineno, name), (_, ncalls, tottime, cumtime, _) in stats.stats.items():
+        label = f'{name} ({_short_path(filename)}:{lineno})' if lineno else name
+        rows.append({'name': label, 'calls': ncalls, 'self_ms': tottime * 1000, 'cum_ms': cumtime * 1000})
+    rows.sort(key=lambda row: row['cum_ms'], reverse=True)
+    return rows[:TOP_FUNCTIONS]
+
+
+def _cprofile_text(profiler):
+    out = io.StringIO()
+    stats = pstats.Stats(profiler, stream=out)
+    stats.sort_stats('cumulative').print_stats(TOP_FUNCTIONS)
+    return out.getvalue()
+
+
+def _query_groups(queries):
+    groups = defaultdict(lambda: {'count': 0, 'ms': 0.0})
+    for alias, sql, duration in queries:
+        group = groups[(alias, sql)]
+        group['count'] += 1
+        group['ms'] += duration * 1000
+    rows = [{'db': alias, 'sql': sql, **values} for (alias, sql), values in groups.items()]
+    rows.sort(key=lambda row: row['ms'], reverse=True)
+    return rows
+
+
+def _template_rows(timings):
+    rows = [
+        {'template': name, 'renders': len(durations), 'ms': sum(durations) * 1000}
+        for name, durations in timings.by_name.items()
+    ]
+    rows.sort(key=lambda row: row['ms'], reverse=True)
+    return rows
+
+
+def get_report_dir():
+    path = str(getattr(settings, 'PROFILER_DIR', settings.BASE_DIR / 'logs' / 'profiles'))
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _prune(directory):
+    keep = getattr(settings, 'PROFILER_MAX_REPORTS', 500)
+    reports = sorted(f for f in os.listdir(directory) if f.endswith('.json'))
+    for name in reports[:max(0, len(reports) - keep)]:
+        for suffix in ('.json', '.prof'):
+            try:
+                os.remove(os.path.join(directory, name[:-5] + suffix))
+            except FileNotFoundError:
+                pass
+
+
+def save_report(report, profiler=None):
+    """Write a report (and the raw cProfile data, if any) to PROFILER_DIR."""
+    directory = get_report_dir()
+    with open(os.path.join(directory, f"{report['id']}.json"), 'w') as f:
+        json.dump(report, f)
+    if profiler is not None:
+        profiler.dump_stats(os.path.join(directory, f"{report['id']}.prof"))
+    _prune(directory)
+
+
+def load_report(report_id):
+    """Load a stored report by id, or None if it does not exist."""
+    if not report_id.replace('-', '').isalnum():
+        return None
+    try:
+        with open(os.path.join(get_report_dir(), f'{report_id}.json')) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def list_reports(limit=200):
+    """Most recent stored reports first (without the bulky sections)."""
+    directory = get_report_dir()
+    reports = []
+    for name in sorted((f for f in os.listdir(directory) if f.endswith('.json')), reverse=True)[:limit]:
+        try:
+            with open(os.path.join(directory, name)) as f:
+                report = json.load(f)
+        except (OSError, ValueError):
+            continue
+        reports.append({k: report.get(k) for k in ('id', 'mode', 'trigger', 'method', 'route', 'view',
+                                                   'status', 'total_ms', 'sql_count', 'sql_ms', 'template_ms')})
+    return reports
+
+
+def format_report(report):
+    """Render a stored report as plain text."""
+    lines = [
+        f"Profile {report['id']}  [{report['mode']}, {report['trigger']}]",
+        f"{report['method']} {report.get('route')}  view={report['view']}  status={report['status']}",
+        '',
+        f"Total     {report['total_ms']:9.1f} ms",
+        f"SQL       {report['sql_ms']:9.1f} ms  ({report['sql_count']} queries)",
+        f"Templates {report['template_ms']:9.1f} ms",
+        f"Other     {report['total_ms'] - report['sql_ms'] - report['template_ms']:9.1f} ms  (Python, cache, I/O)",
+        '',
+        'ORM: queries grouped by SQL (repeated statements usually mean a query per row)',
+    ]
+    for row in report['queries'][:TOP_QUERIES]:
+        flag = '  <-- repeated' if row['count'] > 1 else ''
+        lines.append(f"  {row['ms']:8.2f} ms  x{row['count']:<4} [{row['db']}] {row['sql'][:300]}{flag}")
+    if len(report['queries']) > TOP_QUERIES:
+        lines.append(f"  ... {len(report['queries']) - TOP_QUERIES} more distinct statements")
+
+    lines += ['', 'Templates (inclusive: a page template includes its includes)']
+    for row in report['templates']:
+        lines.append(f"  {row['ms']:8.2f} ms  x{row['renders']:<4} {row['template']}")
+
+    lines += ['', report['profile_text']]
+    return '\n'.join(lines)
+
+
+def compare_reports(a, b):
+    """Plain-text comparison of two stored reports (b relative to a)."""
+    def delta(key, unit='ms'):
+        return f"{key:<12} {a[key]:9.1f} -> {b[key]:9.1f} {unit}  ({b[key] - a[key]:+.1f})"
+
+    lines = [
+        f"Comparing {a['id']} ({a.get('route')}) -> {b['id']} ({b.get('route')})",
+        '',
+        delta('total_ms'),
+        delta('sql_ms'),
+        delta('sql_count', 'queries'),
+        delta('template_ms'),
+        '',
+        'Functions with the largest change in cumulative time:',
+    ]
+    before = {row['name']: row['cum_ms'] for row in a['functions']}
+    after = {row['name']: row['cum_ms'] for row in b['functions']}
+    changes = sorted(
+        ((name, before.get(name, 0.0), after.get(name, 0.0)) for name in before.keys() | after.keys()),
+        key=lambda item: abs(item[2] - item[1]), reverse=True,
+    )
+    for name, old, new in changes[:20]:
+        lines.append(f"  {old:9.1f} -> {new:9.1f} ms  ({new - old:+9.1f})  {name}")
+
+    lines += ['', 'Statements whose execution count changed:']
+    before = {row['sql']: row['count'] for row in a['queries']}
+    after = {row['sql']: row['count'] for row in b['queries']}
+    for sql in sorted(before.keys() | after.keys(), key=lambda s: -abs(after.get(s, 0) - before.get(s, 0))):
+        if before.get(sql, 0) != after.get(sql, 0):
+            lines.append(f"  x{before.get(sql, 0):<4} -> x{after.get(sql, 0):<4} {sql[:200]}")
+    return '\n'.join(lines)
+
+
+class ProfileRun:
+    """
+    One profiled request: starts cProfile or the sampler and template
+    timing on creation, and remembers the SQL counters to diff at the end.
+    """
+
+    def __init__(self, mode, interval):
+        self.stats = current_stats()
+        self.sql_before = self.stats.sql_count if self.stats else 0
+        self.sql_time_before = self.stats.sql_time if self.stats else 0.0
+        self.queries_before = len(self.stats.queries) if self.stats else 0
+
+        self.profiler = None
+        if mode == CPROFILE:
+            if _cprofile_lock.acquire(blocking=False):
+                self.profiler = cProfile.Profile()
+            else:
+                mode = SAMPLING
+        self.mode = mode
+        self.sampler = SamplingProfiler(interval=interval) if mode == SAMPLING else None
+
+        self.timings = TemplateTimings()
+        self._timings_token = _template_timings.set(self.timings)
+        self.total = 0.0
+        self.started = time.perf_counter()
+        if self.profiler is not None:
+            self.profiler.enable()
+        else:
+            self.sampler.start()
+
+    def stop(self):
+        try:
+            if self.profiler is not None:
+                self.profiler.disable()
+            else:
+                self.sampler.stop()
+        finally:
+            self.total = time.perf_counter() - self.started
+            _template_timings.reset(self._timings_token)
+            if self.profiler is not None:
+                _cprofile_lock.release()
+
+    def sql_delta(self):
+        stats = self.stats
+        return {
+            'sql_count': (stats.sql_count - self.sql_before) if stats else 0,
+            'sql_time': (stats.sql_time - self.sql_time_before) if stats else 0.0,
+            'queries': stats.queries[self.queries_before:] if stats else [],
+        }
+
+
+class ProfilerMiddleware:
+    """
+    Profile requests on demand (staff) or at a 1-in-N sample rate.
+
+    Must come after AuthenticationMiddleware (to check is_staff) and after
+    PerformanceMiddleware (for the SQL breakdown).
+
+    Settings:
+        PROFILER_ENABLED: allow staff to request a profile.
+        PROFILER_SAMPLE_RATE: profile one in N requests (0 disables sampling).
+        PROFILER_SAMPLE_INTERVAL: seconds between stack samples.
+        PROFILER_DIR: where reports are stored.
+        PROFILER_MAX_REPORTS: older reports are deleted beyond this count.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        self.enabled = getattr(settings, 'PROFILER_ENABLED', True)
+        self.sample_rate = getattr(settings, 'PROFILER_SAMPLE_RATE', 0)
+        self.interval = getattr(settings, 'PROFILER_SAMPLE_INTERVAL', 0.005)
+        _install_template_timer()
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        mode, trigger = self.requested_mode(request, getattr(request, 'user', None))
+        if mode is None:
+            return self.get_response(request)
+
+        run = ProfileRun(mode, self.interval)
+        try:
+            response = self.get_response(request)
+            # Include rendering of lazy TemplateResponses in the profile
+            if hasattr(response, 'render') and callable(response.render):
+                response = response.render()
+        finally:
+            run.stop()
+        return self.finish(request, response, trigger, run)
+
+    async def __acall__(self, request):
+        user = None
+        if self.enabled and (PROFILE_PARAM in request.GET or PROFILE_HEADER in request.headers):
+            # Only load the session when a profile was asked for
+            user = await request.auser()
+        mode, trigger = self.requested_mode(request, user)
+        if mode is None:
+            return await self.get_response(request)
+
+        run = ProfileRun(SAMPLING, self.interval)
+        try:
+            response = await self.get_response(request)
+            if hasattr(response, 'render') and callable(response.render):
+                response = response.render()
+        finally:
+            run.stop()
+        return self.finish(request, response, trigger, run)
+
+    def requested_mode(self, request, user):
+        """Return (mode, trigger) for this request, or (None, None) to skip profiling."""
+        if self.enabled:
+            value = request.GET.get(PROFILE_PARAM)
+            trigger = 'param'
+            if value is None:
+                value = request.headers.get(PROFILE_HEADER)
+                trigger = 'header'
+            if value is not None and user is not None and user.is_staff:
+                return (SAMPLING if value == SAMPLING else CPROFILE), trigger
+        if self.sample_rate and random.randrange(self.sample_rate) == 0:
+            return SAMPLING, 'sampled'
+        return None, None
+
+    def finish(self, request, response, trigger, run):
+        """Store the report and return the response (or the report itself)."""
+        try:
+            report = self.build_report(
+                request, response, run.mode, trigger, run.total, run.timings, run.profiler, run.sampler,
+                **run.sql_delta(),
+            )
+            save_report(report, run.profiler)
+        except Exception as e:
+            logger.error(f"❌ Could not store request profile: {e}")
+            return response
+
+        if trigger == 'param':
+            return HttpResponse(format_report(report), content_type='text/plain; charset=utf-8')
+        if trigger == 'header':
+            response[REPORT_HEADER] = report['id']
+        return response
+
+    @staticmethod
+    def build_report(request, response, mode, trigger, total, timings, profiler, sampler,
+                     sql_count, sql_time, queries):
+        match = getattr(request, 'resolver_match', None)
+        templates = _template_rows(timings)
+        if profiler is not None:
+            functions, text = _cprofile_functions(profiler), _cprofile_text(profiler)
+        else:
+            functions = sampler.functions()
+            text = (f'Sampled call tree ({sampler.samples} samples every {sampler.interval * 1000:.0f} ms)\n'
+                    + sampler.call_tree())
+        return {
+            'id': time.strftime('%Y%m%d-%H%M%S') + '-' + secrets.token_hex(3),
+            'created': time.time(),
+            'mode': mode,
+            'trigger': trigger,
+            'method': request.method,
+            # The URL pattern, not the path: no usernames, ids or query strings
+            'route': request_route(request)[0],
+            'view': match.view_name if match else None,
+            'status': response.status_code,
+            'total_ms': total * 1000,
+            'sql_count': sql_count,
+            'sql_ms': sql_time * 1000,
+            'template_ms': timings.top_level * 1000,
+            'queries': _query_groups(queries),
+            'templates': templates,
+            'functions': functions,
+            'profile_text': text,
+        }
+
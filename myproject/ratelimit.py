@@ -0,0 +1,232 @@
+"""
+Token-bucket rate limiting backed by the shared cache.
+
+Buckets live in the default cache (Redis or the database cache in production,
+see CACHES in settings), so every gunicorn worker sees the same counts. Each
+bucket is stored as a single ``(tokens, timestamp)`` entry and updated under a
+short lock taken with ``cache.add``, which is atomic on every Django cache
+backend. A request that cannot get the lock within LOCK_ATTEMPTS tries is
+limited rather than let through unlocked: contention means a spike, which is
+when an unlocked read-modify-write would lose counts.
+
+Usage:
+
+    @ratelimit('pay_post:user', key='user', rate='5/m', methods=['POST'])
+    @ratelimit('pay_post:phone', key='phone', rate='3/m', methods=['POST'])
+    @ratelimit('daraja:global', key='global', rate='50/s', burst=100, methods=['POST'])
+    def pay_post(request, pk):
+        ...
+
+Decorators run top to bottom and each one charges its bucket before the
+next is checked, so put shared buckets last: a request refused by its own
+per-user limit then costs the global bucket nothing.
+
+Limited requests get a 429 response with a ``Retry-After`` header. Rates can
+be overridden per bucket name with the ``RATELIMIT_RATES`` setting, and the
+whole subsystem can be switched off with ``RATELIMIT_ENABLE = False``.
+
+Async views can be decorated too; the bucket check then runs in a thread
+(it takes a lock with short sleeps and may resolve ``request.user``).
+"""
+
+import logging
+import math
+import time
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, JsonResponse
+
+logger = logging.getLogger(__name__)
+
+PERIODS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 24 * 60 * 60}
+
+LOCK_TIMEOUT = 1  # seconds; a crashed holder can only block a bucket this long
+LOCK_ATTEMPTS = 25
+LOCK_WAIT = 0.002
+
+
+def parse_rate(rate):
+    """
+    Parse a rate string such as '5/m' or '100/s' into tokens per second.
+
+    Returns:
+        tuple: (tokens per second, number of requests in the period)
+    """
+    try:
+        count, period = rate.split('/')
+        count = int(count)
+        seconds = PERIODS[period.strip().lower()[0]]
+    except (ValueError, KeyError, IndexError):
+        raise ValueError(f"Invalid rate: {rate!r} (expected e.g. '5/m')")
+    return count / seconds, count
+
+
+class TokenBucket:
+    """
+    A named token bucket.
+
+    Args:
+        name: Bucket name, used in cache keys and for RATELIMIT_RATES overrides.
+        rate: Refill rate, e.g. '5/m'.
+        burst: Bucket capacity. Defaults to the number of requests in the period.
+    """
+
+    def __init__(self, name, rate, burst=None):
+        self.name = name
+        self.refill_rate, count = parse_rate(rate)
+        self.capacity = burst or count
+
+    def cache_key(self, key):
+        return f'ratelimit:{self.name}:{key}'
+
+    def consume(self, key, tokens=1, now=None):
+        """
+        Take tokens from the bucket for the given key.
+
+        Returns:
+            tuple: (allowed, retry_after) where retry_after is the number of
+                seconds until enough tokens are available (0 when allowed).
+        """
+        cache_key = self.cache_key(key)
+        lock_key = f'{cache_key}:lock'
+        acquired = False
+        try:
+            for _ in range(LOCK_ATTEMPTS):
+                if cache.add(lock_key, 1, LOCK_TIMEOUT):
+                    acquired = True
+                    break
+                time.sleep(LOCK_WAIT)
+            if not acquired:
+                logger.warning(f"⚠️ Rate limit lock for {cache_key} is contended, limiting request")
+                return False, float(LOCK_TIMEOUT)
+
+            now = time.time() if now is None else now
+            state = cache.get(cache_key)
+            if state is None:
+                available, last = self.capacity, now
+            else:
+                available, last = state
+            available = min(self.capacity, available + max(0.0, now - last) * self.refill_rate)
+
+            if available >= tokens:
+                available -= tokens
+                allowed, retry_after = True, 0.0
+            else:
+                allowed, retry_after = False, (tokens - available) / self.refill_rate
+
+            # Expire the entry once the bucket would have refilled completely
+            timeout = math.ceil(self.capacity / self.refill_rate) + 1
+            cache.set(cache_key, (available, now), timeout)
+            return allowed, retry_after
+        except Exception as e:
+            # Never take the site down because the cache is unavailable
+            logger.error(f"❌ Rate limit check failed for {cache_key}, allowing request: {str(e)}")
+            return True, 0.0
+        finally:
+            if acquired:
+                cache.delete(lock_key)
+
+
+def client_ip(request):
+    """
+    Return the client IP as seen by the first trusted proxy.
+
+    Every proxy appends the address it received the request from to
+    X-Forwarded-For, so only the last RATELIMIT_TRUSTED_PROXIES entries were
+    written by our own proxies; anything before them came from the client and
+    can be forged. With no trusted proxies (or no header) this is REMOTE_ADDR.
+    """
+    hops = getattr(settings, 'RATELIMIT_TRUSTED_PROXIES', 1)
+    forwarded = request.META.get('HTTP_X_FORWARDED_FOR')
+    if forwarded and hops > 0:
+        addresses = [address.strip() for address in forwarded.split(',') if address.strip()]
+        if addresses:
+            return addresses[-min(hops, len(addresses))]
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def _key_user(request):
+    if request.user.is_authenticated:
+        return f'user:{request.user.pk}'
+    return f'ip:{client_ip(request)}'
+
+
+def _key_phone(request):
+    if not request.user.is_authenticated:
+        return None
+    profile = getattr(request.user, 'profile', None)
+    phone = getattr(profile, 'phone_number', '')
+    return f'phone:{phone.replace("+", "").strip()}' if phone else None
+
+
+KEY_FUNCTIONS = {
+    'user': _key_user,
+    'ip': lambda request: f'ip:{client_ip(request)}',
+    'phone': _key_phone,
+    'global': lambda request: 'global',
+}
+
+
+def too_many_requests(request, retry_after):
+    """Build the 429 response for a limited request."""
+    retry_after = max(1, math.ceil(retry_after))
+    message = f"Too many requests. Please try again in {retry_after} seconds."
+    if request.content_type == 'application/json':
+        response = JsonResponse({"detail": message}, status=429)
+    else:
+        response = HttpResponse(message, status=429, content_type='text/plain')
+    response['Retry-After'] = str(retry_after)
+    return response
+
+
+def ratelimit(name, key='user', rate='10/m', burst=None, methods=None):
+    """
+    Decorator that rate-limits a view with a token bucket.
+
+    Args:
+        name: Bucket name. RATELIMIT_RATES[name] overrides ``rate``.
+        key: 'user', 'ip', 'phone', 'global' or a callable taking the request
+            and returning a key (None skips the check).
+        rate: Refill rate, e.g. '5/m'.
+        burst: Bucket capacity (defaults to the requests per period).
+        methods: Only limit these HTTP methods (default: all).
+    """
+    key_func = key if callable(key) else KEY_FUNCTIONS[key]
+    methods = {m.upper() for m in methods} if methods else None
+
+    def check(request):
+        """Return a 429 response if the request is over the limit, else None."""
+        if not getattr(settings, 'RATELIMIT_ENABLE', True) or (methods is not None and request.method not in methods):
+            return None
+        bucket_key = key_func(request)
+        if bucket_key is None:
+            return None
+        bucket_rate = getattr(settings, 'RATELIMIT_RATES', {}).get(name, rate)
+        bucket = TokenBucket(name, bucket_rate, burst)
+        allowed, retry_after = bucket.consume(bucket_key)
+        if not allowed:
+            logger.warning(f"⚠️ Rate limit '{name}' exceeded for {bucket_key}")
+            return too_many_requests(request, retry_after)
+        return None
+
+    def decorator(view_func):
+        if iscoroutinefunction(view_func):
+            @wraps(view_func)
+            async def wrapped(request, *args, **kwargs):
+                limited = await sync_to_async(check)(request)
+                if limited is not None:
+                    return limited
+                return await view_func(request, *args, **kwargs)
+            return wrapped
+
+        @wraps(view_func)
+        def wrapped(request, *args, **kwargs):
+            limited = check(request)
+            if limited is not None:
+                return limited
+            return view_func(request, *args, **kwargs)
+        return wrapped
+    return decorator
@@ -18,6 +18,11 @@ try:
 except ImportError:
     dj_database_url = None
 
+try:
+    import psycopg_pool
+except ImportError:
+    psycopg_pool = None
+
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -53,6 +58,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'myproject.middleware.PerformanceMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -68,8 +74,9 @@ TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
         'DIRS': [],
-        'APP_DIRS': True,
         'OPTIONS': {
+            # See HTML_MINIFY below
+            'loaders': [],
             'context_processors': [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
@@ -102,6 +109,153 @@ else:
         }
     }
 
+# SQLite production mode (on by default when DEBUG is off). Every connection
+# gets WAL (readers no longer wait for the writer), synchronous=NORMAL (safe
+# with WAL, fsync only at checkpoints), a memory-mapped file and a larger page
+# cache, kept warm by persistent connections, and a busy timeout. Writes start
+# their transaction with BEGIN IMMEDIATE so two workers cannot both read and
+# then deadlock upgrading to a write lock (SQLite's "database is locked" that
+# no timeout can fix). Reads go through a separate query-only connection,
+# 'read' (see myproject/db_routers.py). Benchmark: scripts/sqlite_benchmark.py.
+SQLITE_PRODUCTION = os.environ.get('SQLITE_PRODUCTION', str(not DEBUG)) == 'True'
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))
+SQLITE_PRAGMAS = {
+    'busy_timeout': SQLITE_BUSY_TIMEOUT_MS,
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+    'cache_size': -int(os.environ.get('SQLITE_CACHE_KB', 64 * 1024)),  # negative: KiB, not pages
+    'temp_store': 'MEMORY',
+}
+_sqlite_init = ';'.join(f'PRAGMA {name}={value}' for name, value in SQLITE_PRAGMAS.items())
+DATABASE_ROUTERS = []
+if SQLITE_PRODUCTION and DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+    DATABASES['default'].update({
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+    })
+    _sqlite_options = {**DATABASES['default'].get('OPTIONS', {}), 'timeout': SQLITE_BUSY_TIMEOUT_MS / 1000}
+    DATABASES['read'] = {
+        **DATABASES['default'],
+        'OPTIONS': {**_sqlite_options, 'init_command': _sqlite_init + ';PRAGMA query_only=1'},
+        # Tests point it at default's test database instead of creating one
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_ROUTERS.append('myproject.db_routers.ReadWriteRouter')
+    DATABASES['default']['OPTIONS'] = {
+        **_sqlite_options,
+        'init_command': _sqlite_init,
+        'transaction_mode': 'IMMEDIATE',
+    }
+
+# Read replicas: DATABASE_REPLICA_URLS is a comma-separated list of database
+# URLs, added as replica1, replica2, ... Request reads of the apps in
+# DATABASE_REPLICA_APPS go to a random replica; writes, PaymentAccess and
+# everything else stay on the primary, and a user who just wrote reads from
+# the primary for REPLICA_PIN_SECONDS (see myproject/db_routers.py). Two
+# SQLite files work as a local stand-in, kept in step by `sync_replicas`.
+DATABASE_REPLICA_APPS = ['blog']
+REPLICA_PIN_SECONDS = int(os.environ.get('REPLICA_PIN_SECONDS', 15))
+DATABASE_REPLICAS = []
+if dj_database_url:
+    for _index, _url in enumerate(filter(None, os.environ.get('DATABASE_REPLICA_URLS', '').split(',')), 1):
+        _replica = dj_database_url.parse(_url.strip(), conn_max_age=600, conn_health_checks=True)
+        if _replica['ENGINE'] == 'django.db.backends.sqlite3':
+            _replica['OPTIONS'] = {
+                'timeout': SQLITE_BUSY_TIMEOUT_MS / 1000,
+                'init_command': (_sqlite_init + ';' if SQLITE_PRODUCTION else '') + 'PRAGMA query_only=1',
+            }
+        _replica['TEST'] = {'MIRROR': 'default'}
+        DATABASES[f'replica{_index}'] = _replica
+        DATABASE_REPLICAS.append(f'replica{_index}')
+if DATABASE_REPLICAS:
+    DATABASE_ROUTERS.insert(0, 'myproject.db_routers.ReplicaRouter')
+    MIDDLEWARE.insert(1, 'myproject.db_routers.ReplicaPinningMiddleware')
+
+# Region sharding of posts: POST_SHARD_URLS is a comma-separated list of
+# key=url, where key is a region (nairobi, central, coast, eastern,
+# north_eastern, nyanza, rift_valley, western) or a county. Each becomes the
+# database alias shard_<key>, holding the posts of that region with their
+# payments and match notifications; everything else stays on default. Run
+# `migrate --database shard_<key>` for each, then `rebalance_shards` (see
+# blog/sharding.py). Several SQLite files work as a local stand-in. Tests
+# run unsharded (myproject/test_settings.py).
+POST_SHARDS = {}
+if dj_database_url:
+    for _entry in filter(None, os.environ.get('POST_SHARD_URLS', '').split(',')):
+        _key, _, _url = _entry.partition('=')
+        _key = _key.strip().lower().replace("'", '').replace(' ', '_').replace('-', '_')
+        _shard = dj_database_url.parse(_url.strip(), conn_max_age=600, conn_health_checks=True)
+        if _shard['ENGINE'] == 'django.db.backends.sqlite3' and SQLITE_PRODUCTION:
+            _shard['OPTIONS'] = {'timeout': SQLITE_BUSY_TIMEOUT_MS / 1000, 'init_command': _sqlite_init}
+        DATABASES[f'shard_{_key}'] = _shard
+        POST_SHARDS[_key] = f'shard_{_key}'
+if POST_SHARDS:
+    DATABASE_ROUTERS.insert(0, 'blog.sharding.ShardRouter')
+
+# Postgres connection pool (Django's native psycopg 3 pool, requires
+# psycopg[pool]). Each worker process keeps one pool per Postgres alias,
+# between DATABASE_POOL_MIN_SIZE and DATABASE_POOL_MAX_SIZE connections, so
+# the server sees at most workers x max size connections per alias however
+# many threads are busy; a request that finds every connection in use waits
+# up to DATABASE_POOL_TIMEOUT seconds. Connections are checked with an empty
+# query when taken from the pool (CONN_HEALTH_CHECKS) and replaced after
+# DATABASE_POOL_MAX_LIFETIME. Pools are reset across gunicorn forks and
+# exported to /metrics (see myproject/db_pool.py).
+DATABASE_POOL = os.environ.get('DATABASE_POOL', 'True') == 'True'
+DATABASE_POOL_MIN_SIZE = int(os.environ.get('DATABASE_POOL_MIN_SIZE', 1))
+DATABASE_POOL_MAX_SIZE = int(os.environ.get('DATABASE_POOL_MAX_SIZE', 4))
+DATABASE_POOL_TIMEOUT = float(os.environ.get('DATABASE_POOL_TIMEOUT', 10))
+DATABASE_POOL_MAX_IDLE = float(os.environ.get('DATABASE_POOL_MAX_IDLE', 300))
+DATABASE_POOL_MAX_LIFETIME = float(os.environ.get('DATABASE_POOL_MAX_LIFETIME', 1800))
+if DATABASE_POOL and psycopg_pool:
+    for _alias, _database in DATABASES.items():
+        if _database['ENGINE'] != 'django.db.backends.postgresql':
+            continue
+        # The pool replaces persistent connections (Django refuses both)
+        _database['CONN_MAX_AGE'] = 0
+        _database['CONN_HEALTH_CHECKS'] = True
+        _database['OPTIONS'] = {
+            **_database.get('OPTIONS', {}),
+            'pool': {
+                'name': _alias,
+                'min_size': DATABASE_POOL_MIN_SIZE,
+                'max_size': DATABASE_POOL_MAX_SIZE,
+                'timeout': DATABASE_POOL_TIMEOUT,
+                'max_idle': DATABASE_POOL_MAX_IDLE,
+                'max_lifetime': DATABASE_POOL_MAX_LIFETIME,
+            },
+        }
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# The cache is shared between gunicorn workers (rate limits, paid-post sets).
+# Use Redis when REDIS_URL is set (requires the `redis` package), otherwise the
+# database cache in production (run `python manage.py createcachetable`) and
+# local memory in development. CACHE_BACKEND=db forces the database cache, e.g.
+# to share it between the workers of a local gunicorn.
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ.get('REDIS_URL'),
+        }
+    }
+elif not DEBUG or os.environ.get('CACHE_BACKEND') == 'db':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': 'django_cache',
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -156,12 +310,63 @@ CRISPY_TEMPLATE_PACK = 'bootstrap5'
 CRISPY_ALLOWED_TEMPLATE_PACKS = "bootstrap5"
 LOGOUT_REDIRECT_URL = 'blog-home'
 
-EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
-EMAIL_HOST = 'smtp.gmail.com'
-EMAIL_PORT = 587
-EMAIL_USE_TLS = True
+# Outgoing mail is queued in the outbox and sent in the background over a
+# persistent connection (see users/mail.py). EMAIL_OUTBOX_TRANSPORT is the
+# backend the sender actually uses.
+EMAIL_BACKEND = os.environ.get('EMAIL_BACKEND', 'users.mail.OutboxEmailBackend')
+EMAIL_OUTBOX_TRANSPORT = os.environ.get('EMAIL_OUTBOX_TRANSPORT', 'django.core.mail.backends.smtp.EmailBackend')
+# Run a sender thread in each web worker; turn off when running
+# `python manage.py send_queued_mail --loop` as a separate process
+EMAIL_OUTBOX_THREAD = os.environ.get('EMAIL_OUTBOX_THREAD', 'True') == 'True'
+EMAIL_OUTBOX_BATCH_SIZE = 50
+EMAIL_OUTBOX_MAX_ATTEMPTS = 6
+EMAIL_OUTBOX_BACKOFF_BASE = 30  # seconds, doubled per failed attempt
+EMAIL_OUTBOX_BACKOFF_MAX = 3600
+EMAIL_OUTBOX_IDLE_TIMEOUT = 30  # close the SMTP connection after this long without mail
+EMAIL_HOST = os.environ.get('EMAIL_HOST', 'smtp.gmail.com')
+EMAIL_PORT = int(os.environ.get('EMAIL_PORT', 587))
+EMAIL_USE_TLS = os.environ.get('EMAIL_USE_TLS', 'True') == 'True'
+EMAIL_TIMEOUT = 30
 EMAIL_HOST_USER = os.environ.get('EMAIL_USER')
 EMAIL_HOST_PASSWORD = os.environ.get('EMAIL_PASS')
+DEFAULT_FROM_EMAIL = os.environ.get('DEFAULT_FROM_EMAIL', EMAIL_HOST_USER or 'webmaster@localhost')
+
+# Absolute base URL used for links in emails
+SITE_URL = os.environ.get('SITE_URL', 'https://lostlink-kenya-760j.onrender.com').rstrip('/')
+
+# New-match notifications (see blog.services.NotificationService). A user's
+# pending notifications are grouped into one digest once the oldest has
+# waited NOTIFICATION_DIGEST_WINDOW seconds.
+NOTIFICATION_DIGEST_WINDOW = int(os.environ.get('NOTIFICATION_DIGEST_WINDOW', 600))
+# Collect notifications on a background thread instead of in the author's request
+NOTIFICATION_COLLECT_ASYNC = os.environ.get('NOTIFICATION_COLLECT_ASYNC', 'True') == 'True'
+NOTIFICATION_BATCH_SIZE = 200  # recipients per batch
+NOTIFICATION_MAX_DIGEST_ITEMS = 20
+NOTIFICATION_MAX_MATCHES = 500  # counterpart posts considered per new post
+NOTIFICATION_MATCH_MAX_AGE_DAYS = 90
+
+# Hot/cold archival (see blog/archive.py): `archive_posts --loop` moves
+# resolved posts older than ARCHIVE_RESOLVED_AFTER_DAYS and any post older
+# than ARCHIVE_STALE_AFTER_DAYS out of the Post table, ARCHIVE_BATCH_SIZE per
+# transaction, every ARCHIVE_INTERVAL seconds.
+ARCHIVE_RESOLVED_AFTER_DAYS = int(os.environ.get('ARCHIVE_RESOLVED_AFTER_DAYS', 14))
+ARCHIVE_STALE_AFTER_DAYS = int(os.environ.get('ARCHIVE_STALE_AFTER_DAYS', 365))
+ARCHIVE_BATCH_SIZE = int(os.environ.get('ARCHIVE_BATCH_SIZE', 500))
+ARCHIVE_INTERVAL = int(os.environ.get('ARCHIVE_INTERVAL', 3600))
+
+# Uploads (see myproject/uploads.py). A file is dropped while it streams in
+# once it passes UPLOAD_MAX_BYTES; images over UPLOAD_MAX_PIXELS are rejected
+# from their header, and post photos are stored at most POST_IMAGE_MAX_SIZE.
+UPLOAD_MAX_BYTES = int(os.environ.get('UPLOAD_MAX_BYTES', 10 * 1024 * 1024))
+UPLOAD_MAX_PIXELS = int(os.environ.get('UPLOAD_MAX_PIXELS', 40_000_000))
+POST_IMAGE_MAX_SIZE = (1600, 1600)
+FILE_UPLOAD_HANDLERS = [
+    'myproject.uploads.SizeLimitedUploadHandler',
+    'django.core.files.uploadhandler.MemoryFileUploadHandler',
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+]
+# Smaller than Django's 2.5 MB: larger uploads spool to disk, not worker memory
+FILE_UPLOAD_MAX_MEMORY_SIZE = 1024 * 1024
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
@@ -170,9 +375,40 @@ MPESA_CONSUMER_KEY = "Fbo27K75S3jVWLOMbWGiaAsaZ8KKXm7wIrAIGcN9mAPo1xuw"
 MPESA_CONSUMER_SECRET = "CaD07mJGrhA95WlAy2qalLw6siNljQSr50AhOCicEs6LwIMd33ygulcxe4w2IU7t"
 MPESA_SHORTCODE = "174379"
 MPESA_PASSKEY = "bfb279f9aa9bdbcf158e97dd71a467cd2e0c893059b10f78e6b72ada1ed2c919"
-MPESA_STK_URL = "https://sandbox.safaricom.co.ke/mpesa/stkpush/v1/processrequest"
-MPESA_CALLBACK = "https://LostLink-Kenya/mpesa/callback/"
+# M-PESA backend: 'daraja' (Safaricom sandbox/production), 'simulator' (the
+# local Daraja simulator, see users/daraja_simulator.py) or 'mock' (in-process
+# auto-approval, see users/mpesa_mock.py)
+MPESA_BACKEND = os.environ.get('MPESA_BACKEND', 'daraja')
+MPESA_BASE_URL = os.environ.get(
+    'MPESA_BASE_URL',
+    'http://127.0.0.1:8010' if MPESA_BACKEND == 'simulator' else 'https://sandbox.safaricom.co.ke',
+).rstrip('/')
+MPESA_OAUTH_URL = f"{MPESA_BASE_URL}/oauth/v1/generate?grant_type=client_credentials"
+MPESA_STK_URL = f"{MPESA_BASE_URL}/mpesa/stkpush/v1/processrequest"
+MPESA_STK_QUERY_URL = f"{MPESA_BASE_URL}/mpesa/stkpushquery/v1/query"
+MPESA_CALLBACK = os.environ.get('MPESA_CALLBACK', "https://LostLink-Kenya/mpesa/callback/")
 MPESA_FIXED_PRICE = 100
+# The waiting page polls payment_status; if the callback has not arrived this
+# many seconds after the push, the status is asked from Daraja (STK Query),
+# at most once per MPESA_STATUS_QUERY_INTERVAL seconds per payment
+MPESA_STATUS_QUERY_AFTER = int(os.environ.get('MPESA_STATUS_QUERY_AFTER', 20))
+MPESA_STATUS_QUERY_INTERVAL = int(os.environ.get('MPESA_STATUS_QUERY_INTERVAL', 15))
+
+# Route the hot pages (home, post detail, M-PESA callback) to their async
+# versions. On by default under ASGI (myproject/asgi.py); sync views run in a
+# thread there, so leave it on unless debugging.
+ASYNC_VIEWS = os.environ.get('ASYNC_VIEWS', 'False') == 'True'
+
+# Rate limiting (see myproject/ratelimit.py). RATELIMIT_RATES overrides the
+# rate of a bucket by name, e.g. {'daraja:global': '20/s'}.
+RATELIMIT_ENABLE = os.environ.get('RATELIMIT_ENABLE', 'True') == 'True'
+RATELIMIT_RATES = {}
+if os.environ.get('DARAJA_GLOBAL_RATE'):
+    RATELIMIT_RATES['daraja:global'] = os.environ.get('DARAJA_GLOBAL_RATE')
+# Proxies in front of the app that append to X-Forwarded-For (nginx or
+# Render's router: 1). Per-IP limits key on the entry the outermost of them
+# added; 0 uses the socket address.
+RATELIMIT_TRUSTED_PROXIES = int(os.environ.get('RATELIMIT_TRUSTED_PROXIES', 1))
 
 STATIC_ROOT = BASE_DIR / "staticfiles"
 STATIC_URL = "/static/"
@@ -187,6 +423,65 @@ if not DEBUG:
     SECURE_HSTS_PRELOAD = True
     SECURE_PROXY_SSL_HEADER = ('HTTP_X_FORWARDED_PROTO', 'https')
     
-# WhiteNoise for static file serving
-MIDDLEWARE.insert(1, 'whitenoise.middleware.WhiteNoiseMiddleware')
-STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
\ No newline at end of file
+# Request instrumentation (see myproject/middleware.py): Server-Timing header
+# for staff (everyone with DEBUG) and a JSONL log of slow requests with their
+# SQL. The log is shared by all workers: rotate it with logrotate, or set
+# PERF_SLOW_LOG_PATH=- to write it to stdout.
+PERF_INSTRUMENTATION = os.environ.get('PERF_INSTRUMENTATION', 'True') == 'True'
+PERF_SERVER_TIMING = True
+PERF_SLOW_REQUEST_MS = int(os.environ.get('PERF_SLOW_REQUEST_MS', 500))
+PERF_SLOW_LOG_PATH = os.environ.get('PERF_SLOW_LOG_PATH', str(BASE_DIR / 'logs' / 'slow_requests.jsonl'))
+PERF_MAX_LOGGED_QUERIES = 200
+
+# On-demand profiling (see myproject/profiling.py): staff add ?_profile or
+# ?_profile=sample to any URL; PROFILER_SAMPLE_RATE=N also profiles one in N
+# requests with the low-overhead sampler. Reports are kept in PROFILER_DIR.
+MIDDLEWARE.append('myproject.profiling.ProfilerMiddleware')
+PROFILER_ENABLED = os.environ.get('PROFILER_ENABLED', 'True') == 'True'
+PROFILER_SAMPLE_RATE = int(os.environ.get('PROFILER_SAMPLE_RATE', 0))
+PROFILER_SAMPLE_INTERVAL = 0.005
+PROFILER_DIR = os.environ.get('PROFILER_DIR', str(BASE_DIR / 'logs' / 'profiles'))
+PROFILER_MAX_REPORTS = 500
+
+# Sampled, PII-scrubbed capture of request shapes for scripts/replay_traffic.py
+# (see myproject/capture.py). TRAFFIC_CAPTURE_RATE is the fraction recorded.
+MIDDLEWARE.append('myproject.capture.TrafficCaptureMiddleware')
+TRAFFIC_CAPTURE_RATE = float(os.environ.get('TRAFFIC_CAPTURE_RATE', 0))
+TRAFFIC_CAPTURE_PATH = os.environ.get('TRAFFIC_CAPTURE_PATH', str(BASE_DIR / 'logs' / 'traffic.jsonl'))
+
+# Prometheus metrics at /metrics (see myproject/metrics.py). Scrapers send
+# `Authorization: Bearer <token>`; staff can open it too. Without a token the
+# page is only public with DEBUG.
+METRICS_AUTH_TOKEN = os.environ.get('METRICS_AUTH_TOKEN', '')
+
+# WhiteNoise for static file serving (after SecurityMiddleware). The subclass
+# in myproject/middleware.py also runs natively under ASGI.
+MIDDLEWARE.insert(MIDDLEWARE.index('django.middleware.security.SecurityMiddleware') + 1, 'myproject.middleware.WhiteNoiseMiddleware')
+# collectstatic names every static file after its content hash
+# (base.3f2a9c1e0b7d.css) and writes .gz and .br copies next to it (brotli
+# needs whitenoise[brotli]). WhiteNoise serves hashed files with a one-year
+# immutable Cache-Control and picks the encoding the browser accepts. The
+# templates link them with {% static %}, which returns the hashed name; under
+# DEBUG the plain names are used, so runserver needs no collectstatic.
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'whitenoise.storage.CompressedManifestStaticFilesStorage'},
+}
+
+# Smaller pages (see myproject/compression.py). Templates are minified once,
+# when they are compiled: comments removed, whitespace around line breaks
+# collapsed. Text responses are compressed with brotli or gzip; the levels
+# are for on-the-fly compression (scripts/compression_benchmark.py compares
+# them), and views can override them with @compression(...).
+HTML_MINIFY = os.environ.get('HTML_MINIFY', 'True') == 'True'
+# Templates that are not HTML despite their name (prefixes)
+HTML_MINIFY_EXCLUDE = ['registration/password_reset_email.html']
+TEMPLATES[0]['OPTIONS']['loaders'] = [(
+    'myproject.compression.MinifyingLoader' if HTML_MINIFY else 'django.template.loaders.cached.Loader',
+    ['django.template.loaders.filesystem.Loader', 'django.template.loaders.app_directories.Loader'],
+)]
+MIDDLEWARE.insert(MIDDLEWARE.index('myproject.middleware.WhiteNoiseMiddleware') + 1, 'myproject.compression.CompressionMiddleware')
+COMPRESSION_ENABLED = os.environ.get('COMPRESSION_ENABLED', 'True') == 'True'
+COMPRESSION_MIN_BYTES = 512
+COMPRESSION_BROTLI_QUALITY = int(os.environ.get('COMPRESSION_BROTLI_QUALITY', 5))
+COMPRESSION_GZIP_LEVEL = int(os.environ.get('COMPRESSION_GZIP_LEVEL', 6))
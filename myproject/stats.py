@@ -0,0 +1,39 @@
+"""
+Small helpers for summarising latency samples in benchmarks and reports.
+"""
+
+import statistics
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers (0 for an empty list)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[k]
+
+
+def summarize(values):
+    """
+    Summarise a list of samples.
+
+    Returns:
+        dict: count, mean, p50, p95, p99 and max of the samples.
+    """
+    return {
+        'count': len(values),
+        'mean': statistics.mean(values) if values else 0.0,
+        'p50': percentile(values, 50),
+        'p95': percentile(values, 95),
+        'p99': percentile(values, 99),
+        'max': max(values) if values else 0.0,
+    }
+
+
+def format_summary(name, values, scale=1000.0, unit='ms'):
+    """One-line human readable summary, e.g. for command output."""
+    s = summarize(values)
+    return (f"{name:<24} n={s['count']:<6} mean={s['mean'] * scale:9.1f}{unit} "
+            f"p50={s['p50'] * scale:9.1f}{unit} p95={s['p95'] * scale:9.1f}{unit} "
+            f"p99={s['p99'] * scale:9.1f}{unit} max={s['max'] * scale:9.1f}{unit}")
@@ -0,0 +1,27 @@
+"""
+Settings for the test suite: myproject/settings.py with the changes tests
+need. manage.py selects this module for `manage.py test`.
+"""
+
+import os
+
+# The production SQLite configuration (WAL, the query-only 'read' connection
+# and ReadWriteRouter), which settings only enable by default without DEBUG
+os.environ.setdefault('SQLITE_PRODUCTION', 'True')
+
+from .settings import *  # noqa: E402,F401,F403
+
+# Tests don't run collectstatic, so there is no manifest for {% static %} to
+# look hashed names up in
+STORAGES = {
+    **STORAGES,
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+
+# Two empty shard databases (in-memory during tests) for the sharding tests.
+# Sharding stays off: they turn it on with override_settings(POST_SHARDS=...)
+# and the ShardRouter, and the rest of the suite runs unsharded.
+for _alias in ('shard_nairobi', 'shard_coast'):
+    DATABASES[_alias] = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'}
+POST_SHARDS = {}
+DATABASE_ROUTERS = [router for router in DATABASE_ROUTERS if router != 'blog.sharding.ShardRouter']
@@ -0,0 +1,231 @@
+"""
+Upload limits and bounded-memory image ingestion.
+
+Photos come straight from phones: 5-15 MB JPEGs of 12-50 megapixels, which
+take 36-150 MB each once decoded. Every image upload (post photos, avatars)
+goes through three stages so a worker's memory stays bounded per upload:
+
+1. SizeLimitedUploadHandler counts the bytes of each file as the request
+   body streams in and drops the file once it passes UPLOAD_MAX_BYTES,
+   without reading the rest into memory or a temporary file. The view adds
+   the error to the form (UploadLimitsMixin, add_upload_errors).
+
+2. BoundedImageField reads only the image header: unsupported formats and
+   images over UPLOAD_MAX_PIXELS (decompression bombs) are rejected before
+   any pixel is decoded.
+
+3. An image larger than the field's max_size is decoded with JPEG draft
+   mode, straight at the smallest 1/2, 1/4 or 1/8 scale that still covers
+   the target, then resized and re-encoded into a spooled file that the
+   storage copies in chunks. Images already small enough are kept as
+   uploaded (verified, not decoded).
+
+Once stored, each image also gets a placeholder (image_placeholder): a
+16px WebP thumbnail as a data URI (~100 bytes) and its dominant colour.
+Both are saved on the row and inlined in the card markup, so a card shows
+the blurred shape and colour of its photo before the photo itself loads.
+`python manage.py backfill_placeholders` computes them for existing media.
+"""
+
+import base64
+import io
+import os
+import tempfile
+
+from django import forms
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files import File
+from django.core.files.uploadhandler import FileUploadHandler, SkipFile
+from django.template.defaultfilters import filesizeformat
+from PIL import Image, ImageOps
+
+ALLOWED_FORMATS = {'JPEG', 'PNG', 'WEBP', 'GIF'}
+# Keep the output in memory up to this size, then on disk
+SPOOL_BYTES = 1024 * 1024
+EXTENSIONS = {'JPEG': '.jpg', 'PNG': '.png', 'WEBP': '.webp'}
+SAVE_OPTIONS = {
+    'JPEG': {'quality': 85, 'optimize': True, 'progressive': True},
+    'PNG': {'optimize': True},
+    'WEBP': {'quality': 85},
+}
+# Placeholders are scaled up by the browser, which blurs them; larger ones
+# only add bytes to every page that lists the post
+PLACEHOLDER_SIZE = (16, 16)
+PLACEHOLDER_COLORS = 5
+
+
+def max_upload_bytes():
+    return getattr(settings, 'UPLOAD_MAX_BYTES', 10 * 1024 * 1024)
+
+
+def max_upload_pixels():
+    return getattr(settings, 'UPLOAD_MAX_PIXELS', 40_000_000)
+
+
+class SizeLimitedUploadHandler(FileUploadHandler):
+    """
+    First handler in FILE_UPLOAD_HANDLERS: passes chunks on to the memory or
+    temporary-file handler and skips a file once it passes UPLOAD_MAX_BYTES.
+    """
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.received = 0
+        if self.content_length and self.content_length > max_upload_bytes():
+            self.reject()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > max_upload_bytes():
+            self.reject()
+        return raw_data
+
+    def file_complete(self, file_size):
+        return None
+
+    def reject(self):
+        errors = getattr(self.request, 'upload_errors', None)
+        if errors is None:
+            errors = self.request.upload_errors = {}
+        errors[self.field_name] = (
+            f'The file is too large: the limit is {filesizeformat(max_upload_bytes())}.'
+        )
+        # The parser discards what was received and skips the rest of the file
+        raise SkipFile
+
+
+def add_upload_errors(request, *forms_):
+    """Put the files SizeLimitedUploadHandler dropped on the forms that have those fields."""
+    for field, message in getattr(request, 'upload_errors', {}).items():
+        for form in forms_:
+            if field in form.fields:
+                form.add_error(field, message)
+
+
+class UploadLimitsMixin:
+    """FormView mixin: oversized files are form errors instead of silently missing."""
+
+    def get_form(self, form_class=None):
+        form = super().get_form(form_class)
+        if self.request.method == 'POST':
+            add_upload_errors(self.request, form)
+        return form
+
+
+def ingest_image(upload, max_size):
+    """
+    Validate an uploaded image and shrink it to fit ``max_size``.
+
+    Args:
+        upload: UploadedFile
+        max_size: (width, height) box the stored image must fit in
+
+    Returns:
+        File: the upload itself when it already fits, else the resized image
+        in a spooled temporary file
+
+    Raises:
+        ValidationError: too large, unsupported, bomb-sized or unreadable
+    """
+    if upload.size is not None and upload.size > max_upload_bytes():
+        raise ValidationError(
+            f'The file is too large: the limit is {filesizeformat(max_upload_bytes())}.', code='file_too_large'
+        )
+    try:
+        # Lazy: reads the header, decodes nothing yet
+        with Image.open(upload) as image:
+            width, height = image.size
+            image_format = image.format
+            if image_format not in ALLOWED_FORMATS:
+                raise ValidationError('Upload a JPEG, PNG, WebP or GIF image.', code='invalid_image')
+            if width * height > max_upload_pixels():
+                raise ValidationError(
+                    f'The image is too large ({width}x{height} pixels).', code='image_too_large'
+                )
+            if width <= max_size[0] and height <= max_size[1]:
+                image.verify()
+                upload.seek(0)
+                upload.content_type = Image.MIME.get(image_format)
+                return upload
+            resized = _decode_to(image, max_size)
+    except ValidationError:
+        raise
+    except Image.DecompressionBombError as e:
+        # Pillow's own guard, for images far over our limit
+        raise ValidationError('The image is too large.', code='image_too_large') from e
+    except Exception as e:
+        raise ValidationError('Upload a valid image. The file you uploaded was either not an image or a '
+                              'corrupted image.', code='invalid_image') from e
+
+    output = tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES)
+    save_format = image_format if image_format in SAVE_OPTIONS else 'PNG'
+    if save_format == 'JPEG' and resized.mode not in ('RGB', 'L'):
+        resized = resized.convert('RGB')
+    resized.save(output, save_format, **SAVE_OPTIONS[save_format])
+    output.seek(0)
+    stem = os.path.splitext(os.path.basename(upload.name))[0]
+    ingested = File(output, name=f'{stem}{EXTENSIONS[save_format]}')
+    ingested.content_type = Image.MIME.get(save_format)
+    return ingested
+
+
+def _decode_to(image, max_size):
+    """Decode ``image`` at the smallest draft scale covering ``max_size``, then fit it in."""
+    if image.format == 'JPEG':
+        image.draft('RGB' if image.mode not in ('L', 'CMYK') else image.mode, max_size)
+    image.thumbnail(max_size)
+    # Phones store rotation in EXIF; apply it before the tag is lost
+    return ImageOps.exif_transpose(image)
+
+
+class BoundedImageField(forms.ImageField):
+    """ImageField that validates uploads from the header and stores them at most ``max_size``."""
+
+    def __init__(self, *, max_size, **kwargs):
+        self.max_size = max_size
+        super().__init__(**kwargs)
+
+    def to_python(self, data):
+        # FileField.to_python: empty and name checks, no decoding
+        upload = forms.FileField.to_python(self, data)
+        if upload is None:
+            return None
+        return ingest_image(upload, self.max_size)
+
+
+def image_placeholder(file):
+    """
+    Compute the placeholder of a stored image, decoding as little as possible.
+
+    Args:
+        file: Open image file (path or file object)
+
+    Returns:
+        tuple: (LQIP as a ``data:image/webp`` URI, dominant colour as '#rrggbb')
+
+    Raises:
+        OSError: the file is missing or not an image
+    """
+    with Image.open(file) as image:
+        if image.format == 'JPEG':
+            # 1/8 scale decode: a 12 MP photo costs ~190 KB instead of 36 MB
+            image.draft('RGB', (PLACEHOLDER_SIZE[0] * 8, PLACEHOLDER_SIZE[1] * 8))
+        image.thumbnail((PLACEHOLDER_SIZE[0] * 4, PLACEHOLDER_SIZE[1] * 4))
+        return placeholder_from_image(ImageOps.exif_transpose(image))
+
+
+def placeholder_from_image(image):
+    """(LQIP data URI, dominant colour) of an already decoded PIL image."""
+    tiny = image.convert('RGB')
+    tiny.thumbnail(PLACEHOLDER_SIZE)
+    buffer = io.BytesIO()
+    tiny.save(buffer, 'WEBP', quality=40)
+    lqip = 'data:image/webp;base64,' + base64.b64encode(buffer.getvalue()).decode('ascii')
+
+    # The most common colour of a reduced palette, not the mean, which
+    # turns a red phone on a white table pink
+    quantized = tiny.quantize(colors=PLACEHOLDER_COLORS)
+    _, index = max(quantized.getcolors())
+    red, green, blue = quantized.getpalette()[index * 3:index * 3 + 3]
+    return lqip, f'#{red:02x}{green:02x}{blue:02x}'
@@ -21,12 +21,20 @@ import os
 from django.conf import settings
 from django.conf.urls.static import static
 from blog import views as blog_views
+from . import views as project_views
 
 # URL Configuration
 urlpatterns = [
     # Django Admin
     path('admin/', admin.site.urls),
     
+    # Prometheus metrics (aggregated across gunicorn workers)
+    path('metrics', project_views.metrics_view, name='metrics'),
+    
+    # Stored request profiles (staff only, see myproject/profiling.py)
+    path('_profiles/', project_views.profile_list, name='profile-list'),
+    path('_profiles/<str:report_id>/', project_views.profile_detail, name='profile-detail'),
+    
     # Blog app - main content
     path('', blog_views.LandingView.as_view(), name='root-landing'),
     path('blog/', include('blog.urls')),
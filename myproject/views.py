@@ -1,4 +1,65 @@
-from django.http import HttpResponse
+import hmac
+
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import Http404, HttpResponse
+
+from . import metrics, profiling
+
 
 def home(request):
     return HttpResponse("Hello")
+
+
+def metrics_view(request):
+    """
+    Expose Prometheus metrics for all gunicorn workers.
+
+    Scrapers send METRICS_AUTH_TOKEN as a bearer token; staff users can also
+    open the page. Without a token, the metrics are only public with DEBUG.
+    """
+    if not metrics_allowed(request):
+        return HttpResponse('Unauthorized', status=401, content_type='text/plain')
+    if not metrics.enabled():
+        return HttpResponse('prometheus_client is not installed', status=503, content_type='text/plain')
+
+    body, content_type = metrics.render_latest()
+    return HttpResponse(body, content_type=content_type)
+
+
+def metrics_allowed(request):
+    token = getattr(settings, 'METRICS_AUTH_TOKEN', '')
+    if token and hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return True
+    if request.user.is_active and request.user.is_staff:
+        return True
+    return settings.DEBUG and not token
+
+
+@staff_member_required
+def profile_list(request):
+    """List stored request profiles, most recent first."""
+    lines = [f"{'id':<23} {'mode':<8} {'trigger':<7} {'total':>9} {'sql':>14} {'tpl':>9}  route"]
+    for r in profiling.list_reports():
+        lines.append(
+            f"{r['id']:<23} {r['mode']:<8} {r['trigger']:<7} {r['total_ms']:7.1f}ms "
+            f"{r['sql_ms']:7.1f}ms/{r['sql_count']:<3} {r['template_ms']:7.1f}ms  {r['method']} {r['route']}"
+        )
+    return HttpResponse('\n'.join(lines), content_type='text/plain; charset=utf-8')
+
+
+@staff_member_required
+def profile_detail(request, report_id):
+    """Show a stored profile, or compare it with another one via ?against=<id>."""
+    report = profiling.load_report(report_id)
+    if report is None:
+        raise Http404('No such profile')
+    against = request.GET.get('against')
+    if against:
+        baseline = profiling.load_report(against)
+        if baseline is None:
+            raise Http404('No such profile to compare against')
+        body = profiling.compare_reports(baseline, report)
+    else:
+        body = profiling.format_report(report)
+    return HttpResponse(body, content_type='text/plain; charset=utf-8')
@@ -0,0 +1,79 @@
+"""
+Process warm-up for gunicorn.
+
+Called from gunicorn_config.py, in the master before forking when the app is
+preloaded (so every worker inherits the work through copy-on-write), or in
+each worker otherwise. It compiles the project templates, builds the URL
+resolver and checks the database and cache, so the first real request does
+not pay for it. Connections opened here are closed again before returning so
+they are never shared across a fork.
+"""
+
+import logging
+import os
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+from django.template import TemplateDoesNotExist, TemplateSyntaxError
+from django.template.loader import get_template
+from django.urls import get_resolver
+
+from myproject.db_pool import close_pools
+
+logger = logging.getLogger(__name__)
+
+
+def project_templates():
+    """Names of the templates shipped in the project's own apps."""
+    names = []
+    for app_config in apps.get_app_configs():
+        directory = os.path.join(app_config.path, 'templates')
+        if not app_config.path.startswith(str(settings.BASE_DIR)) or not os.path.isdir(directory):
+            continue
+        for root, _, files in os.walk(directory):
+            for filename in files:
+                if filename.endswith(('.html', '.txt')):
+                    names.append(os.path.relpath(os.path.join(root, filename), directory))
+    return sorted(names)
+
+
+def close_connections():
+    """Close database connections and pools, and cache connections (before a fork, or at exit)."""
+    connections.close_all()
+    close_pools()
+    for cache in caches.all(initialized_only=True):
+        cache.close()
+
+
+def warm_up():
+    started = time.perf_counter()
+
+    # Imports every view module and compiles the URL patterns
+    get_resolver().reverse_dict
+
+    # Parsed templates are kept by the cached loader (on when DEBUG is off)
+    compiled = 0
+    for name in project_templates():
+        try:
+            get_template(name)
+            compiled += 1
+        except (TemplateDoesNotExist, TemplateSyntaxError) as e:
+            logger.warning(f"⚠️ Could not compile template {name}: {e}")
+
+    # Fail at boot, not on the first request, if the database or cache is unreachable
+    for alias in connections:
+        try:
+            connections[alias].ensure_connection()
+        except Exception as e:
+            logger.error(f"❌ Database '{alias}' is not reachable during warm-up: {e}")
+    try:
+        caches['default'].get('warmup:ping')
+    except Exception as e:
+        logger.error(f"❌ Cache is not reachable during warm-up: {e}")
+
+    close_connections()
+    logger.info(f"🔥 Warmed up {compiled} templates and the URL resolver in "
+                f"{(time.perf_counter() - started) * 1000:.0f} ms")
@@ -0,0 +1,283 @@
+#!/usr/bin/env python
+"""
+Compare the sync and ASGI deployments at a fixed memory budget.
+
+Starts gunicorn once per profile (gunicorn_config.py: sync, gthread and
+asyncio, the last serving myproject/asgi.py with the async views) with the
+same number of worker processes, drives each with increasing numbers of
+concurrent clients, and reports throughput, latency and the total resident
+memory of the server (master + workers) at each level.
+
+The request mix is the hot path: the home page, post detail pages and the
+payment status endpoint. Status polls hit the local Daraja simulator on
+every request (STK Query, with --daraja-latency), which is the case where a
+sync worker is held doing nothing but waiting.
+
+Needs a seeded database that the servers and this script share, e.g.:
+
+    DATABASE_URL=sqlite:////tmp/seed.db python manage.py migrate
+    DATABASE_URL=sqlite:////tmp/seed.db python manage.py seed_data --posts 2000
+    DATABASE_URL=sqlite:////tmp/seed.db python scripts/asgi_benchmark.py \\
+        --workers 2 --concurrency 8,32,128 --duration 10 --json logs/asgi_benchmark.json
+"""
+
+import argparse
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+# Same cache for this script and every worker (checkout entries, tokens)
+os.environ['CACHE_BACKEND'] = 'db'
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'myproject.settings')
+
+import django
+
+django.setup()
+
+import requests
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+
+from blog.management.commands.seed_data import SEED_PASSWORD, SEED_PREFIX
+from blog.models import Post
+from myproject.stats import summarize
+from users.views import CHECKOUT_CACHE_KEY
+from replay_traffic import login
+
+PROFILES = ('sync', 'gthread', 'asyncio')
+SCENARIOS = ('home', 'detail', 'status')
+
+
+def process_tree_rss_mb(pid):
+    """Resident memory of a process and all of its descendants, in MB (Linux /proc)."""
+    total = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f'/proc/{current}/statm') as f:
+                total += int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+            for task in os.listdir(f'/proc/{current}/task'):
+                with open(f'/proc/{current}/task/{task}/children') as f:
+                    pending.extend(int(child) for child in f.read().split())
+        except (OSError, ValueError):
+            continue
+    return total / (1024 * 1024)
+
+
+def wait_for(url, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            requests.get(url, timeout=2)
+            return
+        except requests.RequestException:
+            time.sleep(0.2)
+    raise SystemExit(f'{url} did not come up within {timeout}s')
+
+
+def start_simulator(port, latency):
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'users.daraja_simulator', '--port', str(port),
+         '--oauth-latency', 'fixed:20', '--query-latency', latency],
+        cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    wait_for(f'http://127.0.0.1:{port}/simulator/stats')
+    return process
+
+
+def start_server(profile, port, workers, simulator_port):
+    env = dict(
+        os.environ,
+        GUNICORN_PROFILE=profile,
+        WEB_CONCURRENCY=str(workers),
+        PORT=str(port),
+        MPESA_BACKEND='simulator',
+        MPESA_BASE_URL=f'http://127.0.0.1:{simulator_port}',
+        # Ask Daraja on every status poll
+        MPESA_STATUS_QUERY_AFTER='0',
+        MPESA_STATUS_QUERY_INTERVAL='0',
+        RATELIMIT_ENABLE='False',
+        PERF_SLOW_REQUEST_MS='100000',
+        GUNICORN_MAX_REQUESTS='0',
+    )
+    env.pop('ASYNC_VIEWS', None)
+    process = subprocess.Popen(
+        ['gunicorn', '-c', 'gunicorn_config.py', '--access-logfile', '/dev/null'],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    wait_for(f'http://127.0.0.1:{port}/blog/?q=warmup')
+    return process
+
+
+def stop(process):
+    process.send_signal(signal.SIGTERM)
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def prepare(username, post_count):
+    """Return the benchmark user and post ids, with a pending STK push cached for each post."""
+    call_command('createcachetable', verbosity=0)
+    user = User.objects.filter(username=username).first()
+    if user is None:
+        raise SystemExit(f'User {username} not found: run `python manage.py seed_data` on this database first')
+    post_ids = list(Post.objects.order_by('-date_posted').values_list('pk', flat=True)[:post_count])
+    for post_id in post_ids:
+        # Unknown to the simulator, so every query answers "still processing"
+        cache.set(CHECKOUT_CACHE_KEY.format(user_id=user.pk, post_id=post_id),
+                  {'id': f'ws_CO_BENCH_{post_id}', 'sent': 0}, 60 * 60)
+    return user, post_ids
+
+
+class LoadRun:
+    """Closed-loop load: each client thread sends its next request as soon as the last one returns."""
+
+    def __init__(self, target, cookies, post_ids, mix, timeout):
+        self.target = target
+        self.cookies = cookies
+        self.post_ids = post_ids
+        self.mix = mix
+        self.timeout = timeout
+        self.results = []
+        self.lock = threading.Lock()
+
+    def url(self, rng):
+        scenario = rng.choice(self.mix)
+        if scenario == 'home':
+            # A filtered listing keeps the page a realistic size on large seeds
+            return scenario, f'{self.target}/blog/?q={rng.choice(["phone", "wallet", "id", "keys"])}'
+        post_id = rng.choice(self.post_ids)
+        if scenario == 'detail':
+            return scenario, f'{self.target}/blog/post/{post_id}/'
+        return scenario, f'{self.target}/post/{post_id}/payment-status/'
+
+    def client(self, seed, deadline):
+        rng = random.Random(seed)
+        session = requests.Session()
+        session.cookies.update(self.cookies)
+        while time.perf_counter() < deadline:
+            scenario, url = self.url(rng)
+            started = time.perf_counter()
+            try:
+                status = session.get(url, timeout=self.timeout, allow_redirects=False).status_code
+            except requests.RequestException:
+                status = None
+            elapsed = time.perf_counter() - started
+            with self.lock:
+                self.results.append((scenario, status, elapsed))
+
+    def run(self, concurrency, duration, on_tick):
+        deadline = time.perf_counter() + duration
+        threads = [threading.Thread(target=self.client, args=(i, deadline), daemon=True) for i in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        while any(thread.is_alive() for thread in threads):
+            on_tick()
+            time.sleep(0.25)
+        return self.results
+
+
+def measure(profile, args, post_ids, simulator_port):
+    server = start_server(profile, args.port, args.workers, simulator_port)
+    target = f'http://127.0.0.1:{args.port}'
+    rows = []
+    try:
+        # Log in once (password hashing is deliberately slow) and share the session
+        session = requests.Session()
+        login(session, target, args.login)
+        for concurrency in args.concurrency:
+            peak_rss = [process_tree_rss_mb(server.pid)]
+            load = LoadRun(target, session.cookies.get_dict(), post_ids, args.mix, args.timeout)
+            results = load.run(concurrency, args.duration,
+                               lambda: peak_rss.append(process_tree_rss_mb(server.pid)))
+            latencies = [r[2] for r in results]
+            errors = sum(1 for r in results if r[1] is None or r[1] >= 400)
+            s = summarize(latencies)
+            row = {
+                'profile': profile,
+                'concurrency': concurrency,
+                'requests': len(results),
+                'rps': len(results) / args.duration,
+                'p50_ms': s['p50'] * 1000,
+                'p95_ms': s['p95'] * 1000,
+                'p99_ms': s['p99'] * 1000,
+                'errors': errors,
+                'peak_rss_mb': max(peak_rss),
+                'scenarios': {
+                    name: {
+                        'requests': len([r for r in results if r[0] == name]),
+                        'p95_ms': summarize([r[2] for r in results if r[0] == name])['p95'] * 1000,
+                    }
+                    for name in args.mix
+                },
+            }
+            row['rps_per_100mb'] = row['rps'] / row['peak_rss_mb'] * 100 if row['peak_rss_mb'] else 0.0
+            rows.append(row)
+            print(f"{profile:<8} {concurrency:>6} {row['rps']:>8.1f} {row['p50_ms']:>8.1f} {row['p95_ms']:>8.1f} "
+                  f"{row['p99_ms']:>8.1f} {errors:>7} {row['peak_rss_mb']:>8.0f} {row['rps_per_100mb']:>10.1f}",
+                  flush=True)
+    finally:
+        stop(server)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--profiles', default=','.join(PROFILES), help='gunicorn profiles to compare')
+    parser.add_argument('--workers', type=int, default=2, help='Worker processes for every profile')
+    parser.add_argument('--concurrency', default='8,32,128', help='Concurrent clients, comma-separated levels')
+    parser.add_argument('--duration', type=float, default=10.0, help='Seconds per concurrency level')
+    parser.add_argument('--mix', default=','.join(SCENARIOS), help=f'Scenarios to mix ({", ".join(SCENARIOS)})')
+    parser.add_argument('--daraja-latency', default='lognormal:300:0.3',
+                        help='STK Query latency spec for the simulator, in ms')
+    parser.add_argument('--login', default=f'{SEED_PREFIX}0000001:{SEED_PASSWORD}', help='username:password')
+    parser.add_argument('--posts', type=int, default=200, help='Distinct posts requested')
+    parser.add_argument('--port', type=int, default=8040)
+    parser.add_argument('--simulator-port', type=int, default=8041)
+    parser.add_argument('--timeout', type=float, default=30.0)
+    parser.add_argument('--json', help='Also write the results to this file')
+    args = parser.parse_args()
+    args.concurrency = [int(c) for c in args.concurrency.split(',')]
+    args.mix = [m for m in args.mix.split(',') if m]
+    profiles = [p for p in args.profiles.split(',') if p]
+    unknown = set(profiles) - set(PROFILES) | set(args.mix) - set(SCENARIOS)
+    if unknown:
+        raise SystemExit(f'Unknown profile or scenario: {", ".join(sorted(unknown))}')
+
+    _, post_ids = prepare(args.login.split(':', 1)[0], args.posts)
+    print(f'{args.workers} workers per profile, mix {"/".join(args.mix)}, Daraja STK Query {args.daraja_latency} ms, '
+          f'{args.duration:g}s per level\n')
+    print(f"{'profile':<8} {'conc':>6} {'req/s':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'errors':>7} "
+          f"{'RSS MB':>8} {'rps/100MB':>10}")
+
+    simulator = start_simulator(args.simulator_port, args.daraja_latency)
+    rows = []
+    try:
+        for profile in profiles:
+            rows.extend(measure(profile, args, post_ids, args.simulator_port))
+    finally:
+        stop(simulator)
+
+    if args.json:
+        os.makedirs(os.path.dirname(os.path.abspath(args.json)), exist_ok=True)
+        with open(args.json, 'w') as f:
+            json.dump({'workers': args.workers, 'mix': args.mix, 'daraja_latency': args.daraja_latency,
+                       'duration_s': args.duration, 'results': rows}, f, indent=2)
+        print(f'\nResults written to {args.json}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+"""
+Benchmark the main pages at several dataset sizes.
+
+For each scale the database is seeded with `manage.py seed_data` (same seed,
+so runs are comparable) and every scenario is requested in-process through
+Django's test client:
+
+    landing            /
+    home[...]          /blog/ with every combination of the five filters
+    post-detail        /blog/post/<pk>/
+    user-posts         /blog/user/<username>/ (a heavy and a light poster)
+    payment:*          locked detail -> pay form -> STK push (mock backend)
+                       -> M-PESA callback -> unlocked detail
+
+Each scenario reports p50/p95/p99 latency, SQL queries per request (from
+PerformanceMiddleware) and the peak Python allocation per request (measured
+in a separate tracemalloc pass so it does not skew the timings). Results are
+written as JSON; pass --compare to diff against an earlier run.
+
+Seeding deletes and recreates the seed_* users, so use a scratch database:
+    cp db.sqlite3 /tmp/bench.db
+    DATABASE_URL=sqlite:////tmp/bench.db python manage.py migrate
+    DATABASE_URL=sqlite:////tmp/bench.db python scripts/benchmark.py --scales 1000,100000,1000000
+    DATABASE_URL=sqlite:////tmp/bench.db python scripts/benchmark.py --scales 1000 --compare logs/benchmarks/<old>.json
+"""
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BASE_DIR))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'myproject.settings')
+# STK pushes must not leave the machine
+os.environ.setdefault('MPESA_BACKEND', 'mock')
+import django
+django.setup()
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client
+from blog.management.commands.seed_data import SEED_PREFIX
+from blog.models import Post
+from myproject.stats import percentile, summarize
+from users.models import PaymentAccess
+
+HOME_FILTERS = {
+    'q': 'samsung',
+    'item_type': 'lost',
+    'category': 'phone',
+    'location': 'Nairobi CBD',
+    'status': 'active',
+}
+
+
+class Scenario:
+    """A named sequence of requests; ``make_request(i)`` returns the i-th one."""
+
+    def __init__(self, name, make_request, user=None):
+        self.name = name
+        self.make_request = make_request
+        self.user = user
+
+
+def build_scenarios(rng, iterations, home_combinations):
+    post_ids = list(Post.objects.filter(author__username__startswith=SEED_PREFIX).values_list('id', flat=True))
+    seeded_users = User.objects.filter(username__startswith=SEED_PREFIX)
+    # seed_data gives the lowest-numbered users the most posts
+    authors = [
+        seeded_users.order_by('username').values_list('username', flat=True)[0],
+        seeded_users.order_by('-username').values_list('username', flat=True)[0],
+    ]
+    scenarios = [Scenario('landing', lambda i: ('get', '/', None))]
+
+    keys = list(HOME_FILTERS)
+    combos = [()]
+    if home_combinations:
+        combos = [c for n in range(len(keys) + 1) for c in itertools.combinations(keys, n)]
+    for combo in combos:
+        params = {key: HOME_FILTERS[key] for key in combo}
+        query = '&'.join(f'{k}={v.replace(" ", "+")}' for k, v in params.items())
+        name = 'home[' + ','.join(combo) + ']'
+        path = f'/blog/?{query}' if query else '/blog/'
+        scenarios.append(Scenario(name, lambda i, path=path: ('get', path, None)))
+
+    sample = [rng.choice(post_ids) for _ in range(iterations)]
+    scenarios.append(Scenario('post-detail', lambda i: ('get', f'/blog/post/{sample[i]}/', None)))
+    scenarios.append(Scenario('user-posts:heavy', lambda i: ('get', f'/blog/user/{authors[0]}/', None)))
+    scenarios.append(Scenario('user-posts:light', lambda i: ('get', f'/blog/user/{authors[-1]}/', None)))
+
+    # The payer pays for a different post on every iteration
+    payer = seeded_users.order_by('username')[1]
+    PaymentAccess.objects.filter(user=payer).delete()
+    paid = [rng.choice(post_ids) for _ in range(iterations)]
+    callback_paid = [rng.choice(post_ids) for _ in range(iterations)]
+
+    def callback(i):
+        body = {'Body': {'stkCallback': {
+            'MerchantRequestID': f'bench-{i}', 'CheckoutRequestID': f'ws_CO_bench_{i}',
+            'ResultCode': 0, 'ResultDesc': 'The service request has been processed successfully.',
+            'CallbackMetadata': {'Item': [
+                {'Name': 'Amount', 'Value': 100.0},
+                {'Name': 'MpesaReceiptNumber', 'Value': f'BENCH{i:06d}'},
+                {'Name': 'PhoneNumber', 'Value': 254700000000},
+                {'Name': 'AccountReference', 'Value': f'POST_{callback_paid[i]}_{payer.pk}'},
+            ]},
+        }}}
+        return 'post', '/mpesa/callback/', json.dumps(body)
+
+    scenarios += [
+        Scenario('payment:locked-detail', lambda i: ('get', f'/post/{paid[i]}/', None), payer),
+        Scenario('payment:pay-form', lambda i: ('get', f'/post/{paid[i]}/pay/', None), payer),
+        Scenario('payment:stk-push', lambda i: ('post', f'/post/{paid[i]}/pay/', {}), payer),
+        Scenario('payment:callback', callback),
+        Scenario('payment:unlocked-detail', lambda i: ('get', f'/post/{paid[i]}/', None), payer),
+    ]
+    return scenarios
+
+
+def send(client, request):
+    method, path, data = request
+    if method == 'get':
+        return client.get(path, secure=True)
+    if isinstance(data, str):
+        return client.post(path, data, content_type='application/json', secure=True)
+    return client.post(path, data or {}, secure=True)
+
+
+def run_scenario(scenario, iterations, memory_iterations):
+    client = Client()
+    if scenario.user is not None:
+        client.force_login(scenario.user)
+
+    # Warm up caches and connections before measuring
+    send(client, scenario.make_request(0))
+
+    latencies, queries, errors = [], [], 0
+    for i in range(iterations):
+        request = scenario.make_request(i)
+        started = time.perf_counter()
+        response = send(client, request)
+        latencies.append(time.perf_counter() - started)
+        stats = getattr(response.wsgi_request, 'perf_stats', None)
+        if stats is not None:
+            queries.append(stats.sql_count)
+        if response.status_code >= 400:
+            errors += 1
+
+    peaks = []
+    if memory_iterations:
+        tracemalloc.start()
+        for i in range(min(memory_iterations, iterations)):
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+            send(client, scenario.make_request(i))
+            peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+        tracemalloc.stop()
+
+    summary = summarize(latencies)
+    return {
+        'requests': iterations,
+        'errors': errors,
+        'status': response.status_code,
+        'mean_ms': summary['mean'] * 1000,
+        'p50_ms': summary['p50'] * 1000,
+        'p95_ms': summary['p95'] * 1000,
+        'p99_ms': summary['p99'] * 1000,
+        'max_ms': summary['max'] * 1000,
+        'queries_p50': percentile(queries, 50) if queries else None,
+        'queries_max': max(queries) if queries else None,
+        'peak_alloc_kb': max(peaks) / 1024 if peaks else None,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=BASE_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old, new):
+    """Print p50/p95/query changes for every (scale, scenario) present in both runs."""
+    old_runs = {run['posts']: run['scenarios'] for run in old['runs']}
+    for run in new['runs']:
+        before = old_runs.get(run['posts'])
+        if before is None:
+            continue
+        print(f"\n{run['posts']} posts: {old['meta'].get('git')} -> {new['meta'].get('git')}")
+        for name, after in run['scenarios'].items():
+            if name not in before:
+                continue
+            b = before[name]
+            change = (after['p50_ms'] - b['p50_ms']) / b['p50_ms'] * 100 if b['p50_ms'] else 0.0
+            print(f"  {name:<44} p50 {b['p50_ms']:8.1f} -> {after['p50_ms']:8.1f}ms ({change:+6.1f}%)  "
+                  f"p95 {b['p95_ms']:8.1f} -> {after['p95_ms']:8.1f}ms  "
+                  f"queries {b['queries_max']} -> {after['queries_max']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scales', default='1000',
+                        help='Comma separated post counts to seed and measure, e.g. 1000,100000,1000000')
+    parser.add_argument('--no-seed', action='store_true', help='Measure the database as it is (one scale)')
+    parser.add_argument('--iterations', type=int, default=30, help='Requests per scenario')
+    parser.add_argument('--memory-iterations', type=int, default=3,
+                        help='Extra requests per scenario under tracemalloc (0 to skip)')
+    parser.add_argument('--home-combinations', action=argparse.BooleanOptionalAction, default=True,
+                        help='Measure every combination of the home page filters')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='Result file (default: logs/benchmarks/<timestamp>.json)')
+    parser.add_argument('--compare', help='Earlier result file to compare against')
+    args = parser.parse_args()
+
+    # Measure the application, not the rate limiter or the outbox
+    settings.RATELIMIT_ENABLE = False
+    settings.EMAIL_BACKEND = 'django.core.mail.backends.locmem.EmailBackend'
+    settings.ALLOWED_HOSTS = list(settings.ALLOWED_HOSTS) + ['testserver']
+
+    result = {
+        'meta': {
+            'started': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'git': git_revision(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'iterations': args.iterations,
+            'seed': args.seed,
+        },
+        'runs': [],
+    }
+
+    scales = [int(s) for s in args.scales.split(',')]
+    for posts in scales[:1] if args.no_seed else scales:
+        run = {'posts': posts}
+        if not args.no_seed:
+            started = time.perf_counter()
+            call_command('seed_data', posts=posts, seed=args.seed, clear=True)
+            run['seed_seconds'] = time.perf_counter() - started
+        run['posts'] = Post.objects.count()
+        run['users'] = User.objects.count()
+        print(f"\n=== {run['posts']} posts, {run['users']} users ===")
+
+        rng = random.Random(args.seed)
+        run['scenarios'] = {}
+        for scenario in build_scenarios(rng, args.iterations, args.home_combinations):
+            stats = run_scenario(scenario, args.iterations, args.memory_iterations)
+            run['scenarios'][scenario.name] = stats
+            peak = f"{stats['peak_alloc_kb']:8.0f}KB" if stats['peak_alloc_kb'] is not None else '     n/a'
+            print(f"  {scenario.name:<44} p50={stats['p50_ms']:8.1f}ms p95={stats['p95_ms']:8.1f}ms "
+                  f"p99={stats['p99_ms']:8.1f}ms queries={stats['queries_max']} peak={peak} "
+                  f"errors={stats['errors']}")
+        # ru_maxrss is in KB on Linux
+        run['max_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        result['runs'].append(run)
+
+    output = args.output or str(BASE_DIR / 'logs' / 'benchmarks' / f"{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(result, f, indent=2)
+    print(f'\nResults written to {output}')
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), result)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+"""
+Measure what HTML minification and response compression cost and save.
+
+Every page of scripts/page_weight.py is rendered in-process through the
+test client, once with the plain cached template loader and once with the
+minifying one (myproject/compression.py), and reported as:
+
+    render      median time to render the page (ms), plain / minified.
+                Minifying happens when a template is compiled, so it should
+                cost nothing here; the one-off compile cost is printed
+                separately for all templates
+    html        raw bytes, plain / minified
+    codecs      for each brotli quality and gzip level: median CPU time to
+                compress the minified page, the bytes sent and the share
+                saved against the plain page. "stream" rows compress in
+                8 KB chunks, flushed after each one as CompressionMiddleware
+                does for streaming responses
+
+The summary adds the pages up per codec: the levels in settings
+(COMPRESSION_BROTLI_QUALITY, COMPRESSION_GZIP_LEVEL) should sit where
+extra CPU time stops buying many bytes.
+
+    DATABASE_URL=sqlite:////tmp/bench.db python manage.py seed_data --posts 1000
+    DATABASE_URL=sqlite:////tmp/bench.db python scripts/compression_benchmark.py
+    DATABASE_URL=sqlite:////tmp/bench.db python scripts/compression_benchmark.py --compare logs/compression/<old>.json
+"""
+
+import argparse
+import copy
+import json
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BASE_DIR))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'myproject.settings')
+import django
+django.setup()
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.test import Client, override_settings
+
+from blog.management.commands.seed_data import SEED_PASSWORD, SEED_PREFIX
+from myproject.compression import StreamCompressor, brotli, compress, minify_html
+from page_weight import git_revision, pages
+
+CODECS = [('gzip', 1), ('gzip', 6), ('gzip', 9), ('br', 1), ('br', 4), ('br', 5), ('br', 6), ('br', 11)]
+STREAM_CHUNK = 8 * 1024
+
+
+def median_ms(func, repeat):
+    """Median wall time of ``func()`` over ``repeat`` runs, in milliseconds."""
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - started)
+    return statistics.median(times) * 1000
+
+
+def compress_stream(data, encoding, level):
+    compressor = StreamCompressor(encoding, level)
+    chunks = [compressor.compress(data[i:i + STREAM_CHUNK]) for i in range(0, len(data), STREAM_CHUNK)]
+    return b''.join(chunks) + compressor.finish()
+
+
+def template_loaders(minify):
+    """TEMPLATES with the minifying or the plain cached loader."""
+    templates = copy.deepcopy(settings.TEMPLATES)
+    templates[0]['OPTIONS']['loaders'] = [(
+        'myproject.compression.MinifyingLoader' if minify else 'django.template.loaders.cached.Loader',
+        ['django.template.loaders.filesystem.Loader', 'django.template.loaders.app_directories.Loader'],
+    )]
+    return templates
+
+
+def compile_cost():
+    """(templates, bytes, ms) of minifying every .html template of the project's apps once."""
+    sources = []
+    for app in ('blog', 'users'):
+        for path in (BASE_DIR / app / 'templates').rglob('*.html'):
+            sources.append(path.read_text(encoding='utf-8'))
+    started = time.perf_counter()
+    for source in sources:
+        minify_html(source)
+    return len(sources), sum(len(s.encode()) for s in sources), (time.perf_counter() - started) * 1000
+
+
+def render(path, login, user, minify, repeat):
+    """(HTML bytes, median render ms) of a page with or without minified templates."""
+    with override_settings(TEMPLATES=template_loaders(minify)):
+        client = Client()
+        if login:
+            client.login(username=user.username, password=SEED_PASSWORD)
+        response = client.get(path)
+        if response.status_code != 200:
+            return None, None
+        return response.content, median_ms(lambda: client.get(path), repeat)
+
+
+def codecs(html, repeat):
+    results = {}
+    for encoding, level in CODECS:
+        if encoding == 'br' and brotli is None:
+            continue
+        for mode, func in (('', compress), ('stream', compress_stream)):
+            # The stream rows only for the levels in settings
+            if mode and level != (settings.COMPRESSION_BROTLI_QUALITY if encoding == 'br'
+                                  else settings.COMPRESSION_GZIP_LEVEL):
+                continue
+            name = f'{encoding} {level}' + (f' {mode}' if mode else '')
+            results[name] = {
+                'bytes': len(func(html, encoding, level)),
+                'ms': median_ms(lambda: func(html, encoding, level), repeat),
+            }
+    return results
+
+
+def fmt(value):
+    return f'{value / 1024:7.1f}K'
+
+
+def compare(old, new):
+    """Print the change in total bytes sent and CPU time per codec."""
+    print(f"\n{old['meta'].get('git')} -> {new['meta'].get('git')}")
+    for name, after in new['summary'].items():
+        before = old['summary'].get(name)
+        if before is None:
+            continue
+        print(f"  {name:<16} {fmt(before['bytes'])} -> {fmt(after['bytes'])} "
+              f"({after['bytes'] - before['bytes']:+d} B)  {before['ms']:6.2f} -> {after['ms']:6.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=20, help='Runs per measurement (the median is kept)')
+    parser.add_argument('--output', help='Result file (default: logs/compression/<timestamp>.json)')
+    parser.add_argument('--compare', help='Earlier result file to compare against')
+    args = parser.parse_args()
+
+    settings.RATELIMIT_ENABLE = False
+    settings.ALLOWED_HOSTS = list(settings.ALLOWED_HOSTS) + ['testserver']
+
+    user = User.objects.filter(username__startswith=SEED_PREFIX).order_by('username').first()
+    result = {'meta': {'started': time.strftime('%Y-%m-%dT%H:%M:%S'), 'git': git_revision(),
+                       'brotli_quality': settings.COMPRESSION_BROTLI_QUALITY,
+                       'gzip_level': settings.COMPRESSION_GZIP_LEVEL}, 'pages': {}, 'summary': {}}
+    count, size, ms = compile_cost()
+    result['meta']['minify_compile'] = {'templates': count, 'bytes': size, 'ms': ms}
+    print(f'🗜️ Minifying {count} templates ({size / 1024:.1f} KB) once at compile time: {ms:.1f} ms\n')
+
+    storages = {**settings.STORAGES, 'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    }}
+    # No Accept-Encoding: the pages come back uncompressed, compression is timed here
+    with override_settings(STORAGES=storages, SECURE_SSL_REDIRECT=False):
+        for name, path, login in pages():
+            plain, plain_ms = render(path, login, user, False, args.repeat)
+            html, html_ms = render(path, login, user, True, args.repeat)
+            if html is None:
+                print(f'  {name}: not HTTP 200, skipped')
+                continue
+            page = {
+                'render_ms': {'plain': plain_ms, 'minified': html_ms},
+                'html': {'plain': len(plain), 'minified': len(html)},
+                'codecs': codecs(html, args.repeat),
+            }
+            result['pages'][name] = page
+            print(f"{name:<12} render {plain_ms:6.1f} / {html_ms:6.1f} ms   html {fmt(len(plain))} / {fmt(len(html))}")
+            for codec, stats in page['codecs'].items():
+                print(f"    {codec:<16} {fmt(stats['bytes'])}  saves {1 - stats['bytes'] / len(plain):6.1%}  "
+                      f"{stats['ms']:6.2f} ms")
+                total = result['summary'].setdefault(codec, {'bytes': 0, 'ms': 0.0})
+                total['bytes'] += stats['bytes']
+                total['ms'] += stats['ms']
+
+    plain_total = sum(page['html']['plain'] for page in result['pages'].values())
+    minified_total = sum(page['html']['minified'] for page in result['pages'].values())
+    print(f"\nAll pages: html {fmt(plain_total)} plain, {fmt(minified_total)} minified")
+    for codec, total in result['summary'].items():
+        saved = plain_total - total['bytes']
+        print(f"  {codec:<16} {fmt(total['bytes'])}  saves {saved / plain_total:6.1%}  {total['ms']:7.2f} ms  "
+              f"{saved / 1024 / total['ms']:7.1f} KB saved per CPU ms")
+
+    output = args.output or str(BASE_DIR / 'logs' / 'compression' / f"{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(result, f, indent=2)
+    print(f'\nResults written to {output}')
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), result)
+
+
+if __name__ == '__main__':
+    main()
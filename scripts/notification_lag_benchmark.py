@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+"""
+Measure end-to-end notification lag under load.
+
+Seeds users with lost posts and saved searches, then creates found posts at a
+fixed rate while a background thread runs the digest sender the way
+`manage.py send_notifications --loop` does. Reports how long post creation
+spent collecting notifications (the cost on the author's request) and the
+lag from post creation to the digest being sent.
+
+Run it against a scratch database, e.g.:
+    cp db.sqlite3 /tmp/bench.db
+    DATABASE_URL=sqlite:////tmp/bench.db python manage.py migrate
+    DATABASE_URL=sqlite:////tmp/bench.db python scripts/notification_lag_benchmark.py --users 2000 --posts 200
+
+Seeded rows are deleted afterwards unless --keep is given.
+"""
+
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'myproject.settings')
+import django
+django.setup()
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import close_old_connections
+from blog.models import MatchNotification, Post, SavedSearch
+from blog.services import NotificationService, SavedSearchService
+from myproject.stats import format_summary
+
+PREFIX = 'bench_notify_'
+LOCATIONS = ['Nairobi CBD', 'Westlands', 'Mombasa', 'Kisumu', 'Nakuru', 'Eldoret', 'Thika', 'Kasarani']
+WORDS = ['black', 'samsung', 'wallet', 'keys', 'passport', 'laptop', 'bag', 'iphone', 'watch', 'ring', 'dog', 'id']
+
+
+def seed(users, searches_per_user):
+    categories = [c for c, _ in Post.CATEGORY_CHOICES]
+    User.objects.bulk_create(
+        [User(username=f'{PREFIX}{i}', email=f'{PREFIX}{i}@example.com') for i in range(users)],
+        batch_size=1000, ignore_conflicts=True,
+    )
+    seeded = list(User.objects.filter(username__startswith=PREFIX))
+    Post.objects.bulk_create([
+        Post(title=f'Lost {random.choice(WORDS)}', content=' '.join(random.sample(WORDS, 4)),
+             item_type=Post.LOST, category=random.choice(categories),
+             location=random.choice(LOCATIONS), author=user)
+        for user in seeded
+    ], batch_size=1000)
+    searches = []
+    for user in seeded:
+        for _ in range(searches_per_user):
+            search = SavedSearch(user=user, q=random.choice(WORDS),
+                                 category=random.choice(categories + [''] * 5),
+                                 location=random.choice(LOCATIONS + [''] * 4))
+            search.anchor = SavedSearchService.anchor_key(search.params)
+            searches.append(search)
+    SavedSearch.objects.bulk_create(searches, batch_size=2000)
+    return seeded
+
+
+def sender_loop(stop_event, interval, results):
+    while not stop_event.is_set():
+        try:
+            result = NotificationService.send_all_due()
+            results['lags'].extend(result['lags'])
+            results['digests'] += result['digests']
+        finally:
+            close_old_connections()
+        stop_event.wait(interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--searches-per-user', type=int, default=3)
+    parser.add_argument('--posts', type=int, default=100, help='Found posts to create')
+    parser.add_argument('--rate', type=float, default=20.0, help='Posts created per second')
+    parser.add_argument('--window', type=int, default=0, help='NOTIFICATION_DIGEST_WINDOW override (seconds)')
+    parser.add_argument('--interval', type=float, default=1.0, help='Sender poll interval (seconds)')
+    parser.add_argument('--sync-collect', action='store_true',
+                        help='Collect inline in the request instead of on the background thread')
+    parser.add_argument('--keep', action='store_true', help='Keep the seeded rows')
+    args = parser.parse_args()
+
+    # Measure the pipeline, not SMTP
+    settings.EMAIL_BACKEND = 'django.core.mail.backends.locmem.EmailBackend'
+    settings.NOTIFICATION_DIGEST_WINDOW = args.window
+    settings.NOTIFICATION_COLLECT_ASYNC = not args.sync_collect
+
+    random.seed(42)
+    started = time.perf_counter()
+    seeded = seed(args.users, args.searches_per_user)
+    print(f'Seeded {len(seeded)} users in {time.perf_counter() - started:.1f}s')
+
+    results = {'lags': [], 'digests': 0}
+    stop_event = threading.Event()
+    sender = threading.Thread(target=sender_loop, args=(stop_event, args.interval, results), daemon=True)
+    sender.start()
+
+    categories = [c for c, _ in Post.CATEGORY_CHOICES]
+    author = seeded[0]
+    collect_times = []
+    try:
+        for i in range(args.posts):
+            tick = time.perf_counter()
+            # post_save -> on_commit -> NotificationService.collect (inline, or
+            # handed to the background collector with NOTIFICATION_COLLECT_ASYNC)
+            Post.objects.create(
+                title=f'Found {random.choice(WORDS)} {random.choice(WORDS)}',
+                content=' '.join(random.sample(WORDS, 5)),
+                item_type=Post.FOUND, category=random.choice(categories),
+                location=random.choice(LOCATIONS), author=author,
+            )
+            collect_times.append(time.perf_counter() - tick)
+            time.sleep(max(0.0, 1.0 / args.rate - (time.perf_counter() - tick)))
+
+        # Wait for the sender to drain everything
+        deadline = time.time() + args.window + 60
+        while time.time() < deadline and MatchNotification.objects.filter(
+                post__author=author, sent_at__isnull=True).exists():
+            time.sleep(0.5)
+    finally:
+        stop_event.set()
+        sender.join()
+
+    created = MatchNotification.objects.filter(post__author=author).count()
+    print(f'Created {args.posts} posts -> {created} notifications, {results["digests"]} digests')
+    print(format_summary('post create (request)', collect_times))
+    print(format_summary('creation -> sent lag', results['lags'], scale=1.0, unit='s'))
+
+    if not args.keep:
+        User.objects.filter(username__startswith=PREFIX).delete()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+"""
+Measure the bytes each main page costs: its HTML and the assets it loads.
+
+Every page is rendered in-process through Django's test client (as a
+seeded user where it needs a login) and reported as:
+
+    html        the HTML document, raw / gzip / brotli. Sent on every view,
+                so inline <style> and <script> are paid again each time
+    inline      the part of the HTML that is inline CSS and JS
+    static      stylesheets, scripts and the fonts they reference from
+                /static/, gzip / brotli. With hashed names and immutable
+                caching these are downloaded once
+    third-party origins the page loads from (CDNs, Google Fonts): each is
+                a DNS lookup, TLS handshake and render-blocking request
+                that can't be measured offline
+
+Compression uses the levels WhiteNoise precompresses with (gzip 9, brotli
+11); brotli columns show n/a when the brotli package is not installed.
+
+    DATABASE_URL=sqlite:////tmp/bench.db python manage.py seed_data --posts 1000
+    DATABASE_URL=sqlite:////tmp/bench.db python scripts/page_weight.py
+    DATABASE_URL=sqlite:////tmp/bench.db python scripts/page_weight.py --compare logs/page_weight/<old>.json
+"""
+
+import argparse
+import gzip
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+from pathlib import Path
+from urllib.parse import urlsplit
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BASE_DIR))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'myproject.settings')
+import django
+django.setup()
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.staticfiles import finders
+from django.test import Client, override_settings
+
+from blog.management.commands.seed_data import SEED_PASSWORD, SEED_PREFIX
+from blog.models import Post
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+INLINE = re.compile(r'<(style|script)(?![^>]*\bsrc=)[^>]*>(.*?)</\1>', re.S | re.I)
+LINK = re.compile(r'<link\b[^>]*\brel="stylesheet"[^>]*>', re.I)
+SCRIPT = re.compile(r'<script\b[^>]*\bsrc="([^"]+)"', re.I)
+HREF = re.compile(r'\bhref="([^"]+)"', re.I)
+CSS_URL = re.compile(r'url\(\s*[\'"]?([^\'")]+)[\'"]?\s*\)')
+
+
+def sizes(data):
+    """Raw, gzip and brotli sizes of ``data`` in bytes."""
+    return {
+        'raw': len(data),
+        'gzip': len(gzip.compress(data, compresslevel=9, mtime=0)),
+        'br': len(brotli.compress(data, quality=11)) if brotli else None,
+    }
+
+
+def add(total, more):
+    for key, value in more.items():
+        total[key] = None if total.get(key, 0) is None or value is None else total.get(key, 0) + value
+
+
+def static_file(url):
+    """Contents of a /static/ URL, from the app static directories."""
+    path = urlsplit(url).path
+    prefix = '/' + settings.STATIC_URL.lstrip('/')
+    if not path.startswith(prefix):
+        return None
+    found = finders.find(path[len(prefix):])
+    if not found:
+        return None
+    with open(found, 'rb') as f:
+        return f.read()
+
+
+def measure(html):
+    """Page weight of one HTML document (see the module docstring)."""
+    inline = sum(len(body.encode()) for _, body in INLINE.findall(html))
+    static, third_party, files = {}, set(), set()
+    queue = [HREF.search(tag).group(1) for tag in LINK.findall(html) if HREF.search(tag)]
+    queue += SCRIPT.findall(html)
+    while queue:
+        url = queue.pop()
+        if url in files:
+            continue
+        files.add(url)
+        if urlsplit(url).netloc:
+            third_party.add(urlsplit(url).netloc)
+            continue
+        data = static_file(url)
+        if data is None:
+            continue
+        add(static, sizes(data))
+        if url.split('?')[0].endswith('.css'):
+            # Fonts and images the stylesheet pulls in, relative to it
+            base = url.rsplit('/', 1)[0]
+            for ref in CSS_URL.findall(data.decode('utf-8', 'replace')):
+                if ref.startswith('data:'):
+                    continue
+                if urlsplit(ref).netloc:
+                    third_party.add(urlsplit(ref).netloc)
+                elif ref.split('?')[0].split('#')[0].endswith(('.woff2', '.woff', '.ttf')):
+                    queue.append(os.path.normpath(f'{base}/{ref}'.split('?')[0].split('#')[0]))
+    return {
+        'html': sizes(html.encode()),
+        'inline_bytes': inline,
+        'static': static,
+        'static_files': len(files) - len([f for f in files if urlsplit(f).netloc]),
+        'third_party': sorted(third_party),
+    }
+
+
+def pages():
+    post = Post.objects.filter(author__username__startswith=SEED_PREFIX).order_by('-date_posted').first()
+    if post is None:
+        sys.exit('No seeded posts: run `python manage.py seed_data` on this database first')
+    return [
+        ('landing', '/', False),
+        ('home', '/blog/', False),
+        ('about', '/blog/about/', False),
+        ('login', '/login/', False),
+        ('post-detail', f'/blog/post/{post.pk}/', True),
+        ('post-create', '/blog/post/new/', True),
+        ('profile', '/profile/', True),
+    ]
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=BASE_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def fmt(value):
+    return f'{value / 1024:7.1f}K' if value is not None else '    n/a'
+
+
+def compare(old, new):
+    """Print the change in HTML and static bytes for every page in both runs."""
+    print(f"\n{old['meta'].get('git')} -> {new['meta'].get('git')}")
+    for name, after in new['pages'].items():
+        before = old['pages'].get(name)
+        if before is None:
+            continue
+        print(f"  {name:<12} html raw {fmt(before['html']['raw'])} -> {fmt(after['html']['raw'])} "
+              f"({after['html']['raw'] - before['html']['raw']:+d} B)  "
+              f"gzip {fmt(before['html']['gzip'])} -> {fmt(after['html']['gzip'])}  "
+              f"third-party origins {len(before['third_party'])} -> {len(after['third_party'])}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--output', help='Result file (default: logs/page_weight/<timestamp>.json)')
+    parser.add_argument('--compare', help='Earlier result file to compare against')
+    args = parser.parse_args()
+
+    settings.RATELIMIT_ENABLE = False
+    settings.ALLOWED_HOSTS = list(settings.ALLOWED_HOSTS) + ['testserver']
+
+    user = User.objects.filter(username__startswith=SEED_PREFIX).order_by('username').first()
+    result = {'meta': {'started': time.strftime('%Y-%m-%dT%H:%M:%S'), 'git': git_revision()}, 'pages': {}}
+    # Unhashed names, so assets are read from the app directories without collectstatic
+    storages = {**settings.STORAGES, 'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    }}
+    with override_settings(STORAGES=storages, SECURE_SSL_REDIRECT=False):
+        anonymous, logged_in = Client(), Client()
+        logged_in.login(username=user.username, password=SEED_PASSWORD)
+        print(f"{'page':<12} {'html raw':>8} {'gzip':>8} {'br':>8} {'inline':>8}   "
+              f"{'static gz':>9} {'br':>8} files  third-party")
+        for name, path, login in pages():
+            response = (logged_in if login else anonymous).get(path)
+            if response.status_code != 200:
+                print(f'  {name}: HTTP {response.status_code}, skipped')
+                continue
+            weight = measure(response.content.decode())
+            result['pages'][name] = weight
+            html, static = weight['html'], weight['static']
+            print(f"{name:<12} {fmt(html['raw'])} {fmt(html['gzip'])} {fmt(html['br'])} "
+                  f"{fmt(weight['inline_bytes'])}   {fmt(static.get('gzip', 0)):>9} {fmt(static.get('br', 0))} "
+                  f"{weight['static_files']:5d}  {', '.join(weight['third_party']) or '-'}")
+
+    output = args.output or str(BASE_DIR / 'logs' / 'page_weight' / f"{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(result, f, indent=2)
+    print(f'\nResults written to {output}')
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), result)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+"""
+End-to-end payment load test against a running server.
+
+Drives the whole pay_post -> mpesa_callback -> post_detail path: each virtual
+user logs in, POSTs to pay_post (which calls the Daraja simulator), then polls
+post_detail until the simulator's callback has unlocked the post.
+
+Setup (three terminals):
+    python -m users.daraja_simulator --callback-delay uniform:500:2000
+    MPESA_BACKEND=simulator MPESA_CALLBACK=http://127.0.0.1:8000/mpesa/callback/ \\
+        RATELIMIT_ENABLE=False GUNICORN_PROFILE=gthread gunicorn -c gunicorn_config.py
+    python scripts/payment_loadtest.py --users 50 --payments 5
+
+GUNICORN_PROFILE picks the worker setup to measure (see gunicorn_config.py).
+pay_post is rate limited to 5 POSTs a minute per user, 3 per phone number
+and 50 a second across the site (myproject/ratelimit.py), so with the limits
+on most payments of a run come back as HTTP 429. Every load-test user has
+its own phone number, but start the server with RATELIMIT_ENABLE=False to
+measure the payment path rather than the limiter.
+
+The script creates (or reuses) the load-test users directly in the configured
+database, so it must point at the same database as the server.
+
+pay_post answers 200 whether or not the STK push went out: a payment counts
+as sent only when the waiting page comes back. Otherwise it is a pay error,
+reported by the message pay_post showed (e.g. a simulator failure).
+"""
+
+import argparse
+import html
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'myproject.settings')
+import django
+django.setup()
+
+import requests
+from django.contrib.auth.models import User
+from blog.models import Post
+from myproject.stats import format_summary
+from users.models import PaymentAccess, Profile
+
+PASSWORD = 'loadtest-Passw0rd!'
+CSRF_RE = re.compile(r'name="csrfmiddlewaretoken" value="([^"]+)"')
+# Only users/waiting.html has it: the STK push was sent
+WAITING_RE = re.compile(r'id="payment-status"')
+ERROR_RE = re.compile(r'class="alert alert-(?:error|danger)\b[^>]*>\s*([^<]+?)\s*<')
+
+
+def pay_outcome(response):
+    """None when pay_post sent the STK push, else why it did not."""
+    if response.status_code != 200:
+        return f'HTTP {response.status_code}'
+    if WAITING_RE.search(response.text):
+        return None
+    match = ERROR_RE.search(response.text)
+    return html.unescape(match.group(1)) if match else 'no waiting page'
+
+
+def ensure_users(count):
+    """Create load-test users with phone numbers and clear their payments."""
+    users = []
+    for i in range(count):
+        user, created = User.objects.get_or_create(username=f'loadtest_{i}')
+        if created:
+            user.set_password(PASSWORD)
+            user.save()
+        Profile.objects.update_or_create(user=user, defaults={'phone_number': f'2547{i:08d}'})
+        users.append(user)
+    PaymentAccess.objects.filter(user__in=users).delete()
+    return users
+
+
+def login(session, base_url, username):
+    page = session.get(f'{base_url}/login/')
+    token = CSRF_RE.search(page.text).group(1)
+    response = session.post(
+        f'{base_url}/login/',
+        data={'username': username, 'password': PASSWORD, 'csrfmiddlewaretoken': token},
+        headers={'Referer': f'{base_url}/login/'},
+        allow_redirects=False,
+    )
+    return response.status_code == 302
+
+
+def run_user(base_url, user, post_ids, poll_interval, unlock_timeout, results, lock):
+    session = requests.Session()
+    if not login(session, base_url, user.username):
+        with lock:
+            results['login_failures'] += 1
+        return
+
+    for post_id in post_ids:
+        pay_url = f'{base_url}/post/{post_id}/pay/'
+        detail_url = f'{base_url}/post/{post_id}/'
+        page = session.get(pay_url)
+        match = CSRF_RE.search(page.text)
+        token = match.group(1) if match else session.cookies.get('csrftoken', '')
+
+        started = time.perf_counter()
+        response = session.post(pay_url, data={'csrfmiddlewaretoken': token},
+                                headers={'Referer': pay_url}, allow_redirects=False)
+        pay_latency = time.perf_counter() - started
+        error = pay_outcome(response)
+        with lock:
+            results['pay'].append(pay_latency)
+            if error is not None:
+                results['errors'][error] += 1
+        if error is not None:
+            continue
+
+        # Poll post_detail until the callback has unlocked the post
+        while time.perf_counter() - started < unlock_timeout:
+            poll_started = time.perf_counter()
+            detail = session.get(detail_url, allow_redirects=False)
+            with lock:
+                results['detail'].append(time.perf_counter() - poll_started)
+            if detail.status_code == 200:
+                with lock:
+                    results['unlock'].append(time.perf_counter() - started)
+                break
+            time.sleep(poll_interval)
+        else:
+            with lock:
+                results['not_unlocked'] += 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+    parser.add_argument('--users', type=int, default=20, help='Concurrent virtual users')
+    parser.add_argument('--payments', type=int, default=3, help='Posts each user pays for')
+    parser.add_argument('--poll-interval', type=float, default=0.25)
+    parser.add_argument('--unlock-timeout', type=float, default=30.0)
+    args = parser.parse_args()
+
+    post_ids = list(Post.objects.order_by('-date_posted').values_list('pk', flat=True)[:args.payments])
+    if not post_ids:
+        print('No posts found; create some posts first.')
+        return 1
+    users = ensure_users(args.users)
+
+    results = {'pay': [], 'detail': [], 'unlock': [], 'errors': Counter(), 'not_unlocked': 0, 'login_failures': 0}
+    lock = threading.Lock()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.users) as pool:
+        for user in users:
+            pool.submit(run_user, args.base_url, user, post_ids, args.poll_interval,
+                        args.unlock_timeout, results, lock)
+    elapsed = time.perf_counter() - started
+
+    total = len(results['pay'])
+    print(f"Payments: {total} in {elapsed:.1f}s ({total / elapsed if elapsed else 0:.1f}/s), "
+          f"unlocked: {len(results['unlock'])}, not unlocked: {results['not_unlocked']}, "
+          f"pay errors: {sum(results['errors'].values())}, login failures: {results['login_failures']}")
+    for error, count in results['errors'].most_common():
+        print(f"   {count:5d} x {error}")
+    print(format_summary('pay_post POST', results['pay']))
+    print(format_summary('post_detail GET', results['detail']))
+    print(format_summary('time to unlock', results['unlock']))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+"""
+Replay captured traffic against a running server.
+
+Reads the JSONL written by TrafficCaptureMiddleware (myproject/capture.py)
+and sends the same request shapes to --target at a fixed rate and
+concurrency, then reports latency percentiles, error rates and per-endpoint
+throughput.
+
+Only GET and HEAD requests are replayed: captures keep no request bodies, and
+replaying POSTs would create posts or trigger payments. Skipped requests are
+counted in the report. Requests captured from logged-in users are sent with a
+logged-in session when --login is given (seed_data users share a password).
+
+Captures record URL patterns (``/blog/post/<int:pk>/``), not paths. Each
+pattern argument is filled in with a random value given with --value, e.g.
+``--value pk=1-300`` (a range) or ``--value username=seed_0000001,seed_0000002``;
+requests with an argument that has no values are skipped.
+
+    # In production, capture 5% of requests to logs/traffic.jsonl
+    TRAFFIC_CAPTURE_RATE=0.05 gunicorn myproject.wsgi:application -c gunicorn_config.py
+
+    # Locally, against a server running the change under test
+    python scripts/replay_traffic.py logs/traffic.jsonl --concurrency 32 --rate 200 \\
+        --login seed_0000001:seed-Passw0rd! --value pk=1-1000 --value username=seed_0000001 \\
+        --json logs/replay.json
+"""
+
+import argparse
+import itertools
+import json
+import queue
+import random
+import re
+import sys
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import requests
+from myproject.stats import format_summary, summarize
+
+REPLAYED_METHODS = ('GET', 'HEAD')
+CSRF_RE = re.compile(r'name="csrfmiddlewaretoken" value="([^"]+)"')
+ROUTE_ARG_RE = re.compile(r'<(?:[^>:]+:)?([^>]+)>')
+
+
+def load_capture(paths):
+    entries = []
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    entries.append(json.loads(line))
+    return entries
+
+
+def login(session, target, credentials):
+    username, password = credentials.split(':', 1)
+    page = session.get(f'{target}/login/', timeout=30)
+    token = CSRF_RE.search(page.text)
+    response = session.post(
+        f'{target}/login/',
+        data={'username': username, 'password': password, 'csrfmiddlewaretoken': token.group(1) if token else ''},
+        headers={'Referer': f'{target}/login/'},
+        timeout=30,
+        allow_redirects=False,
+    )
+    if response.status_code != 302:
+        raise SystemExit(f'Login as {username} failed (status {response.status_code})')
+
+
+def parse_values(options):
+    """{'pk': ['1', ..., '300']} from ['pk=1-300', ...] (ranges or comma-separated lists)."""
+    values = {}
+    for option in options or []:
+        name, _, spec = option.partition('=')
+        if re.fullmatch(r'\d+-\d+', spec):
+            low, high = map(int, spec.split('-'))
+            values[name] = [str(i) for i in range(low, high + 1)]
+        else:
+            values[name] = [v for v in spec.split(',') if v]
+    return values
+
+
+def fill_route(route, values, rng):
+    """A path for the captured URL pattern, or None if an argument has no values."""
+    if route is None or any(name not in values for name in ROUTE_ARG_RE.findall(route)):
+        return None
+    return ROUTE_ARG_RE.sub(lambda m: rng.choice(values[m.group(1)]), route)
+
+
+class Replayer:
+    def __init__(self, target, concurrency, credentials, timeout):
+        self.target = target.rstrip('/')
+        self.concurrency = concurrency
+        self.credentials = credentials
+        self.timeout = timeout
+        self.results = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def session(self, auth):
+        # One keep-alive session per worker thread and auth state
+        sessions = getattr(self.local, 'sessions', None)
+        if sessions is None:
+            sessions = self.local.sessions = {}
+        logged_in = auth != 'anonymous' and self.credentials is not None
+        key = 'user' if logged_in else 'anonymous'
+        if key not in sessions:
+            session = requests.Session()
+            if logged_in:
+                login(session, self.target, self.credentials)
+            sessions[key] = session
+        return sessions[key]
+
+    def send(self, entry):
+        endpoint = entry.get('view') or entry['route']
+        started = time.perf_counter()
+        try:
+            response = self.session(entry['auth']).request(
+                entry['method'], self.target + entry['path'], params=entry.get('query') or None,
+                timeout=self.timeout, allow_redirects=False,
+            )
+            status, error = response.status_code, None
+        except requests.RequestException as e:
+            status, error = None, type(e).__name__
+        elapsed = time.perf_counter() - started
+        with self.lock:
+            self.results.append((endpoint, status, error, elapsed, time.perf_counter()))
+
+    def worker(self, work):
+        while True:
+            entry = work.get()
+            if entry is None:
+                return
+            self.send(entry)
+
+    def run(self, entries, rate, total):
+        """Send ``total`` requests cycling through ``entries`` at ``rate`` per second (0 = unthrottled)."""
+        work = queue.Queue(maxsize=self.concurrency * 2)
+        threads = [threading.Thread(target=self.worker, args=(work,), daemon=True) for _ in range(self.concurrency)]
+        for thread in threads:
+            thread.start()
+
+        started = time.perf_counter()
+        for i, entry in enumerate(itertools.islice(itertools.cycle(entries), total)):
+            if rate:
+                # Open-loop schedule: fall behind rather than slow down when the server is saturated
+                delay = started + i / rate - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            work.put(entry)
+        for _ in threads:
+            work.put(None)
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - started
+
+
+def report(results, duration, skipped, captured_ms):
+    latencies = [r[3] for r in results]
+    errors = sum(1 for r in results if r[1] is None or r[1] >= 500)
+    client_errors = sum(1 for r in results if r[1] is not None and 400 <= r[1] < 500)
+    print(f'\nSent {len(results)} requests in {duration:.1f}s ({len(results) / duration:.1f} req/s), '
+          f'skipped {skipped} captured requests (not GET, or no --value for the URL)')
+    print(f'Errors: {errors} ({errors / max(1, len(results)) * 100:.2f}%) 5xx/connection, {client_errors} 4xx')
+    print(format_summary('all requests', latencies))
+
+    by_endpoint = defaultdict(list)
+    for endpoint, status, error, elapsed, _ in results:
+        by_endpoint[endpoint].append((status, error, elapsed))
+
+    print(f"\n{'endpoint':<28} {'count':>6} {'req/s':>7} {'p50':>8} {'p95':>8} {'p99':>8} {'errors':>7} "
+          f"{'captured p50':>13}")
+    endpoints = {}
+    for endpoint, rows in sorted(by_endpoint.items(), key=lambda item: -len(item[1])):
+        s = summarize([r[2] for r in rows])
+        endpoint_errors = sum(1 for r in rows if r[0] is None or r[0] >= 500)
+        captured = summarize(captured_ms.get(endpoint, []))
+        endpoints[endpoint] = {
+            'count': len(rows),
+            'rps': len(rows) / duration,
+            'p50_ms': s['p50'] * 1000, 'p95_ms': s['p95'] * 1000, 'p99_ms': s['p99'] * 1000,
+            'errors': endpoint_errors,
+            'captured_p50_ms': captured['p50'],
+        }
+        print(f"{endpoint[:28]:<28} {len(rows):>6} {len(rows) / duration:>7.1f} {s['p50'] * 1000:>6.1f}ms "
+              f"{s['p95'] * 1000:>6.1f}ms {s['p99'] * 1000:>6.1f}ms {endpoint_errors:>7} "
+              f"{captured['p50']:>11.1f}ms")
+
+    overall = summarize(latencies)
+    return {
+        'requests': len(results),
+        'duration_s': duration,
+        'rps': len(results) / duration,
+        'errors': errors,
+        'client_errors': client_errors,
+        'skipped': skipped,
+        'p50_ms': overall['p50'] * 1000, 'p95_ms': overall['p95'] * 1000, 'p99_ms': overall['p99'] * 1000,
+        'endpoints': endpoints,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('captures', nargs='+', help='JSONL capture file(s)')
+    parser.add_argument('--target', default='http://127.0.0.1:8000')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--rate', type=float, default=0, help='Requests per second (0 = as fast as possible)')
+    parser.add_argument('--requests', type=int, default=0, help='Total requests (default: each capture once)')
+    parser.add_argument('--login', help='username:password used for requests captured from logged-in users')
+    parser.add_argument('--value', action='append', metavar='NAME=VALUES',
+                        help='Values for a URL argument: a range (pk=1-300) or a list (username=a,b)')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed for the URL argument values')
+    parser.add_argument('--timeout', type=float, default=30.0)
+    parser.add_argument('--json', help='Also write the report to this file')
+    args = parser.parse_args()
+
+    captured = load_capture(args.captures)
+    values, rng = parse_values(args.value), random.Random(args.seed)
+    entries = []
+    for entry in captured:
+        path = fill_route(entry.get('route'), values, rng) if entry['method'] in REPLAYED_METHODS else None
+        if path is not None:
+            entries.append({**entry, 'path': path})
+    skipped = len(captured) - len(entries)
+    if not entries:
+        raise SystemExit('No GET/HEAD requests in the capture that can be filled in (see --value)')
+
+    captured_ms = defaultdict(list)
+    for entry in entries:
+        captured_ms[entry.get('view') or entry['route']].append(entry.get('duration_ms', 0.0))
+
+    replayer = Replayer(args.target, args.concurrency, args.login, args.timeout)
+    total = args.requests or len(entries)
+    print(f'Replaying {total} requests ({len(entries)} captured shapes) against {args.target} '
+          f'with concurrency {args.concurrency}' + (f' at {args.rate:g} req/s' if args.rate else ''))
+    duration = replayer.run(entries, args.rate, total)
+    result = report(replayer.results, duration, skipped, captured_ms)
+
+    if args.json:
+        result.update({'target': args.target, 'concurrency': args.concurrency, 'rate': args.rate})
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
+        print(f'\nReport written to {args.json}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+"""
+Measure how long matching a new post against the saved searches takes.
+
+Seeds --searches saved searches (random keywords, locations and categories
+spread over --users users), then matches --posts unsaved posts two ways:
+
+    index       SavedSearchService.find_matching_searches, the trigram
+                index lookup post creation runs
+    full scan   every active search loaded and checked with
+                PostFilterService.matches
+
+Both must find the same searches for every post; a difference is printed
+and the script exits with status 1.
+
+    DATABASE_URL=sqlite:////tmp/bench.db python manage.py migrate
+    DATABASE_URL=sqlite:////tmp/bench.db python scripts/saved_search_benchmark.py --searches 100000
+
+Seeded rows are deleted afterwards unless --keep is given.
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'myproject.settings')
+import django
+django.setup()
+
+from django.contrib.auth.models import User
+from blog.models import Post, SavedSearch
+from blog.services import PostFilterService, SavedSearchService
+from myproject.stats import format_summary
+
+PREFIX = 'bench_search_'
+LOCATIONS = ['Nairobi CBD', 'Westlands', 'Mombasa', 'Kisumu', 'Nakuru', 'Eldoret', 'Thika', 'Kasarani']
+COLOURS = ['black', 'blue', 'red', 'brown', 'silver', 'gold', 'white', 'green']
+ITEMS = ['samsung', 'wallet', 'keys', 'passport', 'laptop', 'bag', 'iphone', 'phone', 'watch', 'ring', 'dog',
+         'id', 'umbrella', 'jacket', 'glasses', 'earrings', 'tablet', 'charger', 'card', 'backpack', 'camera',
+         'headphones', 'bracelet', 'necklace', 'kitten', 'bicycle', 'helmet', 'scarf', 'shoes', 'purse',
+         'handbag', 'notebook', 'certificate', 'permit', 'logbook', 'atm', 'simcard', 'airpods', 'kindle', 'drone']
+
+
+def phrase():
+    """A search query or post title: an item, often with its colour"""
+    item = random.choice(ITEMS)
+    return f'{random.choice(COLOURS)} {item}' if random.random() < 0.6 else item
+
+
+def seed(users, searches):
+    categories = [c for c, _ in Post.CATEGORY_CHOICES]
+    User.objects.bulk_create(
+        [User(username=f'{PREFIX}{i}', email=f'{PREFIX}{i}@example.com') for i in range(users)],
+        batch_size=1000, ignore_conflicts=True,
+    )
+    seeded = list(User.objects.filter(username__startswith=PREFIX))
+    rows = []
+    for i in range(searches):
+        search = SavedSearch(user=seeded[i % len(seeded)], q=random.choice([phrase()] * 8 + [''] * 2),
+                             category=random.choice(categories + [''] * 5),
+                             location=random.choice(LOCATIONS + [''] * 4))
+        search.anchor = SavedSearchService.anchor_key(search.params)
+        rows.append(search)
+    SavedSearch.objects.bulk_create(rows, batch_size=2000)
+    return seeded
+
+
+def full_scan(post):
+    searches = SavedSearch.objects.filter(is_active=True).exclude(user_id=post.author_id).only(
+        'id', 'user_id', 'q', 'item_type', 'category', 'location', 'status'
+    )
+    return [search for search in searches.iterator(chunk_size=2000) if PostFilterService.matches(post, search.params)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--searches', type=int, default=100000)
+    parser.add_argument('--posts', type=int, default=50, help='Posts to match')
+    parser.add_argument('--keep', action='store_true', help='Keep the seeded rows')
+    args = parser.parse_args()
+
+    random.seed(42)
+    started = time.perf_counter()
+    seeded = seed(args.users, args.searches)
+    print(f'Seeded {args.searches} searches for {len(seeded)} users in {time.perf_counter() - started:.1f}s')
+
+    categories = [c for c, _ in Post.CATEGORY_CHOICES]
+    index_times, scan_times, matched, mismatches = [], [], 0, 0
+    try:
+        for _ in range(args.posts):
+            post = Post(title=f'Found {phrase()}',
+                        content=f'{phrase()} and {phrase()} near the stage', item_type=Post.FOUND,
+                        category=random.choice(categories), location=random.choice(LOCATIONS),
+                        author=seeded[0])
+            tick = time.perf_counter()
+            found = {search.pk for search in SavedSearchService.find_matching_searches(post)}
+            index_times.append(time.perf_counter() - tick)
+            tick = time.perf_counter()
+            expected = {search.pk for search in full_scan(post)}
+            scan_times.append(time.perf_counter() - tick)
+            matched += len(found)
+            if found != expected:
+                mismatches += 1
+                print(f'  "{post.title}": index found {len(found)}, full scan {len(expected)}')
+    finally:
+        if not args.keep:
+            User.objects.filter(username__startswith=PREFIX).delete()
+
+    print(f'Matched {args.posts} posts -> {matched} search hits')
+    print(format_summary('index', index_times))
+    print(format_summary('full scan', scan_times))
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+"""
+Local SMTP sink for testing outbound email throughput.
+
+Accepts every message and throws it away (or appends it to an mbox file),
+printing how many messages and connections it has seen per second. Use it to
+measure the outbox sender without touching Gmail:
+
+    python scripts/smtp_sink.py --port 1025 --latency 0.05
+    EMAIL_HOST=127.0.0.1 EMAIL_PORT=1025 EMAIL_USE_TLS=False \\
+        python manage.py send_queued_mail
+
+--latency adds a per-message delay after DATA to mimic a remote server, and
+--connect-latency a delay before the greeting to mimic the TCP/TLS handshake
+that connection reuse avoids.
+"""
+
+import argparse
+import asyncio
+import time
+
+
+class Stats:
+    def __init__(self):
+        self.messages = 0
+        self.connections = 0
+        self.bytes = 0
+        self.started = time.monotonic()
+
+
+async def handle_client(reader, writer, stats, args, mbox):
+    stats.connections += 1
+    await asyncio.sleep(args.connect_latency)
+    writer.write(b'220 localhost LostLink SMTP sink\r\n')
+    await writer.drain()
+
+    while True:
+        line = await reader.readline()
+        if not line:
+            break
+        command = line.decode('utf-8', 'replace').strip()
+        verb = command[:4].upper()
+
+        if verb == 'EHLO':
+            writer.write(b'250-localhost\r\n250-8BITMIME\r\n250 SIZE 52428800\r\n')
+        elif verb == 'HELO':
+            writer.write(b'250 localhost\r\n')
+        elif verb in ('MAIL', 'RCPT', 'RSET', 'NOOP'):
+            writer.write(b'250 OK\r\n')
+        elif verb == 'DATA':
+            writer.write(b'354 End data with <CR><LF>.<CR><LF>\r\n')
+            await writer.drain()
+            chunks = []
+            while True:
+                data = await reader.readline()
+                if not data or data in (b'.\r\n', b'.\n'):
+                    break
+                chunks.append(data)
+            await asyncio.sleep(args.latency)
+            stats.messages += 1
+            stats.bytes += sum(len(c) for c in chunks)
+            if mbox:
+                mbox.write(b'From sink ' + time.ctime().encode() + b'\n')
+                mbox.writelines(chunks)
+                mbox.write(b'\n')
+            writer.write(b'250 OK: queued\r\n')
+        elif verb == 'QUIT':
+            writer.write(b'221 Bye\r\n')
+            await writer.drain()
+            break
+        else:
+            writer.write(b'502 Command not implemented\r\n')
+        await writer.drain()
+
+    writer.close()
+
+
+async def report(stats, interval):
+    last_messages = 0
+    while True:
+        await asyncio.sleep(interval)
+        elapsed = time.monotonic() - stats.started
+        rate = (stats.messages - last_messages) / interval
+        last_messages = stats.messages
+        print(f'[{elapsed:7.1f}s] messages={stats.messages} ({rate:.1f}/s) '
+              f'connections={stats.connections} bytes={stats.bytes}', flush=True)
+
+
+async def main(args):
+    stats = Stats()
+    mbox = open(args.mbox, 'ab') if args.mbox else None
+    server = await asyncio.start_server(
+        lambda r, w: handle_client(r, w, stats, args, mbox), args.host, args.port
+    )
+    print(f'SMTP sink listening on {args.host}:{args.port}', flush=True)
+    reporter = asyncio.create_task(report(stats, args.report_interval))
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        reporter.cancel()
+        if mbox:
+            mbox.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=1025)
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds to wait before accepting each message')
+    parser.add_argument('--connect-latency', type=float, default=0.0, help='Seconds to wait before the greeting')
+    parser.add_argument('--report-interval', type=float, default=5.0)
+    parser.add_argument('--mbox', default=None, help='Append received messages to this file')
+    try:
+        asyncio.run(main(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+"""
+Readers vs writers on SQLite across worker processes.
+
+Runs reader and writer processes against a copy of a database, the way
+several gunicorn workers share one file, once with Django's default SQLite
+settings and once with the production mode from settings.py (WAL,
+synchronous=NORMAL, mmap, page cache, busy timeout, BEGIN IMMEDIATE writes
+and a separate query-only read connection):
+
+    reader  the post detail page's queries (post + author + profile,
+            related posts, the author's post counts)
+    writer  the M-PESA callback's transaction (read post and user, then
+            update_or_create the PaymentAccess) alternating with a
+            single-statement status update
+
+Each process is a fresh interpreter with its own connections. Reported per
+mode and writer count: operations per second and p95 latency for each side,
+and how many operations failed with "database is locked".
+
+    DATABASE_URL=sqlite:////tmp/seed.db python manage.py seed_data --posts 10000
+    python scripts/sqlite_benchmark.py /tmp/seed.db --readers 4 --writers 1,2,4 --duration 10
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from myproject.stats import summarize
+
+MODES = ('default', 'production')
+
+
+def copy_database(source, mode):
+    """Consistent copy of the database (sqlite backup API) with the journal mode for ``mode``."""
+    fd, path = tempfile.mkstemp(prefix=f'sqlite-bench-{mode}-', suffix='.db')
+    os.close(fd)
+    with sqlite3.connect(source) as src, sqlite3.connect(path) as dst:
+        src.backup(dst)
+        # WAL is stored in the file: reset it so the default mode really is the default
+        dst.execute(f"PRAGMA journal_mode={'WAL' if mode == 'production' else 'DELETE'}")
+    return path
+
+
+def worker(role, mode, path, start_at, duration, seed, results):
+    os.environ.update(
+        DJANGO_SETTINGS_MODULE='myproject.settings',
+        DATABASE_URL=f'sqlite:///{path}',
+        SQLITE_PRODUCTION='True' if mode == 'production' else 'False',
+    )
+    import django
+    django.setup()
+    from django.contrib.auth.models import User
+    from django.db import OperationalError, connections, transaction
+    from blog.models import Post
+    from blog.views import AUTHOR_COUNTS, related_posts
+    from users.models import PaymentAccess
+
+    rng = random.Random(seed)
+    post_ids = list(Post.objects.values_list('pk', flat=True))
+    user_ids = list(User.objects.values_list('pk', flat=True)[:1000])
+
+    def read():
+        post = Post.objects.select_related('author', 'author__profile').get(pk=rng.choice(post_ids))
+        list(related_posts(post))
+        Post.objects.filter(author=post.author).aggregate(**AUTHOR_COUNTS)
+
+    def write(i):
+        if i % 2:
+            Post.objects.filter(pk=rng.choice(post_ids)).update(
+                status=rng.choice([Post.ACTIVE, Post.RESOLVED])
+            )
+            return
+        with transaction.atomic():
+            post = Post.objects.get(pk=rng.choice(post_ids))
+            user = User.objects.get(pk=rng.choice(user_ids))
+            PaymentAccess.objects.update_or_create(user=user, post=post, defaults={'paid': True})
+
+    latencies, locked, other_errors = [], 0, 0
+    time.sleep(max(0.0, start_at - time.time()))
+    deadline = time.perf_counter() + duration
+    i = 0
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        try:
+            read() if role == 'reader' else write(i)
+            latencies.append(time.perf_counter() - started)
+        except OperationalError as e:
+            if 'locked' in str(e):
+                locked += 1
+            else:
+                other_errors += 1
+        i += 1
+    connections.close_all()
+    results.put((role, latencies, locked, other_errors))
+
+
+def run(mode, path, readers, writers, duration):
+    ctx = multiprocessing.get_context('spawn')
+    results = ctx.Queue()
+    # Leave time for every process to import Django before the clock starts
+    start_at = time.time() + 3 + 0.2 * (readers + writers)
+    roles = ['reader'] * readers + ['writer'] * writers
+    processes = [
+        ctx.Process(target=worker, args=(role, mode, path, start_at, duration, seed, results))
+        for seed, role in enumerate(roles)
+    ]
+    for process in processes:
+        process.start()
+    collected = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+
+    row = {'mode': mode, 'readers': readers, 'writers': writers}
+    for role in ('reader', 'writer'):
+        latencies = [l for r, ls, _, _ in collected if r == role for l in ls]
+        s = summarize(latencies)
+        row[f'{role}_ops'] = len(latencies) / duration
+        row[f'{role}_p95_ms'] = s['p95'] * 1000
+        row[f'{role}_locked'] = sum(locked for r, _, locked, _ in collected if r == role)
+        row[f'{role}_errors'] = sum(errors for r, _, _, errors in collected if r == role)
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('database', help='SQLite database to copy (seeded with seed_data)')
+    parser.add_argument('--modes', default=','.join(MODES))
+    parser.add_argument('--readers', type=int, default=4, help='Reader processes')
+    parser.add_argument('--writers', default='1,2,4', help='Writer processes, comma-separated levels')
+    parser.add_argument('--duration', type=float, default=10.0, help='Seconds per run')
+    parser.add_argument('--json', help='Also write the results to this file')
+    args = parser.parse_args()
+    modes = [m for m in args.modes.split(',') if m]
+    if set(modes) - set(MODES):
+        raise SystemExit(f'Unknown mode (choose from {", ".join(MODES)})')
+
+    print(f"{'mode':<11} {'R':>3} {'W':>3} {'reads/s':>9} {'read p95':>9} {'locked':>7} "
+          f"{'writes/s':>9} {'write p95':>10} {'locked':>7}")
+    rows = []
+    for mode in modes:
+        for writers in (int(w) for w in args.writers.split(',')):
+            path = copy_database(args.database, mode)
+            try:
+                row = run(mode, path, args.readers, writers, args.duration)
+            finally:
+                for suffix in ('', '-wal', '-shm', '-journal'):
+                    if os.path.exists(path + suffix):
+                        os.remove(path + suffix)
+            rows.append(row)
+            print(f"{mode:<11} {args.readers:>3} {writers:>3} {row['reader_ops']:>9.1f} "
+                  f"{row['reader_p95_ms']:>7.1f}ms {row['reader_locked']:>7} {row['writer_ops']:>9.1f} "
+                  f"{row['writer_p95_ms']:>8.1f}ms {row['writer_locked']:>7}", flush=True)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'database': args.database, 'duration_s': args.duration, 'results': rows}, f, indent=2)
+        print(f'\nResults written to {args.json}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+"""
+Build the self-hosted, subsetted fonts in blog/static/blog/vendor/fonts/.
+
+The site uses a couple of dozen Font Awesome icons, but the full kit is a
+~100 KB stylesheet and ~300 KB of fonts from a CDN. This script scans the
+templates for the icons they use (`fas fa-phone`, `fab fa-twitter`, ...),
+keeps only those glyphs in WOFF2 copies of the solid/regular/brands fonts
+and writes one small fonts.css with their @font-face rules and classes.
+Text fonts can be added the same way, subset to Latin:
+
+    pip install fonttools brotli fontawesomefree==6.4.0
+    python scripts/subset_fonts.py
+    python scripts/subset_fonts.py --text-font "Outfit=/path/to/Outfit[wght].ttf"
+
+Run it again after using a new icon in a template (the blog tests check
+that every icon in the templates is in fonts.css), passing the same
+--text-font options: the directory is rebuilt from scratch. Icons whose class names
+are only built at runtime (in JS) are not found; list them with --icon.
+"""
+
+import argparse
+import os
+import re
+import sys
+from pathlib import Path
+
+from fontTools import subset
+from fontTools.ttLib import TTFont
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+OUTPUT_DIR = BASE_DIR / 'blog' / 'static' / 'blog' / 'vendor' / 'fonts'
+TEMPLATE_DIRS = [BASE_DIR / 'blog' / 'templates', BASE_DIR / 'users' / 'templates']
+
+# Style class -> (font file stem, CSS family, weight)
+STYLES = {
+    'solid': ('fa-solid-900', 'Font Awesome 6 Free', 900),
+    'regular': ('fa-regular-400', 'Font Awesome 6 Free', 400),
+    'brands': ('fa-brands-400', 'Font Awesome 6 Brands', 400),
+}
+STYLE_CLASSES = {
+    'fa': 'solid', 'fas': 'solid', 'fa-solid': 'solid',
+    'far': 'regular', 'fa-regular': 'regular',
+    'fab': 'brands', 'fa-brands': 'brands',
+}
+# Unicode ranges of Google Fonts' "latin" subset
+LATIN = ('U+0000-00FF,U+0131,U+0152-0153,U+02BB-02BC,U+02C6,U+02DA,U+02DC,U+0304,U+0308,U+0329,'
+         'U+2000-206F,U+2074,U+20AC,U+2122,U+2191,U+2193,U+2212,U+2215,U+FEFF,U+FFFD')
+
+CLASS_ATTR = re.compile(r'class="([^"]*\bfa-[^"]*)"')
+ICON_RULE = re.compile(r'\.(fa-[\w-]+)::?before\s*\{\s*content:\s*"\\([0-9a-f]+)"', re.I)
+FA_CLASS = re.compile(r'\.(fa[\w-]*)')
+
+
+def used_icons(extra):
+    """{style: set of icon and modifier classes} the templates use, plus ``extra`` (solid)."""
+    icons = {style: set() for style in STYLES}
+    for directory in TEMPLATE_DIRS:
+        for path in directory.rglob('*.html'):
+            for value in CLASS_ATTR.findall(path.read_text(encoding='utf-8')):
+                classes = value.split()
+                style = next((STYLE_CLASSES[c] for c in classes if c in STYLE_CLASSES), 'solid')
+                icons[style].update(c for c in classes if c.startswith('fa-') and c not in STYLE_CLASSES)
+    icons['solid'].update(name if name.startswith('fa-') else f'fa-{name}' for name in extra)
+    return icons
+
+
+def css_blocks(css):
+    """Top-level (prelude, body) pairs of a stylesheet, comments removed."""
+    css = re.sub(r'/\*.*?\*/', '', css, flags=re.S)
+    blocks, depth, start, prelude = [], 0, 0, ''
+    for i, char in enumerate(css):
+        if char == '{':
+            if depth == 0:
+                prelude, start = css[start:i].strip(), i + 1
+            depth += 1
+        elif char == '}':
+            depth -= 1
+            if depth == 0:
+                blocks.append((prelude, css[start:i].strip()))
+                start = i + 1
+    return blocks
+
+
+def minify(body):
+    return re.sub(r'\s*([:;,])\s*', r'\1', re.sub(r'\s+', ' ', body)).strip().rstrip(';')
+
+
+def icon_rules(source, icons):
+    """
+    The Font Awesome CSS the used icons need.
+
+    Returns:
+        tuple: (list of CSS rules, {style: set of codepoints})
+    """
+    used = set().union(*icons.values())
+    allowed = used | set(STYLE_CLASSES)
+    css = ''.join((source / 'css' / name).read_text(encoding='utf-8')
+                  for name in ('fontawesome.css', 'solid.css', 'regular.css', 'brands.css'))
+    blocks = [(prelude, body) for prelude, body in css_blocks(css) if not prelude.startswith('@')]
+    defined = {name for prelude, _ in blocks for name in FA_CLASS.findall(prelude)}
+    if missing := sorted(used - defined):
+        sys.exit(f'Unknown Font Awesome classes: {", ".join(missing)}')
+
+    rules = []
+    # @font-face is rewritten for the subsets below; animations are unused
+    for prelude, body in blocks:
+        kept = [
+            selector for selector in (s.strip() for s in prelude.split(','))
+            if (set(FA_CLASS.findall(selector)) or {None}) <= allowed or selector in (':root', ':host')
+        ]
+        if kept:
+            rules.append(f'{",".join(kept)}{{{minify(body)}}}')
+    codepoints = {}
+    for name, code in ICON_RULE.findall(css):
+        codepoints.setdefault(name, int(code, 16))
+    glyphs = {style: {codepoints[name] for name in names if name in codepoints} for style, names in icons.items()}
+    return list(dict.fromkeys(rules)), glyphs
+
+
+def unicode_ranges(ranges):
+    """Codepoints of a CSS unicode-range list."""
+    codepoints = set()
+    for part in ranges.split(','):
+        first, _, last = part.strip().removeprefix('U+').partition('-')
+        codepoints.update(range(int(first, 16), int(last or first, 16) + 1))
+    return codepoints
+
+
+def subset_font(source, output, unicodes):
+    options = subset.Options()
+    options.flavor = 'woff2'
+    options.layout_features = ['*']
+    options.name_IDs = ['*']
+    options.notdef_outline = True
+    font = subset.load_font(str(source), options)
+    subsetter = subset.Subsetter(options)
+    subsetter.populate(unicodes=unicodes)
+    subsetter.subset(font)
+    subset.save_font(font, str(output), options)
+    return os.path.getsize(output)
+
+
+def weight_range(path):
+    """CSS font-weight of a font file: the wght axis of a variable font, else its weight class."""
+    font = TTFont(str(path))
+    if 'fvar' in font:
+        for axis in font['fvar'].axes:
+            if axis.axisTag == 'wght':
+                return f'{int(axis.minValue)} {int(axis.maxValue)}'
+    return str(font['OS/2'].usWeightClass)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--fontawesome', help='Font Awesome Free directory with css/ and webfonts/ '
+                                              '(default: the installed fontawesomefree package)')
+    parser.add_argument('--text-font', action='append', default=[], metavar='FAMILY=PATH',
+                        help='A TTF/OTF to subset to Latin and self-host under FAMILY')
+    parser.add_argument('--icon', action='append', default=[], help='Extra solid icon to keep, e.g. fa-spinner')
+    args = parser.parse_args()
+
+    if args.fontawesome:
+        source = Path(args.fontawesome)
+    else:
+        import fontawesomefree
+        source = Path(fontawesomefree.__file__).parent / 'static' / 'fontawesomefree'
+    header = (source / 'css' / 'fontawesome.css').read_text(encoding='utf-8').split('*/')[0] + '*/'
+
+    icons = used_icons(args.icon)
+    rules, glyphs = icon_rules(source, icons)
+    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+    for stale in OUTPUT_DIR.glob('*.woff2'):
+        stale.unlink()
+
+    faces = []
+    for style, (stem, family, weight) in STYLES.items():
+        if not glyphs[style]:
+            continue
+        size = subset_font(source / 'webfonts' / f'{stem}.ttf', OUTPUT_DIR / f'{stem}.woff2', glyphs[style])
+        faces.append(f"@font-face{{font-family:'{family}';font-style:normal;font-weight:{weight};"
+                     f"font-display:block;src:url({stem}.woff2) format('woff2')}}")
+        print(f'🔤 {stem}.woff2: {len(glyphs[style])} icons, {size / 1024:.1f} KB')
+
+    for spec in args.text_font:
+        family, _, path = spec.partition('=')
+        stem = re.sub(r'[^a-z0-9]+', '-', family.lower()).strip('-') + '-latin'
+        size = subset_font(Path(path), OUTPUT_DIR / f'{stem}.woff2', unicode_ranges(LATIN))
+        faces.append(f"@font-face{{font-family:'{family}';font-style:normal;font-weight:{weight_range(path)};"
+                     f"font-display:swap;src:url({stem}.woff2) format('woff2');unicode-range:{LATIN}}}")
+        print(f'🔤 {stem}.woff2: {family}, {size / 1024:.1f} KB')
+
+    css = '\n'.join([
+        header,
+        '/* Subset by scripts/subset_fonts.py: only the icons the templates use. Do not edit. */',
+        *faces, *rules,
+    ]) + '\n'
+    (OUTPUT_DIR / 'fonts.css').write_text(css, encoding='utf-8')
+    print(f"✅ fonts.css: {sum(len(v) for v in icons.values())} icons, {len(css) / 1024:.1f} KB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,387 @@
+# daraja_simulator.py
+"""
+Local Daraja (Safaricom M-PESA API) simulator for end-to-end payment testing.
+
+Unlike mpesa_mock.py, which replaces stk_push_payment in-process, this is a
+standalone HTTP server that speaks the same endpoints as the Daraja sandbox:
+
+- GET  /oauth/v1/generate?grant_type=client_credentials
+- POST /mpesa/stkpush/v1/processrequest
+- POST /mpesa/stkpushquery/v1/query
+
+After an STK push is accepted, the simulated customer "completes" the payment
+after a configurable delay and the result is POSTed asynchronously to the
+CallBackURL from the request, exactly like the real service. Latency
+distributions, failure rates and duplicate callbacks are configurable so the
+whole pay_post -> mpesa_callback -> post_detail path can be load-tested on a
+single machine.
+
+Usage:
+    python -m users.daraja_simulator --port 8010 --push-latency lognormal:150:0.5 \\
+        --callback-delay uniform:1000:5000 --callback-failure-rate 0.1 --duplicate-rate 0.05
+
+Then point the app at it (see MPESA_BASE_URL / MPESA_CALLBACK in settings):
+    MPESA_BASE_URL=http://127.0.0.1:8010 \\
+    MPESA_CALLBACK=http://127.0.0.1:8000/mpesa/callback/ python manage.py runserver
+
+GET /simulator/stats returns counters for the current run.
+
+This module deliberately does not import Django so it can run on its own.
+"""
+
+import argparse
+import json
+import logging
+import math
+import random
+import threading
+import time
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+# Result codes used by Daraja for STK callbacks
+RESULT_SUCCESS = 0
+RESULT_CANCELLED = 1032
+RESULT_FAILURES = {
+    1: "The balance is insufficient for the transaction.",
+    1032: "Request cancelled by user.",
+    1037: "DS timeout user cannot be reached.",
+    2001: "The initiator information is invalid.",
+}
+
+
+class LatencyDistribution:
+    """
+    A latency distribution parsed from a compact spec string (milliseconds).
+
+    Supported specs:
+        fixed:MS                 always MS
+        uniform:LOW:HIGH         uniformly distributed between LOW and HIGH
+        exp:MEAN                 exponential with the given mean
+        lognormal:MEDIAN:SIGMA   log-normal with the given median (long tail)
+    """
+
+    def __init__(self, spec, rng=None):
+        self.spec = spec
+        self.rng = rng or random.Random()
+        kind, *args = spec.split(":")
+        try:
+            args = [float(a) for a in args]
+        except ValueError:
+            raise ValueError(f"Invalid latency spec: {spec}")
+
+        if kind == "fixed" and len(args) == 1:
+            self._sample = lambda: args[0]
+        elif kind == "uniform" and len(args) == 2:
+            self._sample = lambda: self.rng.uniform(args[0], args[1])
+        elif kind == "exp" and len(args) == 1:
+            self._sample = lambda: self.rng.expovariate(1.0 / args[0]) if args[0] else 0.0
+        elif kind == "lognormal" and len(args) == 2:
+            mu = math.log(args[0]) if args[0] > 0 else 0.0
+            self._sample = lambda: self.rng.lognormvariate(mu, args[1])
+        else:
+            raise ValueError(f"Invalid latency spec: {spec}")
+
+    def sample(self):
+        """Return a latency in seconds."""
+        return max(0.0, self._sample()) / 1000.0
+
+    def __repr__(self):
+        return f"LatencyDistribution({self.spec!r})"
+
+
+class SimulatorConfig:
+    """Knobs controlling how the simulator behaves."""
+
+    def __init__(self, oauth_latency="fixed:20", push_latency="lognormal:150:0.4",
+                 query_latency="fixed:30", callback_delay="uniform:500:3000",
+                 push_failure_rate=0.0, callback_failure_rate=0.0,
+                 duplicate_rate=0.0, callback_workers=16, seed=None):
+        rng = random.Random(seed)
+        self.rng = rng
+        self.oauth_latency = LatencyDistribution(oauth_latency, rng)
+        self.push_latency = LatencyDistribution(push_latency, rng)
+        self.query_latency = LatencyDistribution(query_latency, rng)
+        self.callback_delay = LatencyDistribution(callback_delay, rng)
+        self.push_failure_rate = push_failure_rate
+        self.callback_failure_rate = callback_failure_rate
+        self.duplicate_rate = duplicate_rate
+        self.callback_workers = callback_workers
+
+
+class DarajaSimulator:
+    """
+    In-memory state of the simulated Daraja service.
+
+    Keeps track of issued checkout requests and delivers their callbacks on a
+    small thread pool so slow callback targets never block the HTTP handlers.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.lock = threading.Lock()
+        self.transactions = {}
+        self.stats = {
+            "oauth_requests": 0,
+            "stk_push_requests": 0,
+            "stk_push_rejected": 0,
+            "stk_query_requests": 0,
+            "callbacks_sent": 0,
+            "callbacks_failed_delivery": 0,
+            "callbacks_success": 0,
+            "callbacks_failure": 0,
+            "callbacks_duplicated": 0,
+        }
+        self.executor = ThreadPoolExecutor(max_workers=config.callback_workers,
+                                           thread_name_prefix="daraja-callback")
+
+    def _count(self, name, n=1):
+        with self.lock:
+            self.stats[name] += n
+
+    def _chance(self, rate):
+        with self.lock:
+            return self.config.rng.random() < rate
+
+    def issue_token(self):
+        self._count("oauth_requests")
+        time.sleep(self.config.oauth_latency.sample())
+        return {"access_token": uuid.uuid4().hex, "expires_in": "3599"}
+
+    def stk_push(self, payload):
+        """Accept (or reject) an STK push and schedule its callback."""
+        self._count("stk_push_requests")
+        time.sleep(self.config.push_latency.sample())
+
+        if self._chance(self.config.push_failure_rate):
+            self._count("stk_push_rejected")
+            return 500, {
+                "requestId": uuid.uuid4().hex,
+                "errorCode": "500.001.1001",
+                "errorMessage": "Unable to lock subscriber, a transaction is already in process for the current subscriber",
+            }
+
+        merchant_request_id = f"sim-{uuid.uuid4().hex[:12]}"
+        checkout_request_id = f"ws_CO_SIM_{uuid.uuid4().hex[:16]}"
+        succeed = not self._chance(self.config.callback_failure_rate)
+        if succeed:
+            result_code = RESULT_SUCCESS
+            result_desc = "The service request is processed successfully."
+        else:
+            with self.lock:
+                result_code = self.config.rng.choice(list(RESULT_FAILURES))
+            result_desc = RESULT_FAILURES[result_code]
+
+        transaction = {
+            "MerchantRequestID": merchant_request_id,
+            "CheckoutRequestID": checkout_request_id,
+            "ResultCode": result_code,
+            "ResultDesc": result_desc,
+            "payload": payload,
+            "completed": False,
+        }
+        with self.lock:
+            self.transactions[checkout_request_id] = transaction
+
+        delay = self.config.callback_delay.sample()
+        duplicate = self._chance(self.config.duplicate_rate)
+        self.executor.submit(self._deliver_callback, transaction, delay, duplicate)
+
+        return 200, {
+            "MerchantRequestID": merchant_request_id,
+            "CheckoutRequestID": checkout_request_id,
+            "ResponseCode": "0",
+            "ResponseDescription": "Success. Request accepted for processing",
+            "CustomerMessage": "Success. Request accepted for processing",
+        }
+
+    def stk_query(self, payload):
+        """Return the status of a checkout request."""
+        self._count("stk_query_requests")
+        time.sleep(self.config.query_latency.sample())
+        checkout_request_id = payload.get("CheckoutRequestID")
+        with self.lock:
+            transaction = self.transactions.get(checkout_request_id)
+
+        if transaction is None:
+            return 404, {"errorCode": "404.001.04", "errorMessage": "Invalid CheckoutRequestID"}
+        if not transaction["completed"]:
+            return 500, {"errorCode": "500.001.1001", "errorMessage": "The transaction is being processed"}
+        return 200, {
+            "ResponseCode": "0",
+            "ResponseDescription": "The service request has been accepted successsfully",
+            "MerchantRequestID": transaction["MerchantRequestID"],
+            "CheckoutRequestID": checkout_request_id,
+            "ResultCode": str(transaction["ResultCode"]),
+            "ResultDesc": transaction["ResultDesc"],
+        }
+
+    def build_callback(self, transaction):
+        """Build the callback body Safaricom POSTs to the CallBackURL."""
+        payload = transaction["payload"]
+        stk_callback = {
+            "MerchantRequestID": transaction["MerchantRequestID"],
+            "CheckoutRequestID": transaction["CheckoutRequestID"],
+            "ResultCode": transaction["ResultCode"],
+            "ResultDesc": transaction["ResultDesc"],
+        }
+        if transaction["ResultCode"] == RESULT_SUCCESS:
+            stk_callback["CallbackMetadata"] = {
+                "Item": [
+                    {"Name": "Amount", "Value": float(payload.get("Amount", 0))},
+                    {"Name": "MpesaReceiptNumber", "Value": uuid.uuid4().hex[:10].upper()},
+                    {"Name": "TransactionDate", "Value": int(datetime.now().strftime("%Y%m%d%H%M%S"))},
+                    {"Name": "PhoneNumber", "Value": payload.get("PhoneNumber")},
+                    {"Name": "AccountReference", "Value": payload.get("AccountReference", "")},
+                ]
+            }
+        return {"Body": {"stkCallback": stk_callback}}
+
+    def _deliver_callback(self, transaction, delay, duplicate):
+        time.sleep(delay)
+        with self.lock:
+            transaction["completed"] = True
+        body = json.dumps(self.build_callback(transaction)).encode()
+        url = transaction["payload"].get("CallBackURL")
+        if transaction["ResultCode"] == RESULT_SUCCESS:
+            self._count("callbacks_success")
+        else:
+            self._count("callbacks_failure")
+
+        for attempt in range(2 if duplicate else 1):
+            if attempt:
+                self._count("callbacks_duplicated")
+            try:
+                request = urllib.request.Request(
+                    url, data=body, headers={"Content-Type": "application/json"}, method="POST"
+                )
+                with urllib.request.urlopen(request, timeout=10) as response:
+                    response.read()
+                self._count("callbacks_sent")
+            except Exception as e:
+                self._count("callbacks_failed_delivery")
+                logger.warning(f"⚠️ [SIM] Callback to {url} failed: {e}")
+
+    def snapshot(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats["pending"] = sum(1 for t in self.transactions.values() if not t["completed"])
+        return stats
+
+
+class DarajaRequestHandler(BaseHTTPRequestHandler):
+    """Routes Daraja API paths to the simulator."""
+
+    server_version = "DarajaSimulator/1.0"
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def simulator(self):
+        return self.server.simulator
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+    def _send_json(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            return json.loads(self.rfile.read(length) or b"{}")
+        except json.JSONDecodeError:
+            return None
+
+    def _authorized(self):
+        return self.headers.get("Authorization", "").startswith("Bearer ")
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == "/oauth/v1/generate":
+            if not self.headers.get("Authorization", "").startswith("Basic "):
+                return self._send_json(400, {"errorCode": "400.008.01", "errorMessage": "Invalid Authentication passed"})
+            return self._send_json(200, self.simulator.issue_token())
+        if path == "/simulator/stats":
+            return self._send_json(200, self.simulator.snapshot())
+        return self._send_json(404, {"errorMessage": "Not found"})
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        payload = self._read_json()
+        if path not in ("/mpesa/stkpush/v1/processrequest", "/mpesa/stkpushquery/v1/query"):
+            return self._send_json(404, {"errorMessage": "Not found"})
+        if not self._authorized():
+            return self._send_json(401, {"errorCode": "404.001.03", "errorMessage": "Invalid Access Token"})
+        if payload is None:
+            return self._send_json(400, {"errorCode": "400.002.02", "errorMessage": "Bad Request - Invalid JSON"})
+
+        if path == "/mpesa/stkpush/v1/processrequest":
+            status, data = self.simulator.stk_push(payload)
+        else:
+            status, data = self.simulator.stk_query(payload)
+        return self._send_json(status, data)
+
+
+def make_server(host, port, config):
+    """Create (but do not start) a simulator HTTP server."""
+    server = ThreadingHTTPServer((host, port), DarajaRequestHandler)
+    server.daemon_threads = True
+    server.simulator = DarajaSimulator(config)
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local Daraja (M-PESA) simulator")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8010)
+    parser.add_argument("--oauth-latency", default="fixed:20", help="Latency spec in ms, e.g. fixed:20")
+    parser.add_argument("--push-latency", default="lognormal:150:0.4", help="STK push latency spec in ms")
+    parser.add_argument("--query-latency", default="fixed:30", help="STK query latency spec in ms")
+    parser.add_argument("--callback-delay", default="uniform:500:3000",
+                        help="Delay before the callback is POSTed (customer entering PIN), in ms")
+    parser.add_argument("--push-failure-rate", type=float, default=0.0,
+                        help="Fraction of STK pushes rejected outright")
+    parser.add_argument("--callback-failure-rate", type=float, default=0.0,
+                        help="Fraction of accepted pushes whose callback reports a failure")
+    parser.add_argument("--duplicate-rate", type=float, default=0.0,
+                        help="Fraction of callbacks delivered twice")
+    parser.add_argument("--callback-workers", type=int, default=16)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    config = SimulatorConfig(
+        oauth_latency=args.oauth_latency,
+        push_latency=args.push_latency,
+        query_latency=args.query_latency,
+        callback_delay=args.callback_delay,
+        push_failure_rate=args.push_failure_rate,
+        callback_failure_rate=args.callback_failure_rate,
+        duplicate_rate=args.duplicate_rate,
+        callback_workers=args.callback_workers,
+        seed=args.seed,
+    )
+    server = make_server(args.host, args.port, config)
+    logger.info(f"📡 Daraja simulator listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        logger.info(f"📊 Final stats: {server.simulator.snapshot()}")
+
+
+if __name__ == "__main__":
+    main()
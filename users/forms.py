@@ -1,6 +1,7 @@
 from django import forms
 from django.contrib.auth.models import User
 from django.contrib.auth.forms import UserCreationForm
+from myproject.uploads import BoundedImageField
 from .models import Profile
 
 
@@ -21,6 +22,8 @@ class UserUpdateForm(forms.ModelForm):
 
 
 class ProfileUpdateForm(forms.ModelForm):
+    image = BoundedImageField(max_size=Profile.IMAGE_SIZE)
+
     class Meta:
         model = Profile
         fields = ['image', 'bio', 'location']
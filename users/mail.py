@@ -0,0 +1,306 @@
+"""
+Asynchronous outbound email.
+
+The request path never talks to SMTP: OutboxEmailBackend (EMAIL_BACKEND)
+stores each message in the OutboundEmail table and returns immediately. An
+OutboxSender drains the table in batches over a single persistent SMTP
+connection, retrying failed messages with exponential backoff.
+
+The sender runs either as a daemon thread inside each web worker (started on
+the first enqueue when EMAIL_OUTBOX_THREAD is on) or as a separate process:
+
+    python manage.py send_queued_mail --loop
+
+Rows are claimed with a conditional UPDATE, so any number of senders can run
+against the same table without sending a message twice.
+
+A row stores the message as rendered (``message.message().as_bytes()``),
+with the SMTP envelope next to it: the sender and every recipient,
+including Bcc, which is not in the headers. Sending rebuilds an
+EmailMessage that returns those bytes as they are, so nothing in the table
+is ever unpickled or re-rendered, and a queued row does not depend on the
+Django version that wrote it.
+"""
+
+import logging
+import os
+import random
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.core.mail.backends.base import BaseEmailBackend
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from .models import OutboundEmail
+
+logger = logging.getLogger(__name__)
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+class OutboxEmailBackend(BaseEmailBackend):
+    """Email backend that enqueues messages in the outbox instead of sending them."""
+
+    def send_messages(self, email_messages):
+        if not email_messages:
+            return 0
+        now = timezone.now()
+        rows = [
+            OutboundEmail(
+                subject=str(message.subject)[:255],
+                from_email=message.from_email,
+                recipients='\n'.join(message.recipients()),
+                message=message.message().as_bytes(),
+                next_attempt_at=now,
+            )
+            for message in email_messages
+            if message.recipients()
+        ]
+        try:
+            OutboundEmail.objects.bulk_create(rows)
+        except Exception:
+            if not self.fail_silently:
+                raise
+            return 0
+
+        if _setting('EMAIL_OUTBOX_THREAD', True):
+            transaction.on_commit(wake_background_sender)
+        return len(rows)
+
+
+
+class RenderedMessage:
+    """The stored bytes of a message, in the interface the mail backends use."""
+
+    def __init__(self, data):
+        self.data = data
+
+    def as_bytes(self, unixfrom=False, linesep='\n'):
+        # Stored with \n line endings; SMTP asks for \r\n
+        return self.data.replace(b'\r\n', b'\n').replace(b'\n', linesep.encode())
+
+    def as_string(self, unixfrom=False, linesep='\n'):
+        return self.as_bytes(linesep=linesep).decode('utf-8', 'replace')
+
+    def get_charset(self):
+        return None
+
+
+class QueuedEmailMessage(EmailMessage):
+    """An OutboundEmail row as an EmailMessage: the stored envelope and bytes."""
+
+    def __init__(self, row, connection=None):
+        super().__init__(subject=row.subject, from_email=row.from_email, connection=connection)
+        self.envelope_recipients = row.recipients.splitlines()
+        self.data = bytes(row.message)
+
+    def recipients(self):
+        return self.envelope_recipients
+
+    def message(self, *args, **kwargs):
+        return RenderedMessage(self.data)
+
+
+class OutboxSender:
+    """
+    Sends queued messages in batches over one reusable transport connection.
+
+    Args:
+        batch_size: Messages claimed per batch.
+        max_attempts: Attempts before a message is marked failed.
+        backoff_base: Seconds to wait after the first failure; doubled per attempt.
+        backoff_max: Upper bound on the retry delay.
+        transport: Dotted path of the Django email backend that actually sends.
+    """
+
+    # A row stuck in 'sending' this long (e.g. the worker died) is retried
+    LOCK_TIMEOUT = timedelta(minutes=5)
+
+    def __init__(self, batch_size=None, max_attempts=None, backoff_base=None,
+                 backoff_max=None, transport=None):
+        self.batch_size = batch_size or _setting('EMAIL_OUTBOX_BATCH_SIZE', 50)
+        self.max_attempts = max_attempts or _setting('EMAIL_OUTBOX_MAX_ATTEMPTS', 6)
+        self.backoff_base = backoff_base or _setting('EMAIL_OUTBOX_BACKOFF_BASE', 30)
+        self.backoff_max = backoff_max or _setting('EMAIL_OUTBOX_BACKOFF_MAX', 3600)
+        self.transport = transport or _setting(
+            'EMAIL_OUTBOX_TRANSPORT', 'django.core.mail.backends.smtp.EmailBackend'
+        )
+        self.connection = None
+
+    def claim_batch(self):
+        """Claim up to batch_size due messages for this sender."""
+        now = timezone.now()
+        due = OutboundEmail.objects.filter(
+            status=OutboundEmail.PENDING, next_attempt_at__lte=now
+        ) | OutboundEmail.objects.filter(
+            status=OutboundEmail.SENDING, locked_at__lt=now - self.LOCK_TIMEOUT
+        )
+        candidates = list(due.order_by('next_attempt_at').values_list('pk', 'status')[:self.batch_size])
+
+        claimed = []
+        for pk, status in candidates:
+            # Only one sender can win the conditional update
+            if OutboundEmail.objects.filter(pk=pk, status=status).update(
+                status=OutboundEmail.SENDING, locked_at=now
+            ):
+                claimed.append(pk)
+        return list(OutboundEmail.objects.filter(pk__in=claimed).order_by('next_attempt_at'))
+
+    def open(self):
+        if self.connection is None:
+            self.connection = get_connection(self.transport, fail_silently=False)
+        self.connection.open()
+
+    def close(self):
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except Exception:
+                pass
+            self.connection = None
+
+    def retry_delay(self, attempts):
+        """Exponential backoff with jitter for the given attempt number."""
+        delay = min(self.backoff_max, self.backoff_base * (2 ** (attempts - 1)))
+        return timedelta(seconds=delay * random.uniform(0.8, 1.2))
+
+    def send_batch(self):
+        """
+        Send one batch of due messages.
+
+        Returns:
+            tuple: (sent, failed) counts for the batch.
+        """
+        batch = self.claim_batch()
+        if not batch:
+            return 0, 0
+
+        sent = failed = 0
+        for row in batch:
+            try:
+                if self.connection is None:
+                    self.open()
+                message = QueuedEmailMessage(row, connection=self.connection)
+                if not self.connection.send_messages([message]):
+                    raise RuntimeError('The mail backend did not send the message')
+            except Exception as e:
+                failed += 1
+                # Drop the connection; it is reopened for the next message
+                self.close()
+                self._mark_failed(row, e)
+            else:
+                sent += 1
+                row.status = OutboundEmail.SENT
+                row.sent_at = timezone.now()
+                row.attempts += 1
+                row.locked_at = None
+                row.save(update_fields=['status', 'sent_at', 'attempts', 'locked_at'])
+
+        logger.info(f"📧 Outbox batch: {sent} sent, {failed} failed")
+        return sent, failed
+
+    def _mark_failed(self, row, error):
+        row.attempts += 1
+        row.last_error = str(error)[:1000]
+        row.locked_at = None
+        if row.attempts >= self.max_attempts:
+            row.status = OutboundEmail.FAILED
+            logger.error(f"❌ Giving up on email {row.pk} to {', '.join(row.recipients.splitlines())}: {error}")
+        else:
+            row.status = OutboundEmail.PENDING
+            row.next_attempt_at = timezone.now() + self.retry_delay(row.attempts)
+            logger.warning(f"⚠️ Email {row.pk} failed (attempt {row.attempts}), retrying at {row.next_attempt_at}: {error}")
+        row.save(update_fields=['status', 'attempts', 'last_error', 'locked_at', 'next_attempt_at'])
+
+    def drain(self):
+        """Send batches until nothing is due. Returns (sent, failed) totals."""
+        total_sent = total_failed = 0
+        try:
+            while True:
+                sent, failed = self.send_batch()
+                total_sent += sent
+                total_failed += failed
+                if not sent and not failed:
+                    break
+        finally:
+            self.close()
+        return total_sent, total_failed
+
+    def run(self, stop_event, wake_event=None, interval=None, idle_timeout=None):
+        """
+        Keep draining the outbox until stop_event is set.
+
+        Waits up to interval seconds (or until wake_event is set) between
+        polls. The SMTP connection is kept open between batches and closed
+        after idle_timeout seconds without mail, so bursts reuse one handshake.
+        """
+        interval = interval or _setting('EMAIL_OUTBOX_POLL_INTERVAL', 5)
+        idle_timeout = idle_timeout or _setting('EMAIL_OUTBOX_IDLE_TIMEOUT', 30)
+        last_activity = time.monotonic()
+        try:
+            while not stop_event.is_set():
+                try:
+                    sent, failed = self.send_batch()
+                except Exception as e:
+                    logger.error(f"❌ Outbox sender error: {e}", exc_info=True)
+                    sent = failed = 0
+                    self.close()
+                finally:
+                    close_old_connections()
+
+                if sent or failed:
+                    last_activity = time.monotonic()
+                    continue
+                if self.connection is not None and time.monotonic() - last_activity >= idle_timeout:
+                    self.close()
+                if wake_event is not None:
+                    wake_event.wait(interval)
+                    wake_event.clear()
+                else:
+                    stop_event.wait(interval)
+        finally:
+            self.close()
+
+
+# Per-process background sender thread
+_thread_lock = threading.Lock()
+_thread = None
+_thread_pid = None
+_wake_event = threading.Event()
+_stop_event = threading.Event()
+
+
+def _background_loop():
+    OutboxSender().run(_stop_event, wake_event=_wake_event)
+
+
+def wake_background_sender():
+    """Start this process's sender thread if needed and wake it up."""
+    global _thread, _thread_pid
+    with _thread_lock:
+        # Threads do not survive fork, so restart after gunicorn forks a worker
+        if _thread is None or not _thread.is_alive() or _thread_pid != os.getpid():
+            _stop_event.clear()
+            _thread = threading.Thread(target=_background_loop, name='email-outbox', daemon=True)
+            _thread_pid = os.getpid()
+            _thread.start()
+    _wake_event.set()
+
+
+def stop_background_sender(timeout=None):
+    """
+    Ask the sender thread to finish its current batch and exit.
+
+    With a timeout, wait up to that many seconds for it to finish (used when
+    a gunicorn worker exits, so queued mail is not left half-sent).
+    """
+    _stop_event.set()
+    _wake_event.set()
+    if timeout is not None and _thread is not None and _thread_pid == os.getpid():
+        _thread.join(timeout)
@@ -0,0 +1,31 @@
+import signal
+import threading
+
+from django.core.management.base import BaseCommand
+
+from users.mail import OutboxSender
+
+
+class Command(BaseCommand):
+    help = 'Send queued emails from the outbox over a persistent SMTP connection'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep running and poll the outbox instead of draining it once')
+        parser.add_argument('--batch-size', type=int, default=None)
+        parser.add_argument('--interval', type=float, default=None,
+                            help='Seconds between polls when the outbox is empty (with --loop)')
+
+    def handle(self, *args, **options):
+        sender = OutboxSender(batch_size=options['batch_size'])
+
+        if not options['loop']:
+            sent, failed = sender.drain()
+            self.stdout.write(self.style.SUCCESS(f'Sent {sent} emails, {failed} failed'))
+            return
+
+        stop_event = threading.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(sig, lambda *args: stop_event.set())
+        self.stdout.write('Sending queued emails (Ctrl+C to stop)...')
+        sender.run(stop_event, interval=options['interval'])
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.8 on 2026-10-19 11:44
+
+import blog.archive
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0007_archivedpost'),
+        ('users', '0006_alter_paymentaccess_user'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='paymentaccess',
+            name='post',
+            field=models.ForeignKey(db_constraint=False, on_delete=blog.archive.cascade_unless_archiving, related_name='payments', to='blog.post'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.8 on 2026-10-19 11:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0007_alter_paymentaccess_post'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='image_color',
+            field=models.CharField(blank=True, editable=False, max_length=7),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='image_lqip',
+            field=models.TextField(blank=True, editable=False),
+        ),
+    ]
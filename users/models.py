@@ -1,15 +1,21 @@
 from django.db import models
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save
-from django.dispatch import receiver
+from django.utils import timezone
 from PIL import Image  
 import os
+from blog.archive import cascade_unless_archiving
+from myproject.uploads import placeholder_from_image
 
 
 class PaymentAccess(models.Model):
     """Model to track which users have paid to view which posts"""
-    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="payments")
-    post = models.ForeignKey("blog.Post", on_delete=models.CASCADE, related_name="payments")
+    # Stored with the post: with region sharding the user can be in another
+    # database, so no database constraint (see blog/sharding.py)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="payments", db_constraint=False)
+    # Kept when the post is archived, so the post's id then refers to an
+    # ArchivedPost (see blog/archive.py)
+    post = models.ForeignKey("blog.Post", on_delete=cascade_unless_archiving, related_name="payments",
+                             db_constraint=False)
     paid = models.BooleanField(default=False)
     created = models.DateTimeField(auto_now_add=True)
 
@@ -20,46 +26,114 @@ class PaymentAccess(models.Model):
         return f"{self.user} - {self.post} - {self.paid}"
 
 
+class OutboundEmail(models.Model):
+    """Queued outgoing email, sent in the background by users.mail.OutboxSender"""
+    PENDING = 'pending'
+    SENDING = 'sending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (SENDING, 'Sending'),
+        (SENT, 'Sent'),
+        (FAILED, 'Failed'),
+    ]
+
+    subject = models.CharField(max_length=255, blank=True)
+    # SMTP envelope: the sender and every recipient (Bcc included), one per line
+    from_email = models.CharField(max_length=255, blank=True)
+    recipients = models.TextField()
+    # The rendered message (headers and body) as sent
+    message = models.BinaryField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'next_attempt_at'])]
+
+    def __str__(self):
+        return f"{self.subject} -> {', '.join(self.recipients.splitlines())} ({self.status})"
+
+
 class Profile(models.Model):
+    # Avatars are resized to fit within this box once per upload
+    IMAGE_SIZE = (300, 300)
+
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     bio = models.TextField(blank=True)
     location = models.CharField(max_length=30, blank=True)
     phone_number = models.CharField(max_length=20, blank=True, help_text="Phone number for Mpesa payments (format: 254...)")
     image = models.ImageField(upload_to='profile_pics/', default='default.jpg')
+    # Dimensions of the processed avatar, cached so saves that don't touch the
+    # image never need to open it
+    image_width = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    image_height = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    # Placeholder shown while the avatar loads (see myproject/uploads.py)
+    image_lqip = models.TextField(blank=True, editable=False)
+    image_color = models.CharField(max_length=7, blank=True, editable=False)
 
     def __str__(self):
         return f'{self.user.username} Profile'
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember which image was stored so save() can tell if it changed
+        if 'image' in field_names:
+            instance._processed_image_name = values[field_names.index('image')]
+        return instance
+
+    def image_needs_processing(self):
+        """True if the image changed since it was loaded or was never processed"""
+        # The default avatar is one file shared by every profile: never
+        # opened, let alone resized in place
+        if self.image.name == self._meta.get_field('image').default:
+            return False
+        if self.image.name != getattr(self, '_processed_image_name', None):
+            return True
+        return self.image_width is None and not getattr(self, '_image_checked', False)
+
     def save(self, *args, **kwargs):
+        needs_processing = self.image_needs_processing()
         super().save(*args, **kwargs)
 
+        if needs_processing:
+            self._process_image()
+
+    def _process_image(self):
+        """Resize the avatar once per upload and cache its dimensions and placeholder."""
+        self._processed_image_name = self.image.name
+        self._image_checked = True
+
         # Resize the profile image if necessary. Be defensive: the default
         # image file may not exist (for example in fresh clones), so guard
         # against missing files to avoid crashing on Profile.save().
         try:
             # Only attempt to open if the file actually exists
-            if hasattr(self.image, 'path') and os.path.exists(self.image.path):
-                img = Image.open(self.image.path)
+            if not (self.image and hasattr(self.image, 'path') and os.path.exists(self.image.path)):
+                return
 
-                if img.height > 300 or img.width > 300:
-                    output_size = (300, 300)
-                    img.thumbnail(output_size)
+            with Image.open(self.image.path) as img:
+                if img.height > self.IMAGE_SIZE[1] or img.width > self.IMAGE_SIZE[0]:
+                    img.thumbnail(self.IMAGE_SIZE)
                     img.save(self.image.path)
+                width, height = img.size
+                lqip, color = placeholder_from_image(img)
         except Exception:
             # If anything goes wrong (missing file, PIL error), skip resizing.
             # This prevents site crashes when creating Profiles while the
             # default image hasn't been added to MEDIA_ROOT yet.
-            pass
-
-
-@receiver(post_save, sender=User)
-def create_profile(sender, instance, created, **kwargs):
-    """Automatically create a Profile when a new User is created"""
-    if created:
-        Profile.objects.create(user=instance)
-
+            return
 
-@receiver(post_save, sender=User)
-def save_profile(sender, instance, **kwargs):
-    """Automatically save the Profile when the User is saved"""
-    instance.profile.save()
+        cached = (width, height, lqip, color)
+        if cached != (self.image_width, self.image_height, self.image_lqip, self.image_color):
+            self.image_width, self.image_height, self.image_lqip, self.image_color = cached
+            # Update only the cached fields; a full save would re-run this
+            Profile.objects.filter(pk=self.pk).update(
+                image_width=width, image_height=height, image_lqip=lqip, image_color=color
+            )
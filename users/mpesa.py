@@ -7,15 +7,26 @@ This module handles:
 - STK Push payment requests
 - Callback response processing
 - Transaction logging and validation
+
+The a-prefixed functions are async versions for the ASGI views (see
+myproject/asgi.py). They use httpx with one connection pool per event loop,
+so a slow Daraja call only suspends the request waiting on it.
 """
 
+import asyncio
 import requests
 import base64
+import httpx
 import logging
+import time
+import weakref
+from contextlib import asynccontextmanager
 from datetime import datetime
 from django.conf import settings
+from django.core.cache import cache
 from requests.auth import HTTPBasicAuth
 from .models import PaymentAccess
+from myproject import metrics
 
 # Configure logging for payment debugging
 logger = logging.getLogger(__name__)
@@ -35,7 +46,7 @@ def get_access_token():
         Exception: If OAuth request fails or returns invalid response
     """
     try:
-        url = "https://sandbox.safaricom.co.ke/oauth/v1/generate?grant_type=client_credentials"
+        url = settings.MPESA_OAUTH_URL
         
         # Authenticate using credentials from Django settings
         auth = HTTPBasicAuth(
@@ -43,7 +54,13 @@ def get_access_token():
             settings.MPESA_CONSUMER_SECRET
         )
         
-        response = requests.get(url, auth=auth, timeout=10)
+        started = time.perf_counter()
+        try:
+            response = requests.get(url, auth=auth, timeout=10)
+        except requests.exceptions.RequestException:
+            metrics.observe_daraja('oauth', 'error', time.perf_counter() - started)
+            raise
+        metrics.observe_daraja('oauth', str(response.status_code), time.perf_counter() - started)
         response.raise_for_status()  # Raise exception for HTTP errors
         
         access_token = response.json().get("access_token")
@@ -126,12 +143,18 @@ def stk_push_payment(phone, amount, post_id, user):
         
         # Step 7: Send STK Push request to Safaricom
         logger.info(f"📱 Sending STK Push for {phone_number}, amount: {amount} KES")
-        response = requests.post(
-            settings.MPESA_STK_URL,
-            json=payload,
-            headers=headers,
-            timeout=10
-        )
+        started = time.perf_counter()
+        try:
+            response = requests.post(
+                settings.MPESA_STK_URL,
+                json=payload,
+                headers=headers,
+                timeout=10
+            )
+        except requests.exceptions.RequestException:
+            metrics.observe_daraja('stk_push', 'error', time.perf_counter() - started)
+            raise
+        metrics.observe_daraja('stk_push', str(response.status_code), time.perf_counter() - started)
         response.raise_for_status()
         
         result = response.json()
@@ -156,4 +179,197 @@ def stk_push_payment(phone, amount, post_id, user):
         raise
 
 
+def stk_query(checkout_request_id):
+    """
+    Query the status of an STK Push request.
+    
+    Args:
+        checkout_request_id (str): CheckoutRequestID returned by stk_push_payment
+    
+    Returns:
+        dict: Response from Safaricom. ResultCode "0" means the payment completed;
+            an errorCode means the transaction is still being processed.
+            
+    Raises:
+        Exception: If access token generation fails or the query request fails
+    """
+    try:
+        access_token = get_access_token()
+        timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+        password_string = settings.MPESA_SHORTCODE + settings.MPESA_PASSKEY + timestamp
+        password = base64.b64encode(password_string.encode()).decode()
+        
+        payload = {
+            "BusinessShortCode": settings.MPESA_SHORTCODE,
+            "Password": password,
+            "Timestamp": timestamp,
+            "CheckoutRequestID": checkout_request_id,
+        }
+        headers = {
+            "Authorization": f"Bearer {access_token}",
+            "Content-Type": "application/json"
+        }
+        
+        started = time.perf_counter()
+        try:
+            response = requests.post(
+                settings.MPESA_STK_QUERY_URL,
+                json=payload,
+                headers=headers,
+                timeout=10
+            )
+        except requests.exceptions.RequestException:
+            metrics.observe_daraja('stk_query', 'error', time.perf_counter() - started)
+            raise
+        metrics.observe_daraja('stk_query', str(response.status_code), time.perf_counter() - started)
+        # Daraja answers 500 while the transaction is still being processed
+        return response.json()
+        
+    except requests.exceptions.RequestException as e:
+        logger.error(f"❌ STK Query request failed: {str(e)}")
+        raise Exception(f"STK Query request failed: {str(e)}")
+    except ValueError as e:
+        logger.error(f"❌ Invalid STK Query response: {str(e)}")
+        raise Exception(f"Invalid STK Query response: {str(e)}")
+
+
+
+# Async client (ASGI)
+
+# Daraja tokens are valid for an hour; reuse one across requests and workers
+ACCESS_TOKEN_CACHE_KEY = 'mpesa:access_token'
+ACCESS_TOKEN_MARGIN = 60  # seconds before expiry to fetch a new token
+
+# httpx pools are bound to the event loop they were created on
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def _new_async_client():
+    return httpx.AsyncClient(
+        timeout=10,
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+    )
+
+
+@asynccontextmanager
+async def async_client():
+    """
+    Yield an httpx.AsyncClient for a Daraja call.
+    
+    Under ASGI the worker's event loop lives as long as the process, so one
+    pooled client per loop is shared by all requests. Under WSGI every async
+    view runs on a short-lived loop of its own, so the client is closed with
+    the call instead of leaking its connections.
+    """
+    if not settings.ASYNC_VIEWS:
+        async with _new_async_client() as client:
+            yield client
+        return
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = _async_clients[loop] = _new_async_client()
+    yield client
+
+
+def stk_password(timestamp):
+    """Base64 of SHORTCODE + PASSKEY + TIMESTAMP, as required by Daraja."""
+    password_string = settings.MPESA_SHORTCODE + settings.MPESA_PASSKEY + timestamp
+    return base64.b64encode(password_string.encode()).decode()
 
+
+async def aget_access_token():
+    """
+    Async version of get_access_token().
+    
+    The token is kept in the shared cache until shortly before it expires,
+    so most requests skip the OAuth round trip entirely.
+    
+    Returns:
+        str: Access token for API authorization
+        
+    Raises:
+        Exception: If OAuth request fails or returns invalid response
+    """
+    access_token = await cache.aget(ACCESS_TOKEN_CACHE_KEY)
+    if access_token:
+        return access_token
+
+    started = time.perf_counter()
+    try:
+        async with async_client() as client:
+            response = await client.get(
+                settings.MPESA_OAUTH_URL,
+                auth=(settings.MPESA_CONSUMER_KEY, settings.MPESA_CONSUMER_SECRET),
+            )
+    except httpx.HTTPError as e:
+        metrics.observe_daraja('oauth', 'error', time.perf_counter() - started)
+        logger.error(f"❌ OAuth request failed: {str(e)}")
+        raise Exception(f"Failed to get access token: {str(e)}")
+    metrics.observe_daraja('oauth', str(response.status_code), time.perf_counter() - started)
+
+    try:
+        response.raise_for_status()
+        data = response.json()
+        access_token = data.get("access_token")
+        if not access_token:
+            raise ValueError("No access_token in OAuth response")
+        expires_in = int(data.get("expires_in", 3599))
+    except httpx.HTTPError as e:
+        logger.error(f"❌ OAuth request failed: {str(e)}")
+        raise Exception(f"Failed to get access token: {str(e)}")
+    except (KeyError, ValueError) as e:
+        logger.error(f"❌ Invalid OAuth response: {str(e)}")
+        raise Exception(f"Invalid OAuth response: {str(e)}")
+
+    await cache.aset(ACCESS_TOKEN_CACHE_KEY, access_token, max(1, expires_in - ACCESS_TOKEN_MARGIN))
+    logger.info("✅ M-PESA access token generated successfully")
+    return access_token
+
+
+async def astk_query(checkout_request_id):
+    """
+    Async version of stk_query().
+    
+    Args:
+        checkout_request_id (str): CheckoutRequestID returned by stk_push_payment
+    
+    Returns:
+        dict: Response from Safaricom. ResultCode "0" means the payment completed;
+            an errorCode means the transaction is still being processed.
+            
+    Raises:
+        Exception: If access token generation fails or the query request fails
+    """
+    access_token = await aget_access_token()
+    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+    payload = {
+        "BusinessShortCode": settings.MPESA_SHORTCODE,
+        "Password": stk_password(timestamp),
+        "Timestamp": timestamp,
+        "CheckoutRequestID": checkout_request_id,
+    }
+    headers = {
+        "Authorization": f"Bearer {access_token}",
+        "Content-Type": "application/json"
+    }
+
+    started = time.perf_counter()
+    try:
+        async with async_client() as client:
+            response = await client.post(settings.MPESA_STK_QUERY_URL, json=payload, headers=headers)
+    except httpx.HTTPError as e:
+        metrics.observe_daraja('stk_query', 'error', time.perf_counter() - started)
+        logger.error(f"❌ STK Query request failed: {str(e)}")
+        raise Exception(f"STK Query request failed: {str(e)}")
+    metrics.observe_daraja('stk_query', str(response.status_code), time.perf_counter() - started)
+
+    if response.status_code == 401:
+        # Token revoked or expired early: fetch a fresh one next time
+        await cache.adelete(ACCESS_TOKEN_CACHE_KEY)
+    try:
+        # Daraja answers 500 while the transaction is still being processed
+        return response.json()
+    except ValueError as e:
+        logger.error(f"❌ Invalid STK Query response: {str(e)}")
+        raise Exception(f"Invalid STK Query response: {str(e)}")
@@ -0,0 +1,177 @@
+import uuid
+
+from django.core.cache import cache
+from blog.sharding import PostShardService
+from myproject import metrics
+from .models import PaymentAccess, Profile
+
+
+async def aget_request_user(request):
+    """
+    Resolve request.user in an async view, with the profile preloaded.
+
+    Templates read ``user.profile`` (the navbar avatar). A lazy query there
+    would run on the event loop, which Django refuses, so the profile is
+    loaded here and the resolved user replaces the lazy request.user.
+
+    Returns:
+        User or AnonymousUser
+    """
+    user = await request.auser()
+    if user.is_authenticated:
+        user.profile, _ = await Profile.objects.aget_or_create(user=user)
+    request.user = user
+    return user
+
+
+class PaymentAccessService:
+    """
+    Service class to handle paid-post entitlements.
+    Keeps a per-user set of the post ids a user has paid for in the cache so
+    detail views and post listings can check access without a query per post.
+    PaymentAccess rows live with their post, on its shard when posts are
+    sharded by region (blog/sharding.py).
+
+    Every change to a user's PaymentAccess rows invalidates the set (the
+    post_save/post_delete signals in users/signals.py) by giving the user a
+    new version token. The set is cached together with the token it was
+    loaded under, so a set read from the database just before a payment was
+    recorded, and written to the cache just after, carries the old token and
+    is ignored. The cache is shared between workers (Redis or the database
+    cache in production), so a cached set is authoritative, misses included.
+    """
+
+    CACHE_KEY = 'payment_access:paid_posts:{user_id}'
+    VERSION_KEY = 'payment_access:version:{user_id}'
+    CACHE_TIMEOUT = 60 * 60  # 1 hour
+
+    @classmethod
+    def cache_key(cls, user_id):
+        return cls.CACHE_KEY.format(user_id=user_id)
+
+    @classmethod
+    def version_key(cls, user_id):
+        return cls.VERSION_KEY.format(user_id=user_id)
+
+    @classmethod
+    def get_paid_post_ids(cls, user):
+        """
+        Return the set of post ids the given user has paid for.
+
+        The set is loaded from the database once and then served from the
+        cache. It is also memoised on the user object so repeated lookups in
+        the same request do not hit the cache again.
+
+        Args:
+            user: A Django User (anonymous users have no entitlements).
+
+        Returns:
+            frozenset: Ids of the posts the user can view.
+        """
+        if not user.is_authenticated:
+            return frozenset()
+
+        paid_post_ids = getattr(user, '_paid_post_ids', None)
+        if paid_post_ids is None:
+            key, version_key = cls.cache_key(user.pk), cls.version_key(user.pk)
+            cached = cache.get_many([key, version_key])
+            version = cached.get(version_key)
+            if version is None:
+                cache.add(version_key, uuid.uuid4().hex, None)
+                version = cache.get(version_key)
+            entry = cached.get(key)
+            hit = entry is not None and entry[0] == version
+            metrics.record_cache('paid_posts', hit)
+            if hit:
+                paid_post_ids = entry[1]
+            else:
+                paid_post_ids = frozenset(
+                    post_id for shard in PostShardService.shards()
+                    for post_id in PaymentAccess.objects.using(shard).filter(user_id=user.pk, paid=True)
+                    .values_list('post_id', flat=True)
+                )
+                cache.set(key, (version, paid_post_ids), cls.CACHE_TIMEOUT)
+            user._paid_post_ids = paid_post_ids
+        return paid_post_ids
+
+    @classmethod
+    def has_access(cls, user, post_id):
+        """Check whether the user has paid for the given post (no query once the set is cached)."""
+        return post_id in cls.get_paid_post_ids(user)
+
+    @classmethod
+    def grant_access(cls, user, post):
+        """
+        Record a successful payment and invalidate the cached set.
+
+        Returns:
+            tuple: (PaymentAccess, created) as returned by update_or_create.
+        """
+        payment_access, created = PaymentAccess.objects.using(PostShardService.shard_of(post)).update_or_create(
+            user=user,
+            # post_id: the post can be an ArchivedPost
+            post_id=post.pk,
+            defaults={"paid": True}
+        )
+        # The post_save signal has invalidated the cache already; this also
+        # drops the copy memoised on this user object
+        cls.invalidate(user.pk)
+        user.__dict__.pop('_paid_post_ids', None)
+        return payment_access, created
+
+    # Async counterparts for the ASGI views (same cache entries)
+
+    @classmethod
+    async def aget_paid_post_ids(cls, user):
+        """Async version of get_paid_post_ids()."""
+        if not user.is_authenticated:
+            return frozenset()
+
+        paid_post_ids = getattr(user, '_paid_post_ids', None)
+        if paid_post_ids is None:
+            key, version_key = cls.cache_key(user.pk), cls.version_key(user.pk)
+            cached = await cache.aget_many([key, version_key])
+            version = cached.get(version_key)
+            if version is None:
+                await cache.aadd(version_key, uuid.uuid4().hex, None)
+                version = await cache.aget(version_key)
+            entry = cached.get(key)
+            hit = entry is not None and entry[0] == version
+            metrics.record_cache('paid_posts', hit)
+            if hit:
+                paid_post_ids = entry[1]
+            else:
+                paid_post_ids = frozenset([
+                    post_id for shard in PostShardService.shards() async for post_id in
+                    PaymentAccess.objects.using(shard).filter(user_id=user.pk, paid=True).values_list('post_id', flat=True)
+                ])
+                await cache.aset(key, (version, paid_post_ids), cls.CACHE_TIMEOUT)
+            user._paid_post_ids = paid_post_ids
+        return paid_post_ids
+
+    @classmethod
+    async def ahas_access(cls, user, post_id):
+        """Async version of has_access()."""
+        return post_id in await cls.aget_paid_post_ids(user)
+
+    @classmethod
+    async def agrant_access(cls, user, post):
+        """Async version of grant_access()."""
+        payment_access, created = await PaymentAccess.objects.using(PostShardService.shard_of(post)).aupdate_or_create(
+            user=user,
+            # post_id: the post can be an ArchivedPost
+            post_id=post.pk,
+            defaults={"paid": True}
+        )
+        await cls.ainvalidate(user.pk)
+        user.__dict__.pop('_paid_post_ids', None)
+        return payment_access, created
+
+    @classmethod
+    def invalidate(cls, user_id):
+        """Give the user a new version, so the cached set is reloaded on the next lookup."""
+        cache.set(cls.version_key(user_id), uuid.uuid4().hex, None)
+
+    @classmethod
+    async def ainvalidate(cls, user_id):
+        await cache.aset(cls.version_key(user_id), uuid.uuid4().hex, None)
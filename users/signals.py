@@ -1,12 +1,32 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.contrib.auth.models import User
 from django.dispatch import receiver
-from .models import Profile
+from .models import PaymentAccess, Profile
+from .services import PaymentAccessService
 
-@receiver(post_save, sender=User)
+
+@receiver(post_save, sender=User, dispatch_uid='users.create_profile')
 def create_profile(sender, instance, created, **kwargs):
+    """Automatically create a Profile when a new User is created"""
     if created:
         Profile.objects.create(user=instance)
-@receiver(post_save, sender=User)
-def save_profile(sender, instance, **kwargs):
-    instance.profile.save()
\ No newline at end of file
+
+
+@receiver(post_save, sender=User, dispatch_uid='users.save_profile')
+def save_profile(sender, instance, created, update_fields=None, **kwargs):
+    """Automatically save the Profile when the User is saved"""
+    # Logins only touch last_login; there is nothing to propagate then
+    if created or (update_fields and set(update_fields) <= {'last_login'}):
+        return
+    try:
+        profile = instance.profile
+    except Profile.DoesNotExist:
+        return
+    profile.save()
+
+
+@receiver(post_save, sender=PaymentAccess, dispatch_uid='users.invalidate_paid_posts_save')
+@receiver(post_delete, sender=PaymentAccess, dispatch_uid='users.invalidate_paid_posts_delete')
+def invalidate_paid_posts(sender, instance, **kwargs):
+    """Drop the cached paid-post set when a PaymentAccess row changes (e.g. in the admin)"""
+    PaymentAccessService.invalidate(instance.user_id)
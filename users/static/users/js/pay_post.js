@@ -0,0 +1,7 @@
+document.getElementById('paymentForm')?.addEventListener('submit', function(e) {
+    const payBtn = document.getElementById('payBtn');
+    if (payBtn) {
+        payBtn.disabled = true;
+        payBtn.innerHTML = '<span class="spinner-border spinner-border-sm me-2"></span>Processing payment...';
+    }
+});
@@ -1,3 +1,374 @@
-from django.test import TestCase
+import json
+import smtplib
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail import EmailMessage
+from django.http import HttpResponse
+from django.test import AsyncRequestFactory, RequestFactory, TestCase, override_settings
+from django.urls import reverse
+
+from blog.archive import ArchiveService
+from blog.models import Post
+from myproject.budgets import BudgetTestMixin
+from myproject.ratelimit import TokenBucket, client_ip, ratelimit
+from django.utils import timezone
+
+from users import mpesa_mock, views
+from users.mail import OutboxEmailBackend, OutboxSender
+from users.models import OutboundEmail, PaymentAccess, Profile
+from users.services import PaymentAccessService
+
+
+def callback_body(post, user):
+    return json.dumps({'Body': {'stkCallback': {
+        'MerchantRequestID': '1', 'CheckoutRequestID': 'ws_CO_1', 'ResultCode': 0,
+        'ResultDesc': 'The service request has been processed successfully.',
+        'CallbackMetadata': {'Item': [
+            {'Name': 'Amount', 'Value': 100.0},
+            {'Name': 'MpesaReceiptNumber', 'Value': 'ABC123'},
+            {'Name': 'AccountReference', 'Value': f'POST_{post.pk}_{user.pk}'},
+        ]},
+    }}})
+
+
+@override_settings(SECURE_SSL_REDIRECT=False, RATELIMIT_ENABLE=False)
+class PaymentBudgetTests(BudgetTestMixin, TestCase):
+    """Query, time and allocation budgets for the payment views (see myproject/budgets.py)."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author', 'author@example.com', 'pw')
+        cls.buyer = User.objects.create_user('buyer', 'buyer@example.com', 'pw')
+        Profile.objects.filter(user=cls.buyer).update(phone_number='254712345678')
+        cls.post = Post.objects.create(title='Lost black wallet', content='At the bus stage', author=cls.author)
+
+    def test_pay_post_form(self):
+        self.client.force_login(self.buyer)
+        url = reverse('pay_post', args=[self.post.pk])
+        self.assertWithinBudget('pay_post', lambda: self.client.get(url))
+
+    def test_pay_post_stk_push(self):
+        self.client.force_login(self.buyer)
+        url = reverse('pay_post', args=[self.post.pk])
+        # The mock backend approves the payment without calling Daraja
+        with mock.patch('users.views.stk_push_payment', mpesa_mock.stk_push_payment):
+            self.assertWithinBudget('pay_post', lambda: self.client.post(url), 'stk-push')
+
+    def test_mpesa_callback(self):
+        body = callback_body(self.post, self.buyer)
+        self.assertWithinBudget(
+            'mpesa_callback',
+            lambda: self.client.post(reverse('mpesa_callback'), body, content_type='application/json'),
+        )
+
+
+@override_settings(SECURE_SSL_REDIRECT=False, RATELIMIT_ENABLE=True)
+class RateLimitTests(TestCase):
+    """Token buckets and the ratelimit decorator (myproject/ratelimit.py)."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author', 'author@example.com', 'pw')
+        cls.buyer = User.objects.create_user('buyer', 'buyer@example.com', 'pw')
+        Profile.objects.filter(user=cls.buyer).update(phone_number='254712345678')
+        cls.post = Post.objects.create(title='Lost black wallet', content='At the bus stage', author=cls.author)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_bucket_refills_at_its_rate_up_to_its_capacity(self):
+        bucket = TokenBucket('test', '2/s')
+        self.assertEqual(bucket.consume('k', now=100.0), (True, 0.0))
+        self.assertEqual(bucket.consume('k', now=100.0), (True, 0.0))
+        self.assertEqual(bucket.consume('k', now=100.0), (False, 0.5))
+        # Half a second refills one token
+        self.assertEqual(bucket.consume('k', now=100.5), (True, 0.0))
+        self.assertFalse(bucket.consume('k', now=100.5)[0])
+        # A long pause refills to the capacity, not beyond
+        self.assertTrue(bucket.consume('k', now=200.0)[0])
+        self.assertTrue(bucket.consume('k', now=200.0)[0])
+        self.assertFalse(bucket.consume('k', now=200.0)[0])
+        # Keys have separate buckets
+        self.assertTrue(bucket.consume('other', now=200.0)[0])
+
+    def test_contended_bucket_limits_instead_of_skipping_the_lock(self):
+        bucket = TokenBucket('test', '5/m')
+        cache.add(f"{bucket.cache_key('k')}:lock", 1, 60)
+        with mock.patch('myproject.ratelimit.time.sleep'):
+            allowed, retry_after = bucket.consume('k')
+        self.assertFalse(allowed)
+        self.assertGreater(retry_after, 0)
+        self.assertIsNone(cache.get(bucket.cache_key('k')))
+
+    def test_client_ip_uses_the_entry_added_by_our_proxy(self):
+        request = RequestFactory().get('/', HTTP_X_FORWARDED_FOR='6.6.6.6, 41.90.1.2', REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(client_ip(request), '41.90.1.2')
+        with override_settings(RATELIMIT_TRUSTED_PROXIES=2):
+            self.assertEqual(client_ip(request), '6.6.6.6')
+        with override_settings(RATELIMIT_TRUSTED_PROXIES=0):
+            self.assertEqual(client_ip(request), '10.0.0.1')
+
+    def test_decorator_returns_429_once_the_bucket_is_empty(self):
+        view = ratelimit('test:ip', key='ip', rate='2/m', methods=['POST'])(lambda request: HttpResponse('ok'))
+        factory = RequestFactory()
+        statuses = [view(factory.post('/')).status_code for _ in range(3)]
+        self.assertEqual(statuses, [200, 200, 429])
+        self.assertEqual(view(factory.get('/')).status_code, 200)
+        self.assertGreaterEqual(int(view(factory.post('/'))['Retry-After']), 1)
+
+    def test_pay_post_only_charges_the_daraja_bucket_when_allowed(self):
+        self.client.force_login(self.buyer)
+        url = reverse('pay_post', args=[self.post.pk])
+        with override_settings(RATELIMIT_RATES={'pay_post:user': '1/m'}), \
+                mock.patch('users.views.stk_push_payment', mpesa_mock.stk_push_payment):
+            statuses = [self.client.post(url).status_code for _ in range(3)]
+        self.assertEqual(statuses, [200, 429, 429])
+        available, _ = cache.get(TokenBucket('daraja:global', '50/s').cache_key('global'))
+        self.assertEqual(round(available), 99)
+
+
+class ProfileImageTests(TestCase):
+    """Avatars are processed once per upload (users/models.py)."""
+
+    def test_default_avatar_and_logins_do_no_image_work(self):
+        with mock.patch.object(Profile, '_process_image') as process_image:
+            user = User.objects.create_user('walker', 'walker@example.com', 'pw')
+            # What a login saves (update_last_login)
+            user.last_login = user.date_joined
+            with self.assertNumQueries(1):
+                user.save(update_fields=['last_login'])
+            # A full save propagates to the profile, still with the default avatar
+            user.first_name = 'Wanjiru'
+            user.save()
+        process_image.assert_not_called()
+        self.assertEqual(user.profile.image.name, 'default.jpg')
+
+
+@override_settings(EMAIL_OUTBOX_THREAD=False)
+class OutboxTests(TestCase):
+    """Queued email (users/mail.py), sent through the locmem backend."""
+
+    TRANSPORT = 'django.core.mail.backends.locmem.EmailBackend'
+
+    def enqueue(self, subject='Your post has a match'):
+        message = EmailMessage(subject, 'Someone found a black wallet.', 'LostLink <noreply@example.com>',
+                               ['owner@example.com'], bcc=['audit@example.com'])
+        OutboxEmailBackend().send_messages([message])
+        return OutboundEmail.objects.get(subject=subject)
+
+    def test_queued_message_is_sent_as_rendered(self):
+        row = self.enqueue()
+        self.assertIn(b'Subject: Your post has a match', bytes(row.message))
+        self.assertEqual(OutboxSender(transport=self.TRANSPORT).drain(), (1, 0))
+
+        sent, = mail.outbox
+        # Bcc is only in the envelope, not the headers
+        self.assertEqual(sent.from_email, 'LostLink <noreply@example.com>')
+        self.assertEqual(sent.recipients(), ['owner@example.com', 'audit@example.com'])
+        self.assertEqual(sent.message().as_bytes(linesep='\r\n'), bytes(row.message).replace(b'\n', b'\r\n'))
+        row.refresh_from_db()
+        self.assertEqual((row.status, row.attempts), (OutboundEmail.SENT, 1))
+
+    def test_claimed_rows_are_not_claimed_again_until_stale(self):
+        row = self.enqueue()
+        first, second = OutboxSender(transport=self.TRANSPORT), OutboxSender(transport=self.TRANSPORT)
+        self.assertEqual([r.pk for r in first.claim_batch()], [row.pk])
+        self.assertEqual(second.claim_batch(), [])
+
+        # The first sender died mid-batch
+        OutboundEmail.objects.filter(pk=row.pk).update(
+            locked_at=timezone.now() - OutboxSender.LOCK_TIMEOUT - timedelta(seconds=1)
+        )
+        self.assertEqual(second.send_batch(), (1, 0))
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_failures_are_retried_with_backoff_then_given_up(self):
+        row = self.enqueue()
+        sender = OutboxSender(transport=self.TRANSPORT, max_attempts=2)
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages',
+                        side_effect=smtplib.SMTPServerDisconnected('gone')):
+            self.assertEqual(sender.send_batch(), (0, 1))
+            row.refresh_from_db()
+            self.assertEqual((row.status, row.attempts), (OutboundEmail.PENDING, 1))
+            self.assertGreater(row.next_attempt_at, timezone.now())
+            # Not due yet
+            self.assertEqual(sender.send_batch(), (0, 0))
+
+            OutboundEmail.objects.filter(pk=row.pk).update(next_attempt_at=timezone.now())
+            self.assertEqual(sender.send_batch(), (0, 1))
+        row.refresh_from_db()
+        self.assertEqual((row.status, row.attempts), (OutboundEmail.FAILED, 2))
+        self.assertIn('gone', row.last_error)
+
+
+class PaymentAccessServiceTests(TestCase):
+    """The cached paid-post sets (users/services.py)."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author', 'author@example.com', 'pw')
+        cls.buyer = User.objects.create_user('buyer', 'buyer@example.com', 'pw')
+        cls.posts = [
+            Post.objects.create(title=f'Lost item {i}', content='At the bus stage', author=cls.author)
+            for i in range(2)
+        ]
+
+    def setUp(self):
+        cache.clear()
+
+    def fresh_user(self):
+        # A new request: nothing memoised on the user object
+        return User.objects.get(pk=self.buyer.pk)
+
+    def test_cached_sets_answer_without_queries(self):
+        PaymentAccessService.grant_access(self.fresh_user(), self.posts[0])
+        self.assertTrue(PaymentAccessService.has_access(self.fresh_user(), self.posts[0].pk))
+        user, other_request_user = self.fresh_user(), self.fresh_user()
+        with self.assertNumQueries(0):
+            self.assertTrue(PaymentAccessService.has_access(user, self.posts[0].pk))
+            # Unpaid posts are answered from the same cached set
+            self.assertFalse(PaymentAccessService.has_access(other_request_user, self.posts[1].pk))
+
+    def test_grants_invalidate_instead_of_overwriting(self):
+        first, second = self.fresh_user(), self.fresh_user()
+        # Both requests loaded the set before either payment was recorded
+        PaymentAccessService.get_paid_post_ids(first)
+        PaymentAccessService.get_paid_post_ids(second)
+        PaymentAccessService.grant_access(first, self.posts[0])
+        PaymentAccessService.grant_access(second, self.posts[1])
+        self.assertEqual(
+            PaymentAccessService.get_paid_post_ids(self.fresh_user()), {self.posts[0].pk, self.posts[1].pk}
+        )
+
+    def test_set_loaded_before_a_grant_is_not_served_after_it(self):
+        key, version_key = PaymentAccessService.cache_key(self.buyer.pk), PaymentAccessService.version_key(self.buyer.pk)
+        PaymentAccessService.get_paid_post_ids(self.fresh_user())
+        stale_version = cache.get(version_key)
+        PaymentAccessService.grant_access(self.fresh_user(), self.posts[0])
+        # A concurrent lookup that read the database before the grant
+        # writes its result after it
+        cache.set(key, (stale_version, frozenset()))
+        self.assertTrue(PaymentAccessService.has_access(self.fresh_user(), self.posts[0].pk))
+
+    def test_deleting_access_invalidates(self):
+        PaymentAccessService.grant_access(self.fresh_user(), self.posts[0])
+        self.assertTrue(PaymentAccessService.has_access(self.fresh_user(), self.posts[0].pk))
+        PaymentAccess.objects.filter(user=self.buyer).delete()
+        self.assertFalse(PaymentAccessService.has_access(self.fresh_user(), self.posts[0].pk))
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class MpesaCallbackTests(TestCase):
+    """Both callback views parse and validate the body through read_stk_callback."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author', 'author@example.com', 'pw')
+        cls.buyer = User.objects.create_user('buyer', 'buyer@example.com', 'pw')
+        cls.post = Post.objects.create(title='Lost black wallet', content='At the bus stage', author=cls.author)
+
+    def test_read_stk_callback(self):
+        self.assertEqual(views.read_stk_callback(callback_body(self.post, self.buyer)), (self.post.pk, self.buyer.pk))
+        failed = json.loads(callback_body(self.post, self.buyer))
+        failed['Body']['stkCallback']['ResultCode'] = 1032
+        self.assertIsNone(views.read_stk_callback(json.dumps(failed)))
+        self.assertIsNone(views.read_stk_callback(callback_body(self.post, self.buyer).replace('POST_', 'POST_x')))
+        self.assertIsNone(views.read_stk_callback(b'not json'))
+        self.assertIsNone(views.read_stk_callback(b'{}'))
+
+    def test_sync_and_async_views_grant_access(self):
+        body = callback_body(self.post, self.buyer)
+        response = self.client.post(reverse('mpesa_callback'), body, content_type='application/json')
+        self.assertEqual(response.json(), views.CALLBACK_ACK)
+        self.assertTrue(PaymentAccess.objects.filter(user=self.buyer, post_id=self.post.pk, paid=True).exists())
+
+        PaymentAccess.objects.all().delete()
+        request = AsyncRequestFactory().post(reverse('mpesa_callback'), body, content_type='application/json')
+        response = async_to_sync(views.mpesa_callback_async)(request)
+        self.assertEqual(json.loads(response.content), views.CALLBACK_ACK)
+        self.assertTrue(PaymentAccess.objects.filter(user=self.buyer, post_id=self.post.pk, paid=True).exists())
+
+    def test_bad_body_is_acknowledged(self):
+        response = self.client.post(reverse('mpesa_callback'), 'not json', content_type='application/json')
+        self.assertEqual(response.json(), views.CALLBACK_ACK)
+        self.assertFalse(PaymentAccess.objects.exists())
+
+
+@override_settings(SECURE_SSL_REDIRECT=False, RATELIMIT_ENABLE=False, ARCHIVE_RESOLVED_AFTER_DAYS=14)
+class ArchivedPostPaymentTests(TestCase):
+    """Archived posts keep their payment pages and paid access (blog/archive.py)."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author', 'author@example.com', 'pw')
+        cls.buyer = User.objects.create_user('buyer', 'buyer@example.com', 'pw')
+        cls.post = Post.objects.create(title='Resolved wallet', content='At the stage', author=cls.author,
+                                       status=Post.RESOLVED, date_posted=timezone.now() - timedelta(days=30))
+        ArchiveService.archive_due()
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.buyer)
+
+    def test_pay_then_view_archived_post(self):
+        self.assertFalse(Post.objects.filter(pk=self.post.pk).exists())
+        self.assertRedirects(self.client.get(reverse('post_detail', args=[self.post.pk])),
+                             reverse('pay_post', args=[self.post.pk]))
+        self.assertContains(self.client.get(reverse('pay_post', args=[self.post.pk])), 'Resolved wallet')
+
+        self.client.post(reverse('mpesa_callback'), callback_body(self.post, self.buyer),
+                         content_type='application/json')
+        self.assertTrue(PaymentAccess.objects.filter(user=self.buyer, post_id=self.post.pk, paid=True).exists())
+        self.assertEqual(self.client.get(reverse('payment_status', args=[self.post.pk])).json()['status'], 'paid')
+        response = self.client.get(reverse('post_detail', args=[self.post.pk]))
+        self.assertContains(response, 'Resolved wallet')
+
+    def test_missing_post_is_404(self):
+        self.assertEqual(self.client.get(reverse('post_detail', args=[self.post.pk + 100])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('payment_status', args=[self.post.pk + 100])).status_code, 404)
+
+
+@override_settings(SECURE_SSL_REDIRECT=False, RATELIMIT_ENABLE=False)
+class AsyncPaymentViewTests(TestCase):
+    """The async payment views used by the ASGI deployment (see myproject/asgi.py)."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author', 'author@example.com', 'pw')
+        cls.buyer = User.objects.create_user('buyer', 'buyer@example.com', 'pw')
+        cls.post = Post.objects.create(title='Lost black wallet', content='At the bus stage', author=cls.author)
+
+    def setUp(self):
+        cache.clear()
+
+    async def test_payment_status_after_callback(self):
+        await self.async_client.aforce_login(self.buyer)
+        url = reverse('payment_status', args=[self.post.pk])
+        self.assertEqual((await self.async_client.get(url)).json(), {'status': 'pending', 'paid': False})
+
+        request = AsyncRequestFactory().post(
+            reverse('mpesa_callback'), callback_body(self.post, self.buyer), content_type='application/json'
+        )
+        await views.mpesa_callback_async(request)
+
+        response = (await self.async_client.get(url)).json()
+        self.assertEqual(response['status'], 'paid')
+        self.assertEqual(response['redirect'], reverse('post_detail', args=[self.post.pk]))
+
+    @override_settings(MPESA_STATUS_QUERY_AFTER=0)
+    async def test_payment_status_queries_daraja_when_callback_is_late(self):
+        await self.async_client.aforce_login(self.buyer)
+        await cache.aset(
+            views.CHECKOUT_CACHE_KEY.format(user_id=self.buyer.pk, post_id=self.post.pk),
+            {'id': 'ws_CO_1', 'sent': 0},
+        )
+        with mock.patch('users.views.astk_query', mpesa_mock.astk_query):
+            response = await self.async_client.get(reverse('payment_status', args=[self.post.pk]))
+
+        self.assertEqual(response.json()['status'], 'paid')
+        self.assertTrue(await PaymentAccess.objects.filter(user=self.buyer, post=self.post, paid=True).aexists())
@@ -2,6 +2,7 @@
 URL configuration for the users app
 Handles user registration, profile, and payment endpoints
 """
+from django.conf import settings
 from django.urls import path
 from . import views
 
@@ -14,5 +15,8 @@ urlpatterns = [
     # Payment endpoints
     path('post/<int:pk>/', views.post_detail, name='post_detail'),
     path('post/<int:pk>/pay/', views.pay_post, name='pay_post'),
-    path('mpesa/callback/', views.mpesa_callback, name='mpesa_callback'),
+    path('post/<int:pk>/payment-status/', views.payment_status, name='payment_status'),
+    path('mpesa/callback/',
+         views.mpesa_callback_async if settings.ASYNC_VIEWS else views.mpesa_callback,
+         name='mpesa_callback'),
 ]
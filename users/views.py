@@ -1,23 +1,71 @@
-from django.shortcuts import render, redirect, get_object_or_404
+from django.shortcuts import render, redirect
 from django.contrib.auth import logout
 from django.contrib.auth.decorators import login_required
 from django.views.decorators.csrf import csrf_exempt
 from django.contrib import messages
 from django.views import View
 from django.views.generic import CreateView, UpdateView, TemplateView
-from django.urls import reverse_lazy
+from django.urls import reverse, reverse_lazy
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.http import JsonResponse
+from django.http import Http404, JsonResponse
+from django.core.cache import cache
 import json
 import logging
+import time
 from .forms import UserRegisterForm, UserUpdateForm, ProfileUpdateForm
 from .models import PaymentAccess, Profile
-from blog.models import Post
-from .mpesa import stk_push_payment
+from .services import PaymentAccessService
+from myproject.ratelimit import ratelimit
+from myproject.uploads import add_upload_errors
+from myproject import metrics
+from blog.sharding import PostShardService
+from django.conf import settings
+
+# Select the M-PESA backend. The 'simulator' backend uses the real client
+# pointed at the local Daraja simulator (see MPESA_BASE_URL).
+if settings.MPESA_BACKEND == 'mock':
+    from .mpesa_mock import stk_push_payment, astk_query
+else:
+    from .mpesa import stk_push_payment, astk_query
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+# Cache entry holding a user's pending STK push for a post (see payment_status).
+# STK prompts expire on the phone within minutes, so the entry can too.
+CHECKOUT_CACHE_KEY = 'mpesa:checkout:{user_id}:{post_id}'
+CHECKOUT_CACHE_TIMEOUT = 10 * 60
+
+
+def parse_stk_callback(data):
+    """
+    Pull the result and the metadata items out of an STK callback body.
+    
+    Returns:
+        tuple: (result_code, result_desc, metadata) where metadata maps each
+            CallbackMetadata item name to its value
+    """
+    stk_callback = data.get("Body", {}).get("stkCallback", {})
+    items = stk_callback.get("CallbackMetadata", {}).get("Item", [])
+    metadata = {item.get("Name"): item.get("Value") for item in items}
+    return stk_callback.get("ResultCode"), stk_callback.get("ResultDesc", "Unknown error"), metadata
+
+
+def parse_account_reference(account_reference):
+    """
+    Parse an AccountReference of the form POST_<post_id>_<user_id>.
+    
+    Returns:
+        tuple: (post_id, user_id), or None for any other format
+        
+    Raises:
+        ValueError: If the ids are not numbers
+    """
+    ref_parts = account_reference.split("_")
+    if len(ref_parts) >= 3 and ref_parts[0] == "POST":
+        return int(ref_parts[1]), int(ref_parts[2])
+    return None
+
 
 class CustomLogoutView(View):
     """Custom logout view that logs out user and redirects to login"""
@@ -66,6 +114,7 @@ class ProfileView(LoginRequiredMixin, View):
 
         u_form = UserUpdateForm(request.POST, instance=request.user)
         p_form = ProfileUpdateForm(request.POST, request.FILES, instance=request.user.profile)
+        add_upload_errors(request, p_form)
         
         if u_form.is_valid() and p_form.is_valid():
             u_form.save()
@@ -84,14 +133,12 @@ def post_detail(request, pk):
     Display post details.
     Requires payment of 100 KES to view contact/author information.
     """
-    post = get_object_or_404(Post, pk=pk)
+    # Archived posts keep their URL and payments (blog/archive.py)
+    post = PostShardService.get_post_or_404(pk)
     
-    # Check if user has already paid for this post
-    payment_access = PaymentAccess.objects.filter(
-        user=request.user,
-        post=post,
-        paid=True
-    ).exists()
+    # Check if user has already paid for this post (served from the cached
+    # per-user entitlement set)
+    payment_access = PaymentAccessService.has_access(request.user, post.pk)
     
     # If user has not paid, redirect to payment page
     if not payment_access:
@@ -101,6 +148,11 @@ def post_detail(request, pk):
     return render(request, "blog/post_detail.html", {"post": post, "paid": True})
 
 @login_required
+@ratelimit('pay_post:user', key='user', rate='5/m', methods=['POST'])
+@ratelimit('pay_post:phone', key='phone', rate='3/m', methods=['POST'])
+# Innermost: the shared Daraja quota is only charged for requests the
+# per-user and per-phone limits let through
+@ratelimit('daraja:global', key='global', rate='50/s', burst=100, methods=['POST'])
 def pay_post(request, pk):
     """
     Display payment form and trigger STK Push payment.
@@ -108,7 +160,7 @@ def pay_post(request, pk):
     GET: Show payment form with post details and amount
     POST: Trigger M-PESA STK Push and show waiting screen
     """
-    post = get_object_or_404(Post, pk=pk)
+    post = PostShardService.get_post_or_404(pk)
     amount = 100  # Fixed price for accessing post
     
     if request.method == "POST":
@@ -125,16 +177,25 @@ def pay_post(request, pk):
             # Check response from Safaricom
             response_code = response.get("ResponseCode", "1")
             if response_code == "0":
+                metrics.record_payment("stk_push", "accepted")
                 logger.info(f"✅ STK Push sent successfully for user {request.user.id}")
+                # Lets payment_status ask Daraja directly if the callback is late
+                cache.set(
+                    CHECKOUT_CACHE_KEY.format(user_id=request.user.pk, post_id=post.pk),
+                    {"id": response.get("CheckoutRequestID"), "sent": time.time()},
+                    CHECKOUT_CACHE_TIMEOUT,
+                )
                 messages.success(request, "Payment prompt sent! Check your phone to complete the payment.")
                 return render(request, "users/waiting.html", {"post": post, "amount": amount})
             else:
                 error_msg = response.get("ResponseDescription", "Payment request failed")
+                metrics.record_payment("stk_push", "rejected")
                 logger.warning(f"⚠️ STK Push failed: {error_msg}")
                 messages.error(request, f"Payment request failed: {error_msg}")
                 return render(request, "users/pay_post.html", {"post": post, "amount": amount})
                 
         except Exception as e:
+            metrics.record_payment("stk_push", "error")
             logger.error(f"❌ Error during payment: {str(e)}")
             messages.error(request, f"An error occurred: {str(e)}")
             return render(request, "users/pay_post.html", {"post": post, "amount": amount})
@@ -142,6 +203,49 @@ def pay_post(request, pk):
     # GET request - show payment form
     return render(request, "users/pay_post.html", {"post": post, "amount": amount})
 
+def read_stk_callback(body):
+    """
+    Parse and validate an STK Push callback body, shared by mpesa_callback
+    and mpesa_callback_async.
+
+    Logs the callback and records the payment metric. Failed payments,
+    invalid JSON and unknown AccountReferences are logged and give None.
+
+    Returns:
+        tuple: (post_id, user_id) of a successful payment to record, or None
+    """
+    try:
+        data = json.loads(body)
+    except json.JSONDecodeError as e:
+        logger.error(f"❌ Invalid JSON in callback: {str(e)}")
+        return None
+    logger.info(f"📨 M-PESA Callback received: {json.dumps(data, indent=2)}")
+
+    result_code, result_desc, metadata = parse_stk_callback(data)
+    metrics.record_payment("callback", "success" if result_code == 0 else "failed")
+    if result_code != 0:
+        logger.warning(f"⚠️ Payment failed - ResultCode: {result_code}, Description: {result_desc}")
+        return None
+
+    logger.info("✅ Payment successful, processing transaction...")
+    logger.info(f"💰 Payment Details - Amount: {metadata.get('Amount')}, Phone: {metadata.get('PhoneNumber')}, "
+                f"Receipt: {metadata.get('MpesaReceiptNumber', '')}")
+    # AccountReference format: POST_<post_id>_<user_id>
+    account_reference = metadata.get("AccountReference", "")
+    try:
+        return parse_account_reference(account_reference)
+    except (ValueError, IndexError, AttributeError) as e:
+        logger.error(f"❌ Could not parse AccountReference '{account_reference}': {str(e)}")
+        return None
+
+
+# Always acknowledged: an error would make Safaricom retry the callback
+# multiple times
+CALLBACK_ACK = {
+    "ResultCode": 0,
+    "ResultDesc": "Callback received and processed"
+}
+
 @csrf_exempt
 def mpesa_callback(request):
     """
@@ -173,87 +277,115 @@ def mpesa_callback(request):
         JsonResponse: Acknowledges receipt of callback to Safaricom
     """
     try:
-        # Parse incoming JSON from Safaricom
-        data = json.loads(request.body)
-        logger.info(f"📨 M-PESA Callback received: {json.dumps(data, indent=2)}")
-        
-        # Extract callback data
-        stk_callback = data.get("Body", {}).get("stkCallback", {})
-        result_code = stk_callback.get("ResultCode")
-        
-        # Only process successful payments (ResultCode = 0)
-        if result_code == 0:
-            logger.info("✅ Payment successful, processing transaction...")
-            
-            # Extract metadata from callback response
-            callback_metadata = stk_callback.get("CallbackMetadata", {})
-            items = callback_metadata.get("Item", [])
-            
-            # Extract values from metadata items
-            metadata = {}
-            for item in items:
-                metadata[item.get("Name")] = item.get("Value")
-            
-            # Extract payment details
-            amount = metadata.get("Amount")
-            mpesa_receipt = metadata.get("MpesaReceiptNumber", "")
-            transaction_date = metadata.get("TransactionDate")
-            phone = metadata.get("PhoneNumber")
-            account_reference = metadata.get("AccountReference", "")
-            
-            logger.info(f"💰 Payment Details - Amount: {amount}, Phone: {phone}, Receipt: {mpesa_receipt}")
-            
-            # Parse AccountReference to get post_id and user_id
-            # Format: POST_<post_id>_<user_id>
+        reference = read_stk_callback(request.body)
+        if reference:
+            post_id, user_id = reference
             try:
-                ref_parts = account_reference.split("_")
-                if len(ref_parts) >= 3 and ref_parts[0] == "POST":
-                    post_id = int(ref_parts[1])
-                    user_id = int(ref_parts[2])
-                    
-                    # Retrieve post and user
-                    try:
-                        post = Post.objects.get(pk=post_id)
-                        user = Profile.objects.get(user__pk=user_id).user
-                        
-                        # Record successful payment
-                        payment_access, created = PaymentAccess.objects.update_or_create(
-                            user=user,
-                            post=post,
-                            defaults={
-                                "paid": True,
-                                # Optional: Add fields to store transaction info
-                                # "mpesa_receipt": mpesa_receipt,
-                                # "transaction_date": transaction_date,
-                                # "amount": amount
-                            }
-                        )
-                        
-                        status = "Created" if created else "Updated"
-                        logger.info(f"✅ Payment recorded - {status} PaymentAccess for user {user_id}, post {post_id}")
-                        
-                    except Post.DoesNotExist:
-                        logger.warning(f"⚠️ Post with ID {post_id} not found")
-                    except Profile.DoesNotExist:
-                        logger.warning(f"⚠️ User with ID {user_id} not found")
-                        
-            except (ValueError, IndexError) as e:
-                logger.error(f"❌ Could not parse AccountReference '{account_reference}': {str(e)}")
+                post = PostShardService.get_post_or_404(post_id)
+                user = Profile.objects.select_related('user').get(user__pk=user_id).user
+
+                # Record successful payment and invalidate the user's
+                # cached entitlement set
+                payment_access, created = PaymentAccessService.grant_access(user, post)
+
+                status = "Created" if created else "Updated"
+                logger.info(f"✅ Payment recorded - {status} PaymentAccess for user {user_id}, post {post_id}")
+
+            except Http404:
+                logger.warning(f"⚠️ Post with ID {post_id} not found")
+            except Profile.DoesNotExist:
+                logger.warning(f"⚠️ User with ID {user_id} not found")
+
+    except Exception as e:
+        logger.error(f"❌ Unexpected error in callback handler: {str(e)}", exc_info=True)
+
+    return JsonResponse(CALLBACK_ACK)
+
+
+
+# Async views for the ASGI deployment (see myproject/asgi.py)
+
+@login_required
+@ratelimit('payment_status:user', key='user', rate='60/m')
+async def payment_status(request, pk):
+    """
+    Report whether the user has paid for a post. Polled by the waiting page.
+    
+    Normally the callback grants access and this only reads the cached
+    entitlement set. If the callback is late, Daraja is queried for the
+    pending STK push that pay_post stored in the cache, at most once every
+    MPESA_STATUS_QUERY_INTERVAL seconds and only after
+    MPESA_STATUS_QUERY_AFTER seconds have passed since the push. The query
+    is awaited, so a slow Daraja only holds this request, not a worker.
+    
+    Returns:
+        JsonResponse: {"status": "paid" | "pending" | "failed", "paid": bool,
+            "redirect": URL of the unlocked post once paid}
+    """
+    user = await request.auser()
+    post = await PostShardService.aget_post_or_404(pk)
+    paid = await PaymentAccessService.ahas_access(user, post.pk)
+    status = "paid" if paid else "pending"
+    
+    checkout_key = CHECKOUT_CACHE_KEY.format(user_id=user.pk, post_id=post.pk)
+    checkout = await cache.aget(checkout_key) if not paid else None
+    now = time.time()
+    if (checkout and checkout.get("id")
+            and now - checkout["sent"] >= settings.MPESA_STATUS_QUERY_AFTER
+            and now - checkout.get("queried", 0) >= settings.MPESA_STATUS_QUERY_INTERVAL):
+        checkout["queried"] = now
+        await cache.aset(checkout_key, checkout, CHECKOUT_CACHE_TIMEOUT)
+        try:
+            result = await astk_query(checkout["id"])
+        except Exception as e:
+            logger.warning(f"⚠️ STK Query for post {post.pk} failed: {str(e)}")
+            result = {}
         
-        else:
-            # Payment failed
-            result_desc = stk_callback.get("ResultDesc", "Unknown error")
-            logger.warning(f"⚠️ Payment failed - ResultCode: {result_code}, Description: {result_desc}")
+        # An errorCode without a ResultCode means Daraja is still processing
+        result_code = result.get("ResultCode")
+        if result_code == "0":
+            payment_access, created = await PaymentAccessService.agrant_access(user, post)
+            metrics.record_payment("status_query", "success")
+            logger.info(f"✅ Payment confirmed by STK Query for user {user.pk}, post {post.pk}")
+            status, paid = "paid", True
+        elif result_code is not None:
+            metrics.record_payment("status_query", "failed")
+            logger.warning(f"⚠️ STK Query reports failure for post {post.pk}: {result.get('ResultDesc')}")
+            status = "failed"
+        if result_code is not None:
+            await cache.adelete(checkout_key)
     
-    except json.JSONDecodeError as e:
-        logger.error(f"❌ Invalid JSON in callback: {str(e)}")
+    response = {"status": status, "paid": paid}
+    if paid:
+        response["redirect"] = reverse("post_detail", args=[post.pk])
+    return JsonResponse(response)
+
+@csrf_exempt
+async def mpesa_callback_async(request):
+    """
+    Async version of mpesa_callback: the same handling with the async ORM.
+    
+    Returns:
+        JsonResponse: Acknowledges receipt of callback to Safaricom
+    """
+    try:
+        reference = read_stk_callback(request.body)
+        if reference:
+            post_id, user_id = reference
+            try:
+                post = await PostShardService.aget_post_or_404(post_id)
+                profile = await Profile.objects.select_related('user').aget(user__pk=user_id)
+                payment_access, created = await PaymentAccessService.agrant_access(profile.user, post)
+
+                status = "Created" if created else "Updated"
+                logger.info(f"✅ Payment recorded - {status} PaymentAccess for user {user_id}, post {post_id}")
+
+            except Http404:
+                logger.warning(f"⚠️ Post with ID {post_id} not found")
+            except Profile.DoesNotExist:
+                logger.warning(f"⚠️ User with ID {user_id} not found")
+
     except Exception as e:
         logger.error(f"❌ Unexpected error in callback handler: {str(e)}", exc_info=True)
-    
-    # Always return success to Safaricom to acknowledge receipt
-    # Returning error could cause Safaricom to retry the callback multiple times
-    return JsonResponse({
-        "ResultCode": 0,
-        "ResultDesc": "Callback received and processed"
-    })
 
+    return JsonResponse(CALLBACK_ACK)